@@ -0,0 +1,125 @@
+"""Benchmarks the analytics queries over years of synthetic history.
+
+Receipts with product lines are inserted for the bought products of the catalog that have
+categories, in a transaction that is rolled back at the end, so the database is left as it was.
+The daily rollups that the queries read are rebuilt from them, and refreshing a single day, as
+ingestion does for every receipt, is timed as well. Every query runs uncached. Needs the database
+and the config file that the application reads, with the migrations applied and the categories
+loaded, for example by benchmarks/seed_database.py.
+
+Usage: python benchmarks/analytics_queries.py [--years 5] [--receipts-per-week 3] [--repeat 20]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from database.setup import engine  # noqa: E402
+from database import analytics  # noqa: E402
+from database.rollups import refresh_rollups, days_of_receipts  # noqa: E402
+
+INSERT_RECEIPTS = """
+INSERT INTO receipts (transaction_id, datetime, location, total_price, total_discount)
+SELECT 'benchmark-' || n, now() - n * (interval '1 week' / :per_week), :location, 0, (n % 5) * 0.8
+FROM generate_series(1, :count) AS n
+"""
+
+INSERT_PRODUCTS = """
+INSERT INTO products (product_id, description, name, receipt, quantity, price, total_price, product_not_found)
+SELECT p.product_id, 'BENCHMARK', 'Benchmark product', r.id, 1, 1 + (r.id * 7 + s.n) % 9, 1 + (r.id * 7 + s.n) % 9, false
+FROM receipts r
+CROSS JOIN generate_series(1, 25) AS s(n)
+JOIN bought p ON p.position = 1 + (r.id * 31 + s.n * 17) % (SELECT count(*) FROM bought)
+WHERE r.transaction_id LIKE 'benchmark-%'
+"""
+
+QUERIES = [
+    ("spend by category", analytics.spend_by_category, {}),
+    ("spend by store", analytics.spend_by_store, {}),
+    ("spend per month", analytics.spend_over_time, {"period": "month"}),
+    ("spend per week", analytics.spend_over_time, {"period": "week"}),
+    ("top products", analytics.top_products, {}),
+    ("savings per month", analytics.savings_over_time, {"period": "month"}),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--years", type=int, default=5)
+    parser.add_argument("--receipts-per-week", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with Session(engine) as session:
+        try:
+            session.execute(
+                text(
+                    "CREATE TEMPORARY TABLE bought ON COMMIT DROP AS SELECT product_id, "
+                    "row_number() OVER () AS position FROM (SELECT DISTINCT product_id "
+                    "FROM categories_products LIMIT 2000) products"
+                )
+            )
+            if not session.execute(text("SELECT count(*) FROM bought")).scalar_one():
+                sys.exit("No categorized products, load the categories first")
+            location = session.execute(
+                text(
+                    "INSERT INTO locations (name, address, house_number, city, postal_code) "
+                    "VALUES ('benchmark', '', '', '', '') RETURNING id"
+                )
+            ).scalar_one()
+            count = args.years * 52 * args.receipts_per_week
+            session.execute(
+                text(INSERT_RECEIPTS),
+                {"location": location, "count": count, "per_week": args.receipts_per_week},
+            )
+            lines = session.execute(text(INSERT_PRODUCTS)).rowcount
+            session.execute(text("ANALYZE receipts"))
+            session.execute(text("ANALYZE products"))
+            print(f"{count} receipts with {lines} lines over {args.years} years")
+
+            start = time.perf_counter()
+            rows = refresh_rollups(session)
+            print(f"rebuilt {rows} rollup rows in {(time.perf_counter() - start) * 1000:.2f} ms")
+            receipt = session.execute(
+                text("SELECT id FROM receipts WHERE transaction_id = 'benchmark-1'")
+            ).scalar_one()
+            samples = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                refresh_rollups(session, days_of_receipts(session, [receipt]))
+                samples.append(time.perf_counter() - start)
+            print(
+                f"{'refresh one day':<22} p50 {statistics.median(samples) * 1000:7.2f} ms, "
+                f"max {max(samples) * 1000:7.2f} ms"
+            )
+
+            # The first category level is the most expensive rollup
+            parent = session.execute(
+                text("SELECT ancestor FROM categories_closure WHERE depth = 1 LIMIT 1")
+            ).scalar()
+            queries = QUERIES + [
+                ("spend by subcategory", analytics.spend_by_category, {"parent": parent}),
+                ("category per month", analytics.spend_over_time, {"category": parent}),
+            ]
+            for name, query, params in queries:
+                samples = []
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    analytics.run(session, query, **params)
+                    samples.append(time.perf_counter() - start)
+                print(
+                    f"{name:<22} p50 {statistics.median(samples) * 1000:7.2f} ms, "
+                    f"max {max(samples) * 1000:7.2f} ms"
+                )
+        finally:
+            session.rollback()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Benchmarks the dashboard queries on the sync and the async engine.
+
+Simulates --clients concurrent dashboard requests, uncached. The sync path runs every request on
+a thread of its own with the five queries one after another, as app.py does. The async path runs
+every request as a task with the five queries awaited concurrently, as asgi.py does. Both use the
+pool settings of database/setup.py. Needs the database and the config file that the application
+reads, with the migrations applied. For the whole HTTP path, serve app.py with gunicorn and
+asgi.py with uvicorn and run benchmarks/load_test.py against both.
+
+Usage: python benchmarks/async_dashboard.py [--clients 1 8 32] [--rounds 10]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from database.setup import engine, async_engine  # noqa: E402
+from database import analytics  # noqa: E402
+
+
+def sync_dashboard() -> float:
+    start = time.perf_counter()
+    with Session(engine) as session:
+        for query, params in analytics.DASHBOARD.values():
+            analytics.run(session, query, **params)
+    return time.perf_counter() - start
+
+
+async def run_async(query, params):
+    async with AsyncSession(async_engine) as session:
+        return await analytics.run_async(session, query, **params)
+
+
+async def async_dashboard() -> float:
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(run_async(query, params) for query, params in analytics.DASHBOARD.values())
+    )
+    return time.perf_counter() - start
+
+
+def measure_sync(clients: int, rounds: int) -> tuple[list[float], float]:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        latencies = list(executor.map(lambda _: sync_dashboard(), range(clients * rounds)))
+    return latencies, time.perf_counter() - start
+
+
+async def measure_async(clients: int, rounds: int) -> tuple[list[float], float]:
+    start = time.perf_counter()
+    latencies = []
+    for _ in range(rounds):
+        latencies += await asyncio.gather(*(async_dashboard() for _ in range(clients)))
+    return latencies, time.perf_counter() - start
+
+
+def report(name: str, clients: int, latencies: list[float], elapsed: float):
+    print(
+        f"{name:<6} {clients:>3} clients  {len(latencies) / elapsed:7.1f} dashboards/s  "
+        f"p50 {statistics.median(latencies) * 1000:8.2f} ms  "
+        f"max {max(latencies) * 1000:8.2f} ms"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--rounds", type=int, default=10)
+    args = parser.parse_args()
+
+    # Warm up both pools and the database cache
+    sync_dashboard()
+    await async_dashboard()
+    for clients in args.clients:
+        report("sync", clients, *measure_sync(clients, args.rounds))
+        report("async", clients, *await measure_async(clients, args.rounds))
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
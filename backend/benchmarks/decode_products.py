@@ -0,0 +1,133 @@
+"""Benchmarks decoding and mapping a 3000 product search page.
+
+Compares the generic json decoder with a per key inflection.underscore mapping, as products.py
+used to do, with the msgspec schemas in schemas.py. The baseline needs inflection installed.
+
+Usage: python benchmarks/decode_products.py [--products 3000] [--repeat 10]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from schemas import search_page_decoder, product_values  # noqa: E402
+
+SKIPPED_KEYS = ["descriptionHighlights", "descriptionFull", "extraDescriptions"]
+
+
+def make_product(index: int) -> dict:
+    price = round(random.uniform(0.5, 15), 2)
+    return {
+        "webshopId": 100000 + index,
+        "hqId": 200000 + index,
+        "title": f"AH Product {index}",
+        "salesUnitSize": f"{random.choice([250, 500, 750, 1000])} g",
+        "images": [
+            {"width": size, "height": size, "url": f"https://static.ah.nl/{index}/{size}.jpg"}
+            for size in (48, 80, 200, 400, 800)
+        ],
+        "priceBeforeBonus": price,
+        "currentPrice": round(price * 0.75, 2) if index % 5 == 0 else None,
+        "orderAvailabilityStatus": "IN_ASSORTMENT",
+        "mainCategory": "Zuivel, plantaardig en eieren",
+        "subCategory": "Melk",
+        "brand": "AH",
+        "shopType": "AH",
+        "availableOnline": True,
+        "isPreviouslyBought": False,
+        "descriptionHighlights": "<p>" + "Lekker en vers. " * 20 + "</p>",
+        "propertyIcons": ["biologisch", "vegetarisch"],
+        "nutriscore": "B",
+        "nix18": False,
+        "isStapelBonus": False,
+        "extraDescriptions": ["Houdbaar tot minimaal 7 dagen na levering"],
+        "isBonus": index % 5 == 0,
+        "descriptionFull": "Volledige omschrijving. " * 30,
+        "isOrderable": True,
+        "isInfiniteBonus": False,
+        "isSample": False,
+        "isSponsored": False,
+        "isVirtualBundle": False,
+        "virtualBundleItems": [],
+        "discountLabels": [{"code": "DISCOUNT_BONUS", "defaultDescription": "25% korting"}],
+        "unitPriceDescription": f"prijs per kg €{price * 2:.2f}",
+        "auctionId": None,
+        "bonusStartDate": "2024-01-01",
+        "bonusEndDate": "2024-01-07",
+        "discountType": "AH_INFINITE",
+        "segmentType": "AH",
+        "promotionType": "NATIONAL",
+        "bonusMechanism": "25% korting",
+        "bonusPeriodDescription": "t/m zondag",
+        "bonusSegmentId": 300000 + index,
+        "bonusSegmentDescription": "Alle AH melk",
+        "hasListPrice": True,
+        "isBonusPrice": False,
+        "productCount": 1,
+        "multipleItemPromotion": False,
+        "stickers": [],
+        "orderAvailabilityDescription": None,
+    }
+
+
+def make_page(count: int) -> bytes:
+    page = {
+        "products": [make_product(index) for index in range(count)],
+        "page": {"size": count, "totalElements": count, "totalPages": 1, "number": 0},
+        "aggregation": {"properties": [{"id": index} for index in range(200)]},
+    }
+    return json.dumps(page).encode("utf8")
+
+
+def baseline(data: bytes) -> list[dict]:
+    import inflection
+
+    return [
+        {
+            inflection.underscore(key): value
+            for key, value in product.items()
+            if "virtual" not in key.lower() and key not in SKIPPED_KEYS
+        }
+        for product in json.loads(data)["products"]
+    ]
+
+
+def structs(data: bytes) -> list[dict]:
+    return [product_values(product) for product in search_page_decoder.decode(data).products]
+
+
+def measure(function, data: bytes, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(data)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=3000)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    random.seed(0)
+    data = make_page(args.products)
+    print(f"Page of {args.products} products, {len(data) / 1024 / 1024:.1f} MiB")
+    results = [("msgspec structs", measure(structs, data, args.repeat))]
+    try:
+        results.insert(0, ("json + inflection", measure(baseline, data, args.repeat)))
+    except ImportError:
+        print("inflection is not installed, skipping the baseline")
+    for name, seconds in results:
+        print(f"{name:<20} {seconds * 1000:8.1f} ms per page")
+    if len(results) == 2:
+        print(f"speedup {results[0][1] / results[1][1]:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Benchmarks the memory use and throughput of the purchase history export.
+
+Synthetic receipts with product lines are inserted in a transaction that is rolled back at the
+end, so the database is left as it was. The history is exported through the same connection for
+every size in --rows, and the peak of the Python heap is measured with tracemalloc. The export
+reads from a server-side cursor a chunk at a time, so the peak should stay the same as the
+history grows. Needs the database and the config file that the application reads, with the
+migrations applied.
+
+Usage: python benchmarks/export_memory.py [--rows 10000 100000 1000000] [--format ndjson]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+from sqlalchemy import text
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from database.setup import engine  # noqa: E402
+from database.export import (  # noqa: E402
+    EXPORT_CHUNK_SIZE,
+    export_rows,
+    ndjson_chunks,
+    csv_chunks,
+    write_parquet,
+)
+
+LINES_PER_RECEIPT = 25
+
+INSERT_RECEIPTS = """
+INSERT INTO receipts (transaction_id, datetime, location, total_price, total_discount)
+SELECT CAST(:prefix AS text) || n, now() - n * interval '1 hour', NULL, 0, 0
+FROM generate_series(1, :count) AS n
+"""
+
+INSERT_PRODUCTS = """
+INSERT INTO products (product_id, description, name, receipt, quantity, price, total_price, product_not_found)
+SELECT NULL, 'BENCHMARK ' || s.n, 'Benchmark product', r.id, 1, 1 + s.n % 9, 1 + s.n % 9, true
+FROM receipts r
+CROSS JOIN generate_series(1, :lines) AS s(n)
+WHERE r.transaction_id LIKE CAST(:prefix AS text) || '%'
+"""
+
+
+def export(connection, format: str, chunk_size: int) -> int:
+    """Exports the whole history and discards the output, returns the number of rows"""
+    rows = 0
+
+    def counted():
+        nonlocal rows
+        for chunk in export_rows(connection, chunk_size=chunk_size):
+            rows += len(chunk)
+            yield chunk
+
+    if format == "parquet":
+        write_parquet(os.devnull, counted())
+    else:
+        encode = ndjson_chunks if format == "ndjson" else csv_chunks
+        for _ in encode(counted()):
+            pass
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--format", choices=["ndjson", "csv", "parquet"], default="ndjson")
+    parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        try:
+            inserted = 0
+            for target in sorted(args.rows):
+                count = (target - inserted) // LINES_PER_RECEIPT
+                if count > 0:
+                    prefix = f"benchmark-{inserted}-"
+                    connection.execute(text(INSERT_RECEIPTS), {"prefix": prefix, "count": count})
+                    connection.execute(
+                        text(INSERT_PRODUCTS), {"prefix": prefix, "lines": LINES_PER_RECEIPT}
+                    )
+                    inserted += count * LINES_PER_RECEIPT
+                    connection.execute(text("ANALYZE receipts"))
+                    connection.execute(text("ANALYZE products"))
+
+                tracemalloc.start()
+                start = time.perf_counter()
+                rows = export(connection, args.format, args.chunk_size)
+                elapsed = time.perf_counter() - start
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                print(
+                    f"{rows:>9} rows  {args.format:<7}  {elapsed:7.2f} s  "
+                    f"{rows / elapsed:9.0f} rows/s  peak {peak / 1024:9.1f} KiB"
+                )
+        finally:
+            transaction.rollback()
+
+
+if __name__ == "__main__":
+    main()
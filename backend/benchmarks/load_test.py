@@ -0,0 +1,107 @@
+"""Load tests a running API server at a fixed request rate.
+
+Requests are sent on a fixed schedule by a pool of threads with keep-alive connections, and
+latencies are measured from the moment a request was due, so a server that falls behind shows up
+as growing latency instead of a lower rate. The paths are requested in turn. Latency and
+throughput are reported per interval to show whether they are stable, and in total at the end.
+Start the server first, for example with gunicorn app:app from the src directory. With the
+caches on, repeated paths are mostly answered from the response cache. To load the database
+instead, serve a database seeded by benchmarks/seed_database.py with response_cache_entries and
+analytics_cache_seconds set to 0.
+
+Usage: python benchmarks/load_test.py [--url http://localhost:5000] [--rate 400] [--duration 30]
+    [--threads 64] [--paths /api/receipts /api/analytics/stores]
+"""
+import argparse
+import itertools
+import statistics
+import threading
+import time
+
+import requests
+
+DEFAULT_PATHS = [
+    "/api/receipts",
+    "/api/receipts?limit=10",
+    "/api/analytics/stores",
+    "/api/analytics/categories",
+    "/api/analytics/spend?period=week",
+    "/api/analytics/top-products",
+]
+
+
+def summary(latencies: list[float]) -> str:
+    if len(latencies) < 2:
+        return "no requests"
+    quantiles = statistics.quantiles(latencies, n=100)
+    return (
+        f"p50 {quantiles[49] * 1000:7.2f} ms, p95 {quantiles[94] * 1000:7.2f} ms, "
+        f"p99 {quantiles[98] * 1000:7.2f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--rate", type=float, default=400, help="Requests per second")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds")
+    parser.add_argument("--threads", type=int, default=64)
+    parser.add_argument("--interval", type=float, default=5, help="Seconds per report line")
+    parser.add_argument("--paths", nargs="+", default=DEFAULT_PATHS)
+    args = parser.parse_args()
+
+    total = int(args.rate * args.duration)
+    schedule = itertools.count()
+    paths = itertools.cycle(args.paths)
+    lock = threading.Lock()
+    results = []  # (due, latency, ok)
+    start = time.perf_counter() + 0.5
+
+    def worker():
+        session = requests.Session()
+        while True:
+            with lock:
+                index = next(schedule)
+                path = next(paths)
+            if index >= total:
+                return
+            due = start + index / args.rate
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                ok = session.get(args.url + path, timeout=30).status_code < 400
+            except requests.RequestException:
+                ok = False
+            latency = time.perf_counter() - due
+            with lock:
+                results.append((due - start, latency, ok))
+
+    workers = [threading.Thread(target=worker, daemon=True) for _ in range(args.threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    print(f"{args.rate:.0f} req/s for {args.duration:.0f}s against {args.url}")
+    for interval in range(int(args.duration // args.interval)):
+        window = [
+            result
+            for result in results
+            if interval * args.interval <= result[0] < (interval + 1) * args.interval
+        ]
+        errors = sum(1 for _, _, ok in window if not ok)
+        print(
+            f"{interval * args.interval:5.0f}s  {len(window) / args.interval:6.0f} req/s  "
+            f"{summary([latency for _, latency, _ in window])}  {errors} errors"
+        )
+    errors = sum(1 for _, _, ok in results if not ok)
+    print(
+        f"total  {len(results) / elapsed:6.0f} req/s  "
+        f"{summary([latency for _, latency, _ in results])}  {errors} errors"
+    )
+
+
+if __name__ == "__main__":
+    main()
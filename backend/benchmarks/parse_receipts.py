@@ -0,0 +1,171 @@
+"""Benchmarks parsing the receiptUiItems of receipts.
+
+Compares the previous approach, which scanned the rows several times with next(...) and sliced
+and filtered the list, with the single pass ReceiptParser. Both only parse, no products are
+matched. Recorded receipt details (the JSON of the receipt details endpoint, one file per receipt)
+can be passed with --corpus, otherwise a synthetic corpus is generated. Needs the config file
+that the application reads.
+
+Usage: python benchmarks/parse_receipts.py [--corpus DIRECTORY] [--receipts 1000] [--repeat 5]
+"""
+import argparse
+import glob
+import os
+import random
+import re
+import sys
+import time
+
+import msgspec
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from schemas import ReceiptUiItem, receipt_details_decoder  # noqa: E402
+from classes.ReceiptParser import ReceiptParser  # noqa: E402
+from classes.Discount import Discount  # noqa: E402
+from util import string_to_float  # noqa: E402
+
+DESCRIPTIONS = [
+    "AH HALFVOLLE MELK", "AH BANANEN", "BROOD VOLKOREN", "KIPFILET", "AH PINDAKAAS",
+    "TOMATEN", "KOMKOMMER", "AH JONGE KAAS", "APPELSAP", "PAPRIKA MIX", "AH YOGHURT",
+    "SPAGHETTI", "ROOMBOTER", "AH EIEREN", "WC PAPIER", "KOFFIEBONEN",
+]
+
+
+def make_receipt(rng: random.Random) -> list[ReceiptUiItem]:
+    rows = [
+        ReceiptUiItem(type="ah-logo"),
+        ReceiptUiItem(type="text", value=f"AH Filiaal {rng.randint(1000, 9999)}"),
+        ReceiptUiItem(type="text", value="Straatweg 1"),
+        ReceiptUiItem(type="product", description="BONUSKAART", amount="xx1234"),
+    ]
+    subtotal = 0.0
+    for _ in range(rng.randint(8, 40)):
+        if rng.random() < 0.15:
+            quantity = f"{rng.uniform(0.1, 2):.3f}KG".replace(".", ",")
+            price = rng.uniform(2, 20)
+            amount = price * float(quantity[:-2].replace(",", "."))
+        else:
+            count = rng.randint(1, 4)
+            quantity = str(count)
+            price = rng.uniform(0.5, 8)
+            amount = price * count
+        subtotal += amount
+        rows.append(
+            ReceiptUiItem(
+                type="product",
+                description=rng.choice(DESCRIPTIONS),
+                quantity=quantity,
+                price=f"{price:.2f}".replace(".", ","),
+                amount=f"{amount:.2f}".replace(".", ","),
+                indicator=rng.choice(["", "B"]),
+            )
+        )
+    rows.append(
+        ReceiptUiItem(type="subtotal", text="SUBTOTAAL", amount=f"{subtotal:.2f}".replace(".", ","))
+    )
+    for _ in range(rng.randint(0, 6)):
+        rows.append(
+            ReceiptUiItem(
+                type="product",
+                description=f"BONUS {rng.choice(DESCRIPTIONS)}",
+                quantity="",
+                amount=f"-{rng.uniform(0.2, 3):.2f}".replace(".", ","),
+            )
+        )
+    rows.append(ReceiptUiItem(type="total", label="UW VOORDEEL", amount="3,10"))
+    rows.append(ReceiptUiItem(type="total", label="TOTAAL", amount=f"{subtotal:.2f}".replace(".", ",")))
+    rows.extend(ReceiptUiItem(type="text", value="BETAALD MET PIN") for _ in range(8))
+    return rows
+
+
+def load_corpus(directory: str) -> list[list[ReceiptUiItem]]:
+    corpus = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+        with open(path, "rb") as file:
+            corpus.append(receipt_details_decoder.decode(file.read()).receipt_ui_items)
+    return corpus
+
+
+def baseline_quantity(quantity: str):
+    quantity = quantity.replace(",", ".")
+    regex_result = re.match(r"(\d+.\d+)([a-zA-Z]+)", quantity)
+    if quantity.isnumeric():
+        return float(quantity), None
+    elif regex_result:
+        return float(regex_result.group(1)), regex_result.group(2)
+    return None, None
+
+
+def baseline(receipt_rows: list[ReceiptUiItem]):
+    before_index = next(
+        (i for i, d in enumerate(receipt_rows)
+         if d.type.lower() == "product" and (d.description or "").lower() == "bonuskaart"),
+        None,
+    )
+    after_index = next(
+        (i for i, d in enumerate(receipt_rows)
+         if d.type.lower() == "subtotal" and (d.text or "").lower() == "subtotaal"),
+        None,
+    )
+    lines = []
+    if before_index is not None:
+        product_rows = receipt_rows[before_index + 1 : after_index]
+        product_rows = [item for item in product_rows if item.type.lower() == "product"]
+        for item in product_rows:
+            if not item.quantity:
+                continue
+            quantity, unit = baseline_quantity(item.quantity)
+            lines.append((quantity, unit, item.description, string_to_float(item.price),
+                          string_to_float(item.amount), item.indicator or None))
+
+    before_index = after_index
+    after_index = next(
+        (i for i, d in enumerate(receipt_rows)
+         if d.type.lower() == "total" and (d.label or "").lower() == "uw voordeel"),
+        None,
+    )
+    discount_rows = receipt_rows[before_index + 1 : after_index]
+    discount_rows = [item for item in discount_rows if item.type.lower() == "product"]
+    discounts = {"discounts": [], "total_discount": 0.0}
+    for row in discount_rows:
+        amount = abs(string_to_float(row.amount))
+        discounts["discounts"].append(Discount(row.quantity, row.description, amount))
+        discounts["total_discount"] += amount
+    location = receipt_rows[1].value
+    return lines, discounts, location
+
+
+def measure(function, corpus, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for receipt in corpus:
+            function(receipt)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", help="Directory with recorded receipt details")
+    parser.add_argument("--receipts", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.corpus:
+        corpus = load_corpus(args.corpus)
+    else:
+        rng = random.Random(0)
+        corpus = [make_receipt(rng) for _ in range(args.receipts)]
+    rows = sum(len(receipt) for receipt in corpus)
+    print(f"{len(corpus)} receipts, {rows} rows, {len(msgspec.json.encode(corpus)) / 1024:.0f} KiB")
+
+    receipt_parser = ReceiptParser()
+    for name, function in (("multi-scan", baseline), ("single pass", receipt_parser.parse)):
+        seconds = measure(function, corpus, args.repeat)
+        print(f"{name:<12} {seconds * 1000:8.1f} ms, {seconds / rows * 1e9:6.0f} ns per row")
+
+
+if __name__ == "__main__":
+    main()
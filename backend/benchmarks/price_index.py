@@ -0,0 +1,169 @@
+"""Benchmarks the price index engine on a synthetic purchase history.
+
+--lines purchase lines of --products products in --stores stores are generated over --years
+years, with prices that rise by --inflation per year plus noise. The lines are loaded into the
+NumPy columns of price_index.py, and the chained indices are computed overall, per store and for
+a category of a tenth of the products, by month and by week. Then a week of new receipts is
+added, and later an old receipt is reprocessed, and the cached indices are extended
+incrementally. A per product loop in plain Python, as the index would be computed over the rows
+of products, computes the monthly index of the first --baseline-lines lines for comparison, and
+its result is checked against the engine. The database is not used, but the config file that
+the application reads is.
+
+Usage: python benchmarks/price_index.py [--lines 1000000] [--years 5] [--products 3000]
+"""
+import argparse
+import datetime as dt
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from price_index import PriceIndex, PurchaseLines, price_links, period_index, EPOCH  # noqa: E402
+
+LINES_PER_RECEIPT = 25
+
+
+def make_lines(
+    args, rng: np.random.Generator, first_receipt: int, receipts: int, first_day: int, days: int
+) -> tuple:
+    """Columns of synthetic lines, receipts spread evenly over the days"""
+    count = receipts * LINES_PER_RECEIPT
+    receipt = np.repeat(np.arange(first_receipt, first_receipt + receipts), LINES_PER_RECEIPT)
+    receipt_day = first_day + np.arange(receipts) * days // receipts
+    day = np.repeat(receipt_day, LINES_PER_RECEIPT)
+    location = np.repeat(rng.integers(0, args.stores, receipts), LINES_PER_RECEIPT)
+    # Some products are bought far more often than others
+    product = np.minimum(rng.zipf(1.3, count) - 1, args.products - 1)
+    quantity = rng.integers(1, 4, count)
+    years = (day - args.start) / 365.25
+    price = (
+        (1 + product % 50 / 10)
+        * (1 + args.inflation) ** years
+        * rng.normal(1, 0.05, count).clip(0.8, 1.2)
+    ).round(2)
+    return receipt, day, location, product, quantity, price
+
+
+def baseline(lines: PurchaseLines, rows: int) -> list[tuple]:
+    """The monthly Laspeyres links with a dictionary per product and month"""
+    months = {}
+    for day, product, quantity, price in zip(
+        lines.day[:rows].tolist(),
+        lines.product[:rows].tolist(),
+        lines.quantity[:rows].tolist(),
+        lines.price[:rows].tolist(),
+    ):
+        month = (EPOCH + dt.timedelta(days=day)).replace(day=1)
+        totals = months.setdefault(month, {}).setdefault(product, [0.0, 0.0])
+        totals[0] += quantity
+        totals[1] += quantity * price
+    links = []
+    previous = None
+    for month in sorted(months):
+        current = {
+            product: (quantity, value / quantity)
+            for product, (quantity, value) in months[month].items()
+        }
+        if previous is None:
+            links.append(1.0)
+        else:
+            matched = [product for product in current if product in previous]
+            numerator = sum(current[product][1] * previous[product][0] for product in matched)
+            denominator = sum(previous[product][1] * previous[product][0] for product in matched)
+            links.append(numerator / denominator if denominator else 1.0)
+        previous = current
+    return links
+
+
+def timed(name: str, function, repeat: int = 1):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        samples.append(time.perf_counter() - start)
+    print(f"{name:<36} {min(samples) * 1000:9.2f} ms")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lines", type=int, default=1_000_000)
+    parser.add_argument("--years", type=int, default=5)
+    parser.add_argument("--products", type=int, default=3000)
+    parser.add_argument("--stores", type=int, default=5)
+    parser.add_argument("--inflation", type=float, default=0.04)
+    parser.add_argument("--baseline-lines", type=int, default=200_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    args.start = (dt.date.today() - EPOCH).days - int(args.years * 365.25)
+    receipts = args.lines // LINES_PER_RECEIPT
+    columns = make_lines(args, rng, 1, receipts, args.start, int(args.years * 365.25) - 7)
+
+    index = PriceIndex(_engine=None)
+    for number in range(args.products):
+        index.lines.product_number(str(number))
+    timed("load columns", lambda: index.update([], *columns))
+    size = sum(
+        getattr(index.lines, name).nbytes
+        for name in ("receipt", "day", "location", "product", "quantity", "price")
+    )
+    print(f"{len(index.lines)} lines in {size / 1024 / 1024:.1f} MiB")
+
+    category = frozenset(str(number) for number in range(0, args.products, 10))
+    queries = [
+        ("month", None, None),
+        ("week", None, None),
+        ("month", None, 0),
+        ("month", category, None),
+        ("week", category, 1),
+    ]
+    for period, members, store in queries:
+        name = period + (" category" if members else "")
+        name += f" store {store}" if store is not None else ""
+        index._results.clear()
+        timed(f"compute {name}", lambda: index.compute(period, members, store))
+    timed("cached month", lambda: index.compute("month"), args.repeat)
+
+    links = index.compute("month")
+    yearly = (np.prod(links.laspeyres[1:]) ** (1 / args.years) - 1) * 100
+    print(f"Laspeyres inflation {yearly:.2f}% per year, generated {args.inflation * 100:.2f}%")
+
+    # A week of new receipts after the history, and one old receipt reprocessed
+    new_receipts = 7 * receipts // int(args.years * 365.25)
+    end = args.start + int(args.years * 365.25) - 7
+    added = make_lines(args, rng, receipts + 1, new_receipts, end, 7)
+    old_receipt = receipts // 2
+    old_day = int(columns[1][(old_receipt - 1) * LINES_PER_RECEIPT])
+    reprocessed = make_lines(args, rng, old_receipt, 1, old_day, 1)
+    for step, receipt_ids, lines in (
+        ("a week of new receipts", [], added),
+        ("an old receipt reprocessed", [old_receipt], reprocessed),
+    ):
+        for period, members, store in queries:
+            index.compute(period, members, store)
+        timed(f"update {step}", lambda: index.update(receipt_ids, *lines))
+        for period, members, store in queries[:2]:
+            timed(f"  extend {period}", lambda: index.compute(period, members, store))
+            full = price_links(index.lines, np.ones(len(index.lines), bool), period)
+            incremental = index.compute(period, members, store)
+            assert np.array_equal(full.periods, incremental.periods)
+            assert np.allclose(full.laspeyres, incremental.laspeyres)
+            assert np.allclose(full.paasche, incremental.paasche)
+
+    rows = min(args.baseline_lines, len(index.lines))
+    expected = timed(f"python loop, {rows} lines", lambda: baseline(index.lines, rows))
+    mask = np.zeros(len(index.lines), bool)
+    mask[:rows] = True
+    result = timed(f"numpy, {rows} lines", lambda: price_links(index.lines, mask, "month"))
+    assert np.allclose(result.laspeyres, expected)
+    assert len(np.unique(period_index(index.lines.day[:rows], "month"))) == len(expected)
+
+
+if __name__ == "__main__":
+    main()
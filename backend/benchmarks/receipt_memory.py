@@ -0,0 +1,179 @@
+"""Measures the memory held by 1000 processed receipts.
+
+The previous representation is replicated with dict backed classes: products and discounts with
+an instance __dict__, the product lines as dicts, the catalog candidates kept on every product
+and as potential products, and the raw summary and receipt details kept on the receipt. The
+current representation uses the slotted Receipt and Product, the frozen structs of the parser
+and Candidate. The candidates are released after matching, only the ids of the potential
+products are kept, and so are the raw payloads once the receipt is archived. No database is
+used, every product gets synthetic candidates. Needs the config file that the application reads.
+
+Usage: python benchmarks/receipt_memory.py [--receipts 1000] [--candidates 10]
+"""
+import argparse
+import datetime as dt
+import gc
+import os
+import random
+import sys
+import tracemalloc
+
+import msgspec
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from parse_receipts import make_receipt  # noqa: E402
+from classes.Product import Candidate  # noqa: E402
+from classes.Receipt import Receipt  # noqa: E402
+from classes.ReceiptParser import ReceiptParser  # noqa: E402
+from schemas import ReceiptUiItem  # noqa: E402
+
+
+class LegacyRecord:
+    def __init__(self, **values):
+        self.__dict__.update(values)
+
+
+def make_summary(index: int) -> dict:
+    return {
+        "transactionId": f"AH{index:012d}",
+        "transactionMoment": "2024-03-01T12:00:00Z",
+        "total": {"amount": {"amount": 42.5, "currency": "EUR"}},
+        "storeAddress": {
+            "street": "Straatweg",
+            "houseNumber": "1",
+            "postalCode": "1234AB",
+            "city": "Amsterdam",
+        },
+    }
+
+
+def make_candidates(rng: random.Random, count: int) -> list[tuple]:
+    candidates = []
+    for _ in range(count):
+        price = round(rng.uniform(0.5, 15), 2)
+        candidates.append(
+            (
+                rng.random(),
+                {
+                    "id": rng.randint(1, 100000),
+                    "webshop_id": str(rng.randint(100000, 999999)),
+                    "title": f"AH Product {rng.randint(1, 100000)}",
+                    "sub_category": "Melk",
+                    "price_before_bonus": price,
+                    "current_price": None,
+                    "unit_price": price * 2,
+                    "unit": "kg",
+                    "unit_size": 0.5,
+                },
+            )
+        )
+    return candidates
+
+
+def legacy(corpus: list, candidates: int) -> list:
+    receipts = []
+    rng = random.Random(1)
+    parser = ReceiptParser()
+    for index, encoded in enumerate(corpus):
+        summary = make_summary(index)
+        # The details were decoded to dicts and kept on the receipt
+        details = msgspec.json.decode(encoded)
+        parsed = parser.parse(msgspec.json.decode(encoded, type=list[ReceiptUiItem]))
+        products = []
+        for line in parsed.lines:
+            line = {
+                "quantity": line.quantity,
+                "unit": line.unit,
+                "description": line.description,
+                "price": line.price,
+                "total_price": line.total_price,
+                "indicator": line.indicator,
+            }
+            found = [
+                (score, LegacyRecord(**values))
+                for score, values in make_candidates(rng, candidates)
+            ]
+            products.append(
+                LegacyRecord(
+                    **line,
+                    name=None,
+                    product_id=None,
+                    category=None,
+                    potential_products=[product for _, product in found],
+                    product_not_found=True,
+                    lookup_deferred=True,
+                    datetime=dt.datetime(2024, 3, 1, 12),
+                    candidates=found,
+                    price_history={},
+                )
+            )
+        discounts = [
+            LegacyRecord(type=d.type, description=d.description, amount=d.amount)
+            for d in parsed.discounts
+        ]
+        receipts.append(
+            LegacyRecord(
+                transaction_id=summary["transactionId"],
+                datetime=dt.datetime(2024, 3, 1, 12),
+                receipt_details=details,
+                location=LegacyRecord(name=parsed.location_name, address="Straatweg"),
+                total=summary["total"]["amount"]["amount"],
+                products=products,
+                discounts={"discounts": discounts, "total_discount": parsed.total_discount},
+                _receipt=summary,
+            )
+        )
+    return receipts
+
+
+def compact(corpus: list, candidates: int) -> list:
+    receipts = []
+    rng = random.Random(1)
+    for index, encoded in enumerate(corpus):
+        receipt = Receipt(make_summary(index), msgspec.json.decode(encoded, type=list[ReceiptUiItem]))
+        parsed = receipt._parser.parse(receipt.receipt_details)
+        receipt.products = [receipt._parse_product(line) for line in parsed.lines]
+        receipt.discounts = {"discounts": parsed.discounts, "total_discount": parsed.total_discount}
+        receipt.location = receipt._get_location(receipt.summary["storeAddress"], parsed.location_name)
+        for product in receipt.products:
+            product.candidates = [
+                (score, Candidate(**values)) for score, values in make_candidates(rng, candidates)
+            ]
+            product.defer_lookup()
+            product.release_candidates()
+        receipt.release_payloads()
+        receipts.append(receipt)
+    return receipts
+
+
+def measure(function, corpus: list, candidates: int) -> int:
+    gc.collect()
+    tracemalloc.start()
+    receipts = function(corpus, candidates)
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del receipts
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--receipts", type=int, default=1000)
+    parser.add_argument("--candidates", type=int, default=10)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    corpus = [msgspec.json.encode(make_receipt(rng)) for _ in range(args.receipts)]
+    results = []
+    for name, function in (("dict backed", legacy), ("slotted", compact)):
+        size = measure(function, corpus, args.candidates)
+        results.append(size)
+        print(f"{name:<12} {size / 1024 / 1024:8.2f} MiB, {size / args.receipts / 1024:6.1f} KiB per receipt")
+    print(f"reduction {1 - results[1] / results[0]:.0%}")
+
+
+if __name__ == "__main__":
+    main()
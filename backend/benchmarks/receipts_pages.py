@@ -0,0 +1,91 @@
+"""Benchmarks listing receipts as the receipts table grows.
+
+Compares loading every receipt as ORM objects and serializing them with toJSON, as /api/receipts
+used to do, with the keyset paginated query and the msgspec encoder. Synthetic receipts are
+inserted in a transaction that is rolled back at the end, so the database is left as it was.
+Needs the database and the config file that the application reads, with the migrations applied.
+
+Usage: python benchmarks/receipts_pages.py [--sizes 1000 10000 100000] [--pages 200]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+from sqlalchemy import text
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from database.DbHandler import DbHandler  # noqa: E402
+from schemas import ReceiptSummary, ReceiptsPage, json_encoder, encode_cursor  # noqa: E402
+
+PAGE_SIZE = 50
+
+INSERT_RECEIPTS = """
+INSERT INTO receipts (transaction_id, datetime, location, total_price, total_discount)
+SELECT 'benchmark-' || n, now() - n * interval '1 hour', :location, 5 + (n % 200), n % 7
+FROM generate_series(:start, :stop - 1) AS n
+"""
+
+
+def page(db_handler: DbHandler, after=None) -> bytes:
+    rows = db_handler.get_receipts_page(PAGE_SIZE + 1, after=after)
+    receipts = [ReceiptSummary(*row) for row in rows[:PAGE_SIZE]]
+    next_cursor = None
+    if len(rows) > PAGE_SIZE:
+        next_cursor = encode_cursor(receipts[-1].datetime, receipts[-1].id)
+    return json_encoder.encode(ReceiptsPage(receipts, next_cursor))
+
+
+def percentiles(samples: list[float]) -> str:
+    quantiles = statistics.quantiles(samples, n=20)
+    return f"p50 {statistics.median(samples) * 1000:7.2f} ms, p95 {quantiles[18] * 1000:7.2f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--pages", type=int, default=200)
+    args = parser.parse_args()
+
+    db_handler = DbHandler()
+    session = db_handler._session
+    rng = random.Random(0)
+    try:
+        location = session.execute(
+            text(
+                "INSERT INTO locations (name, address, house_number, city, postal_code) "
+                "VALUES ('benchmark', '', '', '', '') RETURNING id"
+            )
+        ).scalar_one()
+        inserted = 0
+        for size in sorted(args.sizes):
+            session.execute(
+                text(INSERT_RECEIPTS), {"location": location, "start": inserted, "stop": size}
+            )
+            inserted = size
+            session.execute(text("ANALYZE receipts"))
+            keys = session.execute(text("SELECT datetime, id FROM receipts")).all()
+
+            samples = []
+            for _ in range(args.pages):
+                # A random page somewhere in the history, the first page included
+                after = tuple(rng.choice(keys)) if rng.random() < 0.9 else None
+                start = time.perf_counter()
+                page(db_handler, after)
+                samples.append(time.perf_counter() - start)
+            print(f"{size:>7} receipts  keyset page   {percentiles(samples)}")
+
+            start = time.perf_counter()
+            [receipt.toJSON() for receipt in db_handler.get_receipts()]
+            session.expunge_all()
+            print(f"{size:>7} receipts  full list     {(time.perf_counter() - start) * 1000:7.2f} ms")
+    finally:
+        session.rollback()
+        db_handler.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Benchmarks serving a receipts page through the response cache.
+
+A Flask view builds and encodes a page of synthetic receipts, after sleeping for --query-ms to
+stand in for the database. It is requested uncached, from the cache with and without gzip, and
+revalidated with If-None-Match, with the response sizes on the wire. The database is not used,
+but the config file that the application reads is.
+
+Usage: python benchmarks/response_cache.py [--receipts 500] [--query-ms 5] [--requests 500]
+"""
+import argparse
+import datetime as dt
+import os
+import sys
+import tempfile
+import time
+
+import flask
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from database.generation import DataGeneration  # noqa: E402
+from response_cache import ResponseCache  # noqa: E402
+from schemas import ReceiptSummary, ReceiptsPage, json_encoder  # noqa: E402
+
+
+def make_app(receipts: int, query_seconds: float, cache: ResponseCache) -> flask.Flask:
+    app = flask.Flask(__name__)
+    start = dt.datetime(2024, 1, 1, tzinfo=dt.timezone.utc)
+    page = ReceiptsPage(
+        [
+            ReceiptSummary(
+                id, f"AH{id:010d}", start + dt.timedelta(hours=id), id % 7, 5 + id % 200, id % 3
+            )
+            for id in range(receipts)
+        ]
+    )
+
+    def receipts_page():
+        time.sleep(query_seconds)
+        return flask.Response(json_encoder.encode(page), mimetype="application/json")
+
+    app.add_url_rule("/uncached", "uncached", receipts_page)
+    app.add_url_rule("/cached", "cached", lambda: cache.respond(receipts_page))
+    return app
+
+
+def measure(client, path: str, requests: int, headers: dict = None) -> tuple[float, int]:
+    start = time.perf_counter()
+    for _ in range(requests):
+        response = client.get(path, headers=headers)
+    return (time.perf_counter() - start) / requests, len(response.data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--receipts", type=int, default=500)
+    parser.add_argument("--query-ms", type=float, default=5)
+    parser.add_argument("--requests", type=int, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        generation = DataGeneration(os.path.join(directory, "data_generation"))
+        cache = ResponseCache(_generation=generation)
+        client = make_app(args.receipts, args.query_ms / 1000, cache).test_client()
+        etag = client.get("/cached", headers={"Accept-Encoding": "gzip"}).headers["ETag"]
+        results = [
+            ("uncached", measure(client, "/uncached", args.requests)),
+            ("cached", measure(client, "/cached", args.requests)),
+            ("cached, gzip", measure(client, "/cached", args.requests, {"Accept-Encoding": "gzip"})),
+            (
+                "revalidated (304)",
+                measure(
+                    client,
+                    "/cached",
+                    args.requests,
+                    {"Accept-Encoding": "gzip", "If-None-Match": etag},
+                ),
+            ),
+        ]
+    print(f"Page of {args.receipts} receipts, {args.query_ms} ms per query")
+    for name, (seconds, size) in results:
+        print(f"{name:<18} {seconds * 1000:8.3f} ms per request, {size:>7} bytes")
+
+
+if __name__ == "__main__":
+    main()
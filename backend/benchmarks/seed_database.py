@@ -0,0 +1,146 @@
+"""Seeds an empty database with years of synthetic history for the benchmarks.
+
+Inserts a category tree of three levels with its closure, a catalog whose products have
+categories, a few stores and receipts with product lines and discounts, and builds the daily
+rollups from them. Unlike benchmarks/analytics_queries.py the data is committed, so the API can be
+load tested on it. Only use it on a database of its own: it refuses to run when the database
+already has receipts. Needs the config file that the application reads, with the migrations
+applied.
+
+Usage: python benchmarks/seed_database.py [--years 5] [--receipts-per-week 3] [--products 2000]
+"""
+import argparse
+import os
+import sys
+import time
+
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import Session
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from database.setup import engine  # noqa: E402
+from database.DbHandler import REFRESH_CATEGORY_CLOSURE_STATEMENTS  # noqa: E402
+from database.rollups import ROLLUPS, refresh_rollups  # noqa: E402
+
+ROOTS = 10
+CHILDREN = 8
+LEAVES = 5
+STORES = 5
+LINES_PER_RECEIPT = 25
+
+# Taxonomy ids: the roots are 1 to ROOTS, every child and leaf is its parent times 100 plus n
+SEED_STATEMENTS = [
+    """
+    INSERT INTO categories (name, slug, english, taxonomy_id)
+    SELECT 'Categorie ' || id, 'categorie-' || id, 'Category ' || id, id::text
+    FROM (
+        SELECT r AS id FROM generate_series(1, :roots) r
+        UNION ALL
+        SELECT r * 100 + c FROM generate_series(1, :roots) r, generate_series(1, :children) c
+        UNION ALL
+        SELECT (r * 100 + c) * 100 + l
+        FROM generate_series(1, :roots) r, generate_series(1, :children) c,
+            generate_series(1, :leaves) l
+    ) ids
+    """,
+    """
+    INSERT INTO categories_hierarchy (parent, child)
+    SELECT (id / 100)::text, id::text
+    FROM (SELECT taxonomy_id::int AS id FROM categories) ids
+    WHERE id >= 100
+    """,
+    """
+    INSERT INTO ah_products (webshop_id, title, current_price)
+    SELECT 'wi' || n, 'Product ' || n, 1 + n % 9
+    FROM generate_series(1, :products) n
+    """,
+    # Every product is in a leaf and, like set_categories_for_products assigns, its ancestors
+    """
+    INSERT INTO categories_products (taxonomy_id, product_id)
+    SELECT c.ancestor, p.webshop_id
+    FROM ah_products p
+    JOIN (
+        SELECT taxonomy_id, row_number() OVER (ORDER BY taxonomy_id) - 1 AS position
+        FROM categories WHERE taxonomy_id::int >= 10000
+    ) leaf ON leaf.position = p.id % (:roots * :children * :leaves)
+    JOIN categories_closure c ON c.descendant = leaf.taxonomy_id
+    """,
+    """
+    INSERT INTO locations (name, address, house_number, city, postal_code)
+    SELECT 'AH Winkel ' || n, 'Straat', n::text, 'Zaandam', '1234 AB'
+    FROM generate_series(1, :stores) n
+    """,
+    """
+    INSERT INTO receipts (transaction_id, datetime, location, total_price, total_discount)
+    SELECT 'seed-' || n, now() - n * (interval '1 week' / :per_week),
+        (SELECT min(id) FROM locations) + n % :stores, 0, (n % 5) * 0.8
+    FROM generate_series(1, :receipts) n
+    """,
+    """
+    INSERT INTO products (product_id, description, name, receipt, quantity, price, total_price,
+        product_not_found)
+    SELECT p.webshop_id, upper(p.title), p.title, r.id, 1 + s.n % 3, p.current_price,
+        (1 + s.n % 3) * p.current_price, false
+    FROM receipts r
+    CROSS JOIN generate_series(1, :lines) AS s(n)
+    JOIN ah_products p
+        ON p.id = (SELECT min(id) FROM ah_products) + (r.id * 31 + s.n * 17) % :products
+    """,
+    """
+    UPDATE receipts r SET total_price = lines.total - r.total_discount
+    FROM (SELECT receipt, sum(total_price) AS total FROM products GROUP BY receipt) lines
+    WHERE lines.receipt = r.id
+    """,
+    """
+    INSERT INTO discounts (receipt, type, description, amount)
+    SELECT id, 'BONUS', 'AHBONUS', total_discount FROM receipts WHERE total_discount > 0
+    """,
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--years", type=int, default=5)
+    parser.add_argument("--receipts-per-week", type=int, default=3)
+    parser.add_argument("--products", type=int, default=2000)
+    args = parser.parse_args()
+
+    params = {
+        "roots": ROOTS,
+        "children": CHILDREN,
+        "leaves": LEAVES,
+        "stores": STORES,
+        "lines": LINES_PER_RECEIPT,
+        "products": args.products,
+        "per_week": args.receipts_per_week,
+        "receipts": args.years * 52 * args.receipts_per_week,
+    }
+    start = time.perf_counter()
+    with Session(engine) as session:
+        if session.execute(text("SELECT EXISTS (SELECT FROM receipts)")).scalar_one():
+            sys.exit("The database has receipts already, seed a database of its own")
+        for statement in SEED_STATEMENTS[:2]:
+            session.execute(text(statement), params)
+        for statement in REFRESH_CATEGORY_CLOSURE_STATEMENTS:
+            session.execute(text(statement))
+        for statement in SEED_STATEMENTS[2:]:
+            session.execute(text(statement), params)
+        refresh_rollups(session)
+        session.commit()
+    with engine.connect() as connection:
+        lines = connection.execute(text("SELECT count(*) FROM products")).scalar_one()
+        rows = sum(
+            connection.execute(select(func.count()).select_from(model)).scalar_one()
+            for model, _ in ROLLUPS
+        )
+        connection.execute(text("ANALYZE"))
+        connection.commit()
+    print(
+        f"{params['receipts']} receipts with {lines} lines over {args.years} years and "
+        f"{rows} rollup rows in {time.perf_counter() - start:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
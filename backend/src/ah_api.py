@@ -1,6 +1,7 @@
 import requests
 import urllib.parse
 from config import Config
+from schemas import ApiProduct, SearchPage, search_page_decoder, purchases_page_decoder
 import logging
 import math
 
@@ -104,7 +105,7 @@ def fetch_receipts():
 
 def get_previously_bought(
     sort_on: str = "PURCHASE_DATE", size: int = 100, page: int = 0, result: list = None
-):
+) -> list[ApiProduct]:
     if result is None:
         result = []
     response = requests.get(
@@ -131,10 +132,10 @@ def get_previously_bought(
         )
     response.raise_for_status()
 
-    prev_bought = response.json()
-    result.extend(prev_bought["products"])
-    if "next" in prev_bought["links"]:
-        url = prev_bought["links"]["next"]["href"]
+    prev_bought = purchases_page_decoder.decode(response.content)
+    result.extend(prev_bought.products)
+    if "next" in prev_bought.links:
+        url = prev_bought.links["next"].href
         # get the page number and size from the url
         parsed = urllib.parse.urlparse(url)
         params = urllib.parse.parse_qs(parsed.query)
@@ -144,7 +145,7 @@ def get_previously_bought(
     return result
 
 
-def search_products(query=None, page=0, size=750, sort="RELEVANCE", taxonomyId=None):
+def _search_products_response(query=None, page=0, size=750, sort="RELEVANCE", taxonomyId=None):
     size = math.floor(3000 / (page + 1))
     response = requests.get(
         "https://api.ah.nl/mobile-services/product/search/v2?sortOn=RELEVANCE",
@@ -178,18 +179,31 @@ def search_products(query=None, page=0, size=750, sort="RELEVANCE", taxonomyId=N
         )
     if not response.ok:
         response.raise_for_status()
-    return response.json()
+    return response
+
+
+def search_products(query=None, page=0, size=750, sort="RELEVANCE", taxonomyId=None):
+    return _search_products_response(query, page, size, sort, taxonomyId).json()
+
+
+def search_products_page(
+    query=None, page=0, size=750, sort="RELEVANCE", taxonomyId=None
+) -> SearchPage:
+    """Searches products and decodes the page into typed products. Fields that are not stored are skipped while decoding."""
+    return search_page_decoder.decode(
+        _search_products_response(query, page, size, sort, taxonomyId).content
+    )
 
 
 def search_all_products(**kwargs):
     """
     Iterate all the products available, filtering by query or other filters. Will return generator.
     :param kwargs: See params of 'search_products' method, note that size should not be altered to optimize/limit pages
-    :return: generator yielding products
+    :return: generator yielding ApiProduct structs
     """
-    response = search_products(page=0, **kwargs)
-    yield from response["products"]
+    response = search_products_page(page=0, **kwargs)
+    yield from response.products
 
-    for page in range(1, response["page"]["totalPages"]):
-        response = search_products(page=page, **kwargs)
-        yield from response["products"]
+    for page in range(1, response.page.total_pages):
+        response = search_products_page(page=page, **kwargs)
+        yield from response.products
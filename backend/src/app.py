@@ -1,22 +1,247 @@
 import flask
 import flask_cors
+import datetime as dt
 import os
 import sys
 from main import main
+from database.setup import engine
 from database.DbHandler import DbHandler
+from database.export import export_rows, ndjson_chunks, csv_chunks
+from database import analytics
+from database.analytics import analytics_cache
+from response_cache import cached_response
+from price_index import price_index
+from schemas import (
+    RECEIPTS_PAGE_SIZE,
+    MAX_RECEIPTS_PAGE_SIZE,
+    MAX_TOP_PRODUCTS,
+    receipt_detail,
+    receipts_page,
+    json_encoder,
+    decode_cursor,
+)
 
 
 app = flask.Flask(__name__)
 flask_cors.CORS(app)
 
-main()
+# gunicorn.conf.py syncs once in the server process instead of in every worker
+if os.environ.get("GROCITRACK_SYNC_ON_START", "1") == "1":
+    main()
 
 @app.route("/")
 def index():
     return "Hello World!"
 
+def db_handler() -> DbHandler:
+    """Gets the database handler of the current request, it is opened on first use and closed
+    when the request ends"""
+    if "db_handler" not in flask.g:
+        flask.g.db_handler = DbHandler()
+    return flask.g.db_handler
+
+
+@app.teardown_appcontext
+def close_db_handler(exception):
+    handler = flask.g.pop("db_handler", None)
+    if handler is not None:
+        handler.close()
+
+
+def json_response(payload) -> flask.Response:
+    return flask.Response(json_encoder.encode(payload), mimetype="application/json")
+
+
+def query_arg(name: str, type):
+    """Gets an optional query parameter, a 400 response is returned if it can not be parsed"""
+    value = flask.request.args.get(name)
+    if value is None or value == "":
+        return None
+    try:
+        return type(value)
+    except ValueError:
+        flask.abort(400, description=f"Invalid value for {name}: {value}")
+
+
+def parse_ids(value: str) -> list[int]:
+    return [int(id) for id in value.split(",") if id.strip()]
+
+
+def get_receipt_details(receipt_ids: list[int]) -> list:
+    return [
+        receipt_detail(receipt) for receipt in db_handler().get_receipts_with_details(receipt_ids)
+    ]
+
+
+@app.route("/api/receipts/<int:receipt_id>")
+@cached_response
+def get_receipt(receipt_id: int):
+    """Gets a receipt with its store, products and discounts."""
+    receipts = get_receipt_details([receipt_id])
+    if not receipts:
+        flask.abort(404, description=f"Receipt {receipt_id} not found")
+    return json_response(receipts[0])
+
+
 @app.route("/api/receipts")
+@cached_response
 def get_receipts():
-    db_handler = DbHandler()
-    receipts = db_handler.get_receipts()
-    return [receipt.toJSON() for receipt in receipts]
\ No newline at end of file
+    """Lists the receipts newest first, a page at a time.
+
+    Query parameters: limit, cursor (the next_cursor of the previous page), since and until
+    (ISO 8601), location (location ID), min_total and max_total. With ids (comma separated
+    receipt IDs) the receipts are returned with their store, products and discounts instead."""
+    receipt_ids = query_arg("ids", parse_ids)
+    if receipt_ids is not None:
+        if len(receipt_ids) > MAX_RECEIPTS_PAGE_SIZE:
+            flask.abort(400, description=f"At most {MAX_RECEIPTS_PAGE_SIZE} ids are allowed")
+        return json_response({"receipts": get_receipt_details(receipt_ids)})
+    limit = query_arg("limit", int)
+    if limit is None:
+        limit = RECEIPTS_PAGE_SIZE
+    if not 0 < limit <= MAX_RECEIPTS_PAGE_SIZE:
+        flask.abort(400, description=f"limit must be between 1 and {MAX_RECEIPTS_PAGE_SIZE}")
+    after = query_arg("cursor", decode_cursor)
+    rows = db_handler().get_receipts_page(
+        limit + 1,
+        after=after,
+        since=query_arg("since", dt.datetime.fromisoformat),
+        until=query_arg("until", dt.datetime.fromisoformat),
+        location=query_arg("location", int),
+        min_total=query_arg("min_total", float),
+        max_total=query_arg("max_total", float),
+    )
+    return json_response(receipts_page(rows, limit))
+
+
+# Formats that are streamed by /api/export, with their encoder and mimetype
+EXPORT_RESPONSE_FORMATS = {
+    "ndjson": (ndjson_chunks, "application/x-ndjson"),
+    "csv": (csv_chunks, "text/csv"),
+}
+
+
+def date_range() -> dict:
+    return {
+        "since": query_arg("since", dt.datetime.fromisoformat),
+        "until": query_arg("until", dt.datetime.fromisoformat),
+    }
+
+
+def analytics_response(query, **params) -> flask.Response:
+    """Runs a cached analytics query with the date range of the request, a 400 response is
+    returned if the query rejects its parameters"""
+    try:
+        return json_response(analytics_cache.get(query, **params, **date_range()))
+    except ValueError as e:
+        flask.abort(400, description=str(e))
+
+
+@app.route("/api/analytics/categories")
+@cached_response
+def get_spend_by_category():
+    """Spend per child category of parent (a taxonomy ID, the root categories by default)."""
+    return analytics_response(
+        analytics.spend_by_category, parent=flask.request.args.get("parent") or None
+    )
+
+
+@app.route("/api/analytics/stores")
+@cached_response
+def get_spend_by_store():
+    """Spend per store."""
+    return analytics_response(analytics.spend_by_store)
+
+
+@app.route("/api/analytics/spend")
+@cached_response
+def get_spend_over_time():
+    """Spend per period (week or month), optionally for the subtree of category."""
+    return analytics_response(
+        analytics.spend_over_time,
+        period=flask.request.args.get("period", "month"),
+        category=flask.request.args.get("category") or None,
+    )
+
+
+@app.route("/api/analytics/top-products")
+@cached_response
+def get_top_products():
+    """The products with the highest spend, or with order=count the most bought products."""
+    limit = query_arg("limit", int)
+    if limit is None:
+        limit = 20
+    if not 0 < limit <= MAX_TOP_PRODUCTS:
+        flask.abort(400, description=f"limit must be between 1 and {MAX_TOP_PRODUCTS}")
+    return analytics_response(
+        analytics.top_products,
+        limit=limit,
+        order=flask.request.args.get("order", "spend"),
+    )
+
+
+@app.route("/api/analytics/savings")
+@cached_response
+def get_savings_over_time():
+    """Discounts and savings rate per period (week or month)."""
+    return analytics_response(
+        analytics.savings_over_time, period=flask.request.args.get("period", "month")
+    )
+
+
+@app.route("/api/analytics/price-index")
+@cached_response
+def get_price_index():
+    """Chained Laspeyres and Paasche price index of the own purchases per period (week or
+    month), optionally for the subtree of category or for the store location."""
+    try:
+        return json_response(
+            price_index.get(
+                period=flask.request.args.get("period", "month"),
+                category=flask.request.args.get("category") or None,
+                store=query_arg("location", int),
+                **date_range(),
+            )
+        )
+    except ValueError as e:
+        flask.abort(400, description=str(e))
+
+
+@app.route("/api/analytics/dashboard")
+@cached_response
+def get_dashboard():
+    """The stores, root categories, monthly spend, top products and monthly savings at once."""
+    params = date_range()
+    return json_response(
+        {
+            name: analytics_cache.get(query, **defaults, **params)
+            for name, (query, defaults) in analytics.DASHBOARD.items()
+        }
+    )
+
+
+@app.route("/api/export")
+def export():
+    """Streams the whole purchase history, a row per product or discount line, as NDJSON
+    (format=ndjson, the default) or CSV. Optionally limited to since and until. Rows are read
+    from a server-side cursor and sent in chunks, so memory use does not grow with the history."""
+    format = flask.request.args.get("format", "ndjson")
+    if format not in EXPORT_RESPONSE_FORMATS:
+        flask.abort(
+            400,
+            description=f"format must be one of {', '.join(EXPORT_RESPONSE_FORMATS)}, "
+            "Parquet is exported with manage.py export",
+        )
+    encode, mimetype = EXPORT_RESPONSE_FORMATS[format]
+    params = date_range()
+
+    def generate():
+        # Closed when the client disconnects as well
+        with engine.connect() as connection:
+            yield from encode(export_rows(connection, **params))
+
+    return flask.Response(
+        generate(),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f'attachment; filename="grocitrack-export.{format}"'},
+    )
@@ -0,0 +1,224 @@
+"""Async variant of the read API of app.py, on the async engine of database/setup.py.
+
+Requests wait on Postgres without holding a thread, and the independent queries of the dashboard
+run concurrently, each on a connection of its own. The endpoints and their parameters are the
+same as in app.py, and they are served through the same response cache, with ETags and
+precompressed bodies. It does not sync receipts, run main.py or app.py for that.
+
+Usage, from the src directory: uvicorn asgi:app --host 0.0.0.0 --port 5001 --workers 2
+"""
+from contextlib import asynccontextmanager
+import asyncio
+import datetime as dt
+import logging
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Route
+
+from database.setup import async_engine
+from database.DbHandler import receipts_page_query, receipts_with_details_query, in_order
+from database import analytics
+from database.analytics import analytics_cache
+from price_index import price_index
+from response_cache import cached_response_async
+from schemas import (
+    RECEIPTS_PAGE_SIZE,
+    MAX_RECEIPTS_PAGE_SIZE,
+    MAX_TOP_PRODUCTS,
+    receipt_detail,
+    receipts_page,
+    json_encoder,
+    decode_cursor,
+)
+
+log = logging.getLogger(__name__)
+
+
+def json_response(payload) -> Response:
+    return Response(json_encoder.encode(payload), media_type="application/json")
+
+
+def query_arg(request: Request, name: str, type):
+    """Gets an optional query parameter, a 400 response is returned if it can not be parsed"""
+    value = request.query_params.get(name)
+    if value is None or value == "":
+        return None
+    try:
+        return type(value)
+    except ValueError:
+        raise HTTPException(400, detail=f"Invalid value for {name}: {value}")
+
+
+def parse_ids(value: str) -> list[int]:
+    return [int(id) for id in value.split(",") if id.strip()]
+
+
+def date_range(request: Request) -> dict:
+    return {
+        "since": query_arg(request, "since", dt.datetime.fromisoformat),
+        "until": query_arg(request, "until", dt.datetime.fromisoformat),
+    }
+
+
+async def get_receipt_details(receipt_ids: list[int]) -> list:
+    if not receipt_ids:
+        return []
+    async with AsyncSession(async_engine) as session:
+        receipts = await session.scalars(receipts_with_details_query(receipt_ids))
+        return [receipt_detail(receipt) for receipt in in_order(receipts, receipt_ids)]
+
+
+@cached_response_async
+async def get_receipt(request: Request) -> Response:
+    """Gets a receipt with its store, products and discounts."""
+    receipt_id = request.path_params["receipt_id"]
+    receipts = await get_receipt_details([receipt_id])
+    if not receipts:
+        raise HTTPException(404, detail=f"Receipt {receipt_id} not found")
+    return json_response(receipts[0])
+
+
+@cached_response_async
+async def get_receipts(request: Request) -> Response:
+    """Lists the receipts newest first, a page at a time, see get_receipts in app.py."""
+    receipt_ids = query_arg(request, "ids", parse_ids)
+    if receipt_ids is not None:
+        if len(receipt_ids) > MAX_RECEIPTS_PAGE_SIZE:
+            raise HTTPException(400, detail=f"At most {MAX_RECEIPTS_PAGE_SIZE} ids are allowed")
+        return json_response({"receipts": await get_receipt_details(receipt_ids)})
+    limit = query_arg(request, "limit", int)
+    if limit is None:
+        limit = RECEIPTS_PAGE_SIZE
+    if not 0 < limit <= MAX_RECEIPTS_PAGE_SIZE:
+        raise HTTPException(400, detail=f"limit must be between 1 and {MAX_RECEIPTS_PAGE_SIZE}")
+    query = receipts_page_query(
+        limit + 1,
+        after=query_arg(request, "cursor", decode_cursor),
+        **date_range(request),
+        location=query_arg(request, "location", int),
+        min_total=query_arg(request, "min_total", float),
+        max_total=query_arg(request, "max_total", float),
+    )
+    async with AsyncSession(async_engine) as session:
+        rows = (await session.execute(query)).all()
+    return json_response(receipts_page(rows, limit))
+
+
+async def analytics_response(request: Request, query, **params) -> Response:
+    """Runs a cached analytics query with the date range of the request, a 400 response is
+    returned if the query rejects its parameters"""
+    try:
+        return json_response(
+            await analytics_cache.get_async(query, **params, **date_range(request))
+        )
+    except ValueError as e:
+        raise HTTPException(400, detail=str(e))
+
+
+@cached_response_async
+async def get_spend_by_category(request: Request) -> Response:
+    """Spend per child category of parent (a taxonomy ID, the root categories by default)."""
+    return await analytics_response(
+        request, analytics.spend_by_category, parent=request.query_params.get("parent") or None
+    )
+
+
+@cached_response_async
+async def get_spend_by_store(request: Request) -> Response:
+    """Spend per store."""
+    return await analytics_response(request, analytics.spend_by_store)
+
+
+@cached_response_async
+async def get_spend_over_time(request: Request) -> Response:
+    """Spend per period (week or month), optionally for the subtree of category."""
+    return await analytics_response(
+        request,
+        analytics.spend_over_time,
+        period=request.query_params.get("period", "month"),
+        category=request.query_params.get("category") or None,
+    )
+
+
+@cached_response_async
+async def get_top_products(request: Request) -> Response:
+    """The products with the highest spend, or with order=count the most bought products."""
+    limit = query_arg(request, "limit", int)
+    if limit is None:
+        limit = 20
+    if not 0 < limit <= MAX_TOP_PRODUCTS:
+        raise HTTPException(400, detail=f"limit must be between 1 and {MAX_TOP_PRODUCTS}")
+    return await analytics_response(
+        request,
+        analytics.top_products,
+        limit=limit,
+        order=request.query_params.get("order", "spend"),
+    )
+
+
+@cached_response_async
+async def get_savings_over_time(request: Request) -> Response:
+    """Discounts and savings rate per period (week or month)."""
+    return await analytics_response(
+        request, analytics.savings_over_time, period=request.query_params.get("period", "month")
+    )
+
+
+@cached_response_async
+async def get_price_index(request: Request) -> Response:
+    """Chained price index per period, see get_price_index in app.py. It is computed in memory
+    on a thread, so it does not block the event loop."""
+    try:
+        result = await asyncio.to_thread(
+            price_index.get,
+            period=request.query_params.get("period", "month"),
+            category=request.query_params.get("category") or None,
+            store=query_arg(request, "location", int),
+            **date_range(request),
+        )
+    except ValueError as e:
+        raise HTTPException(400, detail=str(e))
+    return json_response(result)
+
+
+@cached_response_async
+async def get_dashboard(request: Request) -> Response:
+    """The stores, root categories, monthly spend, top products and monthly savings at once,
+    queried concurrently."""
+    params = date_range(request)
+    results = await asyncio.gather(
+        *(
+            analytics_cache.get_async(query, **defaults, **params)
+            for query, defaults in analytics.DASHBOARD.values()
+        )
+    )
+    return json_response(dict(zip(analytics.DASHBOARD, results)))
+
+
+@asynccontextmanager
+async def lifespan(app: Starlette):
+    yield
+    await async_engine.dispose()
+
+
+app = Starlette(
+    routes=[
+        Route("/api/receipts/{receipt_id:int}", get_receipt),
+        Route("/api/receipts", get_receipts),
+        Route("/api/analytics/categories", get_spend_by_category),
+        Route("/api/analytics/stores", get_spend_by_store),
+        Route("/api/analytics/spend", get_spend_over_time),
+        Route("/api/analytics/top-products", get_top_products),
+        Route("/api/analytics/savings", get_savings_over_time),
+        Route("/api/analytics/price-index", get_price_index),
+        Route("/api/analytics/dashboard", get_dashboard),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=["*"])],
+    lifespan=lifespan,
+)
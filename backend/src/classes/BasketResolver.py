@@ -0,0 +1,207 @@
+import logging
+
+from classes.Product import Product
+
+log = logging.getLogger(__name__)
+
+# Prices within half a cent are considered equal, this absorbs float rounding of parsed prices
+PRICE_TOLERANCE = 0.005
+# Weight of the similarity score, small enough that a cent of price difference always outweighs it
+SIMILARITY_WEIGHT = 0.001
+# Number of catalog candidates per line that are considered
+MAX_CANDIDATES = 10
+# Upper bound on the number of search nodes per receipt, the best assignment so far is kept after it
+MAX_SEARCH_NODES = 50000
+
+
+class LineOption:
+    """A way to explain a receipt line with a catalog candidate
+
+    Attributes:
+        candidate (DbAHProduct): The catalog candidate
+        cost (float): Price deviation of the line plus a small penalty for a low similarity score
+        saving (float): The bonus discount this option implies for the line
+    """
+
+    __slots__ = ("candidate", "cost", "saving")
+
+    def __init__(self, candidate, cost: float, saving: float):
+        self.candidate = candidate
+        self.cost = cost
+        self.saving = saving
+
+
+class BasketResolver:
+    """Matches all lines of a receipt with the catalog at once.
+
+    Every line is explained by the candidates whose price at the time of the receipt matches the
+    line price. A candidate that was on bonus can also imply a bonus discount. Among all
+    combinations, the resolver picks the one with the smallest price deviation whose implied
+    discounts add up closest to the discounts on the receipt, using a depth first branch and
+    bound search. Lines without any price consistent candidate remain unresolved and are left
+    for the AH API.
+
+    Attributes:
+        products (list[Product]): The products on the receipt with their candidates
+        total_discount (float): The total discount on the receipt
+        assignments (dict[Product, DbAHProduct]): The chosen candidate per resolved product
+        unresolved (list[Product]): The products without a price consistent candidate
+        isolated_misses (int): Number of products that would not be matched on their own
+        nodes (int): Number of visited search nodes
+    """
+
+    def __init__(
+        self,
+        products: list[Product],
+        total_discount: float = 0.0,
+        tolerance: float = PRICE_TOLERANCE,
+        max_candidates: int = MAX_CANDIDATES,
+        max_nodes: int = MAX_SEARCH_NODES,
+    ):
+        self.products = [product for product in products if product.quantity]
+        self.total_discount = total_discount or 0.0
+        self.tolerance = tolerance
+        self.max_candidates = max_candidates
+        self.max_nodes = max_nodes
+        self.assignments = {}
+        self.unresolved = []
+        self.isolated_misses = 0
+        self.nodes = 0
+
+    def _line_options(self, product: Product) -> list[LineOption]:
+        """Gets the candidates that are consistent with the price of a line.
+
+        Args:
+            product (Product): The product of the line.
+
+        Returns:
+            list[LineOption]: The options, cheapest first.
+        """
+        options = {}
+        for similarity, candidate in product.candidates[: self.max_candidates]:
+            penalty = SIMILARITY_WEIGHT * (1 - min(similarity or 0, 1))
+            if product.unit and product.unit.lower() == "kg":
+                if (
+                    candidate.unit in ("kg", None)
+                    and candidate.unit_price is not None
+                    and product.price is not None
+                ):
+                    deviation = abs(candidate.unit_price - product.price)
+                    if deviation <= self.tolerance:
+                        options[(candidate.id, 0.0)] = LineOption(
+                            candidate, deviation + penalty, 0.0
+                        )
+                continue
+
+            if product.quantity == 1:
+                paid = product.total_price
+            elif product.price is not None:
+                paid = product.price
+            elif product.total_price is not None:
+                paid = product.total_price / product.quantity
+            else:
+                paid = None
+            if paid is None:
+                continue
+            prices = {candidate.price_before_bonus, candidate.current_price}
+            prices.update(product.price_history.get(candidate.webshop_id, ()))
+            prices.discard(None)
+            for price in prices:
+                deviation = abs(price - paid)
+                if deviation > self.tolerance:
+                    continue
+                # Paid the regular price, possibly with a bonus discount further down the receipt
+                savings = {0.0}
+                savings.update(
+                    round((price - other) * product.quantity, 2)
+                    for other in prices
+                    if other < price
+                )
+                for saving in savings:
+                    key = (candidate.id, saving)
+                    if key not in options or deviation + penalty < options[key].cost:
+                        options[key] = LineOption(candidate, deviation + penalty, saving)
+        return sorted(options.values(), key=lambda option: option.cost)
+
+    def _search(self, lines: list[list[LineOption]], target: float) -> list[LineOption]:
+        """Finds the combination of options with the lowest cost.
+
+        Args:
+            lines (list[list[LineOption]]): The options per line.
+            target (float): The discount the lines should explain.
+
+        Returns:
+            list[LineOption]: The chosen option per line.
+        """
+        remaining_savings = [0.0] * (len(lines) + 1)
+        for index in range(len(lines) - 1, -1, -1):
+            remaining_savings[index] = remaining_savings[index + 1] + max(
+                option.saving for option in lines[index]
+            )
+
+        # Start from the cheapest option per line, so the search always has an answer
+        best_choice = [options[0] for options in lines]
+        best_cost = sum(option.cost for option in best_choice) + abs(
+            target - sum(option.saving for option in best_choice)
+        )
+        choice = []
+
+        def visit(index: int, cost: float, saving: float):
+            nonlocal best_cost, best_choice
+            self.nodes += 1
+            if self.nodes > self.max_nodes:
+                return
+            bound = cost + max(0.0, saving - target, target - saving - remaining_savings[index])
+            if bound >= best_cost:
+                return
+            if index == len(lines):
+                best_cost = cost + abs(target - saving)
+                best_choice = list(choice)
+                return
+            for option in lines[index]:
+                choice.append(option)
+                visit(index + 1, cost + option.cost, saving + option.saving)
+                choice.pop()
+
+        visit(0, 0.0, 0.0)
+        if self.nodes > self.max_nodes:
+            log.debug(f"Stopped the basket search after {self.max_nodes} nodes")
+        return best_choice
+
+    def resolve(self) -> list[Product]:
+        """Chooses a candidate for every line that has a price consistent candidate.
+
+        Returns:
+            list[Product]: The products that are still unresolved.
+        """
+        fixed_saving = 0.0
+        searched_products = []
+        lines = []
+        for product in self.products:
+            if not product.match_candidates()[1]:
+                self.isolated_misses += 1
+            options = self._line_options(product)
+            if not options:
+                self.unresolved.append(product)
+            elif len(options) == 1:
+                self.assignments[product] = options[0].candidate
+                fixed_saving += options[0].saving
+            else:
+                searched_products.append(product)
+                lines.append(options)
+
+        if lines:
+            # Lines with few options first, so the bound prunes early
+            order = sorted(range(len(lines)), key=lambda index: len(lines[index]))
+            choice = self._search(
+                [lines[index] for index in order], self.total_discount - fixed_saving
+            )
+            for index, option in zip(order, choice):
+                self.assignments[searched_products[index]] = option.candidate
+
+        log.debug(
+            f"Resolved {len(self.assignments)} of {len(self.products)} lines in "
+            f"{self.nodes} search nodes, {len(self.unresolved)} unresolved"
+        )
+        return self.unresolved
+
@@ -1,17 +1,12 @@
-class Location:
-    def __init__(
-        self,
-        name: str = None,
-        address: str = None,
-        house_number: str = None,
-        postal_code: str = None,
-        city: str = None,
-    ):
-        self.name = name
-        self.address = address
-        self.house_number = house_number
-        self.postal_code = postal_code
-        self.city = city
+import msgspec
+
+
+class Location(msgspec.Struct, frozen=True, gc=False):
+    name: str | None = None
+    address: str | None = None
+    house_number: str | None = None
+    postal_code: str | None = None
+    city: str | None = None
 
     def __repr__(self):
         return f"Location(name={self.name}, address={self.address}, house_number={self.house_number}, postal_code={self.postal_code}, city={self.city})"
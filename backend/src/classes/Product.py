@@ -1,20 +1,53 @@
 from supermarktconnector.ah import AHConnector
-import re
 from math import isnan
 from datetime import datetime
 
-from database.model import DbAHProduct, DbPreviousProduct
+import msgspec
 
+from units import parse_unit_price
+from util import api_rate_limiter
 
-class MatchedProduct:
-    def __init__(self, title, webshop_id, sub_category):
-        self.title = title
-        self.webshop_id = webshop_id
-        self.sub_category = sub_category
+
+class MatchedProduct(msgspec.Struct, frozen=True, gc=False):
+    title: str
+    webshop_id: int | str
+    sub_category: str | None
+
+
+class Candidate(msgspec.Struct, frozen=True, gc=False):
+    """A catalog product found for a receipt line, with the columns the matcher needs"""
+
+    id: int
+    webshop_id: str
+    title: str
+    sub_category: str | None
+    price_before_bonus: float | None
+    current_price: float | None
+    unit_price: float | None
+    unit: str | None
+    unit_size: float | None
 
 
 class Product:
-    _connector = AHConnector()
+    __slots__ = (
+        "quantity",
+        "unit",
+        "description",
+        "name",
+        "product_id",
+        "category",
+        "price",
+        "total_price",
+        "indicator",
+        "potential_products",
+        "product_not_found",
+        "lookup_deferred",
+        "datetime",
+        "candidates",
+        "price_history",
+    )
+    # Created on first use, it fetches an access token from the AH API
+    _connector = None
 
     def __init__(
         self,
@@ -25,6 +58,7 @@ class Product:
         total_price: float = None,
         indicator: str = None,
         datetime: datetime = None,
+        resolve: bool = True,
     ):
         self.quantity = quantity
         self.unit = unit
@@ -35,28 +69,41 @@ class Product:
         self.price = price
         self.total_price = total_price
         self.indicator = indicator
+        # The ids of the catalog candidates, kept when the product is not matched in the catalog
         self.potential_products = None
         self.product_not_found = False
+        self.lookup_deferred = False
         self.datetime = datetime
-        self._set_details()
+        self.candidates = []
+        self.price_history = {}
+        if resolve:
+            self._set_details()
 
     @property
     def connector(self):
-        return type(self)._connector
+        return type(self).get_connector()
+
+    @classmethod
+    def get_connector(cls) -> AHConnector:
+        if cls._connector is None:
+            cls._connector = AHConnector()
+        return cls._connector
 
     def _match_product(
         self,
-        products: list[tuple[float, DbAHProduct | DbPreviousProduct]] | list[dict],
+        products: list[tuple[float, Candidate]] | list[dict],
         model: str = None,
-    ) -> (DbAHProduct, bool):
+        price_history: dict[str, set[float]] = None,
+    ) -> (Candidate, bool):
         """Matches the product with the products in the database.
 
         Args:
-            products (list[tuple(float, DbAHProduct|DbPreviousProduct)] | list[dict]): The products to match. If the products are from the database, they are tuples of the similarity score and the product. If the products are from the AH API, they are dictionaries.
+            products (list[tuple(float, Candidate)] | list[dict]): The products to match. If the products are from the database, they are tuples of the similarity score and the product. If the products are from the AH API, they are dictionaries.
             model (str): The model to match with.
+            price_history (dict[str, set[float]]): The prices that were valid at the time of the receipt per webshop ID. Only used for products from the database.
 
         Returns:
-            DbAHProduct: The matched product.
+            Candidate: The matched product.
             bool: Whether the product is matched.
 
         """
@@ -104,88 +151,145 @@ class Product:
             ), False
         else:  # If the results came from searching the database
             for similarity, product in products:
+                prices = {product.price_before_bonus, product.current_price}
+                if price_history:
+                    prices.update(price_history.get(product.webshop_id, ()))
+                prices.discard(None)
                 if self.quantity == 1:
-                    if (
-                        product.price_before_bonus == self.total_price
-                        or product.current_price == self.total_price
-                    ):
+                    if self.total_price in prices:
                         return product, True
                 else:
                     if self.unit and self.unit.lower() == "kg":
-                        unit_price = self._clean_unit_price_description(
-                            product.unit_price_description
-                        )
-                        if unit_price == self.price:
+                        # The unit price is parsed once when the product enters the catalog
+                        if product.unit in ("kg", None) and product.unit_price == self.price:
                             return product, True
                     else:
-                        if (
-                            product.current_price == self.price
-                            or product.price_before_bonus == self.price
-                        ):
+                        if self.price in prices:
                             return product, True
             return products[0][1], False
 
-    def _set_details(self):
-        """Fetches and sets the details of the product."""
-        from database.DbHandler import DbHandler
+    def find_candidates(self, db_handler=None) -> list[tuple[float, Candidate]]:
+        """Searches the catalog for candidates of the product and the prices they had at the time of the receipt.
 
-        db_handler = DbHandler()
-        # TODO: Make constants instead of magic strings
-        model = "previous"
+        Args:
+            db_handler (DbHandler, optional): The database handler to use. Defaults to a new handler.
 
+        Returns:
+            list[tuple[float, Candidate]]: The candidates with their similarity scores. Previously bought products are ranked first.
+        """
+        if db_handler is None:
+            from database.DbHandler import DbHandler
+
+            db_handler = DbHandler()
         if not self.quantity:
-            return
-        products = db_handler.search_product(
-            input=self.description, model=DbPreviousProduct
-        )
-        if not products:
-            products = db_handler.search_product(
-                input=self.description, model=DbAHProduct
+            return []
+        self.candidates = db_handler.search_product(input=self.description)
+        if self.candidates:
+            # Older receipts are matched against the prices at the time of purchase
+            self.price_history = db_handler.get_prices_at(
+                [product.webshop_id for _, product in self.candidates], self.datetime
             )
-            model = "ah"
-        if not products:
-            products = self.connector.search_products(
-                query=self.description, size=15, page=0
-            )["products"]
-            model = "api"
-        if not products:
-            self.product_not_found = True
-            return
-        matched_product, is_matched = self._match_product(products, model)
+        return self.candidates
+
+    def share_candidates(self, product: "Product"):
+        """Reuses the candidates of a product with the same description.
+
+        Args:
+            product (Product): The product to copy the candidates from.
+        """
+        self.candidates = product.candidates
+        self.price_history = product.price_history
+
+    def match_candidates(self) -> (Candidate, bool):
+        """Matches the product with its catalog candidates on its own, without looking at the rest of the receipt.
+
+        Returns:
+            Candidate: The matched product, None if there are no candidates.
+            bool: Whether the product is matched.
+        """
+        if not self.candidates:
+            return None, False
+        return self._match_product(self.candidates, "catalog", self.price_history)
 
+    def apply_match(self, matched_product: Candidate | MatchedProduct, db_handler=None):
+        """Sets the name, product ID and category of the product from a matched product.
+
+        Args:
+            matched_product (Candidate | MatchedProduct): The matched product.
+            db_handler (DbHandler, optional): The database handler to use. Defaults to a new handler.
+        """
+        if db_handler is None:
+            from database.DbHandler import DbHandler
+
+            db_handler = DbHandler()
         self.name = matched_product.title
         self.product_id = matched_product.webshop_id
         category = db_handler.find_category_by_name(matched_product.sub_category)
         if category:
             self.category = category.taxonomy_id
 
-        # This needs major refactoring
+    def resolve_with_api(self, db_handler=None, products: list[dict] = None):
+        """Matches the product with the results of the AH API. The catalog candidates are kept as potential products.
+
+        Args:
+            db_handler (DbHandler, optional): The database handler to use. Defaults to a new handler.
+            products (list[dict], optional): The results of an earlier API search for the same description. Defaults to searching the API.
+        """
+        if self.candidates:
+            self.potential_products = [product.id for _, product in self.candidates]
+        if products is None:
+            products = self.search_api(self.description)
+        if not products:
+            self.product_not_found = True
+            return
+        matched_product, is_matched = self._match_product(products, "api")
+        self.apply_match(matched_product, db_handler)
         if not is_matched:
-            if model != "api":
-                # If there is no exact match in the database, add the
-                # products to the potential products and then search the AH API
-                self.potential_products = {
-                    "products": [
-                        product[1] for product in products
-                    ],  # omit similarity scores
-                    "model": model,
-                }
-                # Search AH API
-                products = self.connector.search_products(
-                    query=self.description, size=15, page=0
-                )["products"]
-                model = "api"
-                if not products:
-                    self.product_not_found = True
-                    return
-                matched_product, is_matched = self._match_product(products, model)
-            if not is_matched:
-                self.product_not_found = True
-        self.name = matched_product.title
-        self.product_id = matched_product.webshop_id
-        category = db_handler.find_category_by_name(matched_product.sub_category)
-        if category:
-            self.category = category.taxonomy_id
+            self.product_not_found = True
+
+    def defer_lookup(self):
+        """Marks the product as not found without searching the AH API. The catalog candidates are
+        kept as potential products and the product is resolved later from the resolution queue."""
+        if self.candidates:
+            self.potential_products = [product.id for _, product in self.candidates]
+        self.product_not_found = True
+        self.lookup_deferred = True
+
+    def release_candidates(self):
+        """Drops the catalog candidates and their price history once the product is resolved."""
+        self.candidates = ()
+        self.price_history = {}
+
+    @classmethod
+    def search_api(cls, description: str) -> list[dict]:
+        """Searches the AH API for a product description.
+
+        Args:
+            description (str): The description of the product.
+
+        Returns:
+            list[dict]: The products found by the API.
+        """
+        api_rate_limiter.acquire()
+        return cls.get_connector().search_products(query=description, size=15, page=0)[
+            "products"
+        ]
+
+    def _set_details(self):
+        """Fetches and sets the details of the product."""
+        from database.DbHandler import DbHandler
+
+        if not self.quantity:
+            return
+        db_handler = DbHandler()
+        if not self.find_candidates(db_handler):
+            self.resolve_with_api(db_handler)
+            return
+        matched_product, is_matched = self.match_candidates()
+        self.apply_match(matched_product, db_handler)
+        if not is_matched:
+            # If there is no exact match in the database, search the AH API
+            self.resolve_with_api(db_handler)
 
     def _get_categories(
         self, category_details: dict, product_id: int, taxonomy: str
@@ -221,15 +325,15 @@ class Product:
             unit_price_description (str): The unit price description.
 
         Returns:
-            float: The cleaned unit price description."""
+            float: The price per unit of the unit price description."""
         if (
             not unit_price_description
             or isinstance(unit_price_description, float)
             and isnan(unit_price_description)
         ):
             return None
-        regex = r"(\d+.\d+)"
-        return float(re.search(regex, unit_price_description).group(1))
+        unit_price, _ = parse_unit_price(unit_price_description)
+        return unit_price
 
     def __repr__(self):
         return f"Product(name={self.name}, product_id={self.product_id}, category={self.category}, price={self.price}, total_price={self.total_price}, indicator={self.indicator})"
@@ -2,11 +2,11 @@ from datetime import datetime
 import requests
 from classes.Location import Location
 from classes.Product import Product
-from classes.Discount import Discount
-from util import string_to_float
+from classes.BasketResolver import BasketResolver
+from classes.ReceiptParser import ReceiptParser, ReceiptLine, parse_quantity
+from schemas import decode_receipt_details
 from ah_api import update_tokens
 from config import Config
-import re
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import logging
 
@@ -20,25 +20,90 @@ class Receipt:
     RECEIPT_DETAILS_URL = (
         "https://api.ah.nl/mobile-services/v2/receipts/{transaction_id}"
     )
+    _parser = ReceiptParser()
+
+    __slots__ = (
+        "transaction_id",
+        "datetime",
+        "receipt_details",
+        "details_payload",
+        "api_lookups",
+        "location",
+        "total",
+        "products",
+        "discounts",
+        "api_calls",
+        "api_calls_avoided",
+        "_receipt",
+    )
 
-    def __init__(self, receipt):
+    def __init__(
+        self,
+        receipt,
+        receipt_details: list = None,
+        api_lookups: bool = True,
+        details_payload: bytes = None,
+    ):
         self.transaction_id = receipt["transactionId"]
         self.datetime = datetime.strptime(
             receipt["transactionMoment"], "%Y-%m-%dT%H:%M:%SZ"
         )
-        self.receipt_details = None
+        self.receipt_details = receipt_details
+        self.details_payload = details_payload
+        self.api_lookups = api_lookups
         self.location = None
         self.total = receipt["total"]["amount"]["amount"]
         self.products = []
         self.discounts = []
+        self.api_calls = 0
+        self.api_calls_avoided = 0
         self._receipt = receipt
 
     def set_details(self):
         """Sets the details of the receipt."""
-        self.receipt_details = self._get_receipt_details()
-        self.products = self._get_products()
-        self.discounts = self._get_discounts()
-        self.location = self._get_location(self._receipt["storeAddress"])
+        self.load_details()
+        parsed = self._parser.parse(self.receipt_details)
+        self.products = self._parse_products(parsed.lines)
+        self.discounts = {
+            "discounts": parsed.discounts,
+            "total_discount": parsed.total_discount,
+        }
+        self._resolve_products()
+        self.location = self._get_location(
+            self._receipt["storeAddress"], parsed.location_name
+        )
+
+    def fetch_details(self) -> bytes:
+        """Fetches the details of the receipt from the API as they were received, unless they
+        are already known. They are archived like this, so no field of the API is lost.
+
+        Returns:
+            bytes: The JSON response of the receipt details endpoint."""
+        if self.details_payload is None:
+            self.details_payload = self._get_receipt_details()
+        return self.details_payload
+
+    def load_details(self) -> list:
+        """Decodes the details of the receipt, they are fetched from the API if they are not
+        known yet.
+
+        Returns:
+            list: A list of receipt details."""
+        if self.receipt_details is None:
+            self.receipt_details = decode_receipt_details(self.fetch_details())
+        return self.receipt_details
+
+    @property
+    def summary(self) -> dict:
+        """The receipt as returned by the receipts endpoint, None once the payloads are released."""
+        return self._receipt
+
+    def release_payloads(self):
+        """Drops the raw summary and receipt details once the receipt is parsed and archived.
+        The parsed products, discounts and location are kept."""
+        self.receipt_details = None
+        self.details_payload = None
+        self._receipt = None
 
     def is_empty(self):
         """Checks if the receipt is empty."""
@@ -48,11 +113,11 @@ class Receipt:
             and len(self.discounts["discounts"]) == 0
         )
 
-    def _get_receipt_details(self) -> list:
+    def _get_receipt_details(self) -> bytes:
         """Fetches the details of a receipt from the API.
 
         Returns:
-            list: A list of receipt details."""
+            bytes: The JSON response."""
         url = self.RECEIPT_DETAILS_URL.format(transaction_id=self.transaction_id)
         response = requests.get(
             url,
@@ -67,98 +132,25 @@ class Receipt:
                 },
             )
         response.raise_for_status()
-        return response.json()["receiptUiItems"]
+        return response.content
 
-    def _get_location(self, store: dict) -> Location:
+    def _get_location(self, store: dict, name: str) -> Location:
         """Gets the store location of the receipt.
 
         Args:
             store (dict): The store information from the API response.
+            name (str): The name of the store from the receipt details.
 
         Returns:
             Location: A Location object."""
         return Location(
-            name=self.receipt_details[1]["value"],
+            name=name,
             address=store["street"],
             house_number=store["houseNumber"],
             postal_code=store["postalCode"],
             city=store["city"],
         )
 
-    def _get_products(self) -> list[Product]:
-        """Gets the products from the receipt.
-
-        Returns:
-            list: A list of Product objects."""
-        receipt_rows = self.receipt_details
-
-        # Remove all elements before "bonuskaart" (and that element itself) and after "subtotaal" to get only the products that have been purchased (without discounts etc.)
-        before_index = next(
-            (
-                index
-                for (index, d) in enumerate(receipt_rows)
-                if d["type"].lower() == "product"
-                and d["description"].lower() == "bonuskaart"
-            ),
-            None,
-        )
-        after_index = next(
-            (
-                index
-                for (index, d) in enumerate(receipt_rows)
-                if d["type"].lower() == "subtotal" and d["text"].lower() == "subtotaal"
-            ),
-            None,
-        )
-        if before_index is None:
-            return []
-        product_rows = receipt_rows[before_index + 1 : after_index]
-
-        # remove all entires don't have the type "product"
-        product_rows = [
-            item for item in product_rows if item["type"].lower() == "product"
-        ]
-        products = self._parse_products(product_rows)
-        return products
-
-    def _get_discounts(self) -> dict:
-        """Gets the discounts from the receipt.
-
-        Returns:
-            dict: A dictionary of Discount objects."""
-        receipt_rows = self.receipt_details
-
-        # Remove all elements before "subtotaal" (and that element itself) and after "uw voordeel" to get only the discounts that were applied
-        before_index = next(
-            (
-                index
-                for (index, d) in enumerate(receipt_rows)
-                if d["type"].lower() == "subtotal" and d["text"].lower() == "subtotaal"
-            ),
-            None,
-        )
-        after_index = next(
-            (
-                index
-                for (index, d) in enumerate(receipt_rows)
-                if d["type"].lower() == "total" and d["label"].lower() == "uw voordeel"
-            ),
-            None,
-        )
-        product_rows = receipt_rows[before_index + 1 : after_index]
-
-        # remove all entires don't have the type "product", as all discounts also have the type product
-        product_rows = [
-            item for item in product_rows if item["type"].lower() == "product"
-        ]
-        discounts = {"discounts": [], "total_discount": 0.0}
-        for row in product_rows:
-            discount_amount = abs(string_to_float(row["amount"]))
-            discount = Discount(row["quantity"], row["description"], discount_amount)
-            discounts["discounts"].append(discount)
-            discounts["total_discount"] += discount_amount
-        return discounts
-
     def get_categories(self) -> dict:
         """Gets the categories of the products in the receipt.
 
@@ -191,55 +183,113 @@ class Receipt:
         )
         return category_dict
 
-    def _parse_product(self, item: dict) -> Product:
-        """Parses a product from the receipt.
+    def _parse_product(self, line: ReceiptLine) -> Product:
+        """Creates a product from a parsed receipt line.
 
         Args:
-            item (dict): The product information from the API response.
+            line (ReceiptLine): The product line parsed by the ReceiptParser.
 
         Returns:
             Product: A Product object.
         """
-        if not item["quantity"]:
-            return None
-        else:
-            quantity, unit = self._parse_quantity(item["quantity"])
-            price = (
-                string_to_float(item["price"])
-                if "price" in item and item["price"] is not None
-                else None
-            )
-            if item["indicator"] == "":
-                item["indicator"] = None
-            amount = string_to_float(item["amount"])
-            product = Product(
-                quantity=quantity,
-                unit=unit,
-                description=item["description"],
-                price=price,
-                total_price=amount,
-                indicator=item["indicator"],
-                datetime=self.datetime,
-            )
-        return product
+        return Product(
+            quantity=line.quantity,
+            unit=line.unit,
+            description=line.description,
+            price=line.price,
+            total_price=line.total_price,
+            indicator=line.indicator,
+            datetime=self.datetime,
+            resolve=False,
+        )
 
-    def _parse_products(self, items: list) -> list[Product]:
-        """Parses the products from the API response.
+    def _parse_products(self, lines: list[ReceiptLine]) -> list[Product]:
+        """Creates the products of the receipt and searches the catalog for their candidates.
+        Products with the same description share a single search.
 
         Args:
-            items (list): The items from the API response.
+            lines (list[ReceiptLine]): The product lines parsed by the ReceiptParser.
 
         Returns:
             list: A list of Product objects.
         """
-        products = []
+        products = [self._parse_product(line) for line in lines]
+        by_description = {}
+        for product in products:
+            if product.quantity:
+                by_description.setdefault(product.description, []).append(product)
         with ThreadPoolExecutor(max_workers=int(config.get("max_workers"))) as executor:
-            futures = [executor.submit(self._parse_product, item) for item in items]
+            futures = {
+                executor.submit(self._find_candidates, same[0]): same
+                for same in by_description.values()
+            }
             for future in as_completed(futures):
-                result = future.result()
-                if result is not None:
-                    products.append(result)
-            return products
+                future.result()
+                first, *rest = futures[future]
+                for product in rest:
+                    product.share_candidates(first)
+        return products
+
+    def _find_candidates(self, product: Product):
+        """Searches the catalog for the candidates of a product with its own database handler.
+
+        Args:
+            product (Product): The product to search the candidates for.
+        """
+        from database.DbHandler import DbHandler
+
+        db_handler = DbHandler()
+        try:
+            product.find_candidates(db_handler)
+        finally:
+            db_handler.close()
+
+    def _resolve_products(self):
+        """Matches the products of the receipt with the catalog as a basket. Only the products
+        without a price consistent candidate are searched in the AH API, once per description.
+        With deferred_lookups enabled or api_lookups disabled they are marked as not found instead.
+        The catalog candidates are released afterwards, only the ids of potential products are kept."""
+        from database.DbHandler import DbHandler
+
+        resolver = BasketResolver(
+            self.products, self.discounts["total_discount"] if self.discounts else 0.0
+        )
+        unresolved = resolver.resolve()
+        db_handler = DbHandler()
+        try:
+            for product, candidate in resolver.assignments.items():
+                product.apply_match(candidate, db_handler)
+
+            by_description = {}
+            if not self.api_lookups or config.get("deferred_lookups", default=False):
+                for product in unresolved:
+                    product.defer_lookup()
+                unresolved = []
+            for product in unresolved:
+                by_description.setdefault(product.description, []).append(product)
+            with ThreadPoolExecutor(
+                max_workers=int(config.get("max_workers"))
+            ) as executor:
+                futures = {
+                    executor.submit(Product.search_api, description): same
+                    for description, same in by_description.items()
+                }
+                for future in as_completed(futures):
+                    api_products = future.result()
+                    for product in futures[future]:
+                        product.resolve_with_api(db_handler, api_products)
+        finally:
+            db_handler.close()
+        for product in self.products:
+            product.release_candidates()
+
+        self.api_calls = len(by_description)
+        self.api_calls_avoided = resolver.isolated_misses - self.api_calls
+        log.info(
+            f"Receipt {self.transaction_id}: matched {len(resolver.assignments)} of "
+            f"{len(resolver.products)} products as a basket, {self.api_calls} API calls "
+            f"instead of {resolver.isolated_misses} ({self.api_calls_avoided} avoided)"
+        )
 
     def _parse_quantity(self, quantity: str) -> tuple[float, str]:
         """Parses the quantity and unit from the quantity string.
@@ -250,14 +300,7 @@ class Receipt:
         Returns:
             tuple[float, str]: The quantity and unit.
         """
-        if quantity is None:
-            return None, None
-        quantity = quantity.replace(",", ".")
-        regex_result = re.match(r"(\d+.\d+)([a-zA-Z]+)", quantity)
-        if quantity.isnumeric():
-            return float(quantity), None
-        elif regex_result:
-            return float(regex_result.group(1)), regex_result.group(2)
+        return parse_quantity(quantity)
 
     def __repr__(self):
         return f"Receipt(transaction_id={self.transaction_id}, datetime={self.datetime}, location={self.location}, total={self.total}, products={self.products}, discounts={self.discounts})"
@@ -0,0 +1,144 @@
+import re
+
+import msgspec
+
+from classes.Discount import Discount
+from util import string_to_float
+
+# Quantities are either a count ("2") or an amount with a unit ("0,534KG")
+QUANTITY_REGEX = re.compile(r"^\s*(\d+(?:[.,]\d+)?)\s*([a-zA-Z]+)?\s*$")
+
+# Parser states, in the order they appear on a receipt
+HEADER = 0
+PRODUCTS = 1
+DISCOUNTS = 2
+TOTALS = 3
+
+
+def parse_quantity(quantity: str) -> tuple[float, str]:
+    """Parses the quantity and unit from the quantity string.
+
+    Args:
+        quantity (str): The quantity string.
+
+    Returns:
+        tuple[float, str]: The quantity and unit, both None if the quantity could not be parsed.
+    """
+    if not quantity:
+        return None, None
+    if quantity.isdigit():
+        return float(quantity), None
+    match = QUANTITY_REGEX.match(quantity)
+    if match is None:
+        return None, None
+    return string_to_float(match.group(1)), match.group(2)
+
+
+class ReceiptLine(msgspec.Struct, frozen=True, gc=False):
+    """A product line of a receipt"""
+
+    quantity: float | None
+    unit: str | None
+    description: str | None
+    price: float | None
+    total_price: float | None
+    indicator: str | None
+
+
+class ParsedReceipt:
+    """The result of parsing the receiptUiItems of a receipt
+
+    Attributes:
+        lines (list[ReceiptLine]): The product lines
+        discounts (list[Discount]): The discounts
+        total_discount (float): The sum of the discounts
+        location_name (str): The name of the store
+        totals (dict[str, float]): The amounts of the subtotal and total rows by lowercase label
+    """
+
+    __slots__ = ("lines", "discounts", "total_discount", "location_name", "totals")
+
+    def __init__(self):
+        self.lines = []
+        self.discounts = []
+        self.total_discount = 0.0
+        self.location_name = None
+        self.totals = {}
+
+
+class ReceiptParser:
+    """Parses the receiptUiItems of a receipt in a single pass.
+
+    The rows are read as a state machine: the header up to the "bonuskaart" row, the products up
+    to the "subtotaal" row, the discounts up to the "uw voordeel" row and the totals after it.
+    Every row is looked at once. A receipt without a "bonuskaart" row has no products, the
+    discounts and totals are still read.
+    """
+
+    def __init__(self):
+        # Lowercase row types, there are only a handful of distinct types
+        self._kinds = {}
+
+    def parse(self, items: list) -> ParsedReceipt:
+        """Parses the rows of a receipt.
+
+        Args:
+            items (list[ReceiptUiItem]): The receiptUiItems of the receipt.
+
+        Returns:
+            ParsedReceipt: The products, discounts, location and totals of the receipt.
+        """
+        parsed = ParsedReceipt()
+        lines = parsed.lines
+        kinds = self._kinds
+        state = HEADER
+        for index, item in enumerate(items):
+            kind = kinds.get(item.type)
+            if kind is None:
+                kind = kinds.setdefault(item.type, item.type.lower())
+
+            if kind == "product":
+                if state == PRODUCTS:
+                    if item.quantity:
+                        lines.append(self._parse_line(item))
+                elif state == DISCOUNTS:
+                    amount = string_to_float(item.amount)
+                    if amount is not None:
+                        discount = Discount(item.quantity, item.description, abs(amount))
+                        parsed.discounts.append(discount)
+                        parsed.total_discount += discount.amount
+                elif state == HEADER:
+                    if item.description and item.description.lower() == "bonuskaart":
+                        state = PRODUCTS
+                continue
+
+            if kind == "subtotal":
+                if state < DISCOUNTS and item.text and item.text.lower() == "subtotaal":
+                    state = DISCOUNTS
+                    parsed.totals["subtotaal"] = string_to_float(item.amount)
+                continue
+
+            if kind == "total":
+                label = (item.label or "").lower()
+                if state == DISCOUNTS and label == "uw voordeel":
+                    state = TOTALS
+                if label and item.amount is not None:
+                    parsed.totals[label] = string_to_float(item.amount)
+                continue
+
+            if state == HEADER and item.value:
+                # The store name is the second row, or else the first row with a value
+                if index == 1 or parsed.location_name is None:
+                    parsed.location_name = item.value
+        return parsed
+
+    def _parse_line(self, item) -> ReceiptLine:
+        quantity, unit = parse_quantity(item.quantity)
+        return ReceiptLine(
+            quantity,
+            unit,
+            item.description,
+            string_to_float(item.price),
+            string_to_float(item.amount),
+            item.indicator or None,
+        )
@@ -19,9 +19,12 @@ class Config(object):
             yaml.dump(config, f)
 
     # Get nested values from the config, for example get("database", "host")
-    def get(self, *keys):
+    # Returns default instead of raising a KeyError if a default is given and a key is missing
+    def get(self, *keys, default=KeyError):
         value = self._config
         for key in keys:
+            if default is not KeyError and (not isinstance(value, dict) or key not in value):
+                return default
             value = value[key]
         return value
 
@@ -1,8 +1,12 @@
 from util import translate
 from database.setup import engine
+from database.cache import reference_cache
+from database.bootstrap import execute_sql_stream
+from database.rollups import refresh_rollups, days_of_receipts, days_of_products
 from database.model import (
     DbAHProduct,
-    DbPreviousProduct,
+    DbAHProductDetails,
+    DbPreviouslyBought,
     DbReceipt,
     DbProduct,
     DbPotentialProduct,
@@ -11,23 +15,179 @@ from database.model import (
     DbCategory,
     DbCategoryHierarchy,
     DbCategoryProduct,
+    DbPriceHistory,
+    DbCategoryClosure,
+    DbResolutionQueue,
+    DbReceiptArchive,
 )
 from config import Config
-from classes.Product import Product
+from classes.Product import Product, Candidate
 from classes.Receipt import Receipt
 from classes.Location import Location
 from classes.Discount import Discount
 from classes.Category import Category
-from sqlalchemy.orm import sessionmaker, aliased
-import re
+from sqlalchemy.orm import Session, selectinload, joinedload
+import datetime as dt
+import msgspec
+import zlib
 
 import logging
 
-from sqlalchemy import func, text, select
+from sqlalchemy import (
+    event,
+    exc,
+    func,
+    text,
+    select,
+    insert,
+    update,
+    values,
+    column,
+    literal_column,
+    tuple_,
+    Select,
+    String,
+)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
 log = logging.getLogger(__name__)
 config = Config()
 
+# Queued lookups that keep failing are dropped after this many attempts
+MAX_RESOLUTION_ATTEMPTS = 5
+# Delay before a failed lookup is retried, doubled on every attempt
+RESOLUTION_RETRY_DELAY = dt.timedelta(minutes=5)
+
+# The catalog columns the matcher needs, in the field order of Candidate. Candidate searches
+# load nothing else
+MATCH_COLUMNS = [
+    DbAHProduct.id,
+    DbAHProduct.webshop_id,
+    DbAHProduct.title,
+    DbAHProduct.sub_category,
+    DbAHProduct.price_before_bonus,
+    DbAHProduct.current_price,
+    DbAHProduct.unit_price,
+    DbAHProduct.unit,
+    DbAHProduct.unit_size,
+]
+
+REFRESH_CATEGORY_CLOSURE_STATEMENTS = [
+    "DELETE FROM categories_closure;",
+    """
+    INSERT INTO categories_closure (ancestor, descendant, depth)
+    WITH RECURSIVE closure(ancestor, descendant, depth) AS (
+        SELECT taxonomy_id, taxonomy_id, 0 FROM categories
+        UNION
+        SELECT h.parent, c.descendant, c.depth + 1
+        FROM categories_hierarchy h
+        JOIN closure c ON h.child = c.ancestor
+        WHERE c.depth < 32
+    )
+    SELECT ancestor, descendant, MIN(depth) FROM closure GROUP BY ancestor, descendant;
+    """,
+]
+
+
+def compress_payload(payload) -> bytes:
+    """Compresses a payload with zlib. JSON that is already encoded is kept byte for byte, other
+    payloads are serialized as compact JSON first"""
+    if not isinstance(payload, bytes):
+        payload = msgspec.json.encode(payload)
+    return zlib.compress(payload, 9)
+
+
+def decompress_payload(data: bytes, decoder: msgspec.json.Decoder = None):
+    """Decompresses a payload created by compress_payload, optionally decoding it"""
+    data = zlib.decompress(data)
+    return decoder.decode(data) if decoder is not None else data
+
+
+def _raise_on_lazy_load(orm_execute_state):
+    """Fails every lazy load of a relationship, see the raise_on_lazy_load option of DbHandler"""
+    # Only selects have load options, the other statements cannot be lazy loads
+    if orm_execute_state.is_select and orm_execute_state.lazy_loaded_from is not None:
+        raise exc.InvalidRequestError(
+            f"Lazy load of {orm_execute_state.loader_strategy_path[-1]} while raise_on_lazy_load "
+            "is enabled, load the relationship eagerly instead"
+        )
+
+
+def receipts_page_query(
+    limit: int,
+    after: tuple[dt.datetime, int] = None,
+    since: dt.datetime = None,
+    until: dt.datetime = None,
+    location: int = None,
+    min_total: float = None,
+    max_total: float = None,
+) -> Select:
+    """Builds the query of a page of receipts, newest first. Pages are selected with a keyset on
+    (datetime, id), so every page costs the same regardless of how far into the history it is.
+
+    Args:
+        limit (int): The maximum number of receipts
+        after (tuple[datetime, int], optional): The datetime and ID of the last receipt of the previous page. Defaults to the first page.
+        since (datetime, optional): Only receipts from this moment on. Defaults to None.
+        until (datetime, optional): Only receipts before this moment. Defaults to None.
+        location (int, optional): Only receipts of this location ID. Defaults to None.
+        min_total (float, optional): Only receipts with at least this total price. Defaults to None.
+        max_total (float, optional): Only receipts with at most this total price. Defaults to None.
+
+    Returns:
+        Select: The id, transaction_id, datetime, location, total_price and total_discount of the
+            receipts"""
+    query = select(
+        DbReceipt.id,
+        DbReceipt.transaction_id,
+        DbReceipt.datetime,
+        DbReceipt.location,
+        DbReceipt.total_price,
+        DbReceipt.total_discount,
+    )
+    if after is not None:
+        query = query.where(tuple_(DbReceipt.datetime, DbReceipt.id) < tuple_(*after))
+    if since is not None:
+        query = query.where(DbReceipt.datetime >= since)
+    if until is not None:
+        query = query.where(DbReceipt.datetime < until)
+    if location is not None:
+        query = query.where(DbReceipt.location == location)
+    if min_total is not None:
+        query = query.where(DbReceipt.total_price >= min_total)
+    if max_total is not None:
+        query = query.where(DbReceipt.total_price <= max_total)
+    return query.order_by(DbReceipt.datetime.desc(), DbReceipt.id.desc()).limit(limit)
+
+
+# Loader options for the location, discounts, products and potential products of receipts
+RECEIPT_DETAILS = (
+    joinedload(DbReceipt.location_relation),
+    selectinload(DbReceipt.discounts),
+    selectinload(DbReceipt.products)
+    .selectinload(DbProduct.potential_product_relation)
+    .joinedload(DbPotentialProduct.ah_product_relation)
+    .load_only(DbAHProduct.webshop_id, DbAHProduct.title),
+)
+
+
+def receipts_with_details_query(receipt_ids: list[int]) -> Select:
+    """Builds the query of receipts with their location, discounts, products and potential
+    products. Everything is loaded in four queries, however many receipts there are.
+
+    Args:
+        receipt_ids (list[int]): The IDs of the receipts
+
+    Returns:
+        Select: The receipts, in any order"""
+    return select(DbReceipt).where(DbReceipt.id.in_(receipt_ids)).options(*RECEIPT_DETAILS)
+
+
+def in_order(receipts, receipt_ids: list[int]) -> list[DbReceipt]:
+    """Orders receipts like receipt_ids, IDs of receipts that do not exist are skipped"""
+    by_id = {receipt.id: receipt for receipt in receipts}
+    return [by_id[id] for id in dict.fromkeys(receipt_ids) if id in by_id]
+
 
 class DbHandler:
     """Class for handling database operations
@@ -36,7 +196,7 @@ class DbHandler:
         _session (Session): The database session
 
     Methods:
-        find_receipt(transaction_id: str) -> DbReceipt
+        find_receipt(transaction_id: str, with_details: bool = False) -> DbReceipt
 
         find_location(name: str) -> DbLocation
 
@@ -44,6 +204,8 @@ class DbHandler:
 
         add_receipt(receipt: Receipt, location_id: int) -> DbReceipt
 
+        store_receipt(receipt: Receipt, location_id: int) -> DbReceipt
+
         add_product(product: Product, receipt_id: int) -> DbProduct
 
         add_products(products: list[Product], receipt_id: int)
@@ -61,40 +223,41 @@ class DbHandler:
     #         cls._instance = super(DbHandler, cls).__new__(cls, *args, **kwargs)
     #     return cls._instance
 
-    def __init__(self, _engine=engine):
+    def __init__(self, _engine=engine, raise_on_lazy_load: bool = None):
+        """
+        Args:
+            raise_on_lazy_load (bool, optional): Raise instead of lazily loading a relationship, so
+                N+1 queries fail fast. Defaults to raise_on_lazy_load in the config, or False.
+        """
         self._engine = _engine
-        self._session = sessionmaker(bind=self._engine)()
+        self._session = Session(self._engine)
+        if raise_on_lazy_load is None:
+            raise_on_lazy_load = config.get("raise_on_lazy_load", default=False)
+        if raise_on_lazy_load:
+            event.listen(self._session, "do_orm_execute", _raise_on_lazy_load)
 
     def execute_sql_file(self, file_path: str):
-        """Executes a SQL file
+        """Executes a SQL file. The file is streamed statement by statement in a single transaction.
 
         Args:
             file_path (str): The path to the SQL file"""
-        with open(file_path, "r", encoding="utf8") as file:
-            script = file.read()
-        script = script.replace(":full", "::full")
-        statements = re.split(r";(?=\s*$)", script, flags=re.MULTILINE)
-
-        with self._engine.connect() as connection:
-            for statement in statements:
-                if statement := statement.strip():
-                    result = connection.execute(text(statement))
-                    log.debug(f"Changed {result.rowcount} rows")
-            connection.commit()
-
-    def find_receipt(self, transaction_id: str) -> DbReceipt:
+        execute_sql_stream(self._engine, file_path)
+        reference_cache.invalidate()
+
+    def find_receipt(self, transaction_id: str, with_details: bool = False) -> DbReceipt:
         """Finds a receipt by transaction_id
 
         Args:
             transaction_id (str): The transaction_id of the receipt
+            with_details (bool, optional): Whether to load the location, discounts, products and
+                potential products of the receipt as well. Defaults to False.
 
         Returns:
             DbReceipt: The receipt with the given transaction_id"""
-        return (
-            self._session.query(DbReceipt)
-            .filter_by(transaction_id=transaction_id)
-            .first()
-        )
+        query = self._session.query(DbReceipt).filter_by(transaction_id=transaction_id)
+        if with_details:
+            query = query.options(*RECEIPT_DETAILS)
+        return query.first()
 
     def find_product(self, product: "Product") -> DbProduct:
         """Finds a product in the database
@@ -122,14 +285,38 @@ class DbHandler:
 
         Returns:
             DbLocation: The location with the given name"""
+        dbLocation = reference_cache.location(name)
+        if dbLocation is not None:
+            return dbLocation
         try:
-            return self._session.query(DbLocation).filter_by(name=name).first()
+            dbLocation = self._session.query(DbLocation).filter_by(name=name).first()
         except Exception:
             return None
+        if dbLocation is not None:
+            # Added by another process since the cache was loaded
+            reference_cache.invalidate()
+        return dbLocation
 
     def find_category(self, taxonomy_id: str) -> DbCategory:
         """Finds a category by taxonomy ID
 
+        Args:
+            taxonomy_id (str): The taxonomy ID of the category
+
+        Returns:
+            DbCategory: The category with the given name"""
+        dbCategory = reference_cache.category(taxonomy_id)
+        if dbCategory is not None:
+            return dbCategory
+        dbCategory = self._query_category(taxonomy_id)
+        if dbCategory is not None:
+            reference_cache.invalidate()
+        return dbCategory
+
+    def _query_category(self, taxonomy_id: str) -> DbCategory:
+        """Finds a category by taxonomy ID in the database, bypassing the reference cache.
+        Use this when the category is going to be modified.
+
         Args:
             taxonomy_id (str): The taxonomy ID of the category
 
@@ -152,10 +339,16 @@ class DbHandler:
 
         Returns:
             DbCategory: The category with the given name"""
+        dbCategory = reference_cache.category_by_name(name)
+        if dbCategory is not None:
+            return dbCategory
         try:
-            return self._session.query(DbCategory).filter_by(name=name).first()
+            dbCategory = self._session.query(DbCategory).filter_by(name=name).first()
         except Exception:
             return None
+        if dbCategory is not None:
+            reference_cache.invalidate()
+        return dbCategory
 
     def get_receipts(self) -> list[DbReceipt]:
         """Gets all receipts from the database
@@ -164,6 +357,33 @@ class DbHandler:
             list[DbReceipt]: The list of receipts"""
         return self._session.query(DbReceipt).all()
 
+    def get_receipts_page(self, limit: int, after: tuple[dt.datetime, int] = None, **filters) -> list:
+        """Gets a page of receipts, newest first, see receipts_page_query()
+
+        Args:
+            limit (int): The maximum number of receipts
+            after (tuple[datetime, int], optional): The datetime and ID of the last receipt of the previous page. Defaults to the first page.
+            filters: The since, until, location, min_total and max_total filters
+
+        Returns:
+            list[Row]: The id, transaction_id, datetime, location, total_price and total_discount
+                of the receipts"""
+        return self._session.execute(receipts_page_query(limit, after, **filters)).all()
+
+    def get_receipts_with_details(self, receipt_ids: list[int]) -> list[DbReceipt]:
+        """Gets receipts with their location, discounts, products and potential products, see
+        receipts_with_details_query()
+
+        Args:
+            receipt_ids (list[int]): The IDs of the receipts
+
+        Returns:
+            list[DbReceipt]: The receipts that exist, in the order of receipt_ids"""
+        if not receipt_ids:
+            return []
+        receipts = self._session.scalars(receipts_with_details_query(receipt_ids))
+        return in_order(receipts, receipt_ids)
+
     def get_receipt(self, receipt_id: int) -> DbReceipt:
         """Gets a receipt from the database
 
@@ -174,12 +394,96 @@ class DbHandler:
             DbReceipt: The receipt with the given ID"""
         return self._session.query(DbReceipt).get(receipt_id)
 
-    def get_prev_products(self) -> list[DbPreviousProduct]:
+    def archive_receipt(self, receipt: Receipt):
+        """Stores the raw API payloads of a receipt compressed in the archive. The details are
+        stored as they were received, every field is kept even if the receipt parser does not use
+        it. An existing archived receipt is replaced.
+
+        Args:
+            receipt (Receipt): The receipt, its details are fetched if they are not known yet"""
+        statement = pg_insert(DbReceiptArchive).values(
+            transaction_id=receipt.transaction_id,
+            datetime=receipt.datetime,
+            summary=compress_payload(receipt.summary),
+            details=compress_payload(receipt.fetch_details()),
+            archived_at=dt.datetime.now(dt.timezone.utc),
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=["transaction_id"],
+            set_={
+                "datetime": statement.excluded.datetime,
+                "summary": statement.excluded.summary,
+                "details": statement.excluded.details,
+                "archived_at": statement.excluded.archived_at,
+            },
+        )
+        try:
+            self._session.execute(statement)
+            self._session.commit()
+        except Exception as e:
+            log.error(f"Error archiving receipt: {e}")
+            self._session.rollback()
+            raise
+        log.debug(f"Archived receipt {receipt.transaction_id}")
+
+    def get_archived_transaction_ids(
+        self,
+        since: dt.datetime = None,
+        until: dt.datetime = None,
+        not_found_only: bool = False,
+    ) -> list[str]:
+        """Gets the transaction IDs of archived receipts
+
+        Args:
+            since (datetime, optional): Only receipts from this moment on. Defaults to None.
+            until (datetime, optional): Only receipts before this moment. Defaults to None.
+            not_found_only (bool, optional): Only receipts with products that were not found. Defaults to False.
+
+        Returns:
+            list[str]: The transaction IDs, oldest receipt first"""
+        query = select(DbReceiptArchive.transaction_id).order_by(DbReceiptArchive.datetime)
+        if since is not None:
+            query = query.where(DbReceiptArchive.datetime >= since)
+        if until is not None:
+            query = query.where(DbReceiptArchive.datetime < until)
+        if not_found_only:
+            query = query.where(
+                select(DbProduct.id)
+                .join(DbReceipt, DbReceipt.id == DbProduct.receipt)
+                .where(
+                    DbReceipt.transaction_id == DbReceiptArchive.transaction_id,
+                    DbProduct.product_not_found,
+                )
+                .exists()
+            )
+        return list(self._session.scalars(query))
+
+    def get_archived_receipt(self, transaction_id: str) -> tuple[dict, bytes]:
+        """Gets the raw API payloads of an archived receipt
+
+        Args:
+            transaction_id (str): The transaction ID of the receipt
+
+        Returns:
+            tuple[dict, bytes]: The receipt summary and the JSON of its details, to be decoded
+                with decode_receipt_details, None if it is not archived"""
+        archived = self._session.get(DbReceiptArchive, transaction_id)
+        if archived is None:
+            return None
+        return msgspec.json.decode(decompress_payload(archived.summary)), decompress_payload(
+            archived.details
+        )
+
+    def get_prev_products(self) -> list[DbAHProduct]:
         """Gets all previously bought products from the database
 
         Returns:
-            list[DbPreviousProduct]: The list of previously bought products"""
-        return self._session.query(DbPreviousProduct).all()
+            list[DbAHProduct]: The list of previously bought products"""
+        return (
+            self._session.query(DbAHProduct)
+            .join(DbPreviouslyBought, DbPreviouslyBought.product == DbAHProduct.id)
+            .all()
+        )
 
     def get_products(self) -> list[DbProduct]:
         """Gets all products from the database
@@ -245,56 +549,74 @@ class DbHandler:
         input: str,
         threshold: float = 0.2,
         top_n_scores: int = 5,
-        model: DbAHProduct | DbPreviousProduct = DbAHProduct,
     ) -> list:
-        """Searches for a product in the database. The search is based on the similarity of the product name and the category name.
+        """Searches for a product in the catalog. The search is based on the similarity of the product name and the category name.
+        Previously bought products and the other catalog products are ranked separately, each keeping the products with the
+        top_n_scores highest scores. Previously bought products come first.
 
         Args:
             input (str): The input to search for
             threshold (float, optional): The similarity threshold. Defaults to 0.2.
-            top_n_scores (int, optional): The number of top scores to return. Defaults to 5.
+            top_n_scores (int, optional): The number of top scores to return per group. Defaults to 5.
 
         Returns:
-            list[DbAHProduct]: The list of products
+            list[tuple[float, Candidate]]: The list of similarity scores and products. Only the
+                product columns needed for matching are loaded.
         """
+        search = func.lower(input)
         max_score = func.greatest(
-            func.similarity(model.title, func.lower(input)),
-            func.similarity(model.sub_category, func.lower(input)),
+            func.similarity(DbAHProduct.title, search),
+            func.similarity(DbAHProduct.sub_category, search),
+        )
+        previously_bought = DbPreviouslyBought.id.is_not(None)
+        # The % operator uses the trigram indexes, it filters on pg_trgm.similarity_threshold.
+        # The setting is local to the transaction, so it does not leak to other queries of the
+        # pooled connection.
+        self._session.execute(
+            text("SELECT set_config('pg_trgm.similarity_threshold', :threshold, true)"),
+            {"threshold": str(threshold)},
         )
-        # ScoredProducts Subquery
         scored_products_subq = (
-            select(model.id, max_score.label("max_score"))
+            select(
+                DbAHProduct.id,
+                max_score.label("max_score"),
+                previously_bought.label("previously_bought"),
+                func.dense_rank()
+                .over(partition_by=previously_bought, order_by=max_score.desc())
+                .label("score_rank"),
+            )
+            .outerjoin(DbPreviouslyBought, DbPreviouslyBought.product == DbAHProduct.id)
             .where(
+                DbAHProduct.title.op("%")(search)
+                | DbAHProduct.sub_category.op("%")(search),
                 max_score > threshold,
             )
-            .alias("scored_products")
+            .subquery("scored_products")
         )
 
-        top_n_scores_subq = (
-            select(scored_products_subq.c.max_score)
-            .group_by(scored_products_subq.c.max_score)
-            .order_by(scored_products_subq.c.max_score.desc())
-            .limit(top_n_scores)
-            .alias("top_n_scores")
+        result_query = (
+            select(
+                scored_products_subq.c.max_score,
+                *MATCH_COLUMNS,
+            )
+            .join(scored_products_subq, DbAHProduct.id == scored_products_subq.c.id)
+            .where(scored_products_subq.c.score_rank <= top_n_scores)
+            .order_by(
+                scored_products_subq.c.previously_bought.desc(),
+                scored_products_subq.c.max_score.desc(),
+            )
         )
 
-        min_score_subq = select(
-            func.min(top_n_scores_subq.c.max_score).label("min_top_score")
-        ).alias("min_score")
-
-        ScoredProducts = aliased(model, scored_products_subq)
+        return [
+            (row[0], Candidate(*row[1:])) for row in self._session.execute(result_query)
+        ]
 
-        result_query = (
-            self._session.query(scored_products_subq.c.max_score, model)
-            .join(ScoredProducts, model.id == ScoredProducts.id)
-            .filter(
-                scored_products_subq.c.max_score
-                >= select(min_score_subq.c.min_top_score).scalar_subquery()
-            )
-        ).order_by(scored_products_subq.c.max_score.desc())
+    def has_ah_products(self) -> bool:
+        """Checks whether the AH products table contains any products
 
-        result = result_query.all()
-        return result
+        Returns:
+            bool: Whether there are AH products in the database"""
+        return self._session.query(DbAHProduct.id).first() is not None
 
     def get_ah_produts(self) -> list[DbAHProduct]:
         """Gets all AH products from the database
@@ -303,83 +625,301 @@ class DbHandler:
             list[DbAHProduct]: The list of AH products"""
         return self._session.query(DbAHProduct).all()
 
+    def get_prices_at(
+        self, webshop_ids: list[str], moment: dt.datetime
+    ) -> dict[str, set[float]]:
+        """Gets the prices that were valid for the given products at a moment in time
+
+        Args:
+            webshop_ids (list[str]): The webshop IDs of the products
+            moment (datetime): The moment to get the prices for, naive datetimes are treated as UTC
+
+        Returns:
+            dict[str, set[float]]: The regular and bonus prices per webshop ID"""
+        webshop_ids = list({webshop_id for webshop_id in webshop_ids if webshop_id})
+        if not webshop_ids or moment is None:
+            return {}
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=dt.timezone.utc)
+        # The bounds are inlined so the expression matches price_history_validity_gist_index
+        validity = func.tstzrange(
+            DbPriceHistory.valid_from, DbPriceHistory.valid_to, literal_column("'[)'")
+        )
+        rows = self._session.execute(
+            select(
+                DbPriceHistory.webshop_id,
+                DbPriceHistory.price,
+                DbPriceHistory.bonus_price,
+            ).where(
+                DbPriceHistory.webshop_id.in_(webshop_ids),
+                validity.op("@>")(moment),
+            )
+        ).all()
+        prices = {}
+        for webshop_id, price, bonus_price in rows:
+            prices.setdefault(webshop_id, set()).update(
+                p for p in (price, bonus_price) if p is not None
+            )
+        return prices
+
+    def record_prices(
+        self,
+        products: list[DbAHProduct],
+        date: dt.datetime = None,
+    ) -> int:
+        """Records the current prices of catalog products in the price history.
+        The open period of a product is closed and a new one is started only if its price changed.
+
+        Args:
+            products (list[DbAHProduct]): The products to record the prices of
+            date (datetime, optional): The moment the prices were observed. Defaults to the
+                product's date_added or now.
+
+        Returns:
+            int: The number of price changes that were recorded"""
+        now = date or dt.datetime.now(dt.timezone.utc)
+        observed = {}
+        for product in products:
+            if not product.webshop_id:
+                continue
+            bonus_price = (
+                product.current_price
+                if product.current_price is not None
+                and product.current_price != product.price_before_bonus
+                else None
+            )
+            valid_from = date or getattr(product, "date_added", None) or now
+            observed[str(product.webshop_id)] = (
+                product.price_before_bonus,
+                bonus_price,
+                valid_from,
+            )
+        if not observed:
+            return 0
+
+        webshop_ids = list(observed)
+        open_periods = {}
+        for i in range(0, len(webshop_ids), 1000):
+            rows = self._session.execute(
+                select(
+                    DbPriceHistory.id,
+                    DbPriceHistory.webshop_id,
+                    DbPriceHistory.price,
+                    DbPriceHistory.bonus_price,
+                ).where(
+                    DbPriceHistory.webshop_id.in_(webshop_ids[i : i + 1000]),
+                    DbPriceHistory.valid_to.is_(None),
+                )
+            ).all()
+            open_periods.update({row.webshop_id: row for row in rows})
+
+        closed_ids = []
+        new_periods = []
+        for webshop_id, (price, bonus_price, valid_from) in observed.items():
+            period = open_periods.get(webshop_id)
+            if period is not None:
+                if period.price == price and period.bonus_price == bonus_price:
+                    continue
+                closed_ids.append(period.id)
+            new_periods.append(
+                {
+                    "webshop_id": webshop_id,
+                    "valid_from": valid_from,
+                    "price": price,
+                    "bonus_price": bonus_price,
+                }
+            )
+        try:
+            for i in range(0, len(closed_ids), 1000):
+                self._session.execute(
+                    update(DbPriceHistory)
+                    .where(DbPriceHistory.id.in_(closed_ids[i : i + 1000]))
+                    .values(valid_to=now)
+                )
+            if new_periods:
+                self._session.execute(insert(DbPriceHistory), new_periods)
+            self._session.commit()
+            log.info(f"Recorded {len(new_periods)} price changes")
+        except Exception as e:
+            log.error(f"Error recording prices: {e}")
+            self._session.rollback()
+            raise
+        return len(new_periods)
+
+    def has_price_history(self) -> bool:
+        """Checks whether any prices have been recorded
+
+        Returns:
+            bool: Whether the price history is not empty"""
+        return self._session.query(DbPriceHistory.id).first() is not None
+
     def get_category_hierarchy_parents(
-        self, taxonomy_id: str, result: list[DbCategory]
+        self, taxonomy_id: str, result: list[DbCategory] = None
     ) -> list[DbCategory]:
-        """Gets all parent categories based on taxonomy_id from the database
+        """Gets the category and all of its parent categories based on taxonomy_id from the database
 
         Args:
             taxonomy_id (str): The taxonomy ID of the category
-            result (list[DbCategory]): The list of categories to add to (recursive)
+            result (list[DbCategory], optional): The list of categories to add to
 
         Returns:
-            list[DbCategory]: The list of categories"""
-        dbCategory = self.find_category(taxonomy_id)
-        if dbCategory is None:
+            list[DbCategory]: The list of categories, ordered from the category itself up to the root"""
+        if result is None:
+            result = []
+        dbCategories = reference_cache.category_ancestors(taxonomy_id)
+        if dbCategories is not None:
+            result.extend(dbCategories)
+            return result
+        dbCategories = (
+            self._session.query(DbCategory)
+            .join(DbCategoryClosure, DbCategoryClosure.ancestor == DbCategory.taxonomy_id)
+            .filter(DbCategoryClosure.descendant == str(taxonomy_id))
+            .order_by(DbCategoryClosure.depth)
+            .all()
+        )
+        if not dbCategories:
             log.error(f'Category "{taxonomy_id}" not found')
             # TODO: get new category from API and insert into DB
             return None
-        result.append(dbCategory)
-        dbCategoryHierarchies = (
-            self._session.query(DbCategoryHierarchy).filter_by(child=taxonomy_id).all()
-        )
-        for dbCategoryHierarchy in dbCategoryHierarchies:
-            self.get_category_hierarchy_parents(dbCategoryHierarchy.parent, result)
+        reference_cache.invalidate()
+        result.extend(dbCategories)
         return result
 
-    def set_categories_for_products(
-        self, products: list["Product"]
-    ) -> list[DbCategoryProduct]:
-        """Sets the categories for the products in the database
+    def has_category_closure(self) -> bool:
+        """Checks whether the category ancestry has been computed
+
+        Returns:
+            bool: Whether the category closure table is not empty"""
+        return self._session.query(DbCategoryClosure.ancestor).first() is not None
+
+    def refresh_category_closure(self):
+        """Recomputes the ancestry of all categories from the category hierarchy"""
+        try:
+            for statement in REFRESH_CATEGORY_CLOSURE_STATEMENTS:
+                self._session.execute(text(statement))
+            self._session.commit()
+            log.info("Refreshed category closure")
+            reference_cache.invalidate()
+        except Exception as e:
+            log.error(f"Error refreshing category closure: {e}")
+            self._session.rollback()
+            raise
+
+    def set_categories_for_products(self, products: list["Product"]) -> int:
+        """Sets the categories and all of their parent categories for the products in the database
+        with a single statement, and recomputes the rollups of the days the products were bought
 
         Args:
             products (list[Product]): The list of products
 
         Returns:
-            list[DbCategoryProduct]: The list of added category products"""
-        categoryProducts = []
-        for product in products:
-            dbCategoryProducts = self.set_categories_for_product(product)
-            if dbCategoryProducts is not None:
-                categoryProducts.append(dbCategoryProducts)
-        return categoryProducts
+            int: The number of added category products"""
+        try:
+            categorized = self._add_product_categories(products)
+            self._receipts_changed([], categorized)
+            self._session.commit()
+        except Exception as e:
+            log.error(f"Error setting categories for products: {e}")
+            self._session.rollback()
+            raise
+        log.debug(f"Added {len(categorized)} category products to database")
+        return len(categorized)
 
-    def set_categories_for_product(self, product: "Product") -> DbCategoryProduct:
-        """Sets the categories for a product into CategoryProduct table
+    def _add_product_categories(self, products: list["Product"]) -> list[str]:
+        """Adds the categories of products to the session without committing
 
-        Args:
-            product (Product): The product to set the categories for"""
-        dbProduct = self.find_product(product)
-        if dbProduct is None:
-            log.error(
-                f'Product "{product.description}" with name "{product.name}" not found'
-            )
-            return None
-        if product.category is None:
-            log.error(
-                f'Product "{product.description}" with name "{product.name}" has no categories'
+        Returns:
+            list[str]: The product ID of every added category product"""
+        assignments = {}
+        for product in products:
+            if product.product_id is None or product.category is None:
+                log.error(
+                    f'Product "{product.description}" with name "{product.name}" has no categories'
+                )
+                continue
+            assignments.setdefault((str(product.product_id), str(product.category)), product)
+        if not assignments:
+            return []
+
+        assigned = values(
+            column("product_id", String),
+            column("taxonomy_id", String),
+            name="assigned",
+        ).data(list(assignments))
+        # A category that is not in the closure has no ancestors to assign, not even itself
+        unknown = self._session.execute(
+            select(assigned.c.product_id, assigned.c.taxonomy_id).where(
+                ~select(DbCategoryClosure.descendant)
+                .where(DbCategoryClosure.descendant == assigned.c.taxonomy_id)
+                .exists()
             )
-            return None
-        dbCategories = self.get_category_hierarchy_parents(product.category, [])
-        if dbCategories is None:
+        ).all()
+        for product_id, taxonomy_id in unknown:
+            product = assignments[(product_id, taxonomy_id)]
             log.error(
-                f'Product "{product.description}" with name "{product.name}" has no categories'
+                f'Product "{product.description}" with name "{product.name}" has no categories, '
+                f"category {taxonomy_id} is not in the category tree"
             )
-            return None
-        for dbCategory in dbCategories:
-            dbCategoryProduct = self.get_category_product(
-                dbProduct.product_id, dbCategory.taxonomy_id
+        statement = (
+            pg_insert(DbCategoryProduct)
+            .from_select(
+                ["product_id", "taxonomy_id"],
+                select(assigned.c.product_id, DbCategoryClosure.ancestor)
+                .select_from(assigned)
+                .join(
+                    DbCategoryClosure,
+                    DbCategoryClosure.descendant == assigned.c.taxonomy_id,
+                ),
             )
-            if dbCategoryProduct:
-                continue
-            dbCategoryProduct = DbCategoryProduct(
-                product_id=dbProduct.product_id,
-                taxonomy_id=dbCategory.taxonomy_id,
+            .on_conflict_do_nothing(index_elements=["product_id", "taxonomy_id"])
+            .returning(DbCategoryProduct.product_id)
+        )
+        return self._session.execute(statement).scalars().all()
+
+    def refresh_rollups(self, receipt_ids: list[int]) -> int:
+        """Recomputes the daily rollups of the days of receipts, after the receipts were changed,
+        and marks the receipts as changed for the analytics replica
+
+        Args:
+            receipt_ids (list[int]): The IDs of the changed receipts
+
+        Returns:
+            int: The number of rollup rows written"""
+        try:
+            written = self._receipts_changed(receipt_ids)
+            self._session.commit()
+        except Exception as e:
+            log.error(f"Error refreshing rollups: {e}")
+            self._session.rollback()
+            raise
+        return written
+
+    def _receipts_changed(self, receipt_ids: list[int], product_ids: list[str] = None) -> int:
+        """Recomputes the rollups of changed receipts and marks them as changed for the analytics
+        replica, without committing. The category rollups of every day with a line of a newly
+        categorized catalog product in product_ids change as well, those days are also
+        recomputed."""
+        if receipt_ids:
+            # The clock instead of the start of the transaction, so the replica, which copies
+            # receipts changed since its last refresh, misses as few as possible
+            self._session.execute(
+                update(DbReceipt)
+                .where(DbReceipt.id.in_(set(receipt_ids)))
+                .values(updated_at=func.clock_timestamp())
             )
-            self._session.add(dbCategoryProduct)
-            self._session.flush()
-        self._session.commit()
-        return dbCategories
+        days = days_of_receipts(self._session, receipt_ids)
+        days |= days_of_products(self._session, product_ids)
+        return refresh_rollups(self._session, days)
+
+    def set_categories_for_product(self, product: "Product") -> int:
+        """Sets the categories for a product into CategoryProduct table
+
+        Args:
+            product (Product): The product to set the categories for
+
+        Returns:
+            int: The number of added category products"""
+        return self.set_categories_for_products([product])
 
     def add_location(self, location: Location) -> DbLocation:
         """Adds a location to the database
@@ -398,6 +938,7 @@ class DbHandler:
         )
         self._session.add(dbLocation)
         self._session.commit()
+        reference_cache.invalidate()
         return dbLocation
 
     def add_receipt(self, receipt: Receipt, location_id: int) -> DbReceipt:
@@ -421,6 +962,58 @@ class DbHandler:
         log.info(f"Added receipt from {receipt.datetime} to database")
         return dbReceipt
 
+    def store_receipt(self, receipt: Receipt, location_id: int) -> DbReceipt:
+        """Adds a receipt with its products, discounts and product categories, queues its
+        deferred lookups and recomputes the rollups of its day, all in a single transaction
+
+        Args:
+            receipt (Receipt): The receipt to add
+            location_id (int): The id of the location
+
+        Returns:
+            DbReceipt: The added receipt"""
+        try:
+            dbReceipt = DbReceipt(
+                transaction_id=receipt.transaction_id,
+                datetime=receipt.datetime,
+                location=location_id,
+                total_price=receipt.total,
+                total_discount=receipt.discounts["total_discount"],
+            )
+            self._session.add(dbReceipt)
+            self._session.flush()
+            dbProducts = self._add_receipt_products(receipt.products, dbReceipt.id)
+            queued = self._enqueue_products(
+                [
+                    dbProduct
+                    for product, dbProduct in zip(receipt.products, dbProducts)
+                    if product.lookup_deferred
+                ]
+            )
+            self._session.add_all(
+                DbDiscount(
+                    type=discount.type,
+                    description=discount.description,
+                    amount=discount.amount,
+                    receipt=dbReceipt.id,
+                )
+                for discount in receipt.discounts["discounts"]
+            )
+            categorized = self._add_product_categories(
+                [product for product in receipt.products if not product.product_not_found]
+            )
+            self._receipts_changed([dbReceipt.id], categorized)
+            self._session.commit()
+        except Exception as e:
+            log.error(f"Error storing receipt {receipt.transaction_id}: {e}")
+            self._session.rollback()
+            raise
+        log.info(
+            f"Added receipt from {receipt.datetime} with {len(dbProducts)} products to database"
+            + (f", queued {queued} lookups" if queued else "")
+        )
+        return dbReceipt
+
     def add_category(self, category: Category, parent: DbCategory = None) -> DbCategory:
         """Adds a category to the database
 
@@ -430,7 +1023,7 @@ class DbHandler:
 
         Returns:
             DbCategory: The added category"""
-        dbCategory = self.find_category(category.taxonomy_id)
+        dbCategory = self._query_category(category.taxonomy_id)
         if dbCategory is None:
             dbCategory = DbCategory(
                 name=category.name,
@@ -467,6 +1060,9 @@ class DbHandler:
                 for child in category.children:
                     self.add_category(child, dbCategory)
         self._session.commit()
+        if parent is None:
+            # Only the outermost call refreshes, after the whole subtree has been added
+            self.refresh_category_closure()
         return dbCategory
 
     def add_product(self, product: "Product", receipt_id: int) -> DbProduct:
@@ -492,38 +1088,22 @@ class DbHandler:
         self._session.add(dbProduct)
         self._session.flush()
 
-        potential_products = []
         if product.potential_products:
-            for potential_product in product.potential_products["products"]:
-                if product.potential_products["model"] == "previous":
-                    dbPotentialProduct = DbPotentialProduct(
-                        product=dbProduct.id,
-                        potential_previous_product=potential_product.id,
-                    )
-                elif product.potential_products["model"] == "ah":
-                    dbPotentialProduct = DbPotentialProduct(
-                        product=dbProduct.id,
-                        potential_ah_product=potential_product.id,
-                    )
-                else:
-                    raise Exception("Invalid model")
-                potential_products.append(dbPotentialProduct)
-            self._session.add_all(potential_products)
+            self._session.add_all(
+                DbPotentialProduct(
+                    product=dbProduct.id,
+                    potential_ah_product=potential_product,
+                )
+                for potential_product in product.potential_products
+            )
         self._session.commit()
         log.debug(f'Added product "{product.name}" to database')
         return dbProduct
 
-    def add_products(
+    def _add_receipt_products(
         self, products: list["Product"], receipt_id: int
     ) -> list[DbProduct]:
-        """Adds a list of products to the database
-
-        Args:
-            products (list[Product]): The list of products to add
-            receipt_id (int): The id of the receipt
-
-        Returns:
-            list[DbProduct]: The added products"""
+        """Adds products and their potential products to the session without committing"""
         dbProducts = []
         potential_products = []
         for product in products:
@@ -542,31 +1122,263 @@ class DbHandler:
             self._session.add(dbProduct)
             self._session.flush()
             if product.potential_products:
-                for potential_product in product.potential_products["products"]:
-                    if product.potential_products["model"] == "previous":
-                        dbPotentialProduct = DbPotentialProduct(
-                            product=dbProduct.id,
-                            potential_previous_product=potential_product.id,
-                        )
-                    elif product.potential_products["model"] == "ah":
-                        dbPotentialProduct = DbPotentialProduct(
-                            product=dbProduct.id,
-                            potential_ah_product=potential_product.id,
-                        )
-                    else:
-                        raise Exception("Invalid model")
-                    potential_products.append(dbPotentialProduct)
+                potential_products.extend(
+                    DbPotentialProduct(
+                        product=dbProduct.id,
+                        potential_ah_product=potential_product,
+                    )
+                    for potential_product in product.potential_products
+                )
+        if potential_products:
+            self._session.add_all(potential_products)
+        return dbProducts
+
+    def add_products(
+        self, products: list["Product"], receipt_id: int
+    ) -> list[DbProduct]:
+        """Adds a list of products to the database
+
+        Args:
+            products (list[Product]): The list of products to add
+            receipt_id (int): The id of the receipt
+
+        Returns:
+            list[DbProduct]: The added products"""
         try:
-            # self._session.add_all(dbProducts)
-            # self._session.flush()
-            if potential_products:
-                self._session.add_all(potential_products)
+            dbProducts = self._add_receipt_products(products, receipt_id)
             self._session.commit()
             log.info(f"Added {len(dbProducts)} products to database")
         except Exception as e:
             log.error(f"Error adding products: {e}")
             self._session.rollback()
             raise
+        return dbProducts
+
+    def apply_receipt_changes(
+        self,
+        receipt_id: int,
+        updated: list[tuple[int, "Product"]] = None,
+        added: list["Product"] = None,
+        deleted: list[int] = None,
+        receipt_values: dict = None,
+        discounts: list[Discount] = None,
+    ):
+        """Writes the changes of a reprocessed receipt in a single transaction
+
+        Args:
+            receipt_id (int): The id of the receipt
+            updated (list[tuple[int, Product]], optional): The ids of stored products with their new match
+            added (list[Product], optional): Products that are new on the receipt, the ones with a
+                deferred lookup are queued
+            deleted (list[int], optional): The ids of stored products that are no longer on the receipt
+            receipt_values (dict, optional): New values of receipt columns
+            discounts (list[Discount], optional): The new discounts, replacing the stored ones"""
+        updated = updated or []
+        added = added or []
+        try:
+            stale = list(deleted or []) + [product_id for product_id, _ in updated]
+            if stale:
+                self._session.execute(
+                    DbPotentialProduct.__table__.delete().where(
+                        DbPotentialProduct.product.in_(stale)
+                    )
+                )
+            if deleted:
+                self._session.execute(
+                    DbProduct.__table__.delete().where(DbProduct.id.in_(deleted))
+                )
+            if updated:
+                self._session.execute(
+                    update(DbProduct),
+                    [
+                        {
+                            "id": product_id,
+                            "name": product.name,
+                            "product_id": product.product_id,
+                            "product_not_found": product.product_not_found,
+                        }
+                        for product_id, product in updated
+                    ],
+                )
+                self._session.add_all(
+                    DbPotentialProduct(
+                        product=product_id,
+                        potential_ah_product=potential_product,
+                    )
+                    for product_id, product in updated
+                    for potential_product in product.potential_products or []
+                )
+            if added:
+                dbProducts = self._add_receipt_products(added, receipt_id)
+                self._enqueue_products(
+                    [
+                        dbProduct
+                        for product, dbProduct in zip(added, dbProducts)
+                        if product.lookup_deferred
+                    ]
+                )
+            if receipt_values:
+                self._session.execute(
+                    update(DbReceipt)
+                    .where(DbReceipt.id == receipt_id)
+                    .values(**receipt_values)
+                )
+            if discounts is not None:
+                self._session.execute(
+                    DbDiscount.__table__.delete().where(DbDiscount.receipt == receipt_id)
+                )
+                self._session.add_all(
+                    DbDiscount(
+                        type=discount.type,
+                        description=discount.description,
+                        amount=discount.amount,
+                        receipt=receipt_id,
+                    )
+                    for discount in discounts
+                )
+            categorized = self._add_product_categories(
+                [
+                    product
+                    for product in [product for _, product in updated] + added
+                    if not product.product_not_found
+                ]
+            )
+            self._receipts_changed([receipt_id], categorized)
+            self._session.commit()
+        except Exception as e:
+            log.error(f"Error applying receipt changes: {e}")
+            self._session.rollback()
+            raise
+
+    def enqueue_products(self, products: list[DbProduct]) -> int:
+        """Queues products whose AH API lookup has been deferred
+
+        Args:
+            products (list[DbProduct]): The products to resolve later
+
+        Returns:
+            int: The number of queued products"""
+        try:
+            queued = self._enqueue_products(products)
+            self._session.commit()
+        except Exception as e:
+            log.error(f"Error queueing products: {e}")
+            self._session.rollback()
+            raise
+        log.debug(f"Queued {queued} products for lookup")
+        return queued
+
+    def _enqueue_products(self, products: list[DbProduct]) -> int:
+        """Queues products in the session without committing"""
+        if not products:
+            return 0
+        now = dt.datetime.now(dt.timezone.utc)
+        statement = (
+            pg_insert(DbResolutionQueue)
+            .values(
+                [
+                    {
+                        "product": product.id,
+                        "description": product.description,
+                        "attempts": 0,
+                        "enqueued_at": now,
+                        "available_at": now,
+                    }
+                    for product in products
+                ]
+            )
+            .on_conflict_do_nothing(index_elements=["product"])
+        )
+        return self._session.execute(statement).rowcount
+
+    def claim_resolution_batch(self, size: int) -> list:
+        """Claims a batch of queued products. The rows stay locked until complete_resolutions is
+        called, concurrent resolvers skip them.
+
+        Args:
+            size (int): The maximum number of products to claim
+
+        Returns:
+            list[Row]: The queue id, attempts, product id, description, quantity, unit, price,
+                total price, receipt id and receipt datetime of the claimed products"""
+        return self._session.execute(
+            select(
+                DbResolutionQueue.id.label("queue_id"),
+                DbResolutionQueue.attempts,
+                DbProduct.id,
+                DbProduct.description,
+                DbProduct.quantity,
+                DbProduct.unit,
+                DbProduct.price,
+                DbProduct.total_price,
+                DbProduct.receipt,
+                DbReceipt.datetime,
+            )
+            .join(DbProduct, DbProduct.id == DbResolutionQueue.product)
+            .outerjoin(DbReceipt, DbReceipt.id == DbProduct.receipt)
+            .where(DbResolutionQueue.available_at <= func.now())
+            .order_by(DbResolutionQueue.available_at, DbResolutionQueue.id)
+            .limit(size)
+            .with_for_update(skip_locked=True, of=DbResolutionQueue)
+        ).all()
+
+    def complete_resolutions(self, resolved: list[tuple], failed: list[tuple]) -> int:
+        """Writes the results of a claimed batch in a single transaction. The resolved products
+        and their categories are updated in bulk and removed from the queue. Failed products are
+        retried later with a growing delay, until MAX_RESOLUTION_ATTEMPTS is reached.
+
+        Args:
+            resolved (list[tuple[Row, Product]]): The claimed rows with their resolved products
+            failed (list[tuple[Row, str]]): The claimed rows that failed with their errors
+
+        Returns:
+            int: The number of updated products"""
+        now = dt.datetime.now(dt.timezone.utc)
+        try:
+            if resolved:
+                self._session.execute(
+                    update(DbProduct),
+                    [
+                        {
+                            "id": row.id,
+                            "name": product.name,
+                            "product_id": product.product_id,
+                            "product_not_found": product.product_not_found,
+                        }
+                        for row, product in resolved
+                    ],
+                )
+            done = [row.queue_id for row, _ in resolved]
+            done.extend(
+                row.queue_id for row, _ in failed if row.attempts + 1 >= MAX_RESOLUTION_ATTEMPTS
+            )
+            if done:
+                self._session.execute(
+                    DbResolutionQueue.__table__.delete().where(DbResolutionQueue.id.in_(done))
+                )
+            retries = [
+                {
+                    "id": row.queue_id,
+                    "attempts": row.attempts + 1,
+                    "last_error": error[:1024],
+                    "available_at": now + RESOLUTION_RETRY_DELAY * 2**row.attempts,
+                }
+                for row, error in failed
+                if row.attempts + 1 < MAX_RESOLUTION_ATTEMPTS
+            ]
+            if retries:
+                self._session.execute(update(DbResolutionQueue), retries)
+            categorized = self._add_product_categories(
+                [product for _, product in resolved if not product.product_not_found]
+            )
+            self._receipts_changed([row.receipt for row, _ in resolved], categorized)
+            # Commits the whole batch, which also releases the claimed rows
+            self._session.commit()
+        except Exception as e:
+            log.error(f"Error completing resolutions: {e}")
+            self._session.rollback()
+            raise
+        return len(resolved)
 
     def add_ah_product(self, product: DbAHProduct) -> DbAHProduct:
         """Adds a product to the database
@@ -597,70 +1409,75 @@ class DbHandler:
             log.error(f"Error adding products: {e}")
             self._session.rollback()
             raise
+        self.record_prices(products)
         return products
 
-    def add_prev_product(self, product: DbPreviousProduct) -> DbPreviousProduct:
-        """Adds a product to the database
+    def add_prev_products(self, products: list[DbAHProduct]) -> list[DbAHProduct]:
+        """Adds previously bought products to the catalog and marks them as previously bought.
+        Products that are already in the catalog are updated if their title or prices changed.
 
         Args:
-            product (DbPreviousProduct): The product to add
+            products (list[DbAHProduct]): The previously bought products, not yet added to a session
 
         Returns:
-            DbPreviousProduct: The added product"""
-        self._session.add(product)
-        self._session.commit()
-        log.info(f'Added previous product "{product.title}" to database')
-        return product
-
-    def add_prev_products(
-        self, products: list[DbPreviousProduct]
-    ) -> list[DbPreviousProduct]:
-        """Adds a list of products to the database
-
-        Args:
-            products (list[DbPreviousProduct]): The list of products to add
-
-        Returns:
-            list[DbPreviousProduct]: The added products"""
-        existing_prev_products = self.get_prev_products()
-        product_ids = [product.webshop_id for product in products]
-        # if the ID of the product is already in the database but the name is different, replace the existing product with the new one
-        # Go through existing_prev_products and check if the product ID is in the list of products to add
-        # If it is, check if the name is different. If it is, replace the existing product with the new one
-        for existing_prev_product in existing_prev_products:
-            if existing_prev_product.webshop_id in product_ids:
-                index = product_ids.index(existing_prev_product.webshop_id)
-                product = products[index]
-                if product.webshop_id == existing_prev_product.webshop_id and (
-                    product.title != existing_prev_product.title
-                    or product.current_price != existing_prev_product.current_price
-                    or product.price_before_bonus
-                    != existing_prev_product.price_before_bonus
-                ):
-                    # replace all fields in existing_prev_product with the new product
-                    for field in existing_prev_product.__table__.columns:
-                        if field.name != "id":
+            list[DbAHProduct]: The products that were new to the catalog"""
+        self.record_prices(products)
+        now = dt.datetime.now(dt.timezone.utc)
+        webshop_ids = [product.webshop_id for product in products]
+        existing_products = {}
+        for i in range(0, len(webshop_ids), 1000):
+            for existing_product in self._session.query(DbAHProduct).filter(
+                DbAHProduct.webshop_id.in_(webshop_ids[i : i + 1000])
+            ):
+                existing_products.setdefault(existing_product.webshop_id, existing_product)
+
+        new_products = []
+        catalog_products = []
+        for product in products:
+            existing_product = existing_products.get(product.webshop_id)
+            if existing_product is None:
+                product.date_added = now
+                new_products.append(product)
+                catalog_products.append(product)
+                continue
+            if (
+                product.title != existing_product.title
+                or product.current_price != existing_product.current_price
+                or product.price_before_bonus != existing_product.price_before_bonus
+            ):
+                # replace all fields of the catalog product with the new product
+                for field in DbAHProduct.__table__.columns:
+                    if field.name not in ("id", "date_added"):
+                        setattr(existing_product, field.name, getattr(product, field.name))
+                if existing_product.details is None:
+                    existing_product.details = product.details
+                elif product.details is not None:
+                    for field in DbAHProductDetails.__table__.columns:
+                        if field.name != "product":
                             setattr(
-                                existing_prev_product,
+                                existing_product.details,
                                 field.name,
-                                getattr(product, field.name),
+                                getattr(product.details, field.name),
                             )
-                    self._session.commit()
-                    log.info(f'Updated previous product "{product.title}"')
+                log.info(f'Updated previous product "{product.title}"')
+            catalog_products.append(existing_product)
 
-        existing_prev_product_ids = [
-            prev_product.webshop_id for prev_product in existing_prev_products
-        ]
-        new_products = [
-            product
-            for product in products
-            if product.webshop_id not in existing_prev_product_ids
-        ]
-        if len(new_products) == 0:
-            log.debug("No new previous products to add")
-            return []
         try:
             self._session.add_all(new_products)
+            self._session.flush()
+            if catalog_products:
+                statement = pg_insert(DbPreviouslyBought).values(
+                    [
+                        {"product": product_id, "date_added": now, "last_seen": now}
+                        for product_id in {product.id for product in catalog_products}
+                    ]
+                )
+                self._session.execute(
+                    statement.on_conflict_do_update(
+                        index_elements=["product"],
+                        set_={"last_seen": statement.excluded.last_seen},
+                    )
+                )
             self._session.commit()
             log.info(f"Added {len(new_products)} previous products to database")
         except Exception as e:
@@ -736,6 +1553,7 @@ class DbHandler:
         try:
             self._session.add_all(dbCategories)
             self._session.commit()
+            reference_cache.invalidate()
             log.debug(f"Added {len(dbCategories)} categories to database")
         except Exception as e:
             log.error(f"Error adding categories: {e}")
@@ -757,6 +1575,7 @@ class DbHandler:
         try:
             self._session.add_all(dbLocations)
             self._session.commit()
+            reference_cache.invalidate()
             log.info(f"Added {len(dbLocations)} locations to database")
         except Exception as e:
             log.error(f"Error adding locations: {e}")
@@ -834,6 +1653,7 @@ class DbHandler:
         try:
             self._session.add_all(dbCategoryHierarchies)
             self._session.commit()
+            reference_cache.invalidate()
             log.debug(
                 f"Added {len(dbCategoryHierarchies)} category hierarchies to database"
             )
@@ -0,0 +1,397 @@
+from database.setup import engine, async_engine
+from database.model import (
+    DbLocation,
+    DbCategory,
+    DbCategoryClosure,
+    DbDailyCategorySpend,
+    DbDailyStoreSpend,
+    DbDailyProductSpend,
+)
+from database.rollups import to_day
+from database.generation import data_generation
+from config import Config
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, func, exists, cast, Date, DateTime, Float, Select
+from collections import OrderedDict
+import asyncio
+import datetime as dt
+import threading
+import time
+import logging
+
+log = logging.getLogger(__name__)
+config = Config()
+
+PERIODS = ("week", "month")
+TOP_PRODUCTS_ORDERS = ("spend", "count")
+
+# The analytics are computed from the daily rollups in database/rollups.py instead of the receipts,
+# so date ranges are whole days: since and until are converted to their day in the rollup timezone.
+
+
+def _in_range(query, day, since: dt.datetime = None, until: dt.datetime = None):
+    if since is not None:
+        query = query.where(day >= to_day(since))
+    if until is not None:
+        query = query.where(day < to_day(until))
+    return query
+
+
+def _check_period(period: str):
+    if period not in PERIODS:
+        raise ValueError(f"period must be one of {', '.join(PERIODS)}, not {period}")
+
+
+def _period_start(period: str, day):
+    return cast(func.date_trunc(period, cast(day, DateTime)), Date).label("period")
+
+
+def run(session: Session, query, **params) -> list[dict]:
+    """Runs an analytics query.
+
+    Args:
+        session (Session): The database session
+        query (Callable): The analytics function that builds the query
+        params: The arguments of the analytics function
+
+    Returns:
+        list[dict]: The rows of the result"""
+    return [row._asdict() for row in session.execute(query(**params))]
+
+
+async def run_async(session: AsyncSession, query, **params) -> list[dict]:
+    """Runs an analytics query on an async session, see run()"""
+    return [row._asdict() for row in await session.execute(query(**params))]
+
+
+def spend_by_category(
+    parent: str = None, since: dt.datetime = None, until: dt.datetime = None
+) -> Select:
+    """Builds the query of the spend per child category of a category, every child including its whole subtree.
+    Products are assigned to their category and all of its ancestors when they are stored, so the
+    rollup of a category already covers its subtree.
+
+    Args:
+        parent (str, optional): The taxonomy ID of the parent category. Defaults to the root categories.
+        since (datetime, optional): Only receipts from this day on. Defaults to None.
+        until (datetime, optional): Only receipts before this day. Defaults to None.
+
+    Returns:
+        Select: The taxonomy_id, name, total, lines and receipts per category, highest total first"""
+    if parent is None:
+        child = aliased(DbCategoryClosure)
+        categories = select(DbCategory.taxonomy_id).where(
+            ~exists().where(child.descendant == DbCategory.taxonomy_id, child.depth == 1)
+        )
+    else:
+        categories = select(DbCategoryClosure.descendant).where(
+            DbCategoryClosure.ancestor == str(parent), DbCategoryClosure.depth == 1
+        )
+    total = func.coalesce(func.sum(DbDailyCategorySpend.total), 0.0).label("total")
+    query = (
+        select(
+            DbCategory.taxonomy_id,
+            DbCategory.name,
+            total,
+            func.sum(DbDailyCategorySpend.lines).label("lines"),
+            # A receipt belongs to a single day, so the daily receipt counts add up
+            func.sum(DbDailyCategorySpend.receipts).label("receipts"),
+        )
+        .join(DbCategory, DbCategory.taxonomy_id == DbDailyCategorySpend.taxonomy_id)
+        .where(DbDailyCategorySpend.taxonomy_id.in_(categories))
+        .group_by(DbCategory.taxonomy_id, DbCategory.name)
+        .order_by(total.desc())
+    )
+    return _in_range(query, DbDailyCategorySpend.day, since, until)
+
+
+def spend_by_store(since: dt.datetime = None, until: dt.datetime = None) -> Select:
+    """Builds the query of the spend per store.
+
+    Args:
+        since (datetime, optional): Only receipts from this day on. Defaults to None.
+        until (datetime, optional): Only receipts before this day. Defaults to None.
+
+    Returns:
+        Select: The location, name, city, total, discount, receipts and the days of the first
+            and last visit per store, highest total first"""
+    total = func.coalesce(func.sum(DbDailyStoreSpend.total), 0.0).label("total")
+    query = (
+        select(
+            DbLocation.id.label("location"),
+            DbLocation.name,
+            DbLocation.city,
+            total,
+            func.coalesce(func.sum(DbDailyStoreSpend.discount), 0.0).label("discount"),
+            func.sum(DbDailyStoreSpend.receipts).label("receipts"),
+            func.min(DbDailyStoreSpend.day).label("first_visit"),
+            func.max(DbDailyStoreSpend.day).label("last_visit"),
+        )
+        .join(DbLocation, DbLocation.id == DbDailyStoreSpend.location)
+        .group_by(DbLocation.id, DbLocation.name, DbLocation.city)
+        .order_by(total.desc())
+    )
+    return _in_range(query, DbDailyStoreSpend.day, since, until)
+
+
+def spend_over_time(
+    period: str = "month",
+    category: str = None,
+    since: dt.datetime = None,
+    until: dt.datetime = None,
+) -> Select:
+    """Builds the query of the spend per week or month with a running total.
+
+    Args:
+        period (str, optional): "week" or "month". Defaults to "month".
+        category (str, optional): Only the products in the subtree of this taxonomy ID. Defaults to all receipts.
+        since (datetime, optional): Only receipts from this day on. Defaults to None.
+        until (datetime, optional): Only receipts before this day. Defaults to None.
+
+    Returns:
+        Select: The first day, total, receipts and cumulative total per period, oldest first
+
+    Raises:
+        ValueError: If the period is not "week" or "month"
+    """
+    _check_period(period)
+    rollup = DbDailyStoreSpend if category is None else DbDailyCategorySpend
+    start = _period_start(period, rollup.day)
+    query = select(
+        start,
+        func.sum(rollup.total).label("total"),
+        func.sum(rollup.receipts).label("receipts"),
+    )
+    if category is not None:
+        query = query.where(DbDailyCategorySpend.taxonomy_id == str(category))
+    periods = _in_range(query, rollup.day, since, until).group_by(start).subquery("periods")
+    return select(
+        periods.c.period,
+        periods.c.total,
+        periods.c.receipts,
+        func.sum(periods.c.total).over(order_by=periods.c.period).label("cumulative_total"),
+    ).order_by(periods.c.period)
+
+
+def top_products(
+    limit: int = 20,
+    order: str = "spend",
+    since: dt.datetime = None,
+    until: dt.datetime = None,
+) -> Select:
+    """Builds the query of the products that were spent the most on or bought the most often.
+
+    Args:
+        limit (int, optional): The number of products. Defaults to 20.
+        order (str, optional): "spend" or "count". Defaults to "spend".
+        since (datetime, optional): Only receipts from this day on. Defaults to None.
+        until (datetime, optional): Only receipts before this day. Defaults to None.
+
+    Returns:
+        Select: The rank, product_id, name, total, lines, quantity, average price and last
+            purchase per product
+
+    Raises:
+        ValueError: If the order is not "spend" or "count"
+    """
+    if order not in TOP_PRODUCTS_ORDERS:
+        raise ValueError(f"order must be one of {', '.join(TOP_PRODUCTS_ORDERS)}, not {order}")
+    total = func.sum(DbDailyProductSpend.total)
+    lines = func.sum(DbDailyProductSpend.lines)
+    ranking = total.desc() if order == "spend" else lines.desc()
+    query = (
+        select(
+            func.rank().over(order_by=ranking).label("rank"),
+            DbDailyProductSpend.product_id,
+            func.max(DbDailyProductSpend.name).label("name"),
+            total.label("total"),
+            lines.label("lines"),
+            func.sum(DbDailyProductSpend.quantity).label("quantity"),
+            (
+                func.sum(DbDailyProductSpend.price_sum) / func.nullif(lines, 0, type_=Float)
+            ).label("average_price"),
+            func.max(DbDailyProductSpend.last_purchase).label("last_purchase"),
+        )
+        .group_by(DbDailyProductSpend.product_id)
+        .order_by(ranking)
+        .limit(limit)
+    )
+    return _in_range(query, DbDailyProductSpend.day, since, until)
+
+
+def savings_over_time(
+    period: str = "month", since: dt.datetime = None, until: dt.datetime = None
+) -> Select:
+    """Builds the query of the discounts per week or month, with the share of the spend before discounts that was
+    saved and the cumulative savings.
+
+    Args:
+        period (str, optional): "week" or "month". Defaults to "month".
+        since (datetime, optional): Only receipts from this day on. Defaults to None.
+        until (datetime, optional): Only receipts before this day. Defaults to None.
+
+    Returns:
+        Select: The first day, discount, total, savings rate and cumulative discount per period,
+            oldest first
+
+    Raises:
+        ValueError: If the period is not "week" or "month"
+    """
+    _check_period(period)
+    start = _period_start(period, DbDailyStoreSpend.day)
+    periods = (
+        _in_range(
+            select(
+                start,
+                func.coalesce(func.sum(DbDailyStoreSpend.discount), 0.0).label("discount"),
+                func.coalesce(func.sum(DbDailyStoreSpend.total), 0.0).label("total"),
+            ),
+            DbDailyStoreSpend.day,
+            since,
+            until,
+        )
+        .group_by(start)
+        .subquery("periods")
+    )
+    before_discount = periods.c.total + periods.c.discount
+    return select(
+        periods.c.period,
+        periods.c.discount,
+        periods.c.total,
+        (periods.c.discount / func.nullif(before_discount, 0, type_=Float)).label("savings_rate"),
+        func.sum(periods.c.discount)
+        .over(order_by=periods.c.period)
+        .label("cumulative_discount"),
+    ).order_by(periods.c.period)
+
+
+# The independent queries of the dashboard, by the key of their result, with their arguments
+DASHBOARD = {
+    "stores": (spend_by_store, {}),
+    "categories": (spend_by_category, {}),
+    "spend": (spend_over_time, {"period": "month"}),
+    "top_products": (top_products, {}),
+    "savings": (savings_over_time, {"period": "month"}),
+}
+
+
+class ResultCache:
+    """Process-wide cache of analytics results. Results are kept for ttl seconds, or until
+    invalidate() is called or the data generation is bumped when receipts are stored. The least
+    recently used results are dropped beyond max_entries. Cached results are shared and must only
+    be read, never modified.
+
+    Attributes:
+        version (int): The current version, bumped on every invalidation
+        hits (int): Number of results answered from the cache
+        misses (int): Number of results that were computed
+    """
+
+    def __init__(
+        self,
+        ttl: float,
+        max_entries: int = 256,
+        _engine=engine,
+        _async_engine=async_engine,
+        _generation=data_generation,
+    ):
+        self._engine = _engine
+        self._async_engine = _async_engine
+        self._generation = _generation
+        self._seen_generation = None
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._results = OrderedDict()
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self):
+        """Drops all cached results"""
+        with self._lock:
+            self.version += 1
+            self._results.clear()
+
+    def _lookup(self, key: tuple, generation: int = None):
+        now = time.monotonic()
+        if generation is None:
+            generation = self._generation.current()
+        with self._lock:
+            if generation != self._seen_generation:
+                # Receipts were stored by this or another process
+                self._seen_generation = generation
+                self.version += 1
+                self._results.clear()
+            cached = self._results.get(key)
+            if cached is not None and cached[0] > now:
+                self._results.move_to_end(key)
+                self.hits += 1
+                return cached[1], None
+            self.misses += 1
+            return None, (now, self.version)
+
+    def _store(self, key: tuple, computed: tuple, result: list[dict]):
+        now, version = computed
+        with self._lock:
+            # A result computed before an invalidation may already be stale
+            if version == self.version:
+                self._results[key] = (now + self.ttl, result)
+                self._results.move_to_end(key)
+                while len(self._results) > self.max_entries:
+                    self._results.popitem(last=False)
+
+    def get(self, query, **params) -> list[dict]:
+        """Gets the result of an analytics query, running it on a miss.
+
+        Args:
+            query (Callable): The analytics function that builds the query
+            params: The arguments of the analytics function
+
+        Returns:
+            list[dict]: The result of the query"""
+        key = (query.__name__, tuple(sorted(params.items())))
+        result, computed = self._lookup(key)
+        if computed is None:
+            return result
+        start = time.perf_counter()
+        with Session(self._engine) as session:
+            result = run(session, query, **params)
+        log.debug(f"Computed {query.__name__}{params} in {time.perf_counter() - start:.3f}s")
+        self._store(key, computed, result)
+        return result
+
+    async def get_async(self, query, **params) -> list[dict]:
+        """Gets the result of an analytics query like get(), but runs it on the async engine.
+        Every call has its own session, so independent queries can be awaited concurrently."""
+        key = (query.__name__, tuple(sorted(params.items())))
+        # Reading the generation is file IO, which does not belong on the event loop
+        generation = await asyncio.to_thread(self._generation.current)
+        result, computed = self._lookup(key, generation)
+        if computed is None:
+            return result
+        start = time.perf_counter()
+        async with AsyncSession(self._async_engine) as session:
+            result = await run_async(session, query, **params)
+        log.debug(f"Computed {query.__name__}{params} in {time.perf_counter() - start:.3f}s")
+        self._store(key, computed, result)
+        return result
+
+    def stats(self) -> dict:
+        """Gets the size and usage statistics of the cache
+
+        Returns:
+            dict: The statistics of the cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "version": self.version,
+                "results": len(self._results),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+            }
+
+
+analytics_cache = ResultCache(float(config.get("analytics_cache_seconds", default=300)))
@@ -0,0 +1,259 @@
+from database.model import Base
+from units import parse_units
+from sqlalchemy import text
+import datetime as dt
+import gzip
+import json
+import os
+import re
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+SNAPSHOT_MANIFEST = "manifest.json"
+SNAPSHOT_FORMAT_VERSION = 1
+SNAPSHOT_TABLES = [
+    "categories",
+    "categories_hierarchy",
+    "ah_products",
+    "ah_product_details",
+    "price_history",
+]
+COPY_CHUNK_SIZE = 1024 * 1024
+# Number of catalog rows parsed per statement when backfilling the unit columns
+UNIT_BACKFILL_CHUNK_SIZE = 5000
+
+# Tokens that change the state of the statement scanner outside of a quoted section
+_TOKEN_REGEX = re.compile(r"['\";]|--|/\*|\$[A-Za-z_0-9]*\$")
+
+
+def iter_sql_statements(file_path: str):
+    """Reads a SQL script statement by statement. Only the current statement is kept in memory.
+    Semicolons inside quoted strings, quoted identifiers, dollar-quoted strings and comments
+    do not end a statement. Line comments are stripped.
+
+    Args:
+        file_path (str): The path to the SQL file
+
+    Yields:
+        str: The statements of the script without the trailing semicolon"""
+    parts = []
+    closing = None  # The token that ends the quoted section we are in, if any
+    with open(file_path, "r", encoding="utf8") as file:
+        for line in file:
+            position = 0
+            while position < len(line):
+                if closing is not None:
+                    end = line.find(closing, position)
+                    if end == -1:
+                        parts.append(line[position:])
+                        position = len(line)
+                        continue
+                    end += len(closing)
+                    parts.append(line[position:end])
+                    position = end
+                    closing = None
+                    continue
+                match = _TOKEN_REGEX.search(line, position)
+                if match is None:
+                    parts.append(line[position:])
+                    break
+                token = match.group()
+                if token == "--":
+                    parts.append(line[position : match.start()])
+                    parts.append("\n")
+                    break
+                if token == ";":
+                    parts.append(line[position : match.start()])
+                    statement = "".join(parts).strip()
+                    parts = []
+                    if statement:
+                        yield statement
+                    position = match.end()
+                    continue
+                # Opening quote or block comment, find where the section ends
+                parts.append(line[position : match.end()])
+                position = match.end()
+                closing = "*/" if token == "/*" else token
+    statement = "".join(parts).strip()
+    if statement:
+        yield statement
+
+
+def backfill_units(connection, missing_only: bool = True) -> int:
+    """Parses the unit price and unit size of the catalog products into the numeric unit columns,
+    without committing. Dumps and snapshots of databases from before the unit columns existed
+    load the catalog without them.
+
+    Args:
+        connection (Connection): The database connection
+        missing_only (bool, optional): Whether to only parse the products without any unit
+            column. Defaults to True.
+
+    Returns:
+        int: The number of parsed products"""
+    missing = (
+        " AND unit_price IS NULL AND unit IS NULL AND unit_size IS NULL" if missing_only else ""
+    )
+    last_id = 0
+    updated = 0
+    while True:
+        rows = connection.execute(
+            text(
+                "SELECT id, unit_price_description, sales_unit_size FROM ah_products "
+                f"WHERE id > :last_id{missing} ORDER BY id LIMIT :limit"
+            ),
+            {"last_id": last_id, "limit": UNIT_BACKFILL_CHUNK_SIZE},
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        values = [
+            {"id": row.id, **parse_units(row.unit_price_description, row.sales_unit_size)}
+            for row in rows
+        ]
+        connection.execute(
+            text(
+                "UPDATE ah_products SET unit_price = :unit_price, unit = :unit, "
+                "unit_size = :unit_size WHERE id = :id"
+            ),
+            values,
+        )
+        updated += len(values)
+    return updated
+
+
+def execute_sql_stream(engine, file_path: str) -> int:
+    """Executes a SQL script statement by statement in a single transaction. The statements are
+    sent verbatim to the driver, so no bind parameter parsing or escaping takes place, and they
+    are pipelined to avoid a round trip per statement. Catalog products that the script loaded
+    without unit columns are parsed in the same transaction.
+
+    Args:
+        engine (Engine): The database engine
+        file_path (str): The path to the SQL file
+
+    Returns:
+        int: The number of executed statements"""
+    start = time.perf_counter()
+    count = 0
+    with engine.begin() as connection:
+        driver_connection = connection.connection.driver_connection
+        with driver_connection.pipeline(), driver_connection.cursor() as cursor:
+            for statement in iter_sql_statements(file_path):
+                cursor.execute(statement)
+                count += 1
+        parsed = backfill_units(connection)
+    log.info(
+        f"Executed {count} statements from {file_path} in {time.perf_counter() - start:.1f}s"
+    )
+    if parsed:
+        log.info(f"Parsed the unit columns of {parsed} catalog products")
+    return count
+
+
+def _table_columns(table_name: str) -> list[str]:
+    return [column.name for column in Base.metadata.tables[table_name].columns]
+
+
+def export_snapshot(engine, directory: str, tables: list[str] = None) -> dict:
+    """Exports tables as gzip-compressed COPY data together with a manifest.
+
+    Args:
+        engine (Engine): The database engine
+        directory (str): The directory to write the snapshot to
+        tables (list[str], optional): The tables to export. Defaults to SNAPSHOT_TABLES.
+
+    Returns:
+        dict: The manifest of the snapshot"""
+    os.makedirs(directory, exist_ok=True)
+    manifest = {
+        "format_version": SNAPSHOT_FORMAT_VERSION,
+        "created_at": dt.datetime.now(dt.timezone.utc).isoformat(),
+        "tables": [],
+    }
+    raw_connection = engine.raw_connection()
+    try:
+        cursor = raw_connection.driver_connection.cursor()
+        for table in tables or SNAPSHOT_TABLES:
+            columns = _table_columns(table)
+            file_name = f"{table}.copy.gz"
+            rows = 0
+            column_list = ", ".join(f'"{column}"' for column in columns)
+            with gzip.open(os.path.join(directory, file_name), "wb") as file, cursor.copy(
+                f"COPY {table} ({column_list}) TO STDOUT"
+            ) as copy:
+                for data in copy:
+                    rows += bytes(data).count(b"\n")
+                    file.write(data)
+            manifest["tables"].append(
+                {"table": table, "columns": columns, "file": file_name, "rows": rows}
+            )
+            log.info(f"Exported {rows} rows from {table}")
+        raw_connection.rollback()
+    finally:
+        raw_connection.close()
+    with open(os.path.join(directory, SNAPSHOT_MANIFEST), "w") as file:
+        json.dump(manifest, file, indent=2)
+    return manifest
+
+
+def load_snapshot(engine, directory: str) -> dict[str, int]:
+    """Loads a snapshot created by export_snapshot with COPY in a single transaction. Tables that
+    already contain rows are skipped. The id sequences are moved past the loaded ids, and the
+    unit columns of catalog products from snapshots that do not have them are parsed.
+
+    Args:
+        engine (Engine): The database engine
+        directory (str): The directory containing the snapshot
+
+    Returns:
+        dict[str, int]: The number of loaded rows per table"""
+    with open(os.path.join(directory, SNAPSHOT_MANIFEST), "r") as file:
+        manifest = json.load(file)
+    if manifest.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported snapshot format version {manifest.get('format_version')}"
+        )
+
+    start = time.perf_counter()
+    loaded = {}
+    with engine.begin() as connection:
+        cursor = connection.connection.driver_connection.cursor()
+        for entry in manifest["tables"]:
+            table = entry["table"]
+            cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {table})")
+            if cursor.fetchone()[0]:
+                log.info(f"Skipping {table}, it already contains rows")
+                continue
+            column_list = ", ".join(f'"{column}"' for column in entry["columns"])
+            with gzip.open(os.path.join(directory, entry["file"]), "rb") as file, cursor.copy(
+                f"COPY {table} ({column_list}) FROM STDIN"
+            ) as copy:
+                while data := file.read(COPY_CHUNK_SIZE):
+                    copy.write(data)
+            if "id" in entry["columns"]:
+                cursor.execute(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                    f"COALESCE(MAX(id), 1), MAX(id) IS NOT NULL) FROM {table}"
+                )
+            loaded[table] = entry["rows"]
+            log.info(f"Loaded {entry['rows']} rows into {table}")
+        if "ah_products" in loaded:
+            parsed = backfill_units(connection)
+            if parsed:
+                log.info(f"Parsed the unit columns of {parsed} catalog products")
+    log.info(f"Loaded snapshot from {directory} in {time.perf_counter() - start:.1f}s")
+    return loaded
+
+
+def has_snapshot(directory: str) -> bool:
+    """Checks whether a directory contains a snapshot
+
+    Args:
+        directory (str): The directory to check
+
+    Returns:
+        bool: Whether the directory contains a snapshot manifest"""
+    return os.path.exists(os.path.join(directory, SNAPSHOT_MANIFEST))
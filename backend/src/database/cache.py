@@ -0,0 +1,164 @@
+from database.setup import engine
+from database.model import DbLocation, DbCategory, DbCategoryClosure
+from sqlalchemy.orm import Session
+from sqlalchemy import select
+import threading
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class ReferenceCache:
+    """Process-wide read-through cache of the small, rarely changing reference tables
+    (locations, categories and the category ancestry).
+
+    The tables are loaded as a whole on first use. Writers call invalidate(), which bumps the
+    version so the next lookup reloads the tables. The cached entities are detached from any
+    session and must only be read, never modified.
+
+    Attributes:
+        version (int): The current version, bumped on every invalidation
+        hits (int): Number of lookups answered from the cache
+        misses (int): Number of lookups that were not found in the cache
+        reloads (int): Number of times the tables were loaded
+        last_reload_seconds (float): Duration of the last reload
+    """
+
+    def __init__(self, _engine=engine):
+        self._engine = _engine
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.version = 0
+        self._loaded_version = None
+        self._locations = {}
+        self._categories = {}
+        self._categories_by_name = {}
+        self._ancestors = {}
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.last_reload_seconds = None
+
+    def invalidate(self):
+        """Marks the cached tables as stale, they are reloaded on the next lookup"""
+        with self._lock:
+            self.version += 1
+
+    def _ensure_loaded(self):
+        if self._loaded_version == self.version:
+            return
+        with self._lock:
+            if self._loaded_version != self.version:
+                self._reload()
+
+    def _reload(self):
+        version = self.version
+        start = time.perf_counter()
+        with Session(self._engine, expire_on_commit=False) as session:
+            locations = session.scalars(select(DbLocation)).all()
+            categories = session.scalars(select(DbCategory).order_by(DbCategory.id)).all()
+            closure = session.execute(
+                select(DbCategoryClosure.descendant, DbCategoryClosure.ancestor).order_by(
+                    DbCategoryClosure.descendant, DbCategoryClosure.depth
+                )
+            ).all()
+            session.expunge_all()
+
+        categories_by_name = {}
+        for category in categories:
+            categories_by_name.setdefault(category.name, category)
+        ancestors = {}
+        for descendant, ancestor in closure:
+            ancestors.setdefault(descendant, []).append(ancestor)
+
+        # Swap in the new dictionaries at once, readers never see a half-loaded cache
+        self._locations = {location.name: location for location in locations}
+        self._categories = {category.taxonomy_id: category for category in categories}
+        self._categories_by_name = categories_by_name
+        self._ancestors = ancestors
+        self._loaded_version = version
+        self.reloads += 1
+        self.last_reload_seconds = time.perf_counter() - start
+        log.debug(
+            f"Loaded reference cache version {version} in {self.last_reload_seconds:.3f}s"
+        )
+
+    def _count(self, value):
+        with self._stats_lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def location(self, name: str) -> DbLocation:
+        """Finds a location by name
+
+        Args:
+            name (str): The name of the location
+
+        Returns:
+            DbLocation: The location with the given name, None if it is not cached"""
+        self._ensure_loaded()
+        return self._count(self._locations.get(name))
+
+    def category(self, taxonomy_id: str) -> DbCategory:
+        """Finds a category by taxonomy ID
+
+        Args:
+            taxonomy_id (str): The taxonomy ID of the category
+
+        Returns:
+            DbCategory: The category with the given taxonomy ID, None if it is not cached"""
+        self._ensure_loaded()
+        return self._count(self._categories.get(str(taxonomy_id)))
+
+    def category_by_name(self, name: str) -> DbCategory:
+        """Finds a category by name
+
+        Args:
+            name (str): The name of the category
+
+        Returns:
+            DbCategory: The first category with the given name, None if it is not cached"""
+        self._ensure_loaded()
+        return self._count(self._categories_by_name.get(name))
+
+    def category_ancestors(self, taxonomy_id: str) -> list[DbCategory]:
+        """Gets the category and all of its parent categories
+
+        Args:
+            taxonomy_id (str): The taxonomy ID of the category
+
+        Returns:
+            list[DbCategory]: The categories ordered from the category itself up to the root,
+                None if the category is not cached"""
+        self._ensure_loaded()
+        ancestors = self._ancestors.get(str(taxonomy_id))
+        if ancestors is None:
+            return self._count(None)
+        categories = self._categories
+        return self._count([categories[ancestor] for ancestor in ancestors])
+
+    def stats(self) -> dict:
+        """Gets the size and usage statistics of the cache
+
+        Returns:
+            dict: The statistics of the cache"""
+        with self._stats_lock:
+            lookups = self.hits + self.misses
+            return {
+                "version": self.version,
+                "locations": len(self._locations),
+                "categories": len(self._categories),
+                "ancestries": len(self._ancestors),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+                "reloads": self.reloads,
+                "last_reload_seconds": self.last_reload_seconds,
+            }
+
+
+reference_cache = ReferenceCache()
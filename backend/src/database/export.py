@@ -0,0 +1,232 @@
+from database.model import (
+    DbReceipt,
+    DbProduct,
+    DbDiscount,
+    DbLocation,
+    DbCategory,
+    DbCategoryClosure,
+    DbCategoryProduct,
+)
+from schemas import ExportLine
+from sqlalchemy import select, func, literal, cast, null, union_all, Float, Integer, String, Select
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from typing import Iterator
+import datetime as dt
+import csv
+import io
+import msgspec
+import logging
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+log = logging.getLogger(__name__)
+
+# Rows fetched from the server-side cursor at once, and rows per Parquet row group
+EXPORT_CHUNK_SIZE = 5000
+EXPORT_FORMATS = ("ndjson", "csv", "parquet")
+EXPORT_COLUMNS = list(ExportLine.__struct_fields__)
+
+_ndjson_encoder = msgspec.json.Encoder()
+
+
+def _category_paths():
+    # Products are stored with their category and all of its ancestors, ordered from the root
+    # down by the number of ancestors of every category
+    ancestors = (
+        select(func.count())
+        .where(DbCategoryClosure.descendant == DbCategoryProduct.taxonomy_id)
+        .scalar_subquery()
+    )
+    return (
+        select(
+            DbCategoryProduct.product_id,
+            func.string_agg(DbCategory.name, aggregate_order_by(literal(" > "), ancestors)).label(
+                "category"
+            ),
+        )
+        .join(DbCategory, DbCategory.taxonomy_id == DbCategoryProduct.taxonomy_id)
+        .group_by(DbCategoryProduct.product_id)
+        .subquery("paths")
+    )
+
+
+def export_query(since: dt.datetime = None, until: dt.datetime = None) -> Select:
+    """Builds the query of the purchase history as flat rows: every product line and every
+    discount of a receipt is a row, with the receipt and its store. Product lines have the path
+    of their category, discount lines the discounted amount.
+
+    Args:
+        since (datetime, optional): Only receipts from this moment on. Defaults to None.
+        until (datetime, optional): Only receipts before this moment. Defaults to None.
+
+    Returns:
+        Select: The rows in the order of EXPORT_COLUMNS, oldest receipt first"""
+    paths = _category_paths()
+    receipt_columns = [
+        DbReceipt.id.label("receipt_id"),
+        DbReceipt.transaction_id,
+        DbReceipt.datetime,
+        DbLocation.name.label("store"),
+    ]
+    products = (
+        select(
+            *receipt_columns,
+            literal("product").label("line_type"),
+            DbProduct.id.label("line_id"),
+            DbProduct.description,
+            DbProduct.name,
+            DbProduct.product_id,
+            DbProduct.quantity,
+            DbProduct.unit,
+            DbProduct.price,
+            DbProduct.total_price,
+            cast(null(), Float).label("discount"),
+            paths.c.category,
+        )
+        .join(DbReceipt, DbReceipt.id == DbProduct.receipt)
+        .outerjoin(DbLocation, DbLocation.id == DbReceipt.location)
+        .outerjoin(paths, paths.c.product_id == DbProduct.product_id)
+    )
+    discounts = (
+        select(
+            *receipt_columns,
+            literal("discount").label("line_type"),
+            DbDiscount.id.label("line_id"),
+            DbDiscount.description,
+            cast(null(), String),
+            cast(null(), String),
+            cast(null(), Integer),
+            cast(null(), String),
+            cast(null(), Float),
+            cast(null(), Float),
+            DbDiscount.amount,
+            cast(null(), String),
+        )
+        .join(DbReceipt, DbReceipt.id == DbDiscount.receipt)
+        .outerjoin(DbLocation, DbLocation.id == DbReceipt.location)
+    )
+    if since is not None:
+        products = products.where(DbReceipt.datetime >= since)
+        discounts = discounts.where(DbReceipt.datetime >= since)
+    if until is not None:
+        products = products.where(DbReceipt.datetime < until)
+        discounts = discounts.where(DbReceipt.datetime < until)
+    lines = union_all(products, discounts).subquery("lines")
+    return select(*(lines.c[name] for name in EXPORT_COLUMNS)).order_by(
+        lines.c.datetime, lines.c.receipt_id, lines.c.line_type.desc(), lines.c.line_id
+    )
+
+
+def export_rows(
+    connection,
+    since: dt.datetime = None,
+    until: dt.datetime = None,
+    chunk_size: int = EXPORT_CHUNK_SIZE,
+) -> Iterator[list]:
+    """Streams the purchase history from a server-side cursor, only chunk_size rows are held in
+    memory at once, however large the history is.
+
+    Args:
+        connection (Connection): The database connection, it must stay open while iterating
+        since (datetime, optional): Only receipts from this moment on. Defaults to None.
+        until (datetime, optional): Only receipts before this moment. Defaults to None.
+        chunk_size (int, optional): The number of rows per chunk. Defaults to EXPORT_CHUNK_SIZE.
+
+    Yields:
+        list[Row]: The next chunk of rows"""
+    result = connection.execution_options(yield_per=chunk_size).execute(
+        export_query(since, until)
+    )
+    try:
+        yield from result.partitions(chunk_size)
+    finally:
+        result.close()
+
+
+def ndjson_chunks(chunks: Iterator[list]) -> Iterator[bytes]:
+    """Encodes chunks of rows as newline delimited JSON objects
+
+    Args:
+        chunks (Iterator[list[Row]]): The chunks of export_rows()
+
+    Yields:
+        bytes: The lines of a chunk"""
+    for rows in chunks:
+        yield _ndjson_encoder.encode_lines([ExportLine(*row) for row in rows])
+
+
+def csv_chunks(chunks: Iterator[list]) -> Iterator[bytes]:
+    """Encodes chunks of rows as CSV with a header, datetimes in ISO 8601
+
+    Args:
+        chunks (Iterator[list[Row]]): The chunks of export_rows()
+
+    Yields:
+        bytes: The header, then the lines of a chunk"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in chunks:
+        writer.writerows(
+            [value.isoformat() if isinstance(value, dt.datetime) else value for value in row]
+            for row in rows
+        )
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        # Only the header, there are no rows
+        yield buffer.getvalue().encode()
+
+
+def parquet_schema() -> "pyarrow.Schema":
+    """The Parquet schema of the export, the columns in the order of EXPORT_COLUMNS"""
+    types = {
+        "receipt_id": pyarrow.int32(),
+        "transaction_id": pyarrow.string(),
+        "datetime": pyarrow.timestamp("us", tz="UTC"),
+        "store": pyarrow.string(),
+        "line_type": pyarrow.string(),
+        "line_id": pyarrow.int32(),
+        "description": pyarrow.string(),
+        "name": pyarrow.string(),
+        "product_id": pyarrow.string(),
+        "quantity": pyarrow.int32(),
+        "unit": pyarrow.string(),
+        "price": pyarrow.float64(),
+        "total_price": pyarrow.float64(),
+        "discount": pyarrow.float64(),
+        "category": pyarrow.string(),
+    }
+    return pyarrow.schema([(name, types[name]) for name in EXPORT_COLUMNS])
+
+
+def write_parquet(path: str, chunks: Iterator[list]) -> int:
+    """Writes chunks of rows to a Parquet file, every chunk is a row group. Needs pyarrow.
+
+    Args:
+        path (str): The path of the file
+        chunks (Iterator[list[Row]]): The chunks of export_rows()
+
+    Returns:
+        int: The number of written rows
+
+    Raises:
+        RuntimeError: If pyarrow is not installed"""
+    if pyarrow is None:
+        raise RuntimeError("Parquet exports need pyarrow, install it with pip install pyarrow")
+    schema = parquet_schema()
+    written = 0
+    with pyarrow.parquet.ParquetWriter(path, schema, compression="zstd") as writer:
+        for rows in chunks:
+            columns = list(zip(*rows))
+            arrays = [
+                pyarrow.array(values, type=field.type) for values, field in zip(columns, schema)
+            ]
+            writer.write_batch(pyarrow.RecordBatch.from_arrays(arrays, schema=schema))
+            written += len(rows)
+    return written
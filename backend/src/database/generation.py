@@ -0,0 +1,76 @@
+from config import Config
+import os
+import threading
+import logging
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where concurrent bumps are not serialized
+    fcntl = None
+
+log = logging.getLogger(__name__)
+config = Config()
+
+
+class DataGeneration:
+    """Counter of the changes to the stored receipts, kept in a file so that every process sees
+    the bumps of the others. Processes that write receipts call bump() after committing, readers
+    version their cached results by current(). Reading the counter only needs a stat of the file
+    while it has not changed, never the database.
+
+    Attributes:
+        path (str): The path of the file with the counter
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._stat = None
+        self._generation = 0
+
+    def _read(self) -> int:
+        try:
+            with open(self.path, "r") as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def current(self) -> int:
+        """Gets the current generation
+
+        Returns:
+            int: The generation, 0 if it was never bumped"""
+        try:
+            stat = os.stat(self.path)
+            signature = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        except FileNotFoundError:
+            signature = None
+        with self._lock:
+            if signature != self._stat:
+                self._generation = self._read() if signature is not None else 0
+                self._stat = signature
+            return self._generation
+
+    def bump(self) -> int:
+        """Starts a new generation, which makes every result cached by the current one stale.
+        Must be called after the changes are committed.
+
+        Returns:
+            int: The new generation"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        with open(f"{self.path}.lock", "w") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            generation = self._read() + 1
+            # Replaced at once, so readers never see a partially written counter
+            temporary = f"{self.path}.{os.getpid()}.tmp"
+            with open(temporary, "w") as f:
+                f.write(str(generation))
+            os.replace(temporary, self.path)
+        log.debug(f"Bumped the data generation to {generation}")
+        return generation
+
+
+data_generation = DataGeneration(config.get("data_generation_file", default="data_generation"))
@@ -0,0 +1,543 @@
+from database.model import DbSchemaMigration
+from database.rollups import refresh_rollups, days_of_receipts
+from database.bootstrap import backfill_units
+from sqlalchemy import select, text
+import datetime as dt
+import time
+import re
+import logging
+
+log = logging.getLogger(__name__)
+
+# Arbitrary key for the advisory lock that keeps concurrent processes from migrating at once
+MIGRATION_LOCK_ID = 7_245_001
+
+
+class Migration:
+    """A versioned schema change
+
+    Attributes:
+        version (int): The version of the schema after the migration has been applied
+        description (str): Short description of the change
+        statements (list[str]): The SQL statements of the migration
+        transactional (bool): Whether the statements run in a single transaction. Statements like
+            CREATE INDEX CONCURRENTLY cannot run inside a transaction and are executed one by one
+            in autocommit mode instead.
+        run (callable): Optional function that receives the connection and runs after the statements
+        check (callable): Optional function that receives the connection and runs before the
+            statements, it raises to stop the migration before it changes anything
+    """
+
+    def __init__(
+        self,
+        version: int,
+        description: str,
+        statements: list[str] = None,
+        transactional: bool = True,
+        run=None,
+        check=None,
+    ):
+        self.version = version
+        self.description = description
+        self.statements = statements or []
+        self.transactional = transactional
+        self.run = run
+        self.check = check
+
+    def __repr__(self):
+        return f"Migration(version={self.version}, description={self.description})"
+
+
+# Catalog columns shared by ah_products and the former previous_products table
+_PREVIOUS_PRODUCT_COLUMNS = [
+    "webshop_id", "hq_id", "title", "sales_unit_size", "images", "price_before_bonus",
+    "order_availability_status", "main_category", "sub_category", "brand", "shop_type",
+    "available_online", "is_previously_bought", "nutriscore", "nix18", "is_stapel_bonus",
+    "property_icons", "is_bonus", "is_orderable", "is_infinite_bonus", "is_sample",
+    "is_sponsored", "discount_labels", "unit_price_description", "auction_id",
+    "bonus_start_date", "bonus_end_date", "discount_type", "segment_type", "promotion_type",
+    "bonus_mechanism", "current_price", "bonus_period_description", "bonus_segment_id",
+    "bonus_segment_description", "has_list_price", "is_bonus_price", "product_count",
+    "multiple_item_promotion", "stickers", "order_availability_description",
+]
+
+
+def _index_previous_products(connection):
+    """Creates the trigram indexes of previous_products. Schemas created after the table was
+    merged into ah_products do not have it."""
+    if connection.execute(text("SELECT to_regclass('previous_products')")).scalar() is not None:
+        connection.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS previous_products_sub_category_gin_index ON previous_products USING gin(sub_category gin_trgm_ops);"
+            )
+        )
+        connection.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS previous_products_title_gin_index ON previous_products USING gin(title gin_trgm_ops);"
+            )
+        )
+
+
+def _merge_previous_products(connection):
+    """Moves the previously bought products into the catalog and links them in previously_bought."""
+    if connection.execute(text("SELECT to_regclass('previous_products')")).scalar() is not None:
+        columns = ", ".join(_PREVIOUS_PRODUCT_COLUMNS)
+        selected_columns = ", ".join(f"p.{column}" for column in _PREVIOUS_PRODUCT_COLUMNS)
+        statements = [
+            f"""
+            INSERT INTO ah_products ({columns}, date_added)
+            SELECT DISTINCT ON (p.webshop_id) {selected_columns}, now()
+            FROM previous_products p
+            WHERE p.webshop_id IS NOT NULL
+              AND NOT EXISTS (SELECT 1 FROM ah_products a WHERE a.webshop_id = p.webshop_id)
+            ORDER BY p.webshop_id, p.id DESC;
+            """,
+            """
+            INSERT INTO previously_bought (product, date_added, last_seen)
+            SELECT MIN(a.id), now(), now()
+            FROM previous_products p
+            JOIN ah_products a ON a.webshop_id = p.webshop_id
+            GROUP BY p.webshop_id
+            ON CONFLICT (product) DO NOTHING;
+            """,
+            """
+            UPDATE potential_products pp
+            SET potential_ah_product = m.product_id
+            FROM (
+                SELECT p.id AS previous_id, MIN(a.id) AS product_id
+                FROM previous_products p
+                JOIN ah_products a ON a.webshop_id = p.webshop_id
+                GROUP BY p.id
+            ) m
+            WHERE pp.potential_previous_product = m.previous_id
+              AND pp.potential_ah_product IS NULL;
+            """,
+            "DELETE FROM potential_products WHERE potential_ah_product IS NULL;",
+            "ALTER TABLE potential_products DROP COLUMN IF EXISTS potential_previous_product;",
+            "DROP TABLE previous_products;",
+        ]
+        for statement in statements:
+            connection.execute(text(statement))
+    connection.execute(
+        text("ALTER TABLE potential_products ALTER COLUMN potential_ah_product SET NOT NULL;")
+    )
+    connection.execute(
+        text("CREATE INDEX IF NOT EXISTS ah_products_webshop_id_index ON ah_products (webshop_id);")
+    )
+
+
+# Columns moved from ah_products to ah_product_details
+_PRODUCT_DETAIL_COLUMNS = [
+    "hq_id", "images", "order_availability_status", "main_category", "brand", "shop_type",
+    "available_online", "is_previously_bought", "nutriscore", "nix18", "is_stapel_bonus",
+    "property_icons", "is_bonus", "is_orderable", "is_infinite_bonus", "is_sample",
+    "is_sponsored", "discount_labels", "auction_id", "bonus_start_date", "bonus_end_date",
+    "discount_type", "segment_type", "promotion_type", "bonus_mechanism",
+    "bonus_period_description", "bonus_segment_id", "bonus_segment_description",
+    "has_list_price", "is_bonus_price", "product_count", "multiple_item_promotion", "stickers",
+    "order_availability_description",
+]
+
+
+def _split_product_details(connection):
+    """Moves the presentation columns of ah_products to ah_product_details."""
+    has_wide_products = connection.execute(
+        text(
+            "SELECT 1 FROM information_schema.columns "
+            "WHERE table_name = 'ah_products' AND column_name = 'images'"
+        )
+    ).first()
+    if has_wide_products is None:
+        return
+    columns = ", ".join(_PRODUCT_DETAIL_COLUMNS)
+    connection.execute(
+        text(
+            f"INSERT INTO ah_product_details (product, {columns}) "
+            f"SELECT id, {columns} FROM ah_products ON CONFLICT (product) DO NOTHING;"
+        )
+    )
+    drop_columns = ", ".join(f"DROP COLUMN {column}" for column in _PRODUCT_DETAIL_COLUMNS)
+    connection.execute(text(f"ALTER TABLE ah_products {drop_columns};"))
+
+
+def _backfill_units(connection):
+    """Parses the unit price and unit size of the catalog products into the numeric unit columns."""
+    updated = backfill_units(connection, missing_only=False)
+    log.info(f"Parsed the unit columns of {updated} catalog products")
+
+
+def _backfill_rollups(connection):
+    """Computes the daily rollups of every receipt that was stored before the rollups existed."""
+    written = refresh_rollups(connection)
+    log.info(f"Computed {written} daily rollup rows")
+
+
+# Every copy of the receipts that were stored more than once. The copy with the most product
+# lines, the oldest of those, is the one that is kept
+_DUPLICATE_RECEIPTS_QUERY = """
+SELECT
+    transaction_id,
+    id AS receipt,
+    datetime,
+    lines,
+    first_value(id) OVER copies AS kept
+FROM (
+    SELECT r.id, r.transaction_id, r.datetime,
+        (SELECT count(*) FROM products p WHERE p.receipt = r.id) AS lines
+    FROM receipts r
+    WHERE r.transaction_id IN (
+        SELECT transaction_id FROM receipts GROUP BY transaction_id HAVING count(*) > 1
+    )
+) receipts
+WINDOW copies AS (PARTITION BY transaction_id ORDER BY lines DESC, id)
+ORDER BY transaction_id, lines DESC, id
+"""
+
+_REMOVE_RECEIPTS_STATEMENTS = [
+    "DELETE FROM potential_products WHERE product IN (SELECT id FROM products WHERE receipt = ANY(:ids));",
+    "DELETE FROM products WHERE receipt = ANY(:ids);",
+    "DELETE FROM discounts WHERE receipt = ANY(:ids);",
+    "DELETE FROM receipts WHERE id = ANY(:ids);",
+]
+
+
+def duplicate_receipts(connection) -> list[dict]:
+    """Finds the receipts that were stored more than once
+
+    Args:
+        connection (Connection): The database connection
+
+    Returns:
+        list[dict]: The transaction_id, receipt id, datetime, number of product lines and the id
+            of the copy that is kept, of every copy"""
+    return [row._asdict() for row in connection.execute(text(_DUPLICATE_RECEIPTS_QUERY))]
+
+
+def remove_duplicate_receipts(connection) -> list[int]:
+    """Removes every copy of the receipts that were stored more than once except the one with
+    the most product lines, with their lines and discounts, and recomputes the rollups of their
+    days. Every removed receipt is logged.
+
+    Args:
+        connection (Connection): The database connection, in a transaction
+
+    Returns:
+        list[int]: The ids of the removed receipts"""
+    removed = [row for row in duplicate_receipts(connection) if row["receipt"] != row["kept"]]
+    if not removed:
+        return []
+    ids = [row["receipt"] for row in removed]
+    days = days_of_receipts(connection, ids)
+    for statement in _REMOVE_RECEIPTS_STATEMENTS:
+        connection.execute(text(statement), {"ids": ids})
+    refresh_rollups(connection, days)
+    for row in removed:
+        log.warning(
+            f"Removed receipt {row['receipt']} with {row['lines']} lines, a copy of transaction "
+            f"{row['transaction_id']} that is kept as receipt {row['kept']}"
+        )
+    return ids
+
+
+def _check_duplicate_receipts(connection):
+    """Stops the migration when receipts were stored more than once, the unique index on their
+    transaction_id can not be built before the copies are removed."""
+    copies = {}
+    for row in duplicate_receipts(connection):
+        copies.setdefault(row["transaction_id"], []).append(str(row["receipt"]))
+    if copies:
+        report = "; ".join(
+            f"{transaction_id} (receipts {', '.join(receipts)})"
+            for transaction_id, receipts in copies.items()
+        )
+        raise RuntimeError(
+            f"{len(copies)} receipts were stored more than once: {report}. Review them and remove "
+            "the copies with python manage.py dedupe-receipts, then migrate again"
+        )
+
+
+MIGRATIONS = [
+    Migration(
+        1,
+        "Trigram indexes for product search",
+        [
+            "CREATE EXTENSION IF NOT EXISTS pg_trgm;",
+            "CREATE INDEX IF NOT EXISTS ah_products_sub_category_gin_index ON ah_products USING gin(sub_category gin_trgm_ops);",
+            "CREATE INDEX IF NOT EXISTS ah_products_title_gin_index ON ah_products USING gin(title gin_trgm_ops);",
+        ],
+        run=_index_previous_products,
+    ),
+    Migration(
+        2,
+        "Range index for the price history",
+        [
+            "CREATE EXTENSION IF NOT EXISTS btree_gist;",
+            "CREATE INDEX IF NOT EXISTS price_history_validity_gist_index ON price_history USING gist(webshop_id, tstzrange(valid_from, valid_to, '[)'));",
+            "CREATE UNIQUE INDEX IF NOT EXISTS price_history_open_unique_index ON price_history (webshop_id) WHERE valid_to IS NULL;",
+        ],
+    ),
+    Migration(
+        3,
+        "Category closure index and unique category products",
+        [
+            "CREATE INDEX IF NOT EXISTS categories_closure_descendant_index ON categories_closure (descendant, depth);",
+            "DELETE FROM categories_products a USING categories_products b WHERE a.id > b.id AND a.product_id = b.product_id AND a.taxonomy_id = b.taxonomy_id;",
+            "CREATE UNIQUE INDEX IF NOT EXISTS categories_products_product_taxonomy_unique_index ON categories_products (product_id, taxonomy_id);",
+        ],
+    ),
+    Migration(
+        4,
+        "Indexes for lookups and foreign keys",
+        [
+            "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS receipts_transaction_id_unique_index ON receipts (transaction_id);",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS receipts_datetime_index ON receipts (datetime);",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS products_name_description_index ON products (name, description);",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS products_receipt_index ON products (receipt);",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS products_not_found_index ON products (description) WHERE product_not_found;",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS discounts_receipt_index ON discounts (receipt);",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS potential_products_product_index ON potential_products (product);",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS categories_name_index ON categories (name);",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS categories_hierarchy_child_index ON categories_hierarchy (child);",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS categories_products_taxonomy_id_index ON categories_products (taxonomy_id);",
+        ],
+        transactional=False,
+        check=_check_duplicate_receipts,
+    ),
+    Migration(
+        5,
+        "Merge previous_products into the ah_products catalog",
+        run=_merge_previous_products,
+    ),
+    Migration(
+        6,
+        "Move presentation columns of ah_products to ah_product_details",
+        run=_split_product_details,
+    ),
+    Migration(
+        7,
+        "Rewrite ah_products to reclaim the space of the dropped columns",
+        ["VACUUM (FULL, ANALYZE) ah_products;"],
+        transactional=False,
+    ),
+    Migration(
+        8,
+        "Numeric unit price and unit size columns for the catalog",
+        [
+            "ALTER TABLE ah_products ADD COLUMN IF NOT EXISTS unit_price double precision, ADD COLUMN IF NOT EXISTS unit varchar(8), ADD COLUMN IF NOT EXISTS unit_size double precision;",
+            "CREATE INDEX IF NOT EXISTS ah_products_unit_unit_price_index ON ah_products (unit, unit_price);",
+        ],
+        run=_backfill_units,
+    ),
+    Migration(
+        9,
+        "Index for claiming queued product lookups",
+        [
+            "CREATE INDEX IF NOT EXISTS resolution_queue_available_at_index ON resolution_queue (available_at, id);",
+        ],
+    ),
+    Migration(
+        10,
+        "Index for selecting archived receipts by date",
+        [
+            "CREATE INDEX IF NOT EXISTS receipt_archive_datetime_index ON receipt_archive (datetime);",
+        ],
+    ),
+    Migration(
+        11,
+        "Keyset index for paging through receipts",
+        [
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS receipts_datetime_id_index ON receipts (datetime, id);",
+            # The keyset index also serves every lookup by datetime alone
+            "DROP INDEX CONCURRENTLY IF EXISTS receipts_datetime_index;",
+        ],
+        transactional=False,
+    ),
+    Migration(
+        12,
+        "Covering index for joining receipt products to their categories",
+        [
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS products_product_id_index ON products (product_id) INCLUDE (receipt, total_price);",
+        ],
+        transactional=False,
+    ),
+    Migration(
+        13,
+        "Daily rollups for the analytics endpoints",
+        [
+            "CREATE INDEX IF NOT EXISTS rollup_daily_category_taxonomy_id_index ON rollup_daily_category (taxonomy_id, day);",
+        ],
+        run=_backfill_rollups,
+    ),
+    Migration(
+        14,
+        "Change timestamps of receipts and category products for the analytics replica",
+        [
+            "ALTER TABLE receipts ADD COLUMN IF NOT EXISTS updated_at timestamp with time zone NOT NULL DEFAULT now();",
+            "ALTER TABLE categories_products ADD COLUMN IF NOT EXISTS updated_at timestamp with time zone NOT NULL DEFAULT now();",
+            "CREATE INDEX IF NOT EXISTS receipts_updated_at_index ON receipts (updated_at);",
+            "CREATE INDEX IF NOT EXISTS categories_products_updated_at_index ON categories_products (updated_at);",
+        ],
+    ),
+    Migration(
+        15,
+        "Drop the trigram indexes of the merged previous_products table",
+        [
+            "DROP INDEX CONCURRENTLY IF EXISTS previous_products_sub_category_gin_index;",
+            "DROP INDEX CONCURRENTLY IF EXISTS previous_products_title_gin_index;",
+        ],
+        transactional=False,
+    ),
+]
+
+INDEX_USAGE_QUERY = """
+SELECT
+    s.relname AS table_name,
+    s.indexrelname AS index_name,
+    s.idx_scan AS scans,
+    s.idx_tup_read AS tuples_read,
+    s.idx_tup_fetch AS tuples_fetched,
+    pg_relation_size(s.indexrelid) AS size_bytes,
+    i.indisunique AS is_unique,
+    i.indisvalid AS is_valid
+FROM pg_stat_user_indexes s
+JOIN pg_index i ON i.indexrelid = s.indexrelid
+ORDER BY s.relname, s.idx_scan DESC, s.indexrelname;
+"""
+
+_CONCURRENT_INDEX_REGEX = re.compile(
+    r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)",
+    re.IGNORECASE,
+)
+
+
+def get_applied_versions(connection) -> set[int]:
+    """Gets the versions of all applied migrations
+
+    Args:
+        connection (Connection): The database connection
+
+    Returns:
+        set[int]: The applied versions"""
+    return set(connection.execute(select(DbSchemaMigration.version)).scalars())
+
+
+def _drop_invalid_index(connection, statement: str):
+    """A failed CREATE INDEX CONCURRENTLY leaves an invalid index behind, which IF NOT EXISTS
+    would silently keep. Drop it so the index is rebuilt."""
+    match = _CONCURRENT_INDEX_REGEX.search(statement)
+    if not match:
+        return
+    invalid = connection.execute(
+        text(
+            "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relname = :name AND NOT i.indisvalid"
+        ),
+        {"name": match.group(1)},
+    ).first()
+    if invalid:
+        log.warning(f'Dropping invalid index "{match.group(1)}"')
+        connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {match.group(1)};"))
+
+
+def _apply(engine, migration: Migration):
+    start = time.perf_counter()
+    if migration.transactional:
+        with engine.begin() as connection:
+            if migration.check is not None:
+                migration.check(connection)
+            for statement in migration.statements:
+                connection.execute(text(statement))
+            if migration.run is not None:
+                migration.run(connection)
+    else:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            if migration.check is not None:
+                migration.check(connection)
+            for statement in migration.statements:
+                _drop_invalid_index(connection, statement)
+                connection.execute(text(statement))
+            if migration.run is not None:
+                migration.run(connection)
+    duration = time.perf_counter() - start
+    with engine.begin() as connection:
+        connection.execute(
+            DbSchemaMigration.__table__.insert().values(
+                version=migration.version,
+                description=migration.description,
+                applied_at=dt.datetime.now(dt.timezone.utc),
+                duration=duration,
+            )
+        )
+    log.info(
+        f"Applied migration {migration.version} ({migration.description}) in {duration:.2f}s"
+    )
+
+
+def migrate(engine, target: int = None) -> list[int]:
+    """Applies all pending migrations in order. Concurrent callers wait for each other.
+
+    Args:
+        engine (Engine): The database engine
+        target (int, optional): The version to migrate to. Defaults to the latest version.
+
+    Returns:
+        list[int]: The versions that were applied"""
+    applied = []
+    # The lock is held by the session, outside of a transaction. An open transaction would keep a
+    # snapshot that CREATE INDEX CONCURRENTLY waits for, forever.
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as lock_connection:
+        lock_connection.execute(
+            text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID}
+        )
+        try:
+            with engine.connect() as connection:
+                applied_versions = get_applied_versions(connection)
+            for migration in sorted(MIGRATIONS, key=lambda m: m.version):
+                if migration.version in applied_versions:
+                    continue
+                if target is not None and migration.version > target:
+                    break
+                _apply(engine, migration)
+                applied.append(migration.version)
+        finally:
+            lock_connection.execute(
+                text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID}
+            )
+    return applied
+
+
+def migration_status(engine) -> list[dict]:
+    """Gets the state of all known migrations
+
+    Args:
+        engine (Engine): The database engine
+
+    Returns:
+        list[dict]: The version, description and application time of every migration"""
+    with engine.connect() as connection:
+        rows = {
+            row.version: row
+            for row in connection.execute(select(DbSchemaMigration)).all()
+        }
+    return [
+        {
+            "version": migration.version,
+            "description": migration.description,
+            "applied_at": rows[migration.version].applied_at
+            if migration.version in rows
+            else None,
+        }
+        for migration in sorted(MIGRATIONS, key=lambda m: m.version)
+    ]
+
+
+def index_usage_report(engine) -> list[dict]:
+    """Reads the index usage statistics from pg_stat_user_indexes
+
+    Args:
+        engine (Engine): The database engine
+
+    Returns:
+        list[dict]: One entry per index with its number of scans, tuples read and size"""
+    with engine.connect() as connection:
+        return [dict(row._mapping) for row in connection.execute(text(INDEX_USAGE_QUERY))]
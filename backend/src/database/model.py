@@ -5,9 +5,13 @@ from sqlalchemy import (
     Float,
     String,
     DateTime,
+    Date,
     Boolean,
+    LargeBinary,
+    func,
 )
 from sqlalchemy.dialects.postgresql import JSONB
+from units import parse_units
 import datetime as dt
 
 class Base(DeclarativeBase):
@@ -24,6 +28,7 @@ class DbReceipt(Base):
         location (int): Location id
         total_price (float): Receipt total price
         total_discount (float): Receipt total discount
+        updated_at (datetime): When the receipt or its lines were last changed
     """
 
     __tablename__ = "receipts"
@@ -34,6 +39,9 @@ class DbReceipt(Base):
     location: Mapped[int] = mapped_column(Integer, ForeignKey("locations.id"))
     total_price: Mapped[float] = mapped_column(Float)
     total_discount: Mapped[float] = mapped_column(Float)
+    updated_at: Mapped[dt.datetime] = mapped_column(
+        DateTime(timezone=True), nullable=False, server_default=func.now()
+    )
 
     products: Mapped[list["DbProduct"]] = relationship(
         "DbProduct", back_populates="receipt_relation"
@@ -56,118 +64,85 @@ class DbReceipt(Base):
         }
 
 class DbAHProduct(Base):
-    """AHProduct model. Mirrors the products that are available in the AH API.
+    """AHProduct model. Mirrors the products that are available in the AH API. Only the columns
+    needed for matching are stored here, so the trigram search scans narrow rows. The remaining
+    attributes are stored in AHProductDetails. Products that have been bought with the account are
+    linked in PreviouslyBought.
 
     Attributes:
         id (int): Product id
         webshop_id (str): Product webshop id
-        hq_id (str): Product hq id
         title (str): Product title
         sales_unit_size (str): Product sales unit size
-        images (JSON): Product images
         price_before_bonus (float): Product price before bonus
-        order_availability_status (str): Product order availability status
-        main_category (str): Product main category
         sub_category (str): Product sub category
-        brand (str): Product brand
-        shop_type (str): Product shop type
-        available_online (bool): Product available online
-        is_previously_bought (bool): Product is previously bought
-        nutriscore (str): Product nutriscore
-        nix18 (bool): Product nix18
-        is_stapel_bonus (bool): Product is stapel bonus
-        property_icons (JSON): Product property icons
-        is_bonus (bool): Product is bonus
-        is_orderable (bool): Product is orderable
-        is_infinite_bonus (bool): Product is infinite bonus
-        is_sample (bool): Product is sample
-        is_sponsored (bool): Product is sponsored
-        discount_labels (JSON): Product discount labels
         unit_price_description (str): Product unit price description
-        auction_id (str): Product auction id
-        bonus_start_date (datetime): Product bonus start date
-        bonus_end_date (datetime): Product bonus end date
-        discount_type (str): Product discount type
-        segment_type (str): Product segment type
-        promotion_type (str): Product promotion type
-        bonus_mechanism (str): Product bonus mechanism
         current_price (float): Product current price
-        bonus_period_description (str): Product bonus period description
-        bonus_segment_id (str): Product bonus segment id
-        bonus_segment_description (str): Product bonus segment description
-        has_list_price (bool): Product has list price
-        is_bonus_price (bool): Product is bonus price
-        product_count (int): Product count
-        multiple_item_promotion (bool): Product multiple item promotion
-        stickers (JSON): Product stickers
-        order_availability_description (str): Product order availability description
+        unit_price (float): Price per unit, parsed from the unit price description
+        unit (str): Normalized unit of the unit price and unit size ("kg", "l" or "st")
+        unit_size (float): Sales unit size in the normalized unit
         date_added (datetime): Product date added
     """
 
     __tablename__ = "ah_products"
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     webshop_id: Mapped[str] = mapped_column(String(255), nullable=True)
-    hq_id: Mapped[str] = mapped_column(String(255), nullable=True)
     title: Mapped[str] = mapped_column(String(255), nullable=True)
     sales_unit_size: Mapped[str] = mapped_column(String(255), nullable=True)
-    images: Mapped[JSONB] = mapped_column(JSONB, nullable=True)
     price_before_bonus: Mapped[float] = mapped_column(Float, nullable=True)
-    order_availability_status: Mapped[str] = mapped_column(String(255), nullable=True)
-    main_category: Mapped[str] = mapped_column(String(255), nullable=True)
     sub_category: Mapped[str] = mapped_column(String(255), nullable=True)
-    brand: Mapped[str] = mapped_column(String(255), nullable=True)
-    shop_type: Mapped[str] = mapped_column(String(255), nullable=True)
-    available_online: Mapped[bool] = mapped_column(Boolean, nullable=True)
-    is_previously_bought: Mapped[bool] = mapped_column(Boolean, nullable=True)
-    nutriscore: Mapped[str] = mapped_column(String(1), nullable=True)
-    nix18: Mapped[bool] = mapped_column(Boolean, nullable=True)
-    is_stapel_bonus: Mapped[bool] = mapped_column(Boolean, nullable=True)
-    property_icons: Mapped[JSONB] = mapped_column(JSONB, nullable=True)
-    is_bonus: Mapped[bool] = mapped_column(Boolean, nullable=True)
-    is_orderable: Mapped[bool] = mapped_column(Boolean, nullable=True)
-    is_infinite_bonus: Mapped[bool] = mapped_column(Boolean, nullable=True)
-    is_sample: Mapped[bool] = mapped_column(Boolean, nullable=True)
-    is_sponsored: Mapped[bool] = mapped_column(Boolean, nullable=True)
-    discount_labels: Mapped[JSONB] = mapped_column(JSONB, nullable=True)
     unit_price_description: Mapped[str] = mapped_column(String(255), nullable=True)
-    auction_id: Mapped[str] = mapped_column(String(255), nullable=True)
-    bonus_start_date: Mapped[dt.datetime] = mapped_column(DateTime(timezone=True), nullable=True)
-    bonus_end_date: Mapped[DateTime] = mapped_column(DateTime, nullable=True)
-    discount_type: Mapped[str] = mapped_column(String(255), nullable=True)
-    segment_type: Mapped[str] = mapped_column(String(255), nullable=True)
-    promotion_type: Mapped[str] = mapped_column(String(255), nullable=True)
-    bonus_mechanism: Mapped[str] = mapped_column(String(255), nullable=True)
     current_price: Mapped[float] = mapped_column(Float, nullable=True)
-    bonus_period_description: Mapped[str] = mapped_column(String(255), nullable=True)
-    bonus_segment_id: Mapped[str] = mapped_column(String(255), nullable=True)
-    bonus_segment_description: Mapped[str] = mapped_column(String(255), nullable=True)
-    has_list_price: Mapped[bool] = mapped_column(Boolean, nullable=True)
-    is_bonus_price: Mapped[bool] = mapped_column(Boolean, nullable=True)
-    product_count: Mapped[int] = mapped_column(Integer, nullable=True)
-    multiple_item_promotion: Mapped[bool] = mapped_column(Boolean, nullable=True)
-    stickers: Mapped[JSONB] = mapped_column(JSONB, nullable=True)
-    order_availability_description: Mapped[str] = mapped_column(String(255), nullable=True)
+    unit_price: Mapped[float] = mapped_column(Float, nullable=True)
+    unit: Mapped[str] = mapped_column(String(8), nullable=True)
+    unit_size: Mapped[float] = mapped_column(Float, nullable=True)
     date_added: Mapped[dt.datetime] = mapped_column(DateTime(timezone=True), nullable=True)
 
+    details: Mapped["DbAHProductDetails"] = relationship(
+        "DbAHProductDetails", back_populates="product_relation", uselist=False, cascade="all, delete-orphan"
+    )
     potential_products: Mapped[list["DbPotentialProduct"]] = relationship(
         "DbPotentialProduct", back_populates="ah_product_relation"
     )
+    previously_bought_relation: Mapped["DbPreviouslyBought"] = relationship(
+        "DbPreviouslyBought", back_populates="product_relation", uselist=False
+    )
 
+    @classmethod
+    def from_api(cls, product: dict, **kwargs) -> "DbAHProduct":
+        """Creates a product and its details from a product of the AH API with snake_case keys.
+        Keys that are not columns of either table are ignored. The numeric unit columns are parsed
+        from the unit price description and sales unit size.
+
+        Args:
+            product (dict): The product with snake_case keys
+            **kwargs: Additional column values, for example date_added
+
+        Returns:
+            DbAHProduct: The product with its details"""
+        values = {
+            **product,
+            **parse_units(product.get("unit_price_description"), product.get("sales_unit_size")),
+            **kwargs,
+        }
+        dbAHProduct = cls(
+            **{key: value for key, value in values.items() if key in _AH_PRODUCT_COLUMNS}
+        )
+        dbAHProduct.details = DbAHProductDetails(
+            **{key: value for key, value in values.items() if key in _AH_PRODUCT_DETAIL_COLUMNS}
+        )
+        return dbAHProduct
 
-class DbPreviousProduct(Base):
-    """PreviousProduct model.
+
+class DbAHProductDetails(Base):
+    """AHProductDetails model. The attributes of an AH product that are only used for presentation.
 
     Attributes:
-        id (int): Product id
-        webshop_id (str): Product webshop id
+        product (int): AHProduct id
         hq_id (str): Product hq id
-        title (str): Product title
-        sales_unit_size (str): Product sales unit size
         images (JSON): Product images
-        price_before_bonus (float): Product price before bonus
         order_availability_status (str): Product order availability status
         main_category (str): Product main category
-        sub_category (str): Product sub category
         brand (str): Product brand
         shop_type (str): Product shop type
         available_online (bool): Product available online
@@ -182,7 +157,6 @@ class DbPreviousProduct(Base):
         is_sample (bool): Product is sample
         is_sponsored (bool): Product is sponsored
         discount_labels (JSON): Product discount labels
-        unit_price_description (str): Product unit price description
         auction_id (str): Product auction id
         bonus_start_date (datetime): Product bonus start date
         bonus_end_date (datetime): Product bonus end date
@@ -190,7 +164,6 @@ class DbPreviousProduct(Base):
         segment_type (str): Product segment type
         promotion_type (str): Product promotion type
         bonus_mechanism (str): Product bonus mechanism
-        current_price (float): Product current price
         bonus_period_description (str): Product bonus period description
         bonus_segment_id (str): Product bonus segment id
         bonus_segment_description (str): Product bonus segment description
@@ -202,17 +175,12 @@ class DbPreviousProduct(Base):
         order_availability_description (str): Product order availability description
     """
 
-    __tablename__ = "previous_products"
-    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    webshop_id: Mapped[str] = mapped_column(String(255), nullable=True)
+    __tablename__ = "ah_product_details"
+    product: Mapped[int] = mapped_column(Integer, ForeignKey("ah_products.id", ondelete="CASCADE"), primary_key=True)
     hq_id: Mapped[str] = mapped_column(String(255), nullable=True)
-    title: Mapped[str] = mapped_column(String(255), nullable=True)
-    sales_unit_size: Mapped[str] = mapped_column(String(255), nullable=True)
     images: Mapped[JSONB] = mapped_column(JSONB, nullable=True)
-    price_before_bonus: Mapped[float] = mapped_column(Float, nullable=True)
     order_availability_status: Mapped[str] = mapped_column(String(255), nullable=True)
     main_category: Mapped[str] = mapped_column(String(255), nullable=True)
-    sub_category: Mapped[str] = mapped_column(String(255), nullable=True)
     brand: Mapped[str] = mapped_column(String(255), nullable=True)
     shop_type: Mapped[str] = mapped_column(String(255), nullable=True)
     available_online: Mapped[bool] = mapped_column(Boolean, nullable=True)
@@ -227,15 +195,13 @@ class DbPreviousProduct(Base):
     is_sample: Mapped[bool] = mapped_column(Boolean, nullable=True)
     is_sponsored: Mapped[bool] = mapped_column(Boolean, nullable=True)
     discount_labels: Mapped[JSONB] = mapped_column(JSONB, nullable=True)
-    unit_price_description: Mapped[str] = mapped_column(String(255), nullable=True)
     auction_id: Mapped[str] = mapped_column(String(255), nullable=True)
     bonus_start_date: Mapped[dt.datetime] = mapped_column(DateTime(timezone=True), nullable=True)
-    bonus_end_date: Mapped[dt.datetime] = mapped_column(DateTime(timezone=True), nullable=True)
+    bonus_end_date: Mapped[DateTime] = mapped_column(DateTime, nullable=True)
     discount_type: Mapped[str] = mapped_column(String(255), nullable=True)
     segment_type: Mapped[str] = mapped_column(String(255), nullable=True)
     promotion_type: Mapped[str] = mapped_column(String(255), nullable=True)
     bonus_mechanism: Mapped[str] = mapped_column(String(255), nullable=True)
-    current_price: Mapped[float] = mapped_column(Float, nullable=True)
     bonus_period_description: Mapped[str] = mapped_column(String(255), nullable=True)
     bonus_segment_id: Mapped[str] = mapped_column(String(255), nullable=True)
     bonus_segment_description: Mapped[str] = mapped_column(String(255), nullable=True)
@@ -246,10 +212,61 @@ class DbPreviousProduct(Base):
     stickers: Mapped[JSONB] = mapped_column(JSONB, nullable=True)
     order_availability_description: Mapped[str] = mapped_column(String(255), nullable=True)
 
-    potential_products: Mapped[list["DbPotentialProduct"]] = relationship(
-        "DbPotentialProduct", back_populates="previous_product_relation"
+    product_relation: Mapped[DbAHProduct] = relationship(
+        "DbAHProduct", back_populates="details"
+    )
+
+
+_AH_PRODUCT_COLUMNS = frozenset(
+    column.name for column in DbAHProduct.__table__.columns if column.name != "id"
+)
+_AH_PRODUCT_DETAIL_COLUMNS = frozenset(
+    column.name for column in DbAHProductDetails.__table__.columns if column.name != "product"
+)
+
+
+class DbPreviouslyBought(Base):
+    """PreviouslyBought model. Marks the catalog products that have been bought with the account.
+
+    Attributes:
+        id (int): PreviouslyBought id
+        product (int): AHProduct id
+        date_added (datetime): When the product first appeared in the previously bought products
+        last_seen (datetime): When the product last appeared in the previously bought products
+    """
+
+    __tablename__ = "previously_bought"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    product: Mapped[int] = mapped_column(Integer, ForeignKey("ah_products.id"), nullable=False, unique=True)
+    date_added: Mapped[dt.datetime] = mapped_column(DateTime(timezone=True), nullable=True)
+    last_seen: Mapped[dt.datetime] = mapped_column(DateTime(timezone=True), nullable=True)
+
+    product_relation: Mapped[DbAHProduct] = relationship(
+        "DbAHProduct", back_populates="previously_bought_relation"
     )
 
+
+class DbPriceHistory(Base):
+    """PriceHistory model. Stores the price of a catalog product over time.
+
+    Attributes:
+        id (int): PriceHistory id
+        webshop_id (str): Product webshop id
+        valid_from (datetime): Start of the period in which the price was valid
+        valid_to (datetime): End of the period in which the price was valid (None if still valid)
+        price (float): Product price before bonus
+        bonus_price (float): Product price during bonus (None if there was no bonus)
+    """
+
+    __tablename__ = "price_history"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    webshop_id: Mapped[str] = mapped_column(String(255), nullable=False)
+    valid_from: Mapped[dt.datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    valid_to: Mapped[dt.datetime] = mapped_column(DateTime(timezone=True), nullable=True)
+    price: Mapped[float] = mapped_column(Float, nullable=True)
+    bonus_price: Mapped[float] = mapped_column(Float, nullable=True)
+
+
 class DbProduct(Base):
     """Product model
 
@@ -282,7 +299,7 @@ class DbProduct(Base):
     receipt_relation: Mapped[DbReceipt] = relationship(
         "DbReceipt", back_populates="products"
     )
-    potential_product_relation: Mapped["DbPotentialProduct"] = relationship(
+    potential_product_relation: Mapped[list["DbPotentialProduct"]] = relationship(
         "DbPotentialProduct", back_populates="product_relation"
     )
 
@@ -293,14 +310,12 @@ class DbPotentialProduct(Base):
     Attributes:
         id (int): PotentialProduct id
         product (int): Product id
-        potential_ah_product (int): Potential AHProduct id
-        potential_previous_product (int): Potential PreviousProduct id"""
+        potential_ah_product (int): Potential AHProduct id"""
 
     __tablename__ = "potential_products"
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     product: Mapped[int] = mapped_column(Integer, ForeignKey("products.id"), nullable=False)
-    potential_ah_product: Mapped[int] = mapped_column(Integer, ForeignKey("ah_products.id"), nullable=True)
-    potential_previous_product: Mapped[int] = mapped_column(Integer, ForeignKey("previous_products.id"), nullable=True)
+    potential_ah_product: Mapped[int] = mapped_column(Integer, ForeignKey("ah_products.id"), nullable=False)
 
     product_relation: Mapped[DbProduct] = relationship(
         "DbProduct", back_populates="potential_product_relation"
@@ -308,9 +323,6 @@ class DbPotentialProduct(Base):
     ah_product_relation: Mapped[DbAHProduct] = relationship(
         "DbAHProduct", back_populates="potential_products"
     )
-    previous_product_relation: Mapped[DbPreviousProduct] = relationship(
-        "DbPreviousProduct", back_populates="potential_products"
-    )
 
 class DbDiscount(Base):
     """Discount model
@@ -383,7 +395,7 @@ class DbLocation(Base):
     city: Mapped[str] = mapped_column(String(255))
     postal_code: Mapped[str] = mapped_column(String(255))
 
-    receipt_relation: Mapped[DbReceipt] = relationship(
+    receipt_relation: Mapped[list[DbReceipt]] = relationship(
         "DbReceipt", back_populates="location_relation"
     )
 
@@ -395,12 +407,16 @@ class DbCategoryProduct(Base):
         id (int): CategoryProduct id
         taxonomy_id (str): Category taxonomy id
         product_id (str): Product id (webshop id)
+        updated_at (datetime): When the category was assigned to the product
     """
 
     __tablename__ = "categories_products"
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     taxonomy_id: Mapped[str] = mapped_column(String(255), ForeignKey("categories.taxonomy_id"))
     product_id: Mapped[str] = mapped_column(String(255))
+    updated_at: Mapped[dt.datetime] = mapped_column(
+        DateTime(timezone=True), nullable=False, server_default=func.now()
+    )
 
     category: Mapped[DbCategory] = relationship(
         "DbCategory", back_populates="category_product_relation"
@@ -427,3 +443,168 @@ class DbCategoryHierarchy(Base):
     child_category: Mapped[DbCategory] = relationship(
         "DbCategory", back_populates="category_hierarchy_child_relation", foreign_keys=[child]
     )
+
+
+class DbCategoryClosure(Base):
+    """CategoryClosure model. Contains every (ancestor, descendant) pair of the category hierarchy,
+    including every category with itself at depth 0.
+
+    Attributes:
+        ancestor (str): Ancestor category taxonomy id
+        descendant (str): Descendant category taxonomy id
+        depth (int): Number of hierarchy levels between the ancestor and the descendant
+    """
+
+    __tablename__ = "categories_closure"
+    ancestor: Mapped[str] = mapped_column(String(255), ForeignKey("categories.taxonomy_id"), primary_key=True)
+    descendant: Mapped[str] = mapped_column(String(255), ForeignKey("categories.taxonomy_id"), primary_key=True)
+    depth: Mapped[int] = mapped_column(Integer, nullable=False)
+
+
+class DbSchemaMigration(Base):
+    """SchemaMigration model. Records which versioned migrations have been applied.
+
+    Attributes:
+        version (int): Migration version
+        description (str): Migration description
+        applied_at (datetime): When the migration was applied
+        duration (float): How long the migration took in seconds
+    """
+
+    __tablename__ = "schema_migrations"
+    version: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    description: Mapped[str] = mapped_column(String(255), nullable=False)
+    applied_at: Mapped[dt.datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    duration: Mapped[float] = mapped_column(Float, nullable=True)
+
+
+class DbMigrationCheckpoint(Base):
+    """MigrationCheckpoint model. Tracks the progress of the legacy SQLite migration per table.
+
+    Attributes:
+        table_name (str): Name of the migrated table
+        last_id (int): Highest id that has been migrated
+        rows (int): Number of migrated rows
+        completed (bool): Whether the table has been migrated completely
+        updated_at (datetime): When the checkpoint was last written
+    """
+
+    __tablename__ = "legacy_migration_checkpoints"
+    table_name: Mapped[str] = mapped_column(String(255), primary_key=True)
+    last_id: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    rows: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    completed: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False)
+    updated_at: Mapped[dt.datetime] = mapped_column(DateTime(timezone=True), nullable=True)
+
+
+class DbResolutionQueue(Base):
+    """ResolutionQueue model. Products that were not found in the database during ingestion and
+    still have to be searched in the AH API.
+
+    Attributes:
+        id (int): ResolutionQueue id
+        product (int): Product id
+        description (str): Product description, used to search the AH API once per description
+        attempts (int): Number of failed attempts to resolve the product
+        last_error (str): The error of the last failed attempt
+        enqueued_at (datetime): When the product was queued
+        available_at (datetime): When the product may be resolved next
+    """
+
+    __tablename__ = "resolution_queue"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    product: Mapped[int] = mapped_column(
+        Integer, ForeignKey("products.id", ondelete="CASCADE"), nullable=False, unique=True
+    )
+    description: Mapped[str] = mapped_column(String(255), nullable=True)
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    last_error: Mapped[str] = mapped_column(String(1024), nullable=True)
+    enqueued_at: Mapped[dt.datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    available_at: Mapped[dt.datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+
+
+class DbReceiptArchive(Base):
+    """ReceiptArchive model. The raw API payloads of a receipt, so receipts can be reprocessed
+    without fetching them again. The payloads are zlib-compressed JSON.
+
+    Attributes:
+        transaction_id (str): Transaction id
+        datetime (datetime): Receipt datetime
+        summary (bytes): The receipt as returned by the receipts endpoint
+        details (bytes): The response of the receipt details endpoint as it was received.
+            Receipts archived before hold only its receiptUiItems.
+        archived_at (datetime): When the receipt was archived
+    """
+
+    __tablename__ = "receipt_archive"
+    transaction_id: Mapped[str] = mapped_column(String(255), primary_key=True)
+    datetime: Mapped[dt.datetime] = mapped_column(DateTime(timezone=True), nullable=True)
+    summary: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    details: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    archived_at: Mapped[dt.datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+
+
+class DbDailyCategorySpend(Base):
+    """DailyCategorySpend model. Rollup of the spend per category per day, every category including
+    the products of its subcategories. Maintained by database/rollups.py.
+
+    Attributes:
+        day (date): The day of the receipts, in the rollup timezone
+        taxonomy_id (str): Category taxonomy id
+        total (float): Sum of the total price of the products
+        lines (int): Number of products
+        receipts (int): Number of receipts with products in the category
+    """
+
+    __tablename__ = "rollup_daily_category"
+    day: Mapped[dt.date] = mapped_column(Date, primary_key=True)
+    taxonomy_id: Mapped[str] = mapped_column(String(255), primary_key=True)
+    total: Mapped[float] = mapped_column(Float, nullable=False)
+    lines: Mapped[int] = mapped_column(Integer, nullable=False)
+    receipts: Mapped[int] = mapped_column(Integer, nullable=False)
+
+
+class DbDailyStoreSpend(Base):
+    """DailyStoreSpend model. Rollup of the receipts per store per day. Maintained by
+    database/rollups.py.
+
+    Attributes:
+        day (date): The day of the receipts, in the rollup timezone
+        location (int): Location id, 0 for receipts without a location
+        total (float): Sum of the total price of the receipts
+        discount (float): Sum of the total discount of the receipts
+        receipts (int): Number of receipts
+    """
+
+    __tablename__ = "rollup_daily_store"
+    day: Mapped[dt.date] = mapped_column(Date, primary_key=True)
+    location: Mapped[int] = mapped_column(Integer, primary_key=True)
+    total: Mapped[float] = mapped_column(Float, nullable=False)
+    discount: Mapped[float] = mapped_column(Float, nullable=False)
+    receipts: Mapped[int] = mapped_column(Integer, nullable=False)
+
+
+class DbDailyProductSpend(Base):
+    """DailyProductSpend model. Rollup of the matched products per day. Maintained by
+    database/rollups.py.
+
+    Attributes:
+        day (date): The day of the receipts, in the rollup timezone
+        product_id (str): Product id (webshop id)
+        name (str): Product name
+        total (float): Sum of the total price of the products
+        lines (int): Number of products
+        quantity (float): Sum of the quantities
+        price_sum (float): Sum of the prices, for the average price
+        last_purchase (datetime): Datetime of the last receipt with the product on the day
+    """
+
+    __tablename__ = "rollup_daily_product"
+    day: Mapped[dt.date] = mapped_column(Date, primary_key=True)
+    product_id: Mapped[str] = mapped_column(String(255), primary_key=True)
+    name: Mapped[str] = mapped_column(String(255), nullable=True)
+    total: Mapped[float] = mapped_column(Float, nullable=False)
+    lines: Mapped[int] = mapped_column(Integer, nullable=False)
+    quantity: Mapped[float] = mapped_column(Float, nullable=False)
+    price_sum: Mapped[float] = mapped_column(Float, nullable=False)
+    last_purchase: Mapped[dt.datetime] = mapped_column(DateTime(timezone=True), nullable=False)
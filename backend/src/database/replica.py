@@ -0,0 +1,337 @@
+from database.model import (
+    DbReceipt,
+    DbProduct,
+    DbDiscount,
+    DbLocation,
+    DbCategory,
+    DbCategoryProduct,
+)
+from config import Config
+from contextlib import contextmanager
+from sqlalchemy import select, func, or_, Integer, Float, String, Boolean, DateTime, Date
+from sqlalchemy.dialects.postgresql import JSONB
+import datetime as dt
+import os
+import time
+import logging
+
+try:
+    import duckdb
+    import pyarrow
+
+    # Not used directly, DuckDB needs it to return timestamps with a time zone to Python
+    import pytz  # noqa: F401
+except ImportError:
+    duckdb = None
+
+log = logging.getLogger(__name__)
+config = Config()
+
+# Rows that are read from Postgres and inserted into the replica at once
+REPLICA_CHUNK_SIZE = 50_000
+# Rows changed this long before the previous refresh are copied again. Changes of transactions
+# that were still running during that refresh were not visible to it, but are stamped earlier.
+CHANGE_OVERLAP = dt.timedelta(minutes=5)
+
+# Receipts and their lines are copied per changed receipt, with the column that refers to it
+RECEIPT_TABLES = [
+    (DbReceipt.__table__, DbReceipt.__table__.c.id),
+    (DbProduct.__table__, DbProduct.__table__.c.receipt),
+    (DbDiscount.__table__, DbDiscount.__table__.c.receipt),
+]
+# Copied by id and change timestamp
+CATALOG_TABLE = DbCategoryProduct.__table__
+# Small enough to be copied whole on every refresh
+DIMENSION_TABLES = [DbLocation.__table__, DbCategory.__table__]
+
+REPLICA_STATE_TABLE = """
+CREATE TABLE IF NOT EXISTS replica_state (
+    table_name VARCHAR,
+    last_id INTEGER,
+    synced_until TIMESTAMPTZ,
+    refreshed_at TIMESTAMPTZ
+)
+"""
+
+
+def _column_types(column) -> tuple:
+    """The DuckDB and Arrow types of a column"""
+    if isinstance(column.type, Integer):
+        return "INTEGER", pyarrow.int32()
+    if isinstance(column.type, Float):
+        return "DOUBLE", pyarrow.float64()
+    if isinstance(column.type, Boolean):
+        return "BOOLEAN", pyarrow.bool_()
+    if isinstance(column.type, DateTime):
+        return "TIMESTAMPTZ", pyarrow.timestamp("us", tz="UTC")
+    if isinstance(column.type, Date):
+        return "DATE", pyarrow.date32()
+    if isinstance(column.type, String):
+        return "VARCHAR", pyarrow.string()
+    raise TypeError(f"Column {column} of type {column.type} can not be replicated")
+
+
+def _columns(table) -> list:
+    # JSON columns are presentation data, not analyzed
+    return [column for column in table.columns if not isinstance(column.type, JSONB)]
+
+
+class AnalyticsReplica:
+    """Columnar copy of the receipts, their lines and the categories of products in an embedded
+    DuckDB file, for analysis that should not compete with ingestion on Postgres. It is refreshed
+    incrementally: receipts by their id and the time they were last changed, category products by
+    their id and the time they were assigned. Needs duckdb, pyarrow and pytz.
+
+    DuckDB allows either one process that writes or any number of readers, so readers should
+    close the file soon. A refresh fails while it is opened elsewhere, and is simply run again.
+
+    Attributes:
+        path (str): The path of the DuckDB file, the replica is disabled without one
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def _require(self):
+        if duckdb is None:
+            raise RuntimeError(
+                "The analytics replica needs duckdb, pyarrow and pytz, install them with "
+                "pip install duckdb pyarrow pytz"
+            )
+        if not self.enabled:
+            raise RuntimeError("Set replica_path in the config to use the analytics replica")
+
+    @contextmanager
+    def connect(self):
+        """Opens the replica read only, for notebooks and API endpoints
+
+        Yields:
+            DuckDBPyConnection: The connection, closed on exit"""
+        self._require()
+        connection = duckdb.connect(self.path, read_only=True)
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    def query(self, sql: str, params: list = None) -> list[dict]:
+        """Runs a query on the replica
+
+        Args:
+            sql (str): The query, with ? or $name placeholders
+            params (list | dict, optional): The parameters of the query. Defaults to None.
+
+        Returns:
+            list[dict]: The rows by column name"""
+        with self.connect() as connection:
+            result = connection.execute(sql, params or [])
+            names = [description[0] for description in result.description]
+            return [dict(zip(names, row)) for row in result.fetchall()]
+
+    def refresh(self, engine, full: bool = False) -> dict:
+        """Copies the changes since the previous refresh from Postgres. All tables are read from
+        a single snapshot of Postgres and written in a single transaction, so the replica is
+        always consistent, and unchanged if the refresh fails.
+
+        Args:
+            engine (Engine): The Postgres engine
+            full (bool, optional): Copy everything again instead of the changes. Defaults to False.
+
+        Returns:
+            dict: The rows copied per table, the lag of the replica before the refresh and the
+                duration of the refresh"""
+        self._require()
+        start = time.perf_counter()
+        with engine.connect() as source, duckdb.connect(self.path) as replica:
+            source = source.execution_options(isolation_level="REPEATABLE READ")
+            with source.begin():
+                snapshot = source.execute(select(func.now())).scalar_one()
+                replica.begin()
+                try:
+                    self._create_tables(replica, full)
+                    state = self._read_state(replica)
+                    copied = {}
+                    previous = state.get(DbReceipt.__tablename__)
+                    copied.update(self._copy_receipts(source, replica, previous))
+                    copied[CATALOG_TABLE.name] = self._copy_catalog(
+                        source, replica, state.get(CATALOG_TABLE.name)
+                    )
+                    for table in DIMENSION_TABLES:
+                        replica.execute(f"DELETE FROM {table.name}")
+                        copied[table.name] = self._copy(
+                            source, replica, table, select(*_columns(table))
+                        )
+                    self._write_state(replica, source, snapshot)
+                    replica.commit()
+                except Exception:
+                    replica.rollback()
+                    raise
+        report = {
+            "tables": copied,
+            "lag": snapshot - previous[1] if previous else None,
+            "duration": time.perf_counter() - start,
+        }
+        log.info(
+            f"Refreshed the analytics replica in {report['duration']:.2f}s, copied "
+            + ", ".join(f"{rows} {table}" for table, rows in copied.items())
+        )
+        return report
+
+    def status(self, engine) -> list[dict]:
+        """Reports how far the replica is behind Postgres, without changing it
+
+        Args:
+            engine (Engine): The Postgres engine
+
+        Returns:
+            list[dict]: Per incrementally copied table, until when it was synced, the lag and the
+                number of rows changed since"""
+        self._require()
+        state = {}
+        if os.path.exists(self.path):
+            with self.connect() as replica:
+                exists = replica.execute(
+                    "SELECT count(*) FROM information_schema.tables "
+                    "WHERE table_name = 'replica_state'"
+                ).fetchone()[0]
+                if exists:
+                    state = self._read_state(replica)
+        rows = []
+        with engine.connect() as source:
+            now = source.execute(select(func.now())).scalar_one()
+            for table in (DbReceipt.__table__, CATALOG_TABLE):
+                last_id, synced_until = state.get(table.name, (None, None))
+                pending = select(func.count()).select_from(table)
+                if last_id is not None:
+                    pending = pending.where(
+                        or_(table.c.id > last_id, table.c.updated_at >= synced_until)
+                    )
+                rows.append(
+                    {
+                        "table": table.name,
+                        "synced_until": synced_until,
+                        "lag": now - synced_until if synced_until else None,
+                        "pending": source.execute(pending).scalar_one(),
+                    }
+                )
+        return rows
+
+    def _create_tables(self, replica, full: bool):
+        tables = [table for table, _ in RECEIPT_TABLES] + [CATALOG_TABLE] + DIMENSION_TABLES
+        if full:
+            replica.execute("DROP TABLE IF EXISTS replica_state")
+        replica.execute(REPLICA_STATE_TABLE)
+        for table in tables:
+            if full:
+                replica.execute(f"DROP TABLE IF EXISTS {table.name}")
+            columns = ", ".join(
+                f"{column.name} {_column_types(column)[0]}" for column in _columns(table)
+            )
+            replica.execute(f"CREATE TABLE IF NOT EXISTS {table.name} ({columns})")
+
+    def _read_state(self, replica) -> dict:
+        return {
+            table_name: (last_id, synced_until)
+            for table_name, last_id, synced_until in replica.execute(
+                "SELECT table_name, last_id, synced_until FROM replica_state"
+            ).fetchall()
+        }
+
+    def _write_state(self, replica, source, snapshot: dt.datetime):
+        replica.execute("DELETE FROM replica_state")
+        for table in (DbReceipt.__table__, CATALOG_TABLE):
+            last_id = source.execute(select(func.max(table.c.id))).scalar()
+            replica.execute(
+                "INSERT INTO replica_state VALUES (?, ?, ?, ?)",
+                [table.name, last_id, snapshot, dt.datetime.now(dt.timezone.utc)],
+            )
+
+    def _changed(self, table, previous: tuple):
+        """The ids of the rows of table that are new or changed since the previous refresh, all
+        rows on the first refresh"""
+        changed = select(table.c.id)
+        if previous is not None:
+            last_id, synced_until = previous
+            changed = changed.where(
+                or_(
+                    table.c.id > (last_id or 0),
+                    table.c.updated_at >= synced_until - CHANGE_OVERLAP,
+                )
+            )
+        return changed
+
+    def _delete(self, replica, source, changed, deletes: list[tuple]):
+        """Deletes the rows of the changed ids from the replica, to be copied again"""
+        ids = source.execute(changed).scalars().all()
+        if not ids:
+            return
+        changed_ids = pyarrow.table({"id": pyarrow.array(ids, type=pyarrow.int32())})
+        replica.register("changed_ids_arrow", changed_ids)
+        replica.execute(
+            "CREATE OR REPLACE TEMPORARY TABLE changed_ids AS SELECT id FROM changed_ids_arrow"
+        )
+        replica.unregister("changed_ids_arrow")
+        for table_name, column_name in deletes:
+            replica.execute(
+                f"DELETE FROM {table_name} WHERE {column_name} IN (SELECT id FROM changed_ids)"
+            )
+
+    def _copy_receipts(self, source, replica, previous: tuple) -> dict:
+        changed = self._changed(DbReceipt.__table__, previous)
+        if previous is not None:
+            self._delete(
+                replica,
+                source,
+                changed,
+                [(table.name, receipt_column.name) for table, receipt_column in RECEIPT_TABLES],
+            )
+        copied = {}
+        for table, receipt_column in RECEIPT_TABLES:
+            query = select(*_columns(table))
+            if previous is not None:
+                query = query.where(receipt_column.in_(changed.scalar_subquery()))
+            copied[table.name] = self._copy(source, replica, table, query)
+        return copied
+
+    def _copy_catalog(self, source, replica, previous: tuple) -> int:
+        changed = self._changed(CATALOG_TABLE, previous)
+        query = select(*_columns(CATALOG_TABLE))
+        if previous is not None:
+            self._delete(replica, source, changed, [(CATALOG_TABLE.name, "id")])
+            query = query.where(CATALOG_TABLE.c.id.in_(changed.scalar_subquery()))
+        copied = self._copy(source, replica, CATALOG_TABLE, query)
+        # Rows are only deleted by hand, which the change timestamps do not show
+        expected = source.execute(select(func.count()).select_from(CATALOG_TABLE)).scalar_one()
+        if replica.execute(f"SELECT count(*) FROM {CATALOG_TABLE.name}").fetchone()[0] != expected:
+            log.info(f"Copying {CATALOG_TABLE.name} whole, rows were deleted")
+            replica.execute(f"DELETE FROM {CATALOG_TABLE.name}")
+            copied = self._copy(source, replica, CATALOG_TABLE, select(*_columns(CATALOG_TABLE)))
+        return copied
+
+    def _copy(self, source, replica, table, query) -> int:
+        """Streams the rows of a query into a table of the replica, a chunk at a time"""
+        columns = _columns(table)
+        schema = pyarrow.schema([(column.name, _column_types(column)[1]) for column in columns])
+        result = source.execution_options(yield_per=REPLICA_CHUNK_SIZE).execute(query)
+        copied = 0
+        try:
+            for rows in result.partitions(REPLICA_CHUNK_SIZE):
+                chunk = pyarrow.Table.from_arrays(
+                    [
+                        pyarrow.array(values, type=field.type)
+                        for values, field in zip(zip(*rows), schema)
+                    ],
+                    schema=schema,
+                )
+                replica.from_arrow(chunk).insert_into(table.name)
+                copied += len(rows)
+        finally:
+            result.close()
+        return copied
+
+
+analytics_replica = AnalyticsReplica(config.get("replica_path", default=None))
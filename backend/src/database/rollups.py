@@ -0,0 +1,219 @@
+from database.model import (
+    DbReceipt,
+    DbProduct,
+    DbCategoryProduct,
+    DbDailyCategorySpend,
+    DbDailyStoreSpend,
+    DbDailyProductSpend,
+)
+from config import Config
+from sqlalchemy import select, insert, func, cast, bindparam, or_, and_, Date, Float
+from zoneinfo import ZoneInfo
+import datetime as dt
+import logging
+
+log = logging.getLogger(__name__)
+config = Config()
+
+# Receipts are assigned to the day on which they were made in this timezone
+ROLLUP_TIMEZONE = config.get("rollup_timezone", default="Europe/Amsterdam")
+# Differences between stored and recomputed sums below this are rounding, not errors
+VERIFY_TOLERANCE = 1e-6
+
+
+def receipt_day():
+    """The day of a receipt in the rollup timezone, as a SQL expression"""
+    # Rendered as a literal, so the expression in GROUP BY is the same as in the select list
+    zone = bindparam("rollup_timezone", ROLLUP_TIMEZONE, literal_execute=True)
+    return cast(func.timezone(zone, DbReceipt.datetime), Date)
+
+
+def to_day(moment: dt.datetime) -> dt.date:
+    """Converts a moment to its day in the rollup timezone, naive moments are taken as is
+
+    Args:
+        moment (datetime): The moment
+
+    Returns:
+        date: The day of the moment"""
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(ZoneInfo(ROLLUP_TIMEZONE))
+    return moment.date()
+
+
+def _on_days(days: set[dt.date]):
+    # Ranges on the datetime column use the receipts index, the day expression would not
+    zone = ZoneInfo(ROLLUP_TIMEZONE)
+    ranges = []
+    for day in sorted(days):
+        start = dt.datetime.combine(day, dt.time(), zone)
+        end = dt.datetime.combine(day + dt.timedelta(days=1), dt.time(), zone)
+        ranges.append(and_(DbReceipt.datetime >= start, DbReceipt.datetime < end))
+    return or_(*ranges)
+
+
+def _category_rollup():
+    day = receipt_day()
+    return (
+        select(
+            day.label("day"),
+            DbCategoryProduct.taxonomy_id.label("taxonomy_id"),
+            func.coalesce(func.sum(DbProduct.total_price), 0.0).label("total"),
+            func.count(DbProduct.id).label("lines"),
+            func.count(func.distinct(DbReceipt.id)).label("receipts"),
+        )
+        .select_from(DbProduct)
+        .join(DbReceipt, DbReceipt.id == DbProduct.receipt)
+        .join(DbCategoryProduct, DbCategoryProduct.product_id == DbProduct.product_id)
+        .group_by(day, DbCategoryProduct.taxonomy_id)
+    )
+
+
+def _store_rollup():
+    day = receipt_day()
+    return select(
+        day.label("day"),
+        func.coalesce(DbReceipt.location, 0).label("location"),
+        func.coalesce(func.sum(DbReceipt.total_price), 0.0).label("total"),
+        func.coalesce(func.sum(DbReceipt.total_discount), 0.0).label("discount"),
+        func.count(DbReceipt.id).label("receipts"),
+    ).group_by(day, DbReceipt.location)
+
+
+def _product_rollup():
+    day = receipt_day()
+    return (
+        select(
+            day.label("day"),
+            DbProduct.product_id.label("product_id"),
+            func.max(DbProduct.name).label("name"),
+            func.coalesce(func.sum(DbProduct.total_price), 0.0).label("total"),
+            func.count(DbProduct.id).label("lines"),
+            cast(func.coalesce(func.sum(DbProduct.quantity), 0), Float).label("quantity"),
+            func.coalesce(func.sum(DbProduct.price), 0.0).label("price_sum"),
+            func.max(DbReceipt.datetime).label("last_purchase"),
+        )
+        .select_from(DbProduct)
+        .join(DbReceipt, DbReceipt.id == DbProduct.receipt)
+        .where(DbProduct.product_id.is_not(None))
+        .group_by(day, DbProduct.product_id)
+    )
+
+
+# The rollup tables with the queries that compute them, the columns are in the order of the table
+ROLLUPS = [
+    (DbDailyCategorySpend, _category_rollup),
+    (DbDailyStoreSpend, _store_rollup),
+    (DbDailyProductSpend, _product_rollup),
+]
+
+
+def days_of_receipts(connection, receipt_ids: list[int]) -> set[dt.date]:
+    """Gets the days of receipts in the rollup timezone
+
+    Args:
+        connection (Session | Connection): The database session or connection
+        receipt_ids (list[int]): The IDs of the receipts
+
+    Returns:
+        set[date]: The days of the receipts"""
+    if not receipt_ids:
+        return set()
+    return set(
+        connection.execute(
+            select(receipt_day()).where(DbReceipt.id.in_(set(receipt_ids))).distinct()
+        ).scalars()
+    )
+
+
+def days_of_products(connection, product_ids: list[str]) -> set[dt.date]:
+    """Gets the days of the receipts with lines of catalog products in the rollup timezone
+
+    Args:
+        connection (Session | Connection): The database session or connection
+        product_ids (list[str]): The catalog product IDs
+
+    Returns:
+        set[date]: The days of the receipts"""
+    if not product_ids:
+        return set()
+    return set(
+        connection.execute(
+            select(receipt_day())
+            .select_from(DbProduct)
+            .join(DbReceipt, DbReceipt.id == DbProduct.receipt)
+            .where(DbProduct.product_id.in_(set(product_ids)))
+            .distinct()
+        ).scalars()
+    )
+
+
+def refresh_rollups(connection, days: set[dt.date] = None) -> int:
+    """Recomputes the rollup rows of the given days from the receipts, without committing. Days
+    are recomputed as a whole, so this is correct for any change to the receipts of a day.
+
+    Args:
+        connection (Session | Connection): The database session or connection
+        days (set[date], optional): The days to recompute. Defaults to recomputing every day.
+
+    Returns:
+        int: The number of rollup rows written"""
+    if days is not None and not days:
+        return 0
+    written = 0
+    for model, rollup in ROLLUPS:
+        table = model.__table__
+        query = rollup()
+        delete = table.delete()
+        if days is not None:
+            query = query.where(_on_days(days))
+            delete = delete.where(table.c.day.in_(days))
+        connection.execute(delete)
+        # SQLAlchemy only keeps the row count of INSERT statements when asked to
+        result = connection.execute(
+            insert(table)
+            .from_select([column.name for column in table.columns], query)
+            .execution_options(preserve_rowcount=True)
+        )
+        written += result.rowcount
+    return written
+
+
+def verify_rollups(connection) -> list[dict]:
+    """Recomputes every rollup from scratch and compares it with the stored rows.
+
+    Args:
+        connection (Session | Connection): The database session or connection
+
+    Returns:
+        list[dict]: Per rollup table the number of stored rows, the recomputed rows that are
+            missing, the stored rows that should not exist and the rows with different values"""
+    report = []
+    for model, rollup in ROLLUPS:
+        table = model.__table__
+        fresh = rollup().subquery("fresh")
+        keys = [column.name for column in table.primary_key.columns]
+        values = [column.name for column in table.columns if not column.primary_key]
+        joined = table.outerjoin(
+            fresh, and_(*(table.c[key] == fresh.c[key] for key in keys)), full=True
+        )
+        stored_missing = table.c[keys[0]].is_(None)
+        fresh_missing = fresh.c[keys[0]].is_(None)
+        differences = [
+            func.abs(table.c[value] - fresh.c[value]) > VERIFY_TOLERANCE
+            if isinstance(table.c[value].type, Float)
+            else table.c[value].is_distinct_from(fresh.c[value])
+            for value in values
+        ]
+        row = connection.execute(
+            select(
+                func.count().filter(~stored_missing).label("rows"),
+                func.count().filter(stored_missing).label("missing"),
+                func.count().filter(fresh_missing).label("extra"),
+                func.count()
+                .filter(~stored_missing, ~fresh_missing, or_(*differences))
+                .label("different"),
+            ).select_from(joined)
+        ).one()
+        report.append({"rollup": table.name, **row._asdict()})
+    return report
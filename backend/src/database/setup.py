@@ -1,15 +1,28 @@
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine
 from config import Config
 from database.model import Base
+from database.migrations import migrate
+import os
 import time
 
 
 config = Config()
-engine = create_engine(
-    f"postgresql+psycopg://{config.get('database')['username']}:{config.get('database')['password']}@{config.get('database')['host']}/{config.get('database')['database_name']}",
-    pool_size=20,
-    max_overflow=10,
-)
+database_url = f"postgresql+psycopg://{config.get('database')['username']}:{config.get('database')['password']}@{config.get('database')['host']}/{config.get('database')['database_name']}"
+pool_settings = {
+    # The API server sizes the pool to its threads per worker, see gunicorn.conf.py
+    "pool_size": int(
+        os.environ.get("DATABASE_POOL_SIZE", config.get("database", "pool_size", default=20))
+    ),
+    "max_overflow": int(
+        os.environ.get("DATABASE_MAX_OVERFLOW", config.get("database", "max_overflow", default=10))
+    ),
+    "pool_timeout": int(config.get("database", "pool_timeout", default=30)),
+}
+engine = create_engine(database_url, **pool_settings)
+# Used by the async API in asgi.py, psycopg runs on asyncio with the same URL. Connections are
+# only opened when it is used.
+async_engine = create_async_engine(database_url, **pool_settings)
 
 attempts = 0
 while attempts < 5:
@@ -20,16 +33,4 @@ while attempts < 5:
         attempts += 1
         time.sleep(5)
 
-
-sql_setup_statements = [
-    "CREATE EXTENSION IF NOT EXISTS pg_trgm;",
-    "CREATE INDEX IF NOT EXISTS previous_products_sub_category_gin_index ON previous_products USING gin(sub_category gin_trgm_ops);",
-    "CREATE INDEX IF NOT EXISTS previous_products_title_gin_index ON previous_products USING gin(title gin_trgm_ops);",
-    "CREATE INDEX IF NOT EXISTS ah_products_sub_category_gin_index ON ah_products USING gin(sub_category gin_trgm_ops);",
-    "CREATE INDEX IF NOT EXISTS ah_products_title_gin_index ON ah_products USING gin(title gin_trgm_ops);",
-]
-
-with engine.connect() as connection:
-    for statement in sql_setup_statements:
-        connection.execute(text(statement))
-    connection.commit()
+migrate(engine)
@@ -0,0 +1,50 @@
+"""Settings for serving app.py with gunicorn, read from the config file.
+
+Every worker is a process with its own connection pool and serves web_threads requests at once.
+A request holds at most one connection at a time, so the pool of a worker is sized to its
+threads. The database has to accept web_workers * (web_threads + overflow) connections, plus
+the ones of main.py and manage.py.
+
+Usage, from the src directory: gunicorn app:app
+"""
+import multiprocessing
+import os
+import subprocess
+import sys
+
+from config import Config
+
+# Not named config, which gunicorn reads as the path of its own config file
+app_config = Config()
+
+bind = app_config.get("web_bind", default="0.0.0.0:5000")
+worker_class = "gthread"
+workers = int(app_config.get("web_workers", default=min(multiprocessing.cpu_count(), 4)))
+threads = int(app_config.get("web_threads", default=8))
+timeout = 60
+keepalive = 5
+# Recycle workers now and then, spread out so they do not restart at once
+max_requests = 10000
+max_requests_jitter = 1000
+
+POOL_OVERFLOW = max(2, threads // 4)
+
+
+def on_starting(server):
+    # Sync once before the workers start, in a separate process so the server itself never
+    # opens database connections that the forked workers would inherit
+    server.log.info("Syncing receipts")
+    result = subprocess.run([sys.executable, "main.py"])
+    if result.returncode != 0:
+        server.log.error(f"Syncing receipts failed with exit code {result.returncode}")
+    server.log.info(
+        f"Serving with {workers} workers of {threads} threads, at most "
+        f"{workers * (threads + POOL_OVERFLOW)} database connections"
+    )
+
+
+def post_fork(server, worker):
+    # Runs in the worker before the app is imported, so the engine is created with these
+    os.environ["DATABASE_POOL_SIZE"] = str(threads)
+    os.environ["DATABASE_MAX_OVERFLOW"] = str(POOL_OVERFLOW)
+    os.environ["GROCITRACK_SYNC_ON_START"] = "0"
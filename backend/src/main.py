@@ -2,6 +2,11 @@ import logging
 import os
 
 from database.DbHandler import DbHandler
+from database.cache import reference_cache
+from database.generation import data_generation
+from database.replica import analytics_replica
+from database.bootstrap import has_snapshot, load_snapshot
+from database.setup import engine
 from ah_api import fetch_receipts
 from config import Config
 from classes.Receipt import Receipt
@@ -16,22 +21,29 @@ logging.basicConfig(
 log = logging.getLogger(__name__)
 config = Config()
 
+SNAPSHOT_DIRECTORY = "database/snapshot"
+
 
 def main():
     log.info("Connecting to database")
     db_handler = DbHandler()
     log.info("Connected to database.")
 
-    if not db_handler.get_ah_produts():
-        if os.path.exists("database/ah_products.sql"):
-            log.info("Creating products table from SQL file")
-            db_handler.execute_sql_file("database/ah_products.sql")
-            log.info("Created products table from SQL file")
-        else:
-            log.info("Fetching all products from AH API")
-            all_ah_products = fetch_products()
-            db_handler.add_ah_products(all_ah_products)
-            log.info("Fetched products from AH API")
+    if has_snapshot(SNAPSHOT_DIRECTORY) and not db_handler.has_ah_products():
+        log.info("Loading products and categories from snapshot")
+        load_snapshot(engine, SNAPSHOT_DIRECTORY)
+        reference_cache.invalidate()
+
+    if not db_handler.has_ah_products():
+        # Dumps of the ah_products table from before the catalog was split no longer fit
+        log.info("Fetching all products from AH API")
+        all_ah_products = fetch_products()
+        db_handler.add_ah_products(all_ah_products)
+        log.info("Fetched products from AH API")
+
+    if not db_handler.has_price_history():
+        log.info("Recording initial price history from products table")
+        db_handler.record_prices(db_handler.get_ah_produts())
 
     if not db_handler.get_categories():
         if os.path.exists("database/categories.sql"):
@@ -40,6 +52,10 @@ def main():
             db_handler.execute_sql_file("database/categories_hierarchy.sql")
             log.info("Created categories table from SQL file")
 
+    if not db_handler.has_category_closure():
+        log.info("Computing category ancestry")
+        db_handler.refresh_category_closure()
+
     log.info("Fetching previously bought products")
     previous_products = fetch_previous_bought()
     db_handler.add_prev_products(previous_products)
@@ -53,31 +69,45 @@ def main():
     ]
     log.info(f"Found {len(receipts)} new receipts.")
     receipts_processed = 0
-    for receipt in receipts:
-        log.info(f"Processing receipt {receipt.transaction_id} from {receipt.datetime}")
-        receipt.set_details()
-        if receipt.is_empty():
-            log.debug(f"Receipt {receipt.transaction_id} is empty.")
+    receipts_stored = 0
+    try:
+        for receipt in receipts:
+            log.info(f"Processing receipt {receipt.transaction_id} from {receipt.datetime}")
+            # Archived before the details are decoded, so they are kept even if decoding fails
+            db_handler.archive_receipt(receipt)
+            receipt.set_details()
+            receipt.release_payloads()
             dbLocation = db_handler.find_location(receipt.location.name)
             if not dbLocation:
                 dbLocation = db_handler.add_location(receipt.location)
-            db_handler.add_receipt(receipt, dbLocation.id)
-            continue
-        location = receipt.location
-        dbLocation = db_handler.find_location(location.name)
-        if not dbLocation:
-            dbLocation = db_handler.add_location(location)
-        dbReceipt = db_handler.add_receipt(receipt, dbLocation.id)
-        log.debug(f"Adding products from receipt {receipt.transaction_id}")
-        db_handler.add_products(receipt.products, dbReceipt.id)
-        log.debug(f"Adding discounts from receipt {receipt.transaction_id}")
-        db_handler.add_discounts(receipt.discounts["discounts"], dbReceipt.id)
-        log.debug(f"Setting product categories for receipt {receipt.transaction_id}")
-        db_handler.set_categories_for_products(receipt.products)
-        receipts_processed += 1
-        log.info(f"Processed {receipts_processed}/{len(receipts)} receipts.")
-
-    db_handler.close()
+            # The receipt, its lines, queued lookups, categories and rollups are committed
+            # together, stored receipts are skipped on the next run, so a stored receipt must be
+            # complete
+            db_handler.store_receipt(receipt, dbLocation.id)
+            receipts_stored += 1
+            if receipt.is_empty():
+                log.debug(f"Receipt {receipt.transaction_id} is empty.")
+                continue
+            receipts_processed += 1
+            log.info(f"Processed {receipts_processed}/{len(receipts)} receipts.")
+    finally:
+        db_handler.close()
+        replica_changed = False
+        if analytics_replica.enabled:
+            # Also picks up the changes of reprocess and resolve-misses since the previous refresh
+            try:
+                copied = analytics_replica.refresh(engine)["tables"]
+                replica_changed = bool(copied["receipts"] or copied["categories_products"])
+            except Exception as e:
+                log.warning(
+                    f"Refreshing the analytics replica failed, retrying on the next run: {e}"
+                )
+        if receipts_stored or replica_changed:
+            # Makes the cached API responses and analytics stale in every process, also when a
+            # later receipt failed, the receipts before it are committed. Bumped after the
+            # refresh, so the price index reads the new receipts from the replica.
+            data_generation.bump()
+    log.info(f"Reference cache: {reference_cache.stats()}")
     log.info(
         f"Added {receipts_processed} new receipts to the database. {len(receipts) - receipts_processed} receipts were empty."
     )
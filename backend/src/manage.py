@@ -0,0 +1,309 @@
+import argparse
+import datetime as dt
+import logging
+import os
+
+from database.setup import engine
+from database.migrations import (
+    migrate,
+    migration_status,
+    index_usage_report,
+    duplicate_receipts,
+    remove_duplicate_receipts,
+)
+from database.bootstrap import export_snapshot, load_snapshot, SNAPSHOT_TABLES
+from database.rollups import verify_rollups, refresh_rollups
+from database.generation import data_generation
+
+logging.basicConfig(
+    format="%(asctime)s [%(levelname)s] %(module)s: %(message)s",
+    level=logging.INFO,
+    handlers=[logging.FileHandler("grocitrack.log"), logging.StreamHandler()],
+)
+log = logging.getLogger(__name__)
+
+
+def print_table(rows: list[dict]):
+    """Prints a list of dictionaries as an aligned table.
+
+    Args:
+        rows (list[dict]): The rows to print, all with the same keys."""
+    if not rows:
+        print("(no rows)")
+        return
+    columns = list(rows[0].keys())
+    widths = {
+        column: max(len(column), *(len(str(row[column])) for row in rows))
+        for column in columns
+    }
+    print("  ".join(column.ljust(widths[column]) for column in columns))
+    print("  ".join("-" * widths[column] for column in columns))
+    for row in rows:
+        print("  ".join(str(row[column]).ljust(widths[column]) for column in columns))
+
+
+def cmd_migrate(args):
+    applied = migrate(engine)
+    if applied:
+        log.info(f"Applied migrations {', '.join(map(str, applied))}")
+    else:
+        log.info("Schema is up to date")
+
+
+def cmd_migrations(args):
+    print_table(migration_status(engine))
+
+
+def cmd_index_usage(args):
+    rows = index_usage_report(engine)
+    if args.unused:
+        rows = [row for row in rows if row["scans"] == 0 and not row["is_unique"]]
+    print_table(rows)
+
+
+def cmd_snapshot_export(args):
+    manifest = export_snapshot(engine, args.directory, args.tables)
+    print_table(
+        [{"table": entry["table"], "rows": entry["rows"]} for entry in manifest["tables"]]
+    )
+
+
+def cmd_snapshot_load(args):
+    loaded = load_snapshot(engine, args.directory)
+    print_table([{"table": table, "rows": rows} for table, rows in loaded.items()])
+
+
+def cmd_migrate_legacy(args):
+    from migration import migrate_legacy
+
+    migrated = migrate_legacy(args.chunk_size, args.workers, args.restart)
+    print_table([{"table": table, "rows": rows} for table, rows in migrated.items()])
+
+
+def cmd_resolve_misses(args):
+    from resolve_misses import resolve_misses
+
+    if hasattr(os, "nice"):
+        # Stay out of the way of ingestion and the API
+        os.nice(10)
+    stats = resolve_misses(args.batch_size, args.max_batches)
+    print_table([stats])
+
+
+def cmd_reprocess(args):
+    from reprocess import reprocess
+
+    totals = reprocess(
+        args.since, args.until, args.not_found, args.workers, args.api, args.dry_run
+    )
+    print_table([totals])
+
+
+def cmd_archive_receipts(args):
+    from reprocess import archive_receipts
+
+    print_table([{"archived": archive_receipts()}])
+
+
+EXPORT_EXTENSIONS = {".ndjson": "ndjson", ".jsonl": "ndjson", ".csv": "csv", ".parquet": "parquet"}
+
+
+def cmd_export(args):
+    from database.export import export_rows, ndjson_chunks, csv_chunks, write_parquet
+
+    format = args.format or EXPORT_EXTENSIONS.get(os.path.splitext(args.path)[1].lower())
+    if format is None:
+        raise SystemExit(f"Pass --format, the format of {args.path} is not known by its extension")
+    with engine.connect() as connection:
+        chunks = export_rows(connection, args.since, args.until, args.chunk_size)
+        if format == "parquet":
+            rows = write_parquet(args.path, chunks)
+        else:
+            rows = 0
+            encode = ndjson_chunks if format == "ndjson" else csv_chunks
+
+            def counted():
+                nonlocal rows
+                for chunk in chunks:
+                    rows += len(chunk)
+                    yield chunk
+
+            with open(args.path, "wb") as f:
+                for data in encode(counted()):
+                    f.write(data)
+    print_table([{"path": args.path, "format": format, "rows": rows}])
+
+
+def cmd_replica_refresh(args):
+    from database.replica import analytics_replica
+
+    report = analytics_replica.refresh(engine, full=args.full)
+    if report["tables"]["receipts"] or report["tables"]["categories_products"]:
+        # The price index reads the replica
+        data_generation.bump()
+    print_table([{"table": table, "copied": rows} for table, rows in report["tables"].items()])
+    print(f"\nLag before the refresh: {report['lag']}, refreshed in {report['duration']:.2f}s")
+
+
+def cmd_replica_status(args):
+    from database.replica import analytics_replica
+
+    print_table(analytics_replica.status(engine))
+
+
+def cmd_verify_rollups(args):
+    with engine.begin() as connection:
+        report = verify_rollups(connection)
+        print_table(report)
+        broken = any(row["missing"] or row["extra"] or row["different"] for row in report)
+        if broken and args.fix:
+            written = refresh_rollups(connection)
+            log.info(f"Rebuilt the rollups with {written} rows")
+    if broken and args.fix:
+        data_generation.bump()
+    elif broken:
+        raise SystemExit(1)
+
+
+def cmd_dedupe_receipts(args):
+    with engine.begin() as connection:
+        print_table(duplicate_receipts(connection))
+        if args.dry_run:
+            return
+        removed = remove_duplicate_receipts(connection)
+    log.info(f"Removed {len(removed)} duplicate receipts")
+    if removed:
+        data_generation.bump()
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Grocitrack maintenance commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    parser_migrate = subparsers.add_parser("migrate", help="Apply pending schema migrations")
+    parser_migrate.set_defaults(func=cmd_migrate)
+
+    parser_migrations = subparsers.add_parser("migrations", help="Show the migration status")
+    parser_migrations.set_defaults(func=cmd_migrations)
+
+    parser_index_usage = subparsers.add_parser(
+        "index-usage", help="Report index usage from pg_stat_user_indexes"
+    )
+    parser_index_usage.add_argument(
+        "--unused", action="store_true", help="Only show non-unique indexes that were never scanned"
+    )
+    parser_index_usage.set_defaults(func=cmd_index_usage)
+
+    parser_snapshot_export = subparsers.add_parser(
+        "snapshot-export", help="Export tables as a compressed COPY snapshot"
+    )
+    parser_snapshot_export.add_argument("directory", help="Directory to write the snapshot to")
+    parser_snapshot_export.add_argument(
+        "--tables", nargs="+", default=SNAPSHOT_TABLES, help="Tables to export"
+    )
+    parser_snapshot_export.set_defaults(func=cmd_snapshot_export)
+
+    parser_snapshot_load = subparsers.add_parser(
+        "snapshot-load", help="Load a snapshot into empty tables"
+    )
+    parser_snapshot_load.add_argument("directory", help="Directory containing the snapshot")
+    parser_snapshot_load.set_defaults(func=cmd_snapshot_load)
+
+    parser_migrate_legacy = subparsers.add_parser(
+        "migrate-legacy", help="Migrate the legacy SQLite database, resuming from checkpoints"
+    )
+    parser_migrate_legacy.add_argument("--chunk-size", type=int, default=5000)
+    parser_migrate_legacy.add_argument(
+        "--workers", type=int, default=4, help="Processes decoding pickled potential products"
+    )
+    parser_migrate_legacy.add_argument(
+        "--restart", action="store_true", help="Discard the checkpoints of a previous run"
+    )
+    parser_migrate_legacy.set_defaults(func=cmd_migrate_legacy)
+
+    parser_resolve_misses = subparsers.add_parser(
+        "resolve-misses", help="Search the AH API for products queued during ingestion"
+    )
+    parser_resolve_misses.add_argument("--batch-size", type=int, default=50)
+    parser_resolve_misses.add_argument(
+        "--max-batches", type=int, default=None, help="Stop after this many batches"
+    )
+    parser_resolve_misses.set_defaults(func=cmd_resolve_misses)
+
+    parser_reprocess = subparsers.add_parser(
+        "reprocess", help="Parse and match archived receipts again, writing only changed rows"
+    )
+    parser_reprocess.add_argument(
+        "--since", type=dt.datetime.fromisoformat, help="Only receipts from this date on"
+    )
+    parser_reprocess.add_argument(
+        "--until", type=dt.datetime.fromisoformat, help="Only receipts before this date"
+    )
+    parser_reprocess.add_argument(
+        "--not-found", action="store_true", help="Only receipts with products that were not found"
+    )
+    parser_reprocess.add_argument("--workers", type=int, default=2)
+    parser_reprocess.add_argument(
+        "--api", action="store_true", help="Search unmatched products in the AH API"
+    )
+    parser_reprocess.add_argument(
+        "--dry-run", action="store_true", help="Only report the changes"
+    )
+    parser_reprocess.set_defaults(func=cmd_reprocess)
+
+    parser_archive_receipts = subparsers.add_parser(
+        "archive-receipts", help="Fetch and archive stored receipts that are not archived yet"
+    )
+    parser_archive_receipts.set_defaults(func=cmd_archive_receipts)
+
+    parser_export = subparsers.add_parser(
+        "export", help="Export the purchase history as NDJSON, CSV or Parquet"
+    )
+    parser_export.add_argument("path", help="The file to write, the format follows its extension")
+    parser_export.add_argument("--format", choices=["ndjson", "csv", "parquet"])
+    parser_export.add_argument(
+        "--since", type=dt.datetime.fromisoformat, help="Only receipts from this date on"
+    )
+    parser_export.add_argument(
+        "--until", type=dt.datetime.fromisoformat, help="Only receipts before this date"
+    )
+    parser_export.add_argument(
+        "--chunk-size", type=int, default=5000, help="Rows per chunk and per Parquet row group"
+    )
+    parser_export.set_defaults(func=cmd_export)
+
+    parser_replica_refresh = subparsers.add_parser(
+        "replica-refresh", help="Copy the changes since the last refresh to the analytics replica"
+    )
+    parser_replica_refresh.add_argument(
+        "--full", action="store_true", help="Copy everything again instead of the changes"
+    )
+    parser_replica_refresh.set_defaults(func=cmd_replica_refresh)
+
+    parser_replica_status = subparsers.add_parser(
+        "replica-status", help="Show how far the analytics replica is behind the database"
+    )
+    parser_replica_status.set_defaults(func=cmd_replica_status)
+
+    parser_verify_rollups = subparsers.add_parser(
+        "verify-rollups", help="Compare the daily rollups with the receipts they are computed from"
+    )
+    parser_verify_rollups.add_argument(
+        "--fix", action="store_true", help="Rebuild the rollups when they differ"
+    )
+    parser_verify_rollups.set_defaults(func=cmd_verify_rollups)
+
+    parser_dedupe_receipts = subparsers.add_parser(
+        "dedupe-receipts",
+        help="Remove the receipts that were stored more than once, except the most complete copy",
+    )
+    parser_dedupe_receipts.add_argument(
+        "--dry-run", action="store_true", help="Only show the copies and which one is kept"
+    )
+    parser_dedupe_receipts.set_defaults(func=cmd_dedupe_receipts)
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    args.func(args)
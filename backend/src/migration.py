@@ -1,43 +1,282 @@
-from database.DbHandler_legacy import DbHandler
-from database.DbHandler import DbHandler as DbHandler_postgres
-import pickle
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import datetime as dt
+import logging
 import math
+import pickle
+import time
+
+from sqlalchemy import select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from database import db_legacy
+from database.setup import engine
+from database.DbHandler import DbHandler
+from database.rollups import refresh_rollups
+from database.generation import data_generation
+from database.model import (
+    DbReceipt,
+    DbProduct,
+    DbDiscount,
+    DbLocation,
+    DbCategory,
+    DbCategoryHierarchy,
+    DbCategoryProduct,
+    DbMigrationCheckpoint,
+)
+
+log = logging.getLogger(__name__)
+
+# Tables are migrated level by level, every level only depends on the levels before it
+MIGRATION_LEVELS = [
+    ["locations", "categories"],
+    ["receipts", "categories_hierarchy", "categories_products"],
+    ["products", "discounts"],
+]
+
+TABLES = {
+    "locations": (
+        db_legacy.DbLocation,
+        DbLocation,
+        ["id", "name", "address", "house_number", "city", "postal_code"],
+    ),
+    "categories": (
+        db_legacy.DbCategory,
+        DbCategory,
+        ["id", "name", "slug", "english", "taxonomy_id"],
+    ),
+    "receipts": (
+        db_legacy.DbReceipt,
+        DbReceipt,
+        ["id", "transaction_id", "datetime", "location", "total_price", "total_discount"],
+    ),
+    "categories_hierarchy": (
+        db_legacy.DbCategoryHierarchy,
+        DbCategoryHierarchy,
+        ["id", "parent", "child"],
+    ),
+    "categories_products": (
+        db_legacy.DbCategoryProduct,
+        DbCategoryProduct,
+        ["id", "taxonomy_id", "product_id"],
+    ),
+    "products": (
+        db_legacy.DbProduct,
+        DbProduct,
+        [
+            "id",
+            "product_id",
+            "description",
+            "name",
+            "receipt",
+            "quantity",
+            "unit",
+            "price",
+            "total_price",
+            "potential_products",
+            "product_not_found",
+        ],
+    ),
+    "discounts": (
+        db_legacy.DbDiscount,
+        DbDiscount,
+        ["id", "receipt", "type", "description", "amount"],
+    ),
+}
+
+
+def decode_potential_products(blob: bytes) -> list[dict]:
+    """Decodes the pickled potential products of a legacy product. NaN values become None.
+
+    Args:
+        blob (bytes): The pickled potential products
+
+    Returns:
+        list[dict]: The potential products"""
+    if not blob:
+        return []
+    potential_products = pickle.loads(blob)
+    for item in potential_products:
+        for key in item:
+            if isinstance(item[key], float) and math.isnan(item[key]):
+                item[key] = None
+    return potential_products
+
+
+def _transform(table_name: str, rows: list[dict], pool: ProcessPoolExecutor) -> list[dict]:
+    if table_name == "categories_hierarchy":
+        # The legacy hierarchy stores the taxonomy ids as integers
+        for row in rows:
+            row["parent"] = str(row["parent"]) if row["parent"] is not None else None
+            row["child"] = str(row["child"]) if row["child"] is not None else None
+    elif table_name == "products":
+        blobs = [row["potential_products"] for row in rows]
+        chunksize = max(1, len(blobs) // 16)
+        for row, decoded in zip(
+            rows, pool.map(decode_potential_products, blobs, chunksize=chunksize)
+        ):
+            row["potential_products"] = decoded
+    return rows
+
+
+def _drop_orphans(connection, table_name: str, rows: list[dict]) -> list[dict]:
+    """Drops the rows of receipts that were not migrated. A receipt with a transaction id that
+    was already migrated is skipped by the unique index, its lines would be duplicates.
+
+    Args:
+        connection (Connection): The connection to the Postgres database
+        table_name (str): The name of the table
+        rows (list[dict]): The rows of the chunk
+
+    Returns:
+        list[dict]: The rows that belong to a migrated receipt or to no receipt"""
+    if table_name not in ("products", "discounts"):
+        return rows
+    receipt_ids = {row["receipt"] for row in rows if row["receipt"] is not None}
+    if not receipt_ids:
+        return rows
+    migrated = set(
+        connection.scalars(select(DbReceipt.id).where(DbReceipt.id.in_(receipt_ids)))
+    )
+    kept = [row for row in rows if row["receipt"] is None or row["receipt"] in migrated]
+    if len(kept) < len(rows):
+        log.warning(
+            f"Skipped {len(rows) - len(kept)} {table_name} of duplicate or missing receipts"
+        )
+    return kept
+
+
+def _get_checkpoint(table_name: str) -> DbMigrationCheckpoint:
+    with engine.connect() as connection:
+        return connection.execute(
+            select(DbMigrationCheckpoint).where(
+                DbMigrationCheckpoint.table_name == table_name
+            )
+        ).first()
+
+
+def _save_checkpoint(connection, table_name: str, last_id: int, rows: int, completed: bool):
+    statement = pg_insert(DbMigrationCheckpoint).values(
+        table_name=table_name,
+        last_id=last_id,
+        rows=rows,
+        completed=completed,
+        updated_at=dt.datetime.now(dt.timezone.utc),
+    )
+    connection.execute(
+        statement.on_conflict_do_update(
+            index_elements=["table_name"],
+            set_={
+                "last_id": statement.excluded.last_id,
+                "rows": statement.excluded.rows,
+                "completed": statement.excluded.completed,
+                "updated_at": statement.excluded.updated_at,
+            },
+        )
+    )
+
+
+def migrate_table(table_name: str, chunk_size: int, pool: ProcessPoolExecutor) -> int:
+    """Migrates a single table, continuing after its last checkpoint
+
+    Args:
+        table_name (str): The name of the table
+        chunk_size (int): The number of rows per chunk
+        pool (ProcessPoolExecutor): The pool to decode pickles in
+
+    Returns:
+        int: The number of rows migrated in this run"""
+    legacy_model, model, columns = TABLES[table_name]
+    checkpoint = _get_checkpoint(table_name)
+    if checkpoint is not None and checkpoint.completed:
+        log.info(f"Skipping {table_name}, it has already been migrated")
+        return 0
+    last_id = checkpoint.last_id if checkpoint is not None else 0
+    total = checkpoint.rows if checkpoint is not None else 0
+    migrated = 0
+    start = time.perf_counter()
+
+    legacy_columns = [getattr(legacy_model, column) for column in columns]
+    query = (
+        select(*legacy_columns)
+        .where(legacy_model.id > last_id)
+        .order_by(legacy_model.id)
+    )
+    # Without a conflict target, legacy duplicates that violate a unique index such as
+    # receipts.transaction_id or categories_products(product_id, taxonomy_id) are skipped too
+    insert_statement = pg_insert(model).on_conflict_do_nothing()
+    with db_legacy.engine.connect() as legacy_connection:
+        result = legacy_connection.execution_options(
+            stream_results=True, yield_per=chunk_size
+        ).execute(query)
+        for partition in result.partitions():
+            rows = _transform(table_name, [dict(row._mapping) for row in partition], pool)
+            last_id = rows[-1]["id"]
+            with engine.begin() as connection:
+                kept = _drop_orphans(connection, table_name, rows)
+                if kept:
+                    connection.execute(insert_statement, kept)
+                _save_checkpoint(connection, table_name, last_id, total + len(rows), False)
+            total += len(rows)
+            migrated += len(rows)
+            log.info(f"Migrated {total} rows of {table_name} (up to id {last_id})")
+
+    with engine.begin() as connection:
+        _save_checkpoint(connection, table_name, last_id, total, True)
+        # Ids were copied explicitly, move the sequence past them
+        connection.execute(
+            text(
+                f"SELECT setval(pg_get_serial_sequence('{table_name}', 'id'), "
+                f"COALESCE(MAX(id), 1), MAX(id) IS NOT NULL) FROM {table_name}"
+            )
+        )
+    log.info(
+        f"Migrated {table_name}: {migrated} rows in {time.perf_counter() - start:.1f}s"
+    )
+    return migrated
+
+
+def migrate_legacy(chunk_size: int = 5000, workers: int = 4, restart: bool = False) -> dict:
+    """Migrates all tables of the legacy SQLite database to Postgres.
+
+    Every table is streamed in id order in chunks and written with bulk inserts. After each chunk
+    a checkpoint is stored in the same transaction, so a rerun continues where the previous run
+    stopped. Tables that do not depend on each other are migrated in parallel and the pickled
+    potential products are decoded in a process pool.
+
+    Args:
+        chunk_size (int, optional): The number of rows per chunk. Defaults to 5000.
+        workers (int, optional): The number of processes decoding pickles. Defaults to 4.
+        restart (bool, optional): Whether to discard the checkpoints of a previous run. Rows that
+            were already migrated are skipped by the inserts. Defaults to False.
+
+    Returns:
+        dict: The number of rows migrated per table"""
+    if restart:
+        with engine.begin() as connection:
+            connection.execute(DbMigrationCheckpoint.__table__.delete())
+    migrated = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for level in MIGRATION_LEVELS:
+            with ThreadPoolExecutor(max_workers=len(level)) as executor:
+                futures = {
+                    table_name: executor.submit(migrate_table, table_name, chunk_size, pool)
+                    for table_name in level
+                }
+                for table_name, future in futures.items():
+                    migrated[table_name] = future.result()
+    db_handler = DbHandler()
+    db_handler.refresh_category_closure()
+    db_handler.close()
+    with engine.begin() as connection:
+        refresh_rollups(connection)
+    data_generation.bump()
+    return migrated
+
 
-db_handler = DbHandler()
-db_handler_postgres = DbHandler_postgres()
-
-categories = db_handler.get_categories()
-categories_hierarchy = db_handler.get_categories_hierarchy()
-categories_products = db_handler.get_categories_products()
-discounts = db_handler.get_discounts()
-locations = db_handler.get_locations()
-products = db_handler.get_products()
-receipts = db_handler.get_receipts()
-
-for product in products:
-    if product.potential_products:
-        product.potential_products = pickle.loads(product.potential_products)
-        for item in product.potential_products:
-            for key in item:
-                if isinstance(item[key], float) and math.isnan(item[key]):
-                    item[key] = None
-    else:
-        product.potential_products = []
-
-db_handler_postgres.add_all_locations(locations)
-print("added locations")
-db_handler_postgres.add_all_receipts(receipts)
-print("added receipts")
-db_handler_postgres.add_all_discounts(discounts)
-print("added discounts")
-db_handler_postgres.add_all_categories(categories)
-print("added categories")
-db_handler_postgres.add_all_categories_hierarchy(categories_hierarchy)
-print("added categories hierarchy")
-db_handler_postgres.add_all_categories_products(categories_products)
-print("added categories products")
-db_handler_postgres.add_all_products(products)
-print("added products")
-db_handler_postgres._session.commit()
-
-print("done!")
+if __name__ == "__main__":
+    logging.basicConfig(
+        format="%(asctime)s [%(levelname)s] %(module)s: %(message)s",
+        level=logging.INFO,
+    )
+    print(migrate_legacy())
+    print("done!")
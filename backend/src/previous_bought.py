@@ -1,8 +1,7 @@
-import inflection
-
 from ah_api import get_previously_bought
 from database.DbHandler import DbHandler
-from database.model import DbPreviousProduct
+from database.model import DbAHProduct
+from schemas import product_values
 
 
 def fetch_previous_bought():
@@ -11,17 +10,10 @@ def fetch_previous_bought():
     set_product_ids = set()
     previous_products = []
     for product in prev_bought:
-        product["webshopId"] = str(product["webshopId"])
-        if product["webshopId"] in set_product_ids:
+        product = product_values(product)
+        if product["webshop_id"] in set_product_ids:
             continue
-        product = {
-            inflection.underscore(key): value
-            for key, value in product.items()
-            if "virtual" not in key.lower()
-            and key
-            not in ["descriptionHighlights", "descriptionFull", "extraDescriptions"]
-        }
-        dbPrevProduct = DbPreviousProduct(**product)
+        dbPrevProduct = DbAHProduct.from_api(product)
         previous_products.append(dbPrevProduct)
         set_product_ids.add(product["webshop_id"])
     return previous_products
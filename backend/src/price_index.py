@@ -0,0 +1,540 @@
+from database.model import DbReceipt, DbProduct, DbCategoryProduct
+from database.rollups import receipt_day, to_day, ROLLUP_TIMEZONE
+from database.generation import data_generation
+from database.replica import CHANGE_OVERLAP, analytics_replica, duckdb
+from collections import OrderedDict
+from sqlalchemy import select, func, or_, Float, Select
+import datetime as dt
+import os
+import threading
+import logging
+
+import msgspec
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+PRICE_INDEX_PERIODS = ("week", "month")
+# Value of the index in the first period
+INDEX_BASE = 100.0
+# Lines read from the database at once
+LOAD_CHUNK_SIZE = 50_000
+EPOCH = dt.date(1970, 1, 1)
+
+# lines_query() on the analytics replica, the receipts are selected by the {changed} condition
+REPLICA_LINES_QUERY = """
+SELECT
+    p.receipt,
+    CAST(timezone($timezone, r.datetime) AS DATE) AS day,
+    r.location,
+    p.product_id,
+    p.unit,
+    coalesce(p.quantity, 1) AS quantity,
+    coalesce(p.price, p.total_price / nullif(p.quantity, 0)) AS price
+FROM products p
+JOIN receipts r ON r.id = p.receipt
+WHERE p.product_id IS NOT NULL AND {changed}
+"""
+REPLICA_CHANGED_RECEIPTS = "(r.id > $last_receipt OR r.updated_at >= $changed_since)"
+
+
+def period_index(days: np.ndarray, period: str) -> np.ndarray:
+    """Numbers the weeks (starting on Monday) or months of days since the epoch"""
+    if period == "month":
+        return days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+    # The epoch is a Thursday
+    return (days.astype(np.int64) + 3) // 7
+
+
+def period_start(index: int, period: str) -> dt.date:
+    """The first day of a period numbered by period_index()"""
+    if period == "month":
+        return np.datetime64(int(index), "M").astype("datetime64[D]").item()
+    return EPOCH + dt.timedelta(days=int(index) * 7 - 3)
+
+
+class PurchaseLines:
+    """Columns of the purchase lines with a matched product: the receipt, its day (days since the
+    epoch in the rollup timezone) and store, the product, the quantity and the price per unit.
+    Products are numbered by their webshop ID and unit, so prices per kilogram are only compared
+    with each other.
+    """
+
+    def __init__(self):
+        self.receipt = np.empty(0, np.int32)
+        self.day = np.empty(0, np.int32)
+        self.location = np.empty(0, np.int32)
+        self.product = np.empty(0, np.int32)
+        self.quantity = np.empty(0, np.float64)
+        self.price = np.empty(0, np.float64)
+        # (webshop ID, unit) by product number, in order
+        self.products = {}
+
+    def __len__(self) -> int:
+        return len(self.receipt)
+
+    def product_number(self, product_id: str, unit: str = None) -> int:
+        return self.products.setdefault((product_id, unit), len(self.products))
+
+    def append(self, receipt, day, location, product, quantity, price):
+        """Appends columns of lines, lines without a positive quantity and price are skipped
+
+        Args:
+            receipt (array): The receipt IDs
+            day (array): The days since the epoch
+            location (array): The location IDs, -1 if unknown
+            product (array): The product numbers of product_number()
+            quantity (array): The quantities
+            price (array): The prices per unit"""
+        quantity = np.asarray(quantity, np.float64)
+        price = np.asarray(price, np.float64)
+        valid = (quantity > 0) & (price > 0)
+        for name, values in (
+            ("receipt", receipt),
+            ("day", day),
+            ("location", location),
+            ("product", product),
+            ("quantity", quantity),
+            ("price", price),
+        ):
+            column = getattr(self, name)
+            values = np.asarray(values, column.dtype)[valid]
+            setattr(self, name, np.concatenate([column, values]))
+
+    def drop(self, receipt_ids) -> int | None:
+        """Removes the lines of receipts
+
+        Args:
+            receipt_ids (array): The IDs of the receipts
+
+        Returns:
+            int | None: The earliest day of the removed lines, None if there were none"""
+        removed = np.isin(self.receipt, np.asarray(receipt_ids, np.int32))
+        if not removed.any():
+            return None
+        first_day = int(self.day[removed].min())
+        for name in ("receipt", "day", "location", "product", "quantity", "price"):
+            setattr(self, name, getattr(self, name)[~removed])
+        return first_day
+
+    def members(self, product_ids: frozenset) -> np.ndarray:
+        """Which product numbers have one of the webshop IDs"""
+        return np.fromiter(
+            (product_id in product_ids for product_id, _ in self.products),
+            bool,
+            count=len(self.products),
+        )
+
+
+class PriceLinks(msgspec.Struct, frozen=True, gc=False):
+    """The links of a chained price index: for every period with purchases the change of the
+    prices since the previous period with purchases, over the products bought in both. The first
+    link and links without such products are 1.
+
+    Attributes:
+        periods (ndarray): The period numbers of period_index(), ascending
+        laspeyres (ndarray): The price change weighted by the quantities of the previous period
+        paasche (ndarray): The price change weighted by the quantities of the period itself
+        matched (ndarray): The number of products bought in both periods
+    """
+
+    periods: np.ndarray
+    laspeyres: np.ndarray
+    paasche: np.ndarray
+    matched: np.ndarray
+
+    def since(self, period: int) -> "PriceLinks":
+        keep = self.periods >= period
+        return PriceLinks(*(values[keep] for values in self._values()))
+
+    def before(self, period: int) -> "PriceLinks":
+        keep = self.periods < period
+        return PriceLinks(*(values[keep] for values in self._values()))
+
+    def _values(self) -> tuple:
+        return self.periods, self.laspeyres, self.paasche, self.matched
+
+    def __add__(self, other: "PriceLinks") -> "PriceLinks":
+        return PriceLinks(
+            *(
+                np.concatenate([mine, theirs])
+                for mine, theirs in zip(self._values(), other._values())
+            )
+        )
+
+
+def price_links(lines: PurchaseLines, rows: np.ndarray, period: str) -> PriceLinks:
+    """Computes the links of the chained Laspeyres and Paasche price indices of lines, vectorized.
+    The unit price of a product in a period is its average price weighted by quantity. Products
+    are matched between consecutive periods with purchases by sorting the (product, period) cells,
+    so the work grows with the number of lines, not with products times periods.
+
+    Args:
+        lines (PurchaseLines): The purchase lines
+        rows (ndarray): A mask of the lines to include
+        period (str): week or month
+
+    Returns:
+        PriceLinks: The links per period with purchases"""
+    periods, period_position = np.unique(
+        period_index(lines.day[rows], period), return_inverse=True
+    )
+    quantity = lines.quantity[rows]
+    cells, cell_position = np.unique(
+        lines.product[rows].astype(np.int64) * len(periods) + period_position,
+        return_inverse=True,
+    )
+    quantities = np.bincount(cell_position, weights=quantity)
+    prices = np.bincount(cell_position, weights=lines.price[rows] * quantity) / quantities
+    cell_product, cell_period = np.divmod(cells, len(periods))
+
+    # Cells are sorted by product and then period, a cell follows the one of the same product in
+    # the previous period with purchases when the product was bought in both
+    current = 1 + np.flatnonzero(
+        (cell_product[1:] == cell_product[:-1]) & (cell_period[1:] == cell_period[:-1] + 1)
+    )
+    previous = current - 1
+    link_period = cell_period[current]
+
+    def ratio(current_weights: np.ndarray, previous_weights: np.ndarray) -> np.ndarray:
+        numerator = np.bincount(link_period, weights=current_weights, minlength=len(periods))
+        denominator = np.bincount(link_period, weights=previous_weights, minlength=len(periods))
+        return np.divide(
+            numerator, denominator, out=np.ones(len(periods)), where=denominator > 0
+        )
+
+    return PriceLinks(
+        periods,
+        ratio(prices[current] * quantities[previous], prices[previous] * quantities[previous]),
+        ratio(prices[current] * quantities[current], prices[previous] * quantities[current]),
+        np.bincount(link_period, minlength=len(periods)),
+    )
+
+
+def lines_query(changed: Select = None) -> Select:
+    """Builds the query of the purchase lines with a matched product, optionally only of the
+    receipts selected by changed. Lines without a price per unit get their total price divided
+    by their quantity."""
+    query = (
+        select(
+            DbProduct.receipt,
+            receipt_day().label("day"),
+            DbReceipt.location,
+            DbProduct.product_id,
+            DbProduct.unit,
+            func.coalesce(DbProduct.quantity, 1).label("quantity"),
+            func.coalesce(
+                DbProduct.price,
+                DbProduct.total_price / func.nullif(DbProduct.quantity, 0, type_=Float),
+            ).label("price"),
+        )
+        .join(DbReceipt, DbReceipt.id == DbProduct.receipt)
+        .where(DbProduct.product_id.is_not(None))
+    )
+    if changed is not None:
+        query = query.where(DbProduct.receipt.in_(changed.scalar_subquery()))
+    return query
+
+
+class PriceIndex:
+    """Chained Laspeyres and Paasche price indices of the own purchases, overall, per category
+    subtree and per store. The purchase lines are kept in memory as NumPy columns and only the
+    lines of receipts that were added or changed are loaded again when the data generation is
+    bumped. The links of every computed index are cached per period and, after receipts changed,
+    only recomputed from the first period they affect. With an analytics replica, the lines and
+    category members are read from it instead of Postgres, so the index is as recent as the
+    last refresh of the replica.
+
+    Attributes:
+        lines (PurchaseLines): The loaded purchase lines
+        max_entries (int): The number of cached indices
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 128,
+        _engine=None,
+        _generation=data_generation,
+        _replica=analytics_replica,
+    ):
+        self.lines = PurchaseLines()
+        self.max_entries = max_entries
+        self._engine = _engine
+        self._generation = _generation
+        self._replica = _replica
+        self._lock = threading.Lock()
+        self._loaded_generation = None
+        self._last_receipt = None
+        self._synced_until = None
+        # The earliest day changed by every update, the version is the number of updates
+        self._changed_from = []
+        self._members = {}
+        self._results = OrderedDict()
+
+    @property
+    def version(self) -> int:
+        return len(self._changed_from)
+
+    def _connect(self):
+        if self._engine is None:
+            # Imported on first use, so the computation also works without a database
+            from database.setup import engine
+
+            self._engine = engine
+        return self._engine.connect()
+
+    def _use_replica(self) -> bool:
+        # Until its first refresh the replica has no tables
+        return (
+            self._replica.enabled and duckdb is not None and os.path.exists(self._replica.path)
+        )
+
+    def update(self, receipt_ids, receipt, day, location, product, quantity, price):
+        """Replaces the lines of receipts, see PurchaseLines.append() for the columns
+
+        Args:
+            receipt_ids (array): The receipts that are replaced, their lines are removed first"""
+        first_day = self.lines.drop(receipt_ids) if len(receipt_ids) else None
+        self.lines.append(receipt, day, location, product, quantity, price)
+        if len(day):
+            added = int(np.min(day))
+            first_day = added if first_day is None else min(first_day, added)
+        if first_day is not None:
+            self._changed_from.append(first_day)
+
+    def _sync(self):
+        """Loads the lines of the receipts that were added or changed since the last load, if
+        the data generation was bumped since"""
+        generation = self._generation.current()
+        if generation == self._loaded_generation:
+            return
+        loaded = None
+        if self._use_replica():
+            try:
+                loaded = self._read_replica()
+            except duckdb.Error as e:
+                # For example while a refresh is writing to it
+                log.warning(f"Reading the analytics replica failed, reading Postgres instead: {e}")
+        if loaded is None:
+            loaded = self._read_postgres()
+        receipt_ids, columns, last_receipt, synced_until = loaded
+        first_load = self._synced_until is None
+        self.update(receipt_ids, *columns)
+        self._last_receipt = last_receipt or 0
+        self._synced_until = synced_until
+        self._loaded_generation = generation
+        if first_load:
+            log.info(f"Loaded {len(self.lines)} purchase lines for the price index")
+        else:
+            log.info(f"Loaded the lines of {len(receipt_ids)} changed receipts for the price index")
+
+    def _read_postgres(self) -> tuple:
+        """Reads the lines of the changed receipts from Postgres
+
+        Returns:
+            tuple: The IDs of the changed receipts, the columns of their lines, the last receipt
+                ID and the moment the lines were read at"""
+        with self._connect() as connection:
+            connection = connection.execution_options(isolation_level="REPEATABLE READ")
+            with connection.begin():
+                now = connection.execute(select(func.now())).scalar_one()
+                changed = None
+                receipt_ids = []
+                if self._synced_until is not None:
+                    changed = select(DbReceipt.id).where(
+                        or_(
+                            DbReceipt.id > self._last_receipt,
+                            DbReceipt.updated_at >= self._synced_until - CHANGE_OVERLAP,
+                        )
+                    )
+                    receipt_ids = connection.execute(changed).scalars().all()
+                result = connection.execution_options(yield_per=LOAD_CHUNK_SIZE).execute(
+                    lines_query(changed)
+                )
+                columns = self._columns(result.partitions(LOAD_CHUNK_SIZE))
+                last_receipt = connection.execute(select(func.max(DbReceipt.id))).scalar()
+        return receipt_ids, columns, last_receipt, now
+
+    def _read_replica(self) -> tuple:
+        """Reads the lines of the changed receipts from the analytics replica, see
+        _read_postgres(). The moment is the one of the Postgres snapshot of its last refresh."""
+        with self._replica.connect() as connection:
+            synced_until = connection.execute(
+                "SELECT synced_until FROM replica_state WHERE table_name = 'receipts'"
+            ).fetchone()[0]
+            changed = "true"
+            params = {"timezone": ROLLUP_TIMEZONE}
+            receipt_ids = []
+            if self._synced_until is not None:
+                changed = REPLICA_CHANGED_RECEIPTS
+                params.update(
+                    last_receipt=self._last_receipt,
+                    changed_since=self._synced_until - CHANGE_OVERLAP,
+                )
+                receipt_ids = [
+                    id
+                    for (id,) in connection.execute(
+                        f"SELECT r.id FROM receipts r WHERE {changed}",
+                        {key: params[key] for key in ("last_receipt", "changed_since")},
+                    ).fetchall()
+                ]
+            result = connection.execute(REPLICA_LINES_QUERY.format(changed=changed), params)
+            columns = self._columns(iter(lambda: result.fetchmany(LOAD_CHUNK_SIZE), []))
+            last_receipt = connection.execute("SELECT max(id) FROM receipts").fetchone()[0]
+        return receipt_ids, columns, last_receipt, synced_until
+
+    def _columns(self, partitions) -> list[np.ndarray]:
+        """Converts chunks of lines_query() rows into the columns of PurchaseLines.append()"""
+        columns = [[] for _ in range(6)]
+        for rows in partitions:
+            receipt, day, location, product_id, unit, quantity, price = zip(*rows)
+            columns[0].append(np.array(receipt, np.int32))
+            columns[1].append(np.array(day, "datetime64[D]").astype(np.int32))
+            columns[2].append(np.array([-1 if id is None else id for id in location], np.int32))
+            columns[3].append(
+                np.fromiter(
+                    map(self.lines.product_number, product_id, unit), np.int32, count=len(rows)
+                )
+            )
+            columns[4].append(np.array(quantity, np.float64))
+            columns[5].append(np.array([np.nan if value is None else value for value in price]))
+        return [
+            np.concatenate(chunks) if chunks else np.empty(0, dtype)
+            for chunks, dtype in zip(
+                columns, (np.int32, np.int32, np.int32, np.int32, np.float64, np.float64)
+            )
+        ]
+
+    def _category_members(self, category: str) -> frozenset:
+        cached = self._members.get(category)
+        # Categories are assigned when receipts are stored, which bumps the data generation
+        if cached is None or cached[0] != self._loaded_generation:
+            members = None
+            if self._use_replica():
+                try:
+                    with self._replica.connect() as connection:
+                        members = frozenset(
+                            product_id
+                            for (product_id,) in connection.execute(
+                                "SELECT product_id FROM categories_products WHERE taxonomy_id = ?",
+                                [category],
+                            ).fetchall()
+                        )
+                except duckdb.Error as e:
+                    log.warning(
+                        f"Reading the analytics replica failed, reading Postgres instead: {e}"
+                    )
+            if members is None:
+                with self._connect() as connection:
+                    members = frozenset(
+                        connection.execute(
+                            select(DbCategoryProduct.product_id).where(
+                                DbCategoryProduct.taxonomy_id == category
+                            )
+                        ).scalars()
+                    )
+            cached = (self._loaded_generation, members)
+            self._members[category] = cached
+        return cached[1]
+
+    def compute(
+        self, period: str = "month", members: frozenset = None, store: int = None
+    ) -> PriceLinks:
+        """Gets the links of an index from the cache, computing them from the first period that
+        changed since they were cached
+
+        Args:
+            period (str, optional): week or month. Defaults to month.
+            members (frozenset, optional): Only products with these webshop IDs. Defaults to None.
+            store (int, optional): Only lines of this location ID. Defaults to None.
+
+        Returns:
+            PriceLinks: The links per period with purchases"""
+        if period not in PRICE_INDEX_PERIODS:
+            raise ValueError(
+                f"period must be one of {', '.join(PRICE_INDEX_PERIODS)}, not {period}"
+            )
+        key = (period, members, store)
+        cached = self._results.get(key)
+        if cached is not None and cached[0] == self.version:
+            self._results.move_to_end(key)
+            return cached[1]
+
+        rows = np.ones(len(self.lines), bool)
+        if members is not None:
+            rows &= self.lines.members(members)[self.lines.product]
+        if store is not None:
+            rows &= self.lines.location == store
+        links = None
+        if cached is not None:
+            first_day = min(self._changed_from[cached[0] :])
+            first_changed = period_index(np.array([first_day]), period)[0]
+            unchanged = cached[1].before(first_changed)
+            if len(unchanged.periods):
+                # The last unchanged period is the base of the first recomputed link
+                base = unchanged.periods[-1]
+                start = (period_start(base, period) - EPOCH).days
+                recomputed = price_links(self.lines, rows & (self.lines.day >= start), period)
+                links = unchanged + recomputed.since(base + 1)
+        if links is None:
+            links = price_links(self.lines, rows, period)
+        self._results[key] = (self.version, links)
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_entries:
+            self._results.popitem(last=False)
+        return links
+
+    def get(
+        self,
+        period: str = "month",
+        category: str = None,
+        store: int = None,
+        since: dt.datetime = None,
+        until: dt.datetime = None,
+    ) -> list[dict]:
+        """Gets a chained price index, loading the changed receipts first
+
+        Args:
+            period (str, optional): week or month. Defaults to month.
+            category (str, optional): The taxonomy ID of a category, only products in its subtree.
+                Defaults to None.
+            store (int, optional): The location ID of a store. Defaults to None.
+            since (datetime, optional): Only periods from this day on, the index is INDEX_BASE in
+                the first of them. Defaults to None.
+            until (datetime, optional): Only periods that start before this day. Defaults to None.
+
+        Returns:
+            list[dict]: The period, Laspeyres and Paasche index and number of matched products
+                per period with purchases
+
+        Raises:
+            ValueError: If the period is not known"""
+        with self._lock:
+            self._sync()
+            members = self._category_members(category) if category is not None else None
+            links = self.compute(period, members, store)
+        if since is not None:
+            start = period_index(np.array([(to_day(since) - EPOCH).days]), period)[0]
+            links = links.since(start)
+        if until is not None:
+            end = period_index(np.array([(to_day(until) - EPOCH).days - 1]), period)[0]
+            links = links.before(end + 1)
+        if not len(links.periods):
+            return []
+        # Chained from the first period that is returned
+        laspeyres = np.cumprod(np.concatenate([[1.0], links.laspeyres[1:]])) * INDEX_BASE
+        paasche = np.cumprod(np.concatenate([[1.0], links.paasche[1:]])) * INDEX_BASE
+        return [
+            {
+                "period": period_start(index, period),
+                "laspeyres": round(float(laspeyres_value), 2),
+                "paasche": round(float(paasche_value), 2),
+                "matched": int(matched),
+            }
+            for index, laspeyres_value, paasche_value, matched in zip(
+                links.periods, laspeyres, paasche, links.matched
+            )
+        ]
+
+
+price_index = PriceIndex()
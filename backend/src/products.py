@@ -1,9 +1,9 @@
 from supermarktconnector.ah import AHConnector
 from ah_api import search_all_products
 import logging
-import inflection
 from database.DbHandler import DbHandler
 from database.model import DbAHProduct
+from schemas import product_values
 import datetime
 
 logging.basicConfig(
@@ -23,16 +23,10 @@ def fetch_products() -> list[DbAHProduct]:
     for category in all_categories:
         products_in_category = search_all_products(taxonomyId=category["id"])
         for product in products_in_category:
-            if product["webshopId"] in set_product_ids:
+            product = product_values(product)
+            if product["webshop_id"] in set_product_ids:
                 continue
-            product = {
-                inflection.underscore(key): value
-                for key, value in product.items()
-                if "virtual" not in key.lower()
-                and key
-                not in ["descriptionHighlights", "descriptionFull", "extraDescriptions"]
-            }
-            dbAHProduct = DbAHProduct(date_added=date, **product)
+            dbAHProduct = DbAHProduct.from_api(product, date_added=date)
             all_products.append(dbAHProduct)
             set_product_ids.add(product["webshop_id"])
         log.info(f"Added products from category {category['name']}")
@@ -0,0 +1,182 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import datetime as dt
+import logging
+import time
+
+from database.DbHandler import DbHandler
+from database.generation import data_generation
+from classes.Receipt import Receipt
+from ah_api import fetch_receipts
+
+log = logging.getLogger(__name__)
+
+
+def _line_key(description, unit, price, total_price) -> tuple:
+    # The quantity is not part of the key, weighed quantities are rounded when they are stored
+    return (description, unit, price, total_price)
+
+
+def diff_products(stored: list, products: list) -> tuple[list, list, list]:
+    """Pairs the stored products of a receipt with the reprocessed products by their receipt line.
+
+    Args:
+        stored (list[DbProduct]): The stored products of the receipt
+        products (list[Product]): The reprocessed products of the receipt
+
+    Returns:
+        tuple[list, list, list]: The ids of stored products with a different match paired with
+            the reprocessed product, the reprocessed products without a stored product and the
+            ids of stored products without a reprocessed product. Reprocessed products whose
+            lookup was deferred never replace the match of their stored product."""
+    unpaired = {}
+    for row in stored:
+        unpaired.setdefault(
+            _line_key(row.description, row.unit, row.price, row.total_price), []
+        ).append(row)
+    updated = []
+    added = []
+    for product in products:
+        rows = unpaired.get(
+            _line_key(product.description, product.unit, product.price, product.total_price)
+        )
+        if not rows:
+            added.append(product)
+            continue
+        row = rows.pop(0)
+        if product.lookup_deferred:
+            # Not found in the catalog and not searched in the AH API, the stored line keeps the
+            # match it got from the AH API or the resolution queue earlier
+            continue
+        if (row.product_id, row.name, bool(row.product_not_found)) != (
+            product.product_id,
+            product.name,
+            product.product_not_found,
+        ):
+            updated.append((row.id, product))
+    deleted = [row.id for rows in unpaired.values() for row in rows]
+    return updated, added, deleted
+
+
+def reprocess_receipt(transaction_id: str, api_lookups: bool = False, dry_run: bool = False) -> dict:
+    """Parses and matches an archived receipt again and writes the rows that changed.
+
+    Args:
+        transaction_id (str): The transaction ID of the receipt
+        api_lookups (bool, optional): Whether products without a catalog match may be searched in the AH API. Defaults to False.
+        dry_run (bool, optional): Only count the changes. Defaults to False.
+
+    Returns:
+        dict: The number of updated, added and deleted products and whether the receipt changed"""
+    stats = {"updated": 0, "added": 0, "deleted": 0, "changed": False}
+    db_handler = DbHandler()
+    try:
+        archived = db_handler.get_archived_receipt(transaction_id)
+        dbReceipt = db_handler.find_receipt(transaction_id, with_details=True)
+        if archived is None or dbReceipt is None:
+            log.warning(f"Receipt {transaction_id} is not archived or not stored, skipping")
+            return stats
+        summary, details = archived
+        receipt = Receipt(summary, api_lookups=api_lookups, details_payload=details)
+        receipt.set_details()
+
+        updated, added, deleted = diff_products(dbReceipt.products, receipt.products)
+        receipt_values = {}
+        if dbReceipt.total_price != receipt.total:
+            receipt_values["total_price"] = receipt.total
+        if dbReceipt.total_discount != receipt.discounts["total_discount"]:
+            receipt_values["total_discount"] = receipt.discounts["total_discount"]
+        stored_discounts = sorted(
+            (d.type, d.description, d.amount) for d in dbReceipt.discounts
+        )
+        new_discounts = sorted(
+            (d.type, d.description, d.amount) for d in receipt.discounts["discounts"]
+        )
+        discounts = (
+            receipt.discounts["discounts"] if stored_discounts != new_discounts else None
+        )
+
+        stats.update(updated=len(updated), added=len(added), deleted=len(deleted))
+        stats["changed"] = bool(
+            updated or added or deleted or receipt_values or discounts is not None
+        )
+        if stats["changed"] and not dry_run:
+            db_handler.apply_receipt_changes(
+                dbReceipt.id, updated, added, deleted, receipt_values, discounts
+            )
+    finally:
+        db_handler.close()
+    return stats
+
+
+def reprocess(
+    since: dt.datetime = None,
+    until: dt.datetime = None,
+    not_found_only: bool = False,
+    workers: int = 2,
+    api_lookups: bool = False,
+    dry_run: bool = False,
+) -> dict:
+    """Reprocesses archived receipts in parallel. Only the rows that changed are written.
+
+    Args:
+        since (datetime, optional): Only receipts from this moment on. Defaults to None.
+        until (datetime, optional): Only receipts before this moment. Defaults to None.
+        not_found_only (bool, optional): Only receipts with products that were not found. Defaults to False.
+        workers (int, optional): The number of receipts processed at once. Every receipt also
+            searches its products with max_workers threads. Defaults to 2.
+        api_lookups (bool, optional): Whether products without a catalog match may be searched in the AH API. Defaults to False.
+        dry_run (bool, optional): Only count the changes. Defaults to False.
+
+    Returns:
+        dict: The number of processed, changed and failed receipts and the changed products"""
+    db_handler = DbHandler()
+    transaction_ids = db_handler.get_archived_transaction_ids(since, until, not_found_only)
+    db_handler.close()
+    log.info(f"Reprocessing {len(transaction_ids)} archived receipts")
+
+    totals = {"receipts": 0, "changed": 0, "failed": 0, "updated": 0, "added": 0, "deleted": 0}
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(reprocess_receipt, transaction_id, api_lookups, dry_run): transaction_id
+            for transaction_id in transaction_ids
+        }
+        for future in as_completed(futures):
+            totals["receipts"] += 1
+            try:
+                stats = future.result()
+            except Exception as e:
+                log.error(f"Reprocessing receipt {futures[future]} failed: {e}")
+                totals["failed"] += 1
+                continue
+            totals["changed"] += stats["changed"]
+            for key in ("updated", "added", "deleted"):
+                totals[key] += stats[key]
+    if totals["changed"] and not dry_run:
+        data_generation.bump()
+    log.info(
+        f"Reprocessed {totals['receipts']} receipts in {time.perf_counter() - start:.1f}s: {totals}"
+    )
+    return totals
+
+
+def archive_receipts() -> int:
+    """Archives the stored receipts that are not in the archive yet by fetching their details
+    from the API once.
+
+    Returns:
+        int: The number of archived receipts"""
+    db_handler = DbHandler()
+    archived = set(db_handler.get_archived_transaction_ids())
+    count = 0
+    try:
+        for summary in fetch_receipts():
+            transaction_id = summary["transactionId"]
+            if transaction_id in archived or db_handler.find_receipt(transaction_id) is None:
+                continue
+            db_handler.archive_receipt(Receipt(summary))
+            count += 1
+    finally:
+        db_handler.close()
+    log.info(f"Archived {count} receipts")
+    return count
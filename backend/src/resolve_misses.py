@@ -0,0 +1,78 @@
+import logging
+import time
+
+from database.DbHandler import DbHandler
+from database.generation import data_generation
+from classes.Product import Product
+
+log = logging.getLogger(__name__)
+
+
+def resolve_misses(batch_size: int = 50, max_batches: int = None) -> dict:
+    """Drains the resolution queue. Every batch is claimed with SKIP LOCKED, so several resolvers
+    can run at once. Each distinct description is searched in the AH API once per batch, under
+    the shared API rate limiter, and the results are written in bulk.
+
+    Args:
+        batch_size (int, optional): The number of queued products per batch. Defaults to 50.
+        max_batches (int, optional): Stop after this many batches. Defaults to draining the queue.
+
+    Returns:
+        dict: The number of batches, API calls and resolved, not found and failed products"""
+    stats = {"batches": 0, "api_calls": 0, "resolved": 0, "not_found": 0, "failed": 0}
+    start = time.perf_counter()
+    db_handler = DbHandler()
+    try:
+        while max_batches is None or stats["batches"] < max_batches:
+            rows = db_handler.claim_resolution_batch(batch_size)
+            if not rows:
+                break
+            by_description = {}
+            for row in rows:
+                by_description.setdefault(row.description, []).append(row)
+
+            resolved = []
+            failed = []
+            for description, same in by_description.items():
+                try:
+                    api_products = Product.search_api(description)
+                except Exception as e:
+                    log.warning(f'Searching "{description}" failed: {e}')
+                    failed.extend((row, str(e)) for row in same)
+                    continue
+                stats["api_calls"] += 1
+                for row in same:
+                    product = Product(
+                        quantity=row.quantity,
+                        unit=row.unit,
+                        description=row.description,
+                        price=row.price,
+                        total_price=row.total_price,
+                        datetime=row.datetime,
+                        resolve=False,
+                    )
+                    product.resolve_with_api(db_handler, api_products)
+                    resolved.append((row, product))
+
+            db_handler.complete_resolutions(resolved, failed)
+            data_generation.bump()
+            stats["batches"] += 1
+            stats["resolved"] += sum(1 for _, product in resolved if not product.product_not_found)
+            stats["not_found"] += sum(1 for _, product in resolved if product.product_not_found)
+            stats["failed"] += len(failed)
+            log.info(
+                f"Resolved batch {stats['batches']}: {len(rows)} products, "
+                f"{len(by_description)} descriptions"
+            )
+    finally:
+        db_handler.close()
+    log.info(f"Drained the resolution queue in {time.perf_counter() - start:.1f}s: {stats}")
+    return stats
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format="%(asctime)s [%(levelname)s] %(module)s: %(message)s",
+        level=logging.INFO,
+    )
+    print(resolve_misses())
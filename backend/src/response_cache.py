@@ -0,0 +1,357 @@
+from database.generation import data_generation
+from config import Config
+from collections import OrderedDict
+from urllib.parse import urlencode
+import asyncio
+import functools
+import gzip
+import hashlib
+import os
+import shutil
+import threading
+import logging
+
+import flask
+import msgspec
+from werkzeug.http import parse_accept_header, parse_etags, quote_etag
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+log = logging.getLogger(__name__)
+config = Config()
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+class CachedResponse(msgspec.Struct, frozen=True, gc=False):
+    """A response body with its compressed variants, keyed by content coding ("identity",
+    "gzip" and "br"), and the hash of the body that the ETags are derived from"""
+
+    digest: str
+    mimetype: str
+    bodies: dict[str, bytes]
+
+    def etag(self, encoding: str) -> str:
+        # Every coding is a different representation, so they get different strong ETags
+        return self.digest if encoding == "identity" else f"{self.digest}-{encoding}"
+
+
+def compress(body: bytes, mimetype: str) -> CachedResponse:
+    """Compresses a response body once, with gzip and brotli if it is installed
+
+    Args:
+        body (bytes): The uncompressed body
+        mimetype (str): The mimetype of the body
+
+    Returns:
+        CachedResponse: The body with its compressed variants"""
+    bodies = {"identity": body}
+    if len(body) >= MIN_COMPRESS_SIZE:
+        compressed = {"gzip": gzip.compress(body, GZIP_LEVEL, mtime=0)}
+        if brotli is not None:
+            compressed["br"] = brotli.compress(body, quality=BROTLI_QUALITY)
+        bodies.update(
+            (encoding, data) for encoding, data in compressed.items() if len(data) < len(body)
+        )
+    digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+    return CachedResponse(digest, mimetype, bodies)
+
+
+def negotiate(
+    cached: CachedResponse, accept_encoding: str = None, if_none_match: str = None
+) -> tuple[int, str]:
+    """Chooses the content coding of a cached response for the headers of a request
+
+    Args:
+        cached (CachedResponse): The cached response
+        accept_encoding (str, optional): The Accept-Encoding header. Defaults to None.
+        if_none_match (str, optional): The If-None-Match header. Defaults to None.
+
+    Returns:
+        tuple[int, str]: 304 if the client has any representation of the response already,
+            otherwise 200, and the content coding"""
+    encoding = parse_accept_header(accept_encoding).best_match(
+        [encoding for encoding in ("br", "gzip") if encoding in cached.bodies] + ["identity"],
+        default="identity",
+    )
+    etags = parse_etags(if_none_match)
+    if any(etags.contains_weak(cached.etag(tag)) for tag in cached.bodies):
+        return 304, encoding
+    return 200, encoding
+
+
+def response_headers(cached: CachedResponse, encoding: str) -> dict[str, str]:
+    """The headers of a response served from the cache in a content coding"""
+    headers = {
+        "ETag": quote_etag(cached.etag(encoding)),
+        "Vary": "Accept-Encoding",
+        # Clients may keep the response but have to revalidate it, which is a cheap 304
+        "Cache-Control": "no-cache",
+    }
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return headers
+
+
+class DirectoryBackend:
+    """Stores cached responses as files in a directory on the local disk, so that they are
+    shared by the worker processes of the API. Every generation has its own subdirectory and
+    older generations are removed when a new one is started.
+
+    Attributes:
+        directory (str): The directory of the cache
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._encoder = msgspec.msgpack.Encoder()
+        self._decoder = msgspec.msgpack.Decoder(CachedResponse)
+
+    def _path(self, generation: int, request: str) -> str:
+        name = hashlib.sha256(request.encode()).hexdigest()
+        return os.path.join(self.directory, str(generation), name)
+
+    def get(self, generation: int, request: str) -> CachedResponse:
+        """Gets a cached response, None if it is not stored or unreadable"""
+        try:
+            with open(self._path(generation, request), "rb") as f:
+                return self._decoder.decode(f.read())
+        except FileNotFoundError:
+            return None
+        except (OSError, msgspec.DecodeError) as e:
+            log.warning(f"Ignoring unreadable cached response for {request}: {e}")
+            return None
+
+    def set(self, generation: int, request: str, response: CachedResponse):
+        """Stores a response, failures are logged and ignored"""
+        path = self._path(generation, request)
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                self._remove_older(generation)
+            # Replaced at once, so other processes never read a partially written file
+            temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temporary, "wb") as f:
+                f.write(self._encoder.encode(response))
+            os.replace(temporary, path)
+        except OSError as e:
+            log.warning(f"Could not store cached response for {request}: {e}")
+
+    def _remove_older(self, generation: int):
+        for name in os.listdir(self.directory):
+            if name.isdigit() and int(name) < generation:
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+
+class ResponseCache:
+    """Cache of the responses of the read endpoints, in front of the database.
+
+    Responses are keyed by the data generation and the request path with its sorted query
+    parameters, so bumping the generation after storing receipts makes every cached response
+    stale at once, in every process. The least recently used responses of a process are dropped
+    beyond max_entries, the optional backend shares responses between processes. Bodies are
+    compressed once when they are stored and served as they are. Responses carry a strong ETag,
+    a matching If-None-Match is answered with 304 from the cache. Without entries and a backend
+    the cache is off and every request runs its view, which load tests of the database need.
+
+    Attributes:
+        hits (int): Number of responses served from this process
+        backend_hits (int): Number of responses served from the backend
+        misses (int): Number of responses that were computed
+        not_modified (int): Number of 304 responses
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 512,
+        backend: DirectoryBackend = None,
+        _generation=data_generation,
+    ):
+        self.max_entries = max_entries
+        self.backend = backend
+        self._generation = _generation
+        self._lock = threading.Lock()
+        self._responses = OrderedDict()
+        self.hits = 0
+        self.backend_hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 or self.backend is not None
+
+    def key(self, generation: int, path: str, args: list[tuple[str, str]]) -> tuple:
+        """The cache key of a request path with its query parameters"""
+        return (generation, f"{path}?{urlencode(sorted(args))}")
+
+    def _lookup_memory(self, key: tuple) -> CachedResponse:
+        with self._lock:
+            cached = self._responses.get(key)
+            if cached is not None:
+                self._responses.move_to_end(key)
+                self.hits += 1
+            return cached
+
+    def _lookup_backend(self, key: tuple) -> CachedResponse:
+        if self.backend is None:
+            return None
+        cached = self.backend.get(*key)
+        if cached is not None:
+            self._remember(key, cached)
+            with self._lock:
+                self.backend_hits += 1
+        return cached
+
+    def _lookup(self, key: tuple) -> CachedResponse:
+        cached = self._lookup_memory(key)
+        return cached if cached is not None else self._lookup_backend(key)
+
+    def _store(self, key: tuple, body: bytes, mimetype: str) -> CachedResponse:
+        """Compresses a computed response and stores it in this process and the backend"""
+        cached = compress(body, mimetype)
+        with self._lock:
+            self.misses += 1
+        self._remember(key, cached)
+        if self.backend is not None:
+            self.backend.set(*key, cached)
+        return cached
+
+    def _negotiate(self, cached: CachedResponse, headers) -> tuple[int, str]:
+        status, encoding = negotiate(
+            cached, headers.get("Accept-Encoding"), headers.get("If-None-Match")
+        )
+        if status == 304:
+            with self._lock:
+                self.not_modified += 1
+        return status, encoding
+
+    def _remember(self, key: tuple, response: CachedResponse):
+        with self._lock:
+            self._responses[key] = response
+            self._responses.move_to_end(key)
+            while len(self._responses) > self.max_entries:
+                self._responses.popitem(last=False)
+
+    def respond(self, view, *args, **kwargs) -> flask.Response:
+        """Serves the response of a view for the current request from the cache, the view is
+        only called on a miss. Responses other than 200 are not cached.
+
+        Args:
+            view (Callable): The view function
+            args: The positional arguments of the view
+            kwargs: The keyword arguments of the view
+
+        Returns:
+            Response: The cached response, or 304 if the client has it already"""
+        if not self.enabled:
+            return view(*args, **kwargs)
+        request = flask.request
+        # Read before the view runs, a bump during the view leaves the result under the old key
+        generation = self._generation.current()
+        key = self.key(generation, request.path, request.args.items(multi=True))
+        cached = self._lookup(key)
+        if cached is None:
+            response = flask.make_response(view(*args, **kwargs))
+            if response.status_code != 200 or response.direct_passthrough:
+                return response
+            cached = self._store(key, response.get_data(), response.mimetype)
+
+        status, encoding = self._negotiate(cached, request.headers)
+        if status == 304:
+            response = flask.Response(status=304)
+        else:
+            response = flask.Response(cached.bodies[encoding], mimetype=cached.mimetype)
+        response.headers.update(response_headers(cached, encoding))
+        return response
+
+    async def respond_async(self, request, view, *args, **kwargs):
+        """Serves the response of an async Starlette view like respond(). Reading the generation
+        and the backend, and compressing, are file and CPU work that runs on a thread, so the
+        event loop only waits for them.
+
+        Args:
+            request (starlette.requests.Request): The request
+            view (Callable): The async view function, called with the request and the arguments
+            args: The positional arguments of the view
+            kwargs: The keyword arguments of the view
+
+        Returns:
+            starlette.responses.Response: The cached response, or 304 if the client has it
+                already"""
+        from starlette.responses import Response
+
+        if not self.enabled:
+            return await view(request, *args, **kwargs)
+        generation = await asyncio.to_thread(self._generation.current)
+        key = self.key(generation, request.url.path, request.query_params.multi_items())
+        cached = self._lookup_memory(key)
+        if cached is None and self.backend is not None:
+            cached = await asyncio.to_thread(self._lookup_backend, key)
+        if cached is None:
+            response = await view(request, *args, **kwargs)
+            if response.status_code != 200 or not hasattr(response, "body"):
+                return response
+            mimetype = (response.media_type or "").split(";")[0]
+            cached = await asyncio.to_thread(self._store, key, response.body, mimetype)
+
+        status, encoding = self._negotiate(cached, request.headers)
+        headers = response_headers(cached, encoding)
+        if status == 304:
+            return Response(status_code=304, headers=headers)
+        return Response(cached.bodies[encoding], media_type=cached.mimetype, headers=headers)
+
+    def clear(self):
+        """Drops the responses cached by this process"""
+        with self._lock:
+            self._responses.clear()
+
+    def stats(self) -> dict:
+        """Gets the size and usage statistics of the cache
+
+        Returns:
+            dict: The statistics of the cache"""
+        with self._lock:
+            lookups = self.hits + self.backend_hits + self.misses
+            return {
+                "generation": self._generation.current(),
+                "responses": len(self._responses),
+                "hits": self.hits,
+                "backend_hits": self.backend_hits,
+                "misses": self.misses,
+                "not_modified": self.not_modified,
+                "hit_rate": (self.hits + self.backend_hits) / lookups if lookups else None,
+            }
+
+
+def cached_response(view):
+    """Decorator that serves a read endpoint through the response cache"""
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        return response_cache.respond(view, *args, **kwargs)
+
+    return wrapper
+
+
+def cached_response_async(view):
+    """Decorator that serves an async Starlette endpoint through the response cache"""
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        return await response_cache.respond_async(request, view, *args, **kwargs)
+
+    return wrapper
+
+
+_directory = config.get("response_cache_directory", default=None)
+response_cache = ResponseCache(
+    int(config.get("response_cache_entries", default=512)),
+    DirectoryBackend(_directory) if _directory else None,
+)
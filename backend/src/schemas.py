@@ -0,0 +1,322 @@
+import base64
+import datetime as dt
+from typing import Any
+
+import msgspec
+
+# Payload schemas of the AH API. Field names are the snake_case column names, rename="camel"
+# maps them to the camelCase keys of the API once per schema. Keys that are not declared are
+# skipped by the decoder without being materialized.
+
+
+class ApiProduct(msgspec.Struct, rename="camel"):
+    """A product of the AH product search, with the fields stored in ah_products and ah_product_details"""
+
+    webshop_id: int | str
+    title: str | None = None
+    sales_unit_size: str | None = None
+    price_before_bonus: float | None = None
+    sub_category: str | None = None
+    unit_price_description: str | None = None
+    current_price: float | None = None
+    hq_id: int | str | None = None
+    images: Any = None
+    order_availability_status: str | None = None
+    main_category: str | None = None
+    brand: str | None = None
+    shop_type: str | None = None
+    available_online: bool | None = None
+    is_previously_bought: bool | None = None
+    nutriscore: str | None = None
+    nix18: bool | None = None
+    is_stapel_bonus: bool | None = None
+    property_icons: Any = None
+    is_bonus: bool | None = None
+    is_orderable: bool | None = None
+    is_infinite_bonus: bool | None = None
+    is_sample: bool | None = None
+    is_sponsored: bool | None = None
+    discount_labels: Any = None
+    auction_id: int | str | None = None
+    bonus_start_date: str | None = None
+    bonus_end_date: str | None = None
+    discount_type: str | None = None
+    segment_type: str | None = None
+    promotion_type: str | None = None
+    bonus_mechanism: str | None = None
+    bonus_period_description: str | None = None
+    bonus_segment_id: int | str | None = None
+    bonus_segment_description: str | None = None
+    has_list_price: bool | None = None
+    is_bonus_price: bool | None = None
+    product_count: int | None = None
+    multiple_item_promotion: bool | None = None
+    stickers: Any = None
+    order_availability_description: str | None = None
+
+
+class PageInfo(msgspec.Struct, rename="camel", frozen=True):
+    total_pages: int = 0
+    total_elements: int = 0
+
+
+class SearchPage(msgspec.Struct):
+    """A page of the AH product search"""
+
+    products: list[ApiProduct] = []
+    page: PageInfo = PageInfo()
+
+
+class Link(msgspec.Struct):
+    href: str
+
+
+class PurchasesPage(msgspec.Struct):
+    """A page of the previously bought products"""
+
+    products: list[ApiProduct] = []
+    links: dict[str, Link] = {}
+
+
+class ReceiptUiItem(msgspec.Struct, omit_defaults=True):
+    """A row of the receiptUiItems of a receipt"""
+
+    type: str = ""
+    description: str | None = None
+    text: str | None = None
+    label: str | None = None
+    quantity: str | None = None
+    price: str | None = None
+    amount: str | None = None
+    indicator: str | None = None
+    value: str | None = None
+
+
+class ReceiptDetails(msgspec.Struct, rename="camel"):
+    receipt_ui_items: list[ReceiptUiItem] = []
+
+
+search_page_decoder = msgspec.json.Decoder(SearchPage)
+purchases_page_decoder = msgspec.json.Decoder(PurchasesPage)
+receipt_details_decoder = msgspec.json.Decoder(ReceiptDetails)
+receipt_items_decoder = msgspec.json.Decoder(list[ReceiptUiItem])
+
+
+def decode_receipt_details(data: bytes) -> list[ReceiptUiItem]:
+    """Decodes the receiptUiItems of a response of the receipt details endpoint. Receipts that
+    were archived before the responses were archived as received hold the bare list.
+
+    Args:
+        data (bytes): The JSON response, or the JSON list of receiptUiItems
+
+    Returns:
+        list[ReceiptUiItem]: The receiptUiItems"""
+    if data.lstrip().startswith(b"["):
+        return receipt_items_decoder.decode(data)
+    return receipt_details_decoder.decode(data).receipt_ui_items
+
+
+def product_values(product: ApiProduct) -> dict:
+    """Gets the column values of a product of the AH API
+
+    Args:
+        product (ApiProduct): The product
+
+    Returns:
+        dict: The values per snake_case column name"""
+    values = msgspec.structs.asdict(product)
+    values["webshop_id"] = str(product.webshop_id)
+    return values
+
+
+# Payload schemas of the grocery tracker API, served by app.py and asgi.py
+
+RECEIPTS_PAGE_SIZE = 50
+MAX_RECEIPTS_PAGE_SIZE = 500
+MAX_TOP_PRODUCTS = 100
+
+
+class ReceiptSummary(msgspec.Struct):
+    """A receipt in a list of receipts"""
+
+    id: int
+    transaction_id: str
+    datetime: dt.datetime
+    location: int | None
+    total_price: float | None
+    total_discount: float | None
+
+
+class ReceiptsPage(msgspec.Struct):
+    """A page of receipts, next_cursor is None on the last page"""
+
+    receipts: list[ReceiptSummary]
+    next_cursor: str | None = None
+
+
+class LocationDetail(msgspec.Struct):
+    id: int
+    name: str
+    address: str | None
+    house_number: str | None
+    postal_code: str | None
+    city: str | None
+
+
+class DiscountDetail(msgspec.Struct):
+    id: int
+    type: str | None
+    description: str | None
+    amount: float | None
+
+
+class PotentialProductDetail(msgspec.Struct):
+    id: int
+    webshop_id: str
+    title: str
+
+
+class ProductDetail(msgspec.Struct):
+    id: int
+    product_id: str | None
+    description: str | None
+    name: str | None
+    quantity: float | None
+    unit: str | None
+    price: float | None
+    total_price: float | None
+    product_not_found: bool | None
+    potential_products: list[PotentialProductDetail]
+
+
+class ReceiptDetail(ReceiptSummary):
+    """A receipt with its store, products and discounts"""
+
+    location_detail: LocationDetail | None
+    products: list[ProductDetail]
+    discounts: list[DiscountDetail]
+
+
+def receipt_detail(receipt) -> ReceiptDetail:
+    """Converts a receipt loaded with DbHandler.get_receipts_with_details
+
+    Args:
+        receipt (DbReceipt): The receipt with its relationships loaded
+
+    Returns:
+        ReceiptDetail: The receipt with its store, products and discounts"""
+    location = receipt.location_relation
+    return ReceiptDetail(
+        id=receipt.id,
+        transaction_id=receipt.transaction_id,
+        datetime=receipt.datetime,
+        location=receipt.location,
+        total_price=receipt.total_price,
+        total_discount=receipt.total_discount,
+        location_detail=LocationDetail(
+            location.id,
+            location.name,
+            location.address,
+            location.house_number,
+            location.postal_code,
+            location.city,
+        )
+        if location is not None
+        else None,
+        products=[
+            ProductDetail(
+                product.id,
+                product.product_id,
+                product.description,
+                product.name,
+                product.quantity,
+                product.unit,
+                product.price,
+                product.total_price,
+                product.product_not_found,
+                [
+                    PotentialProductDetail(
+                        potential.potential_ah_product,
+                        potential.ah_product_relation.webshop_id,
+                        potential.ah_product_relation.title,
+                    )
+                    for potential in product.potential_product_relation
+                ],
+            )
+            for product in sorted(receipt.products, key=lambda product: product.id)
+        ],
+        discounts=[
+            DiscountDetail(discount.id, discount.type, discount.description, discount.amount)
+            for discount in sorted(receipt.discounts, key=lambda discount: discount.id)
+        ],
+    )
+
+
+class ExportLine(msgspec.Struct, gc=False):
+    """A product or discount line of a receipt in an export, see database/export.py"""
+
+    receipt_id: int
+    transaction_id: str
+    datetime: dt.datetime | None
+    store: str | None
+    line_type: str
+    line_id: int
+    description: str | None
+    name: str | None
+    product_id: str | None
+    quantity: int | None
+    unit: str | None
+    price: float | None
+    total_price: float | None
+    discount: float | None
+    category: str | None
+
+
+json_encoder = msgspec.json.Encoder()
+_cursor_decoder = msgspec.json.Decoder(tuple[dt.datetime, int])
+
+
+def encode_cursor(datetime: dt.datetime, id: int) -> str:
+    """Encodes the keyset of the last receipt of a page as an opaque cursor
+
+    Args:
+        datetime (datetime): The datetime of the receipt
+        id (int): The ID of the receipt
+
+    Returns:
+        str: The cursor"""
+    return base64.urlsafe_b64encode(json_encoder.encode((datetime, id))).decode("ascii")
+
+
+def receipts_page(rows: list, limit: int) -> ReceiptsPage:
+    """Builds a page of receipts from up to limit + 1 rows, the extra row tells whether there is
+    a next page
+
+    Args:
+        rows (list[Row]): The rows of the receipts
+        limit (int): The size of the page
+
+    Returns:
+        ReceiptsPage: The page with the cursor of the next page"""
+    receipts = [ReceiptSummary(*row) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor(receipts[-1].datetime, receipts[-1].id)
+    return ReceiptsPage(receipts, next_cursor)
+
+
+def decode_cursor(cursor: str) -> tuple[dt.datetime, int]:
+    """Decodes a cursor made by encode_cursor
+
+    Args:
+        cursor (str): The cursor
+
+    Returns:
+        tuple[datetime, int]: The datetime and ID of the receipt
+
+    Raises:
+        ValueError: If the cursor is not valid"""
+    try:
+        return _cursor_decoder.decode(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (msgspec.DecodeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
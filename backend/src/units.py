@@ -0,0 +1,100 @@
+import re
+
+# Normalized unit and the factor to convert to it
+UNITS = {
+    "kg": ("kg", 1.0),
+    "kilo": ("kg", 1.0),
+    "g": ("kg", 0.001),
+    "gr": ("kg", 0.001),
+    "gram": ("kg", 0.001),
+    "l": ("l", 1.0),
+    "lt": ("l", 1.0),
+    "liter": ("l", 1.0),
+    "ml": ("l", 0.001),
+    "cl": ("l", 0.01),
+    "st": ("st", 1.0),
+    "stuk": ("st", 1.0),
+    "stuks": ("st", 1.0),
+}
+_NUMBER = r"(\d+(?:[.,]\d+)?)"
+_UNIT = r"(kg|kilo|gram|gr|g|liter|lt|ml|cl|l|stuks|stuk|st)\b"
+UNIT_PRICE_REGEX = re.compile(
+    rf"per\s+(?:{_NUMBER}\s*)?{_UNIT}\D*?(\d+[.,]\d+)", re.IGNORECASE
+)
+UNIT_PRICE_FALLBACK_REGEX = re.compile(r"(\d+[.,]\d+)")
+UNIT_SIZE_REGEX = re.compile(
+    rf"(?:(\d+)\s*x\s*)?{_NUMBER}\s*{_UNIT}", re.IGNORECASE
+)
+
+
+def _to_float(string: str) -> float:
+    return float(string.replace(",", "."))
+
+
+def parse_unit_price(description: str) -> tuple[float, str]:
+    """Parses a unit price description like "Prijs per KG €8.98" into a price per normalized unit.
+
+    Args:
+        description (str): The unit price description.
+
+    Returns:
+        tuple[float, str]: The price per unit ("kg", "l" or "st") and the unit. The unit is None if it
+            could not be recognized, both are None if there is no price in the description.
+    """
+    if not description or not isinstance(description, str):
+        return None, None
+    match = UNIT_PRICE_REGEX.search(description)
+    if match is None:
+        fallback = UNIT_PRICE_FALLBACK_REGEX.search(description)
+        if fallback is None:
+            return None, None
+        return _to_float(fallback.group(1)), None
+    amount, unit, price = match.groups()
+    unit, factor = UNITS[unit.lower()]
+    amount = _to_float(amount) if amount else 1.0
+    price = _to_float(price)
+    if amount * factor != 1.0:
+        price = round(price / (amount * factor), 4)
+    return price, unit
+
+
+def parse_unit_size(sales_unit_size: str) -> tuple[float, str]:
+    """Parses a sales unit size like "500 g", "6 x 330 ml" or "4 stuks" into an amount of a normalized unit.
+
+    Args:
+        sales_unit_size (str): The sales unit size.
+
+    Returns:
+        tuple[float, str]: The size in the normalized unit ("kg", "l" or "st") and the unit, both None if
+            the size could not be parsed.
+    """
+    if not sales_unit_size or not isinstance(sales_unit_size, str):
+        return None, None
+    match = UNIT_SIZE_REGEX.search(sales_unit_size)
+    if match is None:
+        return None, None
+    count, amount, unit = match.groups()
+    unit, factor = UNITS[unit.lower()]
+    size = (int(count) if count else 1) * _to_float(amount) * factor
+    return round(size, 4), unit
+
+
+def parse_units(unit_price_description: str, sales_unit_size: str) -> dict:
+    """Parses the unit price and unit size of a catalog product into the unit_price, unit and unit_size columns.
+    The unit is taken from the unit price, the size is only kept if it is expressed in the same unit.
+
+    Args:
+        unit_price_description (str): The unit price description.
+        sales_unit_size (str): The sales unit size.
+
+    Returns:
+        dict: The unit_price, unit and unit_size values.
+    """
+    unit_price, price_unit = parse_unit_price(unit_price_description)
+    unit_size, size_unit = parse_unit_size(sales_unit_size)
+    unit = price_unit or size_unit
+    return {
+        "unit_price": unit_price,
+        "unit": unit,
+        "unit_size": unit_size if size_unit == unit else None,
+    }
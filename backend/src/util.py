@@ -1,6 +1,20 @@
 import deepl
 from config import Config
+
+# Re-exported, the unit parsing lives in units.py so the database models can import it without
+# deepl and the config
+from units import (  # noqa: F401
+    UNITS,
+    UNIT_PRICE_REGEX,
+    UNIT_PRICE_FALLBACK_REGEX,
+    UNIT_SIZE_REGEX,
+    parse_unit_price,
+    parse_unit_size,
+    parse_units,
+)
 import logging
+import threading
+import time
 
 # change logging level to warning for deepl
 logging.getLogger("deepl").setLevel(logging.WARNING)
@@ -40,3 +54,40 @@ def translate(
         text, source_lang=source_language, target_lang=target_language
     ).text
     return translated_text
+
+
+class RateLimiter:
+    """Thread-safe token bucket that limits how often an action can be performed.
+
+    Attributes:
+        rate (float): Number of actions per second
+        burst (int): Number of actions that can be performed at once after being idle
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Waits until an action may be performed."""
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.burst, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+# Shared by every search of the AH API in this process
+api_rate_limiter = RateLimiter(float(config.get("api_rate_limit", default=5)))
@@ -0,0 +1,54 @@
+"""Fixtures shared by the tests.
+
+Tests that need the database use the Postgres database of the config file in the
+GROCITRACK_TEST_CONFIG environment variable. It is migrated on first use and emptied before every
+test, so it must be a database of its own. Without the variable these tests are skipped, the
+other tests read the settings of config-template.yml.
+
+Usage: GROCITRACK_TEST_CONFIG=test-config.yml python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import config  # noqa: E402
+
+TEST_CONFIG = os.environ.get("GROCITRACK_TEST_CONFIG")
+# Must be set before any module reads the config
+config.config_path = TEST_CONFIG or os.path.join(
+    os.path.dirname(__file__), "..", "config-template.yml"
+)
+
+# Tables that are not emptied between tests
+KEPT_TABLES = {"schema_migrations"}
+
+
+@pytest.fixture(scope="session")
+def engine():
+    if not TEST_CONFIG:
+        pytest.skip("Set GROCITRACK_TEST_CONFIG to run the tests that need the database")
+    from database.setup import engine
+
+    return engine
+
+
+@pytest.fixture
+def db(engine, monkeypatch):
+    """The engine of an empty, migrated test database. Every DbHandler of the test raises on lazy
+    loads of relationships, so N+1 queries fail the test."""
+    from sqlalchemy import text
+    from database.model import Base
+    from database.cache import reference_cache
+
+    tables = ", ".join(
+        table.name for table in Base.metadata.sorted_tables if table.name not in KEPT_TABLES
+    )
+    with engine.begin() as connection:
+        connection.execute(text(f"TRUNCATE {tables} RESTART IDENTITY CASCADE"))
+    reference_cache.invalidate()
+    monkeypatch.setitem(config.Config()._config, "raise_on_lazy_load", True)
+    return engine
+
@@ -0,0 +1,240 @@
+"""The analytics queries on a few receipts, against totals worked out by hand."""
+import datetime as dt
+
+import pytest
+from sqlalchemy.orm import Session
+
+UTC = dt.timezone.utc
+# (moment, location, discount, [(webshop id, quantity, price)])
+RECEIPTS = [
+    (dt.datetime(2024, 1, 10, 10, tzinfo=UTC), 1, 0.5, [("wi1", 2, 1.00), ("wi2", 1, 3.00)]),
+    # February 1st in Amsterdam, where the rollup days are
+    (dt.datetime(2024, 1, 31, 23, 30, tzinfo=UTC), 2, 0.0, [("wi1", 1, 1.20), ("wi2", 1, 2.10)]),
+    (dt.datetime(2024, 2, 15, 12, tzinfo=UTC), 1, 1.0, [("wi2", 2, 3.30)]),
+]
+JANUARY = dt.date(2024, 1, 1)
+FEBRUARY = dt.date(2024, 2, 1)
+
+
+def store(engine):
+    """Stores the receipts in the categories Zuivel > Melk (wi1) and Groente (wi2), and builds
+    the rollups"""
+    from database.model import (
+        DbCategory,
+        DbCategoryClosure,
+        DbCategoryProduct,
+        DbDiscount,
+        DbLocation,
+        DbProduct,
+        DbReceipt,
+    )
+    from database.rollups import refresh_rollups
+
+    with Session(engine) as session:
+        session.add_all(
+            [
+                DbLocation(
+                    id=1,
+                    name="AH Stationsstraat",
+                    address="Stationsstraat",
+                    house_number="1",
+                    city="Zaandam",
+                    postal_code="1234 AB",
+                ),
+                DbLocation(
+                    id=2,
+                    name="AH Dam",
+                    address="Dam",
+                    house_number="1",
+                    city="Amsterdam",
+                    postal_code="1012 JS",
+                ),
+                DbCategory(name="Zuivel", slug="zuivel", english="Dairy", taxonomy_id="1"),
+                DbCategory(name="Melk", slug="melk", english="Milk", taxonomy_id="101"),
+                DbCategory(name="Groente", slug="groente", english="Vegetables", taxonomy_id="2"),
+            ]
+        )
+        session.flush()
+        session.add_all(
+            DbCategoryClosure(ancestor=ancestor, descendant=descendant, depth=depth)
+            for ancestor, descendant, depth in [
+                ("1", "1", 0),
+                ("101", "101", 0),
+                ("2", "2", 0),
+                ("1", "101", 1),
+            ]
+        )
+        # Products are assigned to their category and its ancestors
+        session.add_all(
+            DbCategoryProduct(product_id=product_id, taxonomy_id=taxonomy_id)
+            for product_id, taxonomy_id in [("wi1", "101"), ("wi1", "1"), ("wi2", "2")]
+        )
+        for index, (moment, location, discount, lines) in enumerate(RECEIPTS):
+            total = sum(quantity * price for _, quantity, price in lines)
+            receipt = DbReceipt(
+                transaction_id=f"AH-{index}",
+                datetime=moment,
+                location=location,
+                total_price=total,
+                total_discount=discount,
+            )
+            session.add(receipt)
+            session.flush()
+            session.add_all(
+                DbProduct(
+                    receipt=receipt.id,
+                    description=product_id.upper(),
+                    product_id=product_id,
+                    name=product_id,
+                    quantity=quantity,
+                    price=price,
+                    total_price=quantity * price,
+                    product_not_found=False,
+                )
+                for product_id, quantity, price in lines
+            )
+            if discount:
+                session.add(
+                    DbDiscount(
+                        receipt=receipt.id, type="BONUS", description="BONUS", amount=discount
+                    )
+                )
+        session.flush()
+        refresh_rollups(session)
+        session.commit()
+
+
+@pytest.fixture
+def analytics_db(db):
+    store(db)
+    return db
+
+
+def run(engine, query, **params) -> list[dict]:
+    from database.analytics import run
+
+    with Session(engine) as session:
+        return run(session, query, **params)
+
+
+def columns(rows: list[dict], *names: str) -> list[tuple]:
+    return [tuple(row[name] for name in names) for row in rows]
+
+
+def test_spend_by_category(analytics_db):
+    from database.analytics import spend_by_category
+
+    names = ("taxonomy_id", "name", "total", "lines", "receipts")
+    assert list(run(analytics_db, spend_by_category)[0]) == list(names)
+    assert columns(run(analytics_db, spend_by_category), *names) == [
+        ("2", "Groente", pytest.approx(11.7), 3, 3),
+        ("1", "Zuivel", pytest.approx(3.2), 2, 2),
+    ]
+    assert columns(run(analytics_db, spend_by_category, parent="1"), *names) == [
+        ("101", "Melk", pytest.approx(3.2), 2, 2)
+    ]
+    january = run(
+        analytics_db,
+        spend_by_category,
+        since=dt.datetime(2024, 1, 1, tzinfo=UTC),
+        until=dt.datetime(2024, 2, 1, tzinfo=UTC),
+    )
+    assert columns(january, "name", "total") == [
+        ("Groente", pytest.approx(3.0)),
+        ("Zuivel", pytest.approx(2.0)),
+    ]
+
+
+def test_spend_by_store(analytics_db):
+    from database.analytics import spend_by_store
+
+    assert run(analytics_db, spend_by_store) == [
+        {
+            "location": 1,
+            "name": "AH Stationsstraat",
+            "city": "Zaandam",
+            "total": pytest.approx(11.6),
+            "discount": pytest.approx(1.5),
+            "receipts": 2,
+            "first_visit": dt.date(2024, 1, 10),
+            "last_visit": dt.date(2024, 2, 15),
+        },
+        {
+            "location": 2,
+            "name": "AH Dam",
+            "city": "Amsterdam",
+            "total": pytest.approx(3.3),
+            "discount": 0.0,
+            "receipts": 1,
+            "first_visit": FEBRUARY,
+            "last_visit": FEBRUARY,
+        },
+    ]
+
+
+def test_spend_over_time(analytics_db):
+    from database.analytics import spend_over_time
+
+    names = ("period", "total", "receipts", "cumulative_total")
+    assert list(run(analytics_db, spend_over_time)[0]) == list(names)
+    assert columns(run(analytics_db, spend_over_time), *names) == [
+        (JANUARY, pytest.approx(5.0), 1, pytest.approx(5.0)),
+        (FEBRUARY, pytest.approx(9.9), 2, pytest.approx(14.9)),
+    ]
+    by_category = run(analytics_db, spend_over_time, category="1")
+    assert columns(by_category, "period", "total", "cumulative_total") == [
+        (JANUARY, pytest.approx(2.0), pytest.approx(2.0)),
+        (FEBRUARY, pytest.approx(1.2), pytest.approx(3.2)),
+    ]
+    # Days start in the rollup timezone, the receipt of January 31st 23:30 UTC is in February
+    since = run(analytics_db, spend_over_time, since=dt.datetime(2024, 2, 1))
+    assert columns(since, "period", "receipts") == [(FEBRUARY, 2)]
+    weeks = run(analytics_db, spend_over_time, period="week")
+    assert [row["period"] for row in weeks] == [
+        dt.date(2024, 1, 8),
+        dt.date(2024, 1, 29),
+        dt.date(2024, 2, 12),
+    ]
+    with pytest.raises(ValueError):
+        spend_over_time(period="year")
+
+
+def test_top_products(analytics_db):
+    from database.analytics import top_products
+
+    rows = run(analytics_db, top_products)
+    assert columns(rows, "rank", "product_id", "lines", "quantity", "last_purchase") == [
+        (1, "wi2", 3, 4.0, RECEIPTS[2][0]),
+        (2, "wi1", 2, 3.0, RECEIPTS[1][0]),
+    ]
+    assert rows[0]["total"] == pytest.approx(11.7)
+    assert rows[0]["average_price"] == pytest.approx((3.00 + 2.10 + 3.30) / 3)
+    assert rows[1]["average_price"] == pytest.approx((1.00 + 1.20) / 2)
+    assert [row["product_id"] for row in run(analytics_db, top_products, limit=1)] == ["wi2"]
+    assert [row["product_id"] for row in run(analytics_db, top_products, order="count")] == [
+        "wi2",
+        "wi1",
+    ]
+    with pytest.raises(ValueError):
+        top_products(order="price")
+
+
+def test_savings_over_time(analytics_db):
+    from database.analytics import savings_over_time
+
+    assert run(analytics_db, savings_over_time) == [
+        {
+            "period": JANUARY,
+            "discount": pytest.approx(0.5),
+            "total": pytest.approx(5.0),
+            "savings_rate": pytest.approx(0.5 / 5.5),
+            "cumulative_discount": pytest.approx(0.5),
+        },
+        {
+            "period": FEBRUARY,
+            "discount": pytest.approx(1.0),
+            "total": pytest.approx(9.9),
+            "savings_rate": pytest.approx(1.0 / 10.9),
+            "cumulative_discount": pytest.approx(1.5),
+        },
+    ]
@@ -0,0 +1,90 @@
+import pytest
+
+pytest.importorskip("starlette")
+
+from starlette.applications import Starlette  # noqa: E402
+from starlette.exceptions import HTTPException  # noqa: E402
+from starlette.responses import Response  # noqa: E402
+from starlette.routing import Route  # noqa: E402
+from starlette.testclient import TestClient  # noqa: E402
+
+from test_replica import Generation  # noqa: E402
+
+BODY = b'{"spend": [' + b", ".join(b"%d" % number for number in range(1000)) + b"]}"
+
+
+def cached_app(cache):
+    """A Starlette app with a counting endpoint behind the response cache"""
+    calls = []
+
+    async def spend(request):
+        calls.append(request.url.path)
+        if request.query_params.get("missing"):
+            raise HTTPException(404, detail="Not found")
+        return Response(BODY, media_type="application/json")
+
+    async def endpoint(request):
+        return await cache.respond_async(request, spend)
+
+    return Starlette(routes=[Route("/api/analytics/spend", endpoint)]), calls
+
+
+def test_async_response_cache():
+    from response_cache import ResponseCache
+
+    generation = Generation()
+    cache = ResponseCache(_generation=generation)
+    app, calls = cached_app(cache)
+    client = TestClient(app)
+
+    first = client.get("/api/analytics/spend", headers={"Accept-Encoding": "identity"})
+    assert first.status_code == 200
+    assert first.content == BODY
+    assert first.headers["content-type"] == "application/json"
+    assert first.headers["vary"] == "Accept-Encoding"
+    assert first.headers["cache-control"] == "no-cache"
+    assert "content-encoding" not in first.headers
+
+    compressed = client.get("/api/analytics/spend", headers={"Accept-Encoding": "gzip"})
+    assert compressed.headers["content-encoding"] == "gzip"
+    assert compressed.content == BODY
+    assert compressed.headers["etag"] != first.headers["etag"]
+    assert calls == ["/api/analytics/spend"]
+
+    # Any representation of the client is current
+    not_modified = client.get(
+        "/api/analytics/spend",
+        headers={"Accept-Encoding": "identity", "If-None-Match": compressed.headers["etag"]},
+    )
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+    assert not_modified.headers["etag"] == first.headers["etag"]
+    assert (cache.hits, cache.misses, cache.not_modified) == (2, 1, 1)
+
+    # Errors are passed through and not cached
+    assert client.get("/api/analytics/spend?missing=1").status_code == 404
+    assert client.get("/api/analytics/spend?missing=1").status_code == 404
+    assert cache.misses == 1
+
+    generation.generation += 1
+    client.get("/api/analytics/spend")
+    assert calls.count("/api/analytics/spend") == 4
+
+
+def test_asgi_routes_are_cached(db):
+    import asgi
+    from response_cache import response_cache
+
+    from test_queries import MOMENTS, store_receipts
+
+    receipt_id = store_receipts(db, MOMENTS[:1])[0]
+    response_cache.clear()
+    with TestClient(asgi.app) as client:
+        response = client.get(f"/api/receipts/{receipt_id}")
+        again = client.get(
+            f"/api/receipts/{receipt_id}", headers={"If-None-Match": response.headers["etag"]}
+        )
+        assert client.get("/api/receipts/0").status_code == 404
+    assert response.status_code == 200
+    assert response.json()["id"] == receipt_id
+    assert again.status_code == 304
@@ -0,0 +1,49 @@
+import gzip
+import json
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+
+def write_snapshot(directory, columns: list[str], rows: list[tuple]):
+    """Writes a snapshot of ah_products with only the given columns, like one of a database from
+    before the unit columns existed"""
+    with gzip.open(directory / "ah_products.copy.gz", "wt") as file:
+        for row in rows:
+            file.write("\t".join(row) + "\n")
+    manifest = {
+        "format_version": 1,
+        "tables": [
+            {
+                "table": "ah_products",
+                "columns": columns,
+                "file": "ah_products.copy.gz",
+                "rows": len(rows),
+            }
+        ],
+    }
+    (directory / "manifest.json").write_text(json.dumps(manifest))
+
+
+def test_load_snapshot_parses_units(db, tmp_path):
+    from database.bootstrap import load_snapshot
+    from database.model import DbAHProduct
+
+    write_snapshot(
+        tmp_path,
+        ["id", "webshop_id", "title", "sales_unit_size", "unit_price_description"],
+        [
+            ("1", "wi1525", "AH Halfvolle melk", "1 l", "Prijs per L €1.19"),
+            ("2", "wi4500", "AH Jonge kaas", "500 g", "Prijs per KG €7.98"),
+        ],
+    )
+
+    assert load_snapshot(db, str(tmp_path)) == {"ah_products": 2}
+
+    with Session(db) as session:
+        units = session.execute(
+            select(DbAHProduct.unit_price, DbAHProduct.unit, DbAHProduct.unit_size).order_by(
+                DbAHProduct.id
+            )
+        ).all()
+    assert units == [(1.19, "l", 1.0), (7.98, "kg", 0.5)]
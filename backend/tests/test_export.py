@@ -0,0 +1,145 @@
+import csv
+import datetime as dt
+import io
+import json
+
+import pytest
+from sqlalchemy.orm import Session
+
+from test_queries import MOMENTS, store_receipts
+
+MOMENT = dt.datetime(2024, 3, 1, 10, 30, tzinfo=dt.timezone.utc)
+VALUES = {
+    "receipt_id": 1,
+    "transaction_id": "AH-1",
+    "datetime": MOMENT,
+    "store": "AH Stationsstraat",
+    "line_type": "product",
+    "line_id": 3,
+    "description": "HALFVOLLE MELK",
+    "name": "AH Halfvolle melk",
+    "product_id": "wi1525",
+    "quantity": 2,
+    "unit": None,
+    "price": 1.19,
+    "total_price": 2.38,
+    "discount": None,
+    "category": "Zuivel > Melk",
+}
+
+
+def export_row(**values) -> tuple:
+    """A row of export_rows(), the columns in the order of EXPORT_COLUMNS"""
+    from database.export import EXPORT_COLUMNS
+
+    values = {**VALUES, **values}
+    return tuple(values[name] for name in EXPORT_COLUMNS)
+
+
+ROWS = [
+    export_row(),
+    export_row(
+        line_type="discount",
+        line_id=4,
+        description="AHMELK",
+        name=None,
+        product_id=None,
+        quantity=None,
+        price=None,
+        total_price=None,
+        discount=0.5,
+        category=None,
+    ),
+]
+
+
+def test_export_query_columns():
+    from database.export import EXPORT_COLUMNS, export_query
+    from schemas import ExportLine
+
+    assert list(export_query().selected_columns.keys()) == EXPORT_COLUMNS
+    assert EXPORT_COLUMNS == list(ExportLine.__struct_fields__)
+
+
+def test_ndjson_chunks():
+    from database.export import ndjson_chunks
+
+    chunks = list(ndjson_chunks(iter([ROWS[:1], ROWS[1:]])))
+
+    assert len(chunks) == 2
+    lines = [json.loads(line) for chunk in chunks for line in chunk.splitlines()]
+    assert lines[0] == {**VALUES, "datetime": "2024-03-01T10:30:00Z"}
+    assert lines[1]["line_type"] == "discount"
+    assert lines[1]["discount"] == 0.5
+    assert list(ndjson_chunks(iter([]))) == []
+
+
+def test_csv_chunks():
+    from database.export import EXPORT_COLUMNS, csv_chunks
+
+    chunks = list(csv_chunks(iter([ROWS[:1], ROWS[1:]])))
+
+    # The header goes with the first chunk
+    assert len(chunks) == 2
+    rows = list(csv.DictReader(io.StringIO(b"".join(chunks).decode())))
+    assert list(rows[0]) == EXPORT_COLUMNS
+    assert rows[0]["datetime"] == "2024-03-01T10:30:00+00:00"
+    assert rows[0]["total_price"] == "2.38"
+    assert rows[0]["unit"] == ""
+    assert rows[1]["description"] == "AHMELK"
+    assert rows[1]["discount"] == "0.5"
+
+
+def test_csv_chunks_without_rows():
+    from database.export import EXPORT_COLUMNS, csv_chunks
+
+    assert b"".join(csv_chunks(iter([]))).decode() == ",".join(EXPORT_COLUMNS) + "\n"
+    assert b"".join(csv_chunks(iter([[]]))).decode() == ",".join(EXPORT_COLUMNS) + "\n"
+
+
+def test_write_parquet(tmp_path):
+    pytest.importorskip("pyarrow")
+    import pyarrow.parquet
+    from database.export import EXPORT_COLUMNS, write_parquet
+
+    path = str(tmp_path / "export.parquet")
+    assert write_parquet(path, iter([ROWS[:1], ROWS[1:]])) == 2
+
+    file = pyarrow.parquet.ParquetFile(path)
+    assert file.schema_arrow.names == EXPORT_COLUMNS
+    # A row group per chunk
+    assert file.metadata.num_row_groups == 2
+    assert file.read().to_pylist() == [dict(zip(EXPORT_COLUMNS, row)) for row in ROWS]
+
+    empty = str(tmp_path / "empty.parquet")
+    assert write_parquet(empty, iter([])) == 0
+    table = pyarrow.parquet.read_table(empty)
+    assert table.num_rows == 0
+    assert table.schema.names == EXPORT_COLUMNS
+
+
+def test_export_rows(db):
+    from database.export import EXPORT_COLUMNS, csv_chunks, export_rows
+
+    store_receipts(db, MOMENTS[:2])
+    with Session(db) as session:
+        connection = session.connection()
+        chunks = list(export_rows(connection, chunk_size=4))
+        since = list(export_rows(connection, since=MOMENTS[0]))
+        text = b"".join(csv_chunks(export_rows(connection, chunk_size=4))).decode()
+
+    # Two products and a discount per receipt, the oldest receipt first
+    assert [len(chunk) for chunk in chunks] == [4, 2]
+    rows = [row._asdict() for chunk in chunks for row in chunk]
+    assert list(rows[0]) == EXPORT_COLUMNS
+    assert [(row["transaction_id"], row["line_type"]) for row in rows[:3]] == [
+        ("AH-TEST-1", "product"),
+        ("AH-TEST-1", "product"),
+        ("AH-TEST-1", "discount"),
+    ]
+    assert rows[2]["discount"] == 0.1
+    assert [row.transaction_id for chunk in since for row in chunk] == ["AH-TEST-0"] * 3
+    lines = list(csv.DictReader(io.StringIO(text)))
+    assert lines[0]["datetime"] == MOMENTS[1].isoformat()
+    descriptions = [line["description"] for line in lines[:3]]
+    assert descriptions == ["HALFVOLLE MELK", "BANANEN", "AHBANANEN"]
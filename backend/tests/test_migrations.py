@@ -0,0 +1,74 @@
+import pytest
+from sqlalchemy import text
+
+from test_queries import MOMENTS, store_receipts
+
+
+@pytest.fixture
+def duplicates(db):
+    """Three copies of a transaction: the first without its second line, the other two complete.
+    The unique index on transaction_id is dropped for the test.
+
+    Yields:
+        tuple[Engine, list[int]]: The engine and the receipt IDs"""
+    with db.begin() as connection:
+        connection.execute(text("DROP INDEX receipts_transaction_id_unique_index"))
+    receipts = store_receipts(db, MOMENTS[:3])
+    with db.begin() as connection:
+        connection.execute(text("UPDATE receipts SET transaction_id = 'AH-TEST-0'"))
+        connection.execute(
+            text("DELETE FROM products WHERE receipt = :id AND description = 'BANANEN'"),
+            {"id": receipts[0]},
+        )
+    try:
+        yield db, receipts
+    finally:
+        with db.begin() as connection:
+            connection.execute(text("TRUNCATE receipts CASCADE"))
+            connection.execute(
+                text(
+                    "CREATE UNIQUE INDEX receipts_transaction_id_unique_index "
+                    "ON receipts (transaction_id)"
+                )
+            )
+
+
+def test_duplicate_receipts_stop_the_migration(duplicates):
+    from database.migrations import MIGRATIONS
+
+    engine, receipts = duplicates
+    migration = next(migration for migration in MIGRATIONS if migration.version == 4)
+    with engine.connect() as connection:
+        with pytest.raises(RuntimeError) as error:
+            migration.check(connection)
+        # Nothing was removed
+        assert connection.execute(text("SELECT count(*) FROM receipts")).scalar_one() == 3
+    assert f"AH-TEST-0 (receipts {receipts[1]}, {receipts[2]}, {receipts[0]})" in str(error.value)
+    assert "manage.py dedupe-receipts" in str(error.value)
+
+
+def test_remove_duplicate_receipts(duplicates, caplog):
+    from database.migrations import duplicate_receipts, remove_duplicate_receipts
+    from database.rollups import verify_rollups, refresh_rollups
+
+    engine, receipts = duplicates
+    with engine.begin() as connection:
+        refresh_rollups(connection)
+        copies = duplicate_receipts(connection)
+        assert [(row["receipt"], row["lines"], row["kept"]) for row in copies] == [
+            (receipts[1], 2, receipts[1]),
+            (receipts[2], 2, receipts[1]),
+            (receipts[0], 1, receipts[1]),
+        ]
+        assert remove_duplicate_receipts(connection) == [receipts[2], receipts[0]]
+        assert duplicate_receipts(connection) == []
+        assert remove_duplicate_receipts(connection) == []
+        remaining = connection.execute(text("SELECT receipt FROM products")).scalars().all()
+        assert remaining == [receipts[1]] * 2
+        # The rollups of the days of the removed copies were recomputed
+        assert not any(
+            row["missing"] or row["extra"] or row["different"]
+            for row in verify_rollups(connection)
+        )
+    for receipt in (receipts[0], receipts[2]):
+        assert f"Removed receipt {receipt} " in caplog.text
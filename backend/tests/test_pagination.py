@@ -0,0 +1,58 @@
+import datetime as dt
+
+import pytest
+
+from schemas import decode_cursor, encode_cursor, receipts_page
+
+
+def test_cursor_round_trip():
+    moment = dt.datetime(2024, 3, 1, 10, 30, tzinfo=dt.timezone.utc)
+
+    cursor = encode_cursor(moment, 42)
+
+    assert decode_cursor(cursor) == (moment, 42)
+
+
+def test_invalid_cursor():
+    for cursor in ["", "not a cursor", encode_cursor(dt.datetime(2024, 3, 1), 1)[:-4]]:
+        with pytest.raises(ValueError):
+            decode_cursor(cursor)
+
+
+def test_receipts_page():
+    moment = dt.datetime(2024, 3, 1, tzinfo=dt.timezone.utc)
+    rows = [(id, f"AH-{id}", moment, None, 1.0, 0.0) for id in (3, 2, 1)]
+
+    page = receipts_page(rows, 2)
+
+    assert [receipt.id for receipt in page.receipts] == [3, 2]
+    assert decode_cursor(page.next_cursor) == (moment, 2)
+    assert receipts_page(rows, 3).next_cursor is None
+
+
+def test_receipts_limit(db):
+    pytest.importorskip("starlette")
+    from starlette.testclient import TestClient
+
+    import asgi
+    from response_cache import response_cache
+    from schemas import MAX_RECEIPTS_PAGE_SIZE
+
+    from test_queries import MOMENTS, store_receipts
+
+    receipt_ids = store_receipts(db, MOMENTS[:3])
+    response_cache.clear()
+    with TestClient(asgi.app) as client:
+        # A limit of 0 is rejected, not taken as the default page size
+        assert client.get("/api/receipts?limit=0").status_code == 400
+        too_large = client.get(f"/api/receipts?limit={MAX_RECEIPTS_PAGE_SIZE + 1}")
+        assert too_large.status_code == 400
+        default = client.get("/api/receipts").json()
+        first = client.get("/api/receipts?limit=2").json()
+        second = client.get(f"/api/receipts?limit=2&cursor={first['next_cursor']}").json()
+
+    # MOMENTS go back in time, the newest receipt was stored first
+    assert [receipt["id"] for receipt in default["receipts"]] == receipt_ids
+    assert default["next_cursor"] is None
+    assert [receipt["id"] for receipt in first["receipts"] + second["receipts"]] == receipt_ids
+    assert second["next_cursor"] is None
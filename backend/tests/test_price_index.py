@@ -0,0 +1,168 @@
+"""The price index engine on lines in memory, the database is not used."""
+import datetime as dt
+
+import numpy as np
+import pytest
+
+from test_replica import Generation
+
+
+def days(*dates: dt.date) -> list[int]:
+    from price_index import EPOCH
+
+    return [(date - EPOCH).days for date in dates]
+
+
+def links_of(lines: list[tuple], period: str = "month"):
+    """The links of all lines, as (receipt, day, location, product, quantity, price)"""
+    from price_index import PurchaseLines, price_links
+
+    purchase_lines = PurchaseLines()
+    purchase_lines.append(*zip(*lines))
+    return price_links(purchase_lines, np.ones(len(purchase_lines), bool), period)
+
+
+def test_price_links_by_hand():
+    from price_index import period_start
+
+    january, february, march = days(dt.date(2024, 1, 5), dt.date(2024, 2, 5), dt.date(2024, 3, 5))
+    links = links_of(
+        [
+            # Product 0 costs 1.00 on average in January, weighted by quantity
+            (1, january, 1, 0, 1, 0.90),
+            (1, january, 1, 0, 1, 1.10),
+            (1, january, 1, 1, 1, 3.00),
+            (2, february, 1, 0, 1, 1.20),
+            (2, february, 1, 1, 2, 3.30),
+            # Only product 0 is bought in both February and March
+            (3, march, 1, 0, 3, 1.10),
+            (3, march, 1, 2, 1, 5.00),
+            # Lines without a positive quantity and price are skipped
+            (3, march, 1, 1, 0, 3.30),
+            (3, march, 1, 1, 1, 0.0),
+        ]
+    )
+
+    assert [period_start(period, "month") for period in links.periods] == [
+        dt.date(2024, 1, 1),
+        dt.date(2024, 2, 1),
+        dt.date(2024, 3, 1),
+    ]
+    np.testing.assert_array_equal(links.matched, [0, 2, 1])
+    np.testing.assert_allclose(
+        links.laspeyres, [1.0, (1.20 * 2 + 3.30 * 1) / (1.00 * 2 + 3.00 * 1), 1.10 / 1.20]
+    )
+    np.testing.assert_allclose(
+        links.paasche, [1.0, (1.20 * 1 + 3.30 * 2) / (1.00 * 1 + 3.00 * 2), 1.10 / 1.20]
+    )
+
+
+def test_price_links_skip_periods_without_purchases():
+    from price_index import period_index, period_start
+
+    # Nothing is bought in the weeks between, so the second link compares with the first week
+    first, later = days(dt.date(2024, 1, 3), dt.date(2024, 1, 31))
+    links = links_of([(1, first, 1, 0, 1, 2.00), (2, later, 1, 0, 1, 2.50)], "week")
+
+    assert [period_start(period, "week") for period in links.periods] == [
+        dt.date(2024, 1, 1),
+        dt.date(2024, 1, 29),
+    ]
+    assert links.periods[0] == period_index(np.array([first]), "week")[0]
+    np.testing.assert_array_equal(links.matched, [0, 1])
+    np.testing.assert_allclose(links.laspeyres, [1.0, 1.25])
+
+
+def random_receipts(rng: np.random.Generator, first_receipt: int, count: int, start: int) -> dict:
+    """Receipts with a few lines each, every other day from start
+
+    Returns:
+        dict[int, list[tuple]]: The lines by receipt ID"""
+    receipts = {}
+    for offset in range(count):
+        receipt = first_receipt + offset
+        day = start + 2 * offset
+        location = int(rng.integers(1, 3))
+        products = rng.choice(12, size=int(rng.integers(2, 6)), replace=False)
+        receipts[receipt] = [
+            (
+                receipt,
+                day,
+                location,
+                int(product),
+                int(rng.integers(1, 4)),
+                round(float((1 + product / 4) * rng.uniform(0.9, 1.2)), 2),
+            )
+            for product in products
+        ]
+    return receipts
+
+
+def load(price_index, receipts: dict, replaced=()):
+    """Replaces the lines of the replaced receipts and adds those of receipts"""
+    lines = [line for receipt_lines in receipts.values() for line in receipt_lines]
+    columns = list(zip(*lines)) if lines else [[] for _ in range(6)]
+    price_index.update(np.array(list(replaced), np.int32), *columns)
+
+
+@pytest.mark.parametrize("period", ["month", "week"])
+def test_incremental_update_matches_full_recompute(period):
+    from price_index import PriceIndex
+
+    rng = np.random.default_rng(7)
+    start = days(dt.date(2023, 1, 2))[0]
+    # Two stretches of receipts with a month between them
+    receipts = random_receipts(rng, 1, 100, start)
+    receipts.update(random_receipts(rng, 101, 100, start + 260))
+    # The only purchase of its week and month, it is dropped later
+    alone = 1000
+    receipts[alone] = [(alone, start + 229, 1, 3, 2, 2.50)]
+    members = frozenset({"wi0", "wi3", "wi5", "wi8"})
+    # (members, store) of the indices that are cached before the update
+    variants = [(None, None), (members, None), (None, 2), (members, 1)]
+
+    incremental = PriceIndex(_generation=Generation())
+    for product in range(12):
+        incremental.lines.product_number(f"wi{product}")
+    load(incremental, receipts)
+
+    def check():
+        full = PriceIndex(_generation=Generation())
+        full.lines.products = dict(incremental.lines.products)
+        load(full, receipts)
+        for variant_members, store in variants:
+            expected = full.compute(period, variant_members, store)
+            links = incremental.compute(period, variant_members, store)
+            np.testing.assert_array_equal(links.periods, expected.periods)
+            np.testing.assert_array_equal(links.matched, expected.matched)
+            np.testing.assert_allclose(links.laspeyres, expected.laspeyres)
+            np.testing.assert_allclose(links.paasche, expected.paasche)
+            assert incremental.compute(period, variant_members, store) is links
+
+    check()
+    # New receipts after the last one, and a receipt in the middle reprocessed with other prices
+    added = random_receipts(rng, 2000, 10, start + 460)
+    reprocessed = 120
+    changed = {
+        reprocessed: [
+            (reprocessed, day, location, product, quantity + 1, price * 1.3)
+            for _, day, location, product, quantity, price in receipts[reprocessed]
+        ]
+    }
+    load(incremental, added)
+    load(incremental, changed, replaced=[reprocessed])
+    receipts.update(added)
+    receipts.update(changed)
+    check()
+
+    # The period of the dropped receipt has no purchases left
+    load(incremental, {}, replaced=[alone])
+    del receipts[alone]
+    check()
+
+
+def test_compute_rejects_unknown_period():
+    from price_index import PriceIndex
+
+    with pytest.raises(ValueError):
+        PriceIndex(_generation=Generation()).compute("year")
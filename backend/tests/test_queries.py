@@ -0,0 +1,174 @@
+"""The user-facing queries load everything they need eagerly. The handlers fail on lazy loads, so
+an N+1 query fails the test instead of only making it slow."""
+import contextlib
+import datetime as dt
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+MOMENT = dt.datetime(2024, 3, 1, 10, tzinfo=dt.timezone.utc)
+# Newest first, a minute apart
+MOMENTS = [MOMENT - dt.timedelta(minutes=minutes) for minutes in range(5)]
+
+
+@contextlib.contextmanager
+def count_queries(engine):
+    """Counts the statements sent to the database in the block"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def store_receipts(engine, moments: list[dt.datetime]) -> list[int]:
+    """Stores a receipt at every moment with two products, the first with a potential product,
+    and a discount"""
+    from database.model import (
+        DbAHProduct,
+        DbDiscount,
+        DbLocation,
+        DbPotentialProduct,
+        DbProduct,
+        DbReceipt,
+    )
+
+    with Session(engine) as session:
+        location = DbLocation(
+            name="AH Stationsstraat",
+            address="Stationsstraat",
+            house_number="1",
+            city="Zaandam",
+            postal_code="1234 AB",
+        )
+        catalog_product = DbAHProduct(webshop_id="wi1525", title="AH Halfvolle melk")
+        session.add_all([location, catalog_product])
+        session.flush()
+        receipt_ids = []
+        for index, moment in enumerate(moments):
+            receipt = DbReceipt(
+                transaction_id=f"AH-TEST-{index}",
+                datetime=moment,
+                location=location.id,
+                total_price=2.19,
+                total_discount=0.1,
+            )
+            session.add(receipt)
+            session.flush()
+            melk = DbProduct(
+                receipt=receipt.id,
+                description="HALFVOLLE MELK",
+                quantity=1,
+                total_price=1.19,
+                product_not_found=True,
+            )
+            bananen = DbProduct(
+                receipt=receipt.id,
+                description="BANANEN",
+                quantity=2,
+                price=0.5,
+                total_price=1.0,
+                product_not_found=True,
+            )
+            session.add_all(
+                [
+                    melk,
+                    bananen,
+                    DbDiscount(
+                        receipt=receipt.id, type="BONUS", description="AHBANANEN", amount=0.1
+                    ),
+                ]
+            )
+            session.flush()
+            session.add(
+                DbPotentialProduct(product=melk.id, potential_ah_product=catalog_product.id)
+            )
+            receipt_ids.append(receipt.id)
+        session.commit()
+        return receipt_ids
+
+
+def receipt_details(engine, receipt_ids: list[int]) -> tuple[list, int]:
+    """Loads and converts receipts like the receipt endpoints do
+
+    Returns:
+        tuple[list[ReceiptDetail], int]: The receipts and the number of queries"""
+    from database.DbHandler import DbHandler
+    from schemas import receipt_detail
+
+    db_handler = DbHandler(raise_on_lazy_load=True)
+    try:
+        with count_queries(engine) as statements:
+            details = [
+                receipt_detail(receipt)
+                for receipt in db_handler.get_receipts_with_details(receipt_ids)
+            ]
+    finally:
+        db_handler.close()
+    return details, len(statements)
+
+
+def test_receipt_details_query_count(db):
+    receipt_ids = store_receipts(db, MOMENTS)
+
+    single, single_queries = receipt_details(db, receipt_ids[:1])
+    details, queries = receipt_details(db, list(reversed(receipt_ids)))
+
+    # The receipts with their location, the discounts, the products and the potential products
+    assert single_queries == queries == 4
+    assert [detail.id for detail in details] == list(reversed(receipt_ids))
+    assert details[-1] == single[0]
+    detail = single[0]
+    assert detail.location_detail.name == "AH Stationsstraat"
+    assert [product.description for product in detail.products] == ["HALFVOLLE MELK", "BANANEN"]
+    potential_products = detail.products[0].potential_products
+    assert [(potential.webshop_id, potential.title) for potential in potential_products] == [
+        ("wi1525", "AH Halfvolle melk")
+    ]
+    assert [discount.description for discount in detail.discounts] == ["AHBANANEN"]
+
+
+def test_lazy_load_raises(db):
+    from sqlalchemy import exc
+    from database.DbHandler import DbHandler
+
+    receipt_id = store_receipts(db, MOMENTS[:1])[0]
+    db_handler = DbHandler(raise_on_lazy_load=True)
+    try:
+        receipt = db_handler.get_receipt(receipt_id)
+        with pytest.raises(exc.InvalidRequestError):
+            receipt.products
+    finally:
+        db_handler.close()
+
+
+def test_receipts_pages(db):
+    from database.DbHandler import DbHandler
+    from schemas import decode_cursor, receipts_page
+
+    # Two receipts at most moments, so the pages also have to split ties on the id
+    moments = MOMENTS[:3] * 2 + MOMENTS[3:4]
+    receipt_ids = store_receipts(db, moments)
+    expected = [id for _, id in sorted(zip(moments, receipt_ids), reverse=True)]
+
+    db_handler = DbHandler(raise_on_lazy_load=True)
+    seen = []
+    after = None
+    try:
+        while True:
+            with count_queries(db) as statements:
+                page = receipts_page(db_handler.get_receipts_page(2 + 1, after), 2)
+            assert len(statements) == 1
+            seen.extend(receipt.id for receipt in page.receipts)
+            if page.next_cursor is None:
+                break
+            after = decode_cursor(page.next_cursor)
+    finally:
+        db_handler.close()
+    assert seen == expected
@@ -0,0 +1,88 @@
+from classes.Discount import Discount
+from classes.ReceiptParser import ReceiptLine, ReceiptParser, parse_quantity
+from schemas import ReceiptUiItem
+
+HEADER = [
+    ReceiptUiItem(type="ah-logo"),
+    ReceiptUiItem(type="text", value="AH Stationsstraat"),
+    ReceiptUiItem(type="text", value="Stationsstraat 1"),
+]
+PRODUCTS = [
+    ReceiptUiItem(type="product", quantity="1", description="HALFVOLLE MELK", amount="1,19"),
+    ReceiptUiItem(
+        type="product", quantity="2", description="BANANEN", price="0,50", amount="1,00"
+    ),
+    ReceiptUiItem(
+        type="product",
+        quantity="0,534KG",
+        description="MANDARIJNEN",
+        price="2,99",
+        amount="1,60",
+        indicator="B",
+    ),
+    # Rows without a quantity, like the "statiegeld" remark under a line, are not products
+    ReceiptUiItem(type="product", description="STATIEGELD"),
+]
+DISCOUNTS = [
+    ReceiptUiItem(type="product", quantity="BONUS", description="AHMANDARIJNEN", amount="-0,40"),
+    ReceiptUiItem(type="total", label="UW VOORDEEL", amount="0,40"),
+]
+TOTALS = [
+    ReceiptUiItem(type="total", label="TOTAAL", amount="3,39"),
+    ReceiptUiItem(type="text", value="Bedankt voor uw bezoek"),
+]
+LINES = [
+    ReceiptLine(1.0, None, "HALFVOLLE MELK", None, 1.19, None),
+    ReceiptLine(2.0, None, "BANANEN", 0.5, 1.0, None),
+    ReceiptLine(0.534, "KG", "MANDARIJNEN", 2.99, 1.6, "B"),
+]
+
+
+def subtotal(amount: str) -> ReceiptUiItem:
+    return ReceiptUiItem(type="subtotal", text="SUBTOTAAL", amount=amount)
+
+
+def test_parse_with_bonuskaart():
+    items = [
+        *HEADER,
+        ReceiptUiItem(type="product", description="BONUSKAART", amount="xx1234"),
+        *PRODUCTS,
+        subtotal("3,79"),
+        *DISCOUNTS,
+        *TOTALS,
+    ]
+
+    parsed = ReceiptParser().parse(items)
+
+    assert parsed.lines == LINES
+    assert parsed.discounts == [Discount("BONUS", "AHMANDARIJNEN", 0.4)]
+    assert parsed.total_discount == 0.4
+    assert parsed.location_name == "AH Stationsstraat"
+    assert parsed.totals == {"subtotaal": 3.79, "uw voordeel": 0.4, "totaal": 3.39}
+
+
+def test_parse_without_bonuskaart():
+    items = [*HEADER, *PRODUCTS, subtotal("3,79"), *TOTALS]
+
+    parsed = ReceiptParser().parse(items)
+
+    # Like before the single pass parser, the rows are not taken as products
+    assert parsed.lines == []
+    assert parsed.discounts == []
+    assert parsed.total_discount == 0.0
+    assert parsed.location_name == "AH Stationsstraat"
+
+
+def test_parse_empty_receipt():
+    parsed = ReceiptParser().parse([*HEADER, *TOTALS])
+
+    assert parsed.lines == []
+    assert parsed.totals == {"totaal": 3.39}
+
+
+def test_parse_quantity():
+    assert parse_quantity("2") == (2.0, None)
+    assert parse_quantity("0,534KG") == (0.534, "KG")
+    assert parse_quantity("1.5 kg") == (1.5, "kg")
+    assert parse_quantity("") == (None, None)
+    assert parse_quantity("BONUS") == (None, None)
@@ -0,0 +1,103 @@
+import datetime as dt
+
+import pytest
+from sqlalchemy.orm import Session
+
+from test_queries import count_queries
+
+pytest.importorskip("duckdb")
+
+
+class Generation:
+    """A data generation that is bumped by hand"""
+
+    def __init__(self):
+        self.generation = 0
+
+    def current(self) -> int:
+        return self.generation
+
+
+# (transaction id, moment, [(webshop id, quantity, price)])
+RECEIPTS = [
+    ("AH-1", dt.datetime(2024, 1, 10), [("wi1", 2, 1.00), ("wi2", 1, 3.00)]),
+    ("AH-2", dt.datetime(2024, 2, 10), [("wi1", 1, 1.20), ("wi2", 2, 3.30)]),
+    # Late in the evening in UTC, the next month in Amsterdam
+    ("AH-3", dt.datetime(2024, 3, 31, 22, 30), [("wi1", 3, 1.10)]),
+]
+
+
+def store(engine, receipts: list[tuple]):
+    from database.model import DbCategory, DbCategoryProduct, DbLocation, DbProduct, DbReceipt
+
+    with Session(engine) as session:
+        location = session.get(DbLocation, 1)
+        if location is None:
+            location = DbLocation(
+                id=1,
+                name="AH Stationsstraat",
+                address="Stationsstraat",
+                house_number="1",
+                city="Zaandam",
+                postal_code="1234 AB",
+            )
+            session.add(location)
+            session.add(
+                DbCategory(name="Zuivel", slug="zuivel", english="Dairy", taxonomy_id="1301")
+            )
+            session.flush()
+            session.add(DbCategoryProduct(product_id="wi1", taxonomy_id="1301"))
+        for transaction_id, moment, lines in receipts:
+            receipt = DbReceipt(
+                transaction_id=transaction_id,
+                datetime=moment.replace(tzinfo=dt.timezone.utc),
+                location=1,
+                total_price=sum(quantity * price for _, quantity, price in lines),
+                total_discount=0.0,
+            )
+            session.add(receipt)
+            session.flush()
+            session.add_all(
+                DbProduct(
+                    receipt=receipt.id,
+                    description=product_id.upper(),
+                    product_id=product_id,
+                    name=product_id,
+                    quantity=quantity,
+                    price=price,
+                    total_price=quantity * price,
+                    product_not_found=False,
+                )
+                for product_id, quantity, price in lines
+            )
+        session.commit()
+
+
+def test_price_index_reads_the_replica(db, tmp_path):
+    from database.replica import AnalyticsReplica
+    from price_index import PriceIndex
+
+    replica = AnalyticsReplica(str(tmp_path / "replica.duckdb"))
+    generation = Generation()
+    from_replica = PriceIndex(_engine=db, _generation=generation, _replica=replica)
+    from_postgres = PriceIndex(_engine=db, _generation=generation, _replica=AnalyticsReplica())
+
+    store(db, RECEIPTS[:2])
+    replica.refresh(db)
+    with count_queries(db) as statements:
+        index = from_replica.get()
+        category_index = from_replica.get(category="1301")
+    assert statements == []
+    assert index == from_postgres.get()
+    assert category_index == from_postgres.get(category="1301")
+    assert [row["period"] for row in index] == [dt.date(2024, 1, 1), dt.date(2024, 2, 1)]
+
+    # Only the new receipt is read again
+    store(db, RECEIPTS[2:])
+    replica.refresh(db)
+    generation.generation += 1
+    with count_queries(db) as statements:
+        index = from_replica.get()
+    assert statements == []
+    assert index == from_postgres.get()
+    assert [row["period"] for row in index][-1] == dt.date(2024, 4, 1)
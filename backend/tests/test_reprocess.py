@@ -0,0 +1,183 @@
+import datetime as dt
+
+import msgspec
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from schemas import ReceiptUiItem
+
+TRANSACTION_ID = "AH-TEST-1"
+SUMMARY = {
+    "transactionId": TRANSACTION_ID,
+    "transactionMoment": "2024-03-01T10:00:00Z",
+    "total": {"amount": {"amount": 6.18}},
+    "storeAddress": {
+        "street": "Stationsstraat",
+        "houseNumber": "1",
+        "postalCode": "1234 AB",
+        "city": "Zaandam",
+    },
+}
+# quantity, description, price, amount
+LINES = [
+    ("1", "HALFVOLLE MELK", None, "1,19"),
+    ("2", "BANANEN", "0,50", "1,00"),
+    ("1", "JONGE KAAS", None, "3,99"),
+]
+
+
+def receipt_items(lines: list[tuple]) -> list[ReceiptUiItem]:
+    return [
+        ReceiptUiItem(type="ah-logo"),
+        ReceiptUiItem(type="text", value="AH Stationsstraat"),
+        ReceiptUiItem(type="product", description="BONUSKAART", amount="xx1234"),
+        *(
+            ReceiptUiItem(
+                type="product",
+                quantity=quantity,
+                description=description,
+                price=price,
+                amount=amount,
+            )
+            for quantity, description, price, amount in lines
+        ),
+        ReceiptUiItem(type="subtotal", text="SUBTOTAAL", amount="6,18"),
+        ReceiptUiItem(type="total", label="TOTAAL", amount="6,18"),
+    ]
+
+
+def store_receipt(engine) -> int:
+    """Stores the receipt without its cheese, its milk was matched with the AH API and its
+    bananas were not found"""
+    from database.model import DbLocation, DbReceipt, DbProduct
+
+    with Session(engine) as session:
+        location = DbLocation(
+            name="AH Stationsstraat",
+            address="Stationsstraat",
+            house_number="1",
+            city="Zaandam",
+            postal_code="1234 AB",
+        )
+        session.add(location)
+        session.flush()
+        receipt = DbReceipt(
+            transaction_id=TRANSACTION_ID,
+            datetime=dt.datetime(2024, 3, 1, 10, tzinfo=dt.timezone.utc),
+            location=location.id,
+            total_price=6.18,
+            total_discount=0.0,
+        )
+        session.add(receipt)
+        session.flush()
+        session.add_all(
+            [
+                DbProduct(
+                    receipt=receipt.id,
+                    description="HALFVOLLE MELK",
+                    quantity=1,
+                    total_price=1.19,
+                    product_id="1525",
+                    name="AH Halfvolle melk",
+                    product_not_found=False,
+                ),
+                DbProduct(
+                    receipt=receipt.id,
+                    description="BANANEN",
+                    quantity=2,
+                    price=0.5,
+                    total_price=1.0,
+                    product_not_found=True,
+                ),
+            ]
+        )
+        session.commit()
+        return receipt.id
+
+
+def details_payload(lines: list[tuple]) -> bytes:
+    return msgspec.json.encode({"receiptUiItems": receipt_items(lines)})
+
+
+def archive(payload: bytes):
+    from database.DbHandler import DbHandler
+    from classes.Receipt import Receipt
+
+    db_handler = DbHandler()
+    try:
+        db_handler.archive_receipt(Receipt(SUMMARY, details_payload=payload))
+    finally:
+        db_handler.close()
+
+
+def stored_products(engine) -> dict:
+    from database.model import DbProduct
+
+    with Session(engine) as session:
+        return {
+            product.description: (product.product_id, product.name, product.product_not_found)
+            for product in session.scalars(select(DbProduct))
+        }
+
+
+def test_reprocessing_keeps_api_matches(db):
+    from database.model import DbProduct, DbResolutionQueue
+    from reprocess import reprocess_receipt
+
+    store_receipt(db)
+    archive(details_payload(LINES))
+
+    # The catalog is empty, so without API lookups no line gets a new match
+    stats = reprocess_receipt(TRANSACTION_ID)
+
+    assert stats == {"updated": 0, "added": 1, "deleted": 0, "changed": True}
+    products = stored_products(db)
+    assert products["HALFVOLLE MELK"] == ("1525", "AH Halfvolle melk", False)
+    assert products["BANANEN"] == (None, None, True)
+    assert products["JONGE KAAS"] == (None, None, True)
+    with Session(db) as session:
+        queued = session.scalars(
+            select(DbProduct.description).join(
+                DbResolutionQueue, DbResolutionQueue.product == DbProduct.id
+            )
+        ).all()
+    assert queued == ["JONGE KAAS"]
+
+    assert reprocess_receipt(TRANSACTION_ID) == {
+        "updated": 0,
+        "added": 0,
+        "deleted": 0,
+        "changed": False,
+    }
+    assert stored_products(db) == products
+
+
+def test_reprocessing_removes_lines(db):
+    from reprocess import reprocess_receipt
+
+    store_receipt(db)
+    archive(details_payload(LINES[:1]))
+
+    stats = reprocess_receipt(TRANSACTION_ID)
+
+    assert stats == {"updated": 0, "added": 0, "deleted": 1, "changed": True}
+    assert stored_products(db) == {"HALFVOLLE MELK": ("1525", "AH Halfvolle melk", False)}
+
+
+def test_archive_keeps_payload_as_received(db):
+    from database.DbHandler import DbHandler
+
+    # Fields the parser does not know and a quantity that is not a string
+    payload = (
+        b'{"receiptUiItems": [{"type": "product", "quantity": 1, "description": "MELK",'
+        b' "style": {"bold": true}}], "receiptImage": {"url": "https://example.com"}}'
+    )
+    archive(payload)
+
+    db_handler = DbHandler()
+    try:
+        summary, details = db_handler.get_archived_receipt(TRANSACTION_ID)
+    finally:
+        db_handler.close()
+    assert summary == SUMMARY
+    assert details == payload
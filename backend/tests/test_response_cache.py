@@ -0,0 +1,203 @@
+import gzip
+import hashlib
+import zlib
+
+import flask
+import pytest
+
+from test_replica import Generation
+
+BODY = b'{"spend": [' + b", ".join(b"%d" % number for number in range(1000)) + b"]}"
+
+
+class Brotli:
+    """Stands in for the brotli module, which is optional"""
+
+    @staticmethod
+    def compress(body: bytes, quality: int) -> bytes:
+        return zlib.compress(body)
+
+
+@pytest.fixture
+def cached(monkeypatch):
+    """A Flask app with a few endpoints behind a response cache of its own
+
+    Yields:
+        tuple[FlaskClient, ResponseCache, Generation, list[str]]: The test client, the cache, its
+            data generation and the paths the endpoints computed"""
+    import response_cache
+    from response_cache import ResponseCache
+
+    monkeypatch.setattr(response_cache, "brotli", Brotli)
+    generation = Generation()
+    cache = ResponseCache(_generation=generation)
+    calls = []
+    app = flask.Flask(__name__)
+
+    def cached_view(view):
+        def wrapper(*args, **kwargs):
+            return cache.respond(view, *args, **kwargs)
+
+        wrapper.__name__ = view.__name__
+        return wrapper
+
+    @app.route("/spend")
+    @cached_view
+    def spend():
+        calls.append(flask.request.full_path)
+        return flask.Response(BODY, mimetype="application/json")
+
+    @app.route("/small")
+    @cached_view
+    def small():
+        calls.append(flask.request.full_path)
+        return {"total": 1.19}
+
+    @app.route("/missing")
+    @cached_view
+    def missing():
+        calls.append(flask.request.full_path)
+        flask.abort(404)
+
+    @app.route("/error")
+    @cached_view
+    def error():
+        calls.append(flask.request.full_path)
+        return {"error": "Invalid value"}, 400
+
+    yield app.test_client(), cache, generation, calls
+
+
+def test_compress():
+    from response_cache import compress
+
+    cached = compress(BODY, "application/json")
+    digest = hashlib.blake2b(BODY, digest_size=16).hexdigest()
+    assert cached.digest == digest
+    assert gzip.decompress(cached.bodies["gzip"]) == BODY
+    assert cached.bodies["identity"] == BODY
+    assert cached.etag("identity") == digest
+    assert cached.etag("gzip") == f"{digest}-gzip"
+    # Small bodies are not worth compressing
+    assert list(compress(b"{}", "application/json").bodies) == ["identity"]
+
+
+def test_etags(cached):
+    client, cache, _, _ = cached
+
+    response = client.get("/spend", headers={"Accept-Encoding": "identity"})
+    assert response.status_code == 200
+    assert response.data == BODY
+    digest = hashlib.blake2b(BODY, digest_size=16).hexdigest()
+    assert response.headers["ETag"] == f'"{digest}"'
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert response.headers["Cache-Control"] == "no-cache"
+    # The same body gets the same ETag after it was computed again
+    cache.clear()
+    again = client.get("/spend", headers={"Accept-Encoding": "identity"})
+    assert again.headers["ETag"] == response.headers["ETag"]
+
+
+def test_if_none_match(cached):
+    client, cache, _, calls = cached
+
+    etag = client.get("/spend", headers={"Accept-Encoding": "gzip"}).headers["ETag"]
+    not_modified = client.get(
+        "/spend", headers={"Accept-Encoding": "gzip", "If-None-Match": etag}
+    )
+    assert not_modified.status_code == 304
+    assert not_modified.data == b""
+    assert not_modified.headers["ETag"] == etag
+    # The client has a representation in another coding, which is as current
+    assert (
+        client.get(
+            "/spend", headers={"Accept-Encoding": "identity", "If-None-Match": etag}
+        ).status_code
+        == 304
+    )
+    assert client.get("/spend", headers={"If-None-Match": '"other"'}).status_code == 200
+    assert client.get("/spend", headers={"If-None-Match": "*"}).status_code == 304
+    assert len(calls) == 1
+    assert cache.not_modified == 3
+
+
+def test_accept_encoding(cached):
+    client, _, _, calls = cached
+
+    def encoding(accept_encoding: str, path: str = "/spend") -> str:
+        response = client.get(path, headers={"Accept-Encoding": accept_encoding})
+        assert response.status_code == 200
+        return response.headers.get("Content-Encoding", "identity")
+
+    assert encoding("gzip, deflate, br") == "br"
+    assert encoding("gzip") == "gzip"
+    assert encoding("gzip;q=1.0, br;q=0.5") == "gzip"
+    assert encoding("deflate") == "identity"
+    assert encoding("br;q=0, gzip;q=0") == "identity"
+    assert encoding("gzip", "/small") == "identity"
+    response = client.get("/spend", headers={"Accept-Encoding": "gzip"})
+    assert gzip.decompress(response.data) == BODY
+    assert response.headers["ETag"].endswith('-gzip"')
+    assert calls == ["/spend?", "/small?"]
+
+
+def test_errors_are_not_cached(cached):
+    client, cache, _, calls = cached
+
+    for _ in range(2):
+        missing = client.get("/missing")
+        assert missing.status_code == 404
+        assert "ETag" not in missing.headers
+        error = client.get("/error")
+        assert error.status_code == 400
+        assert error.json == {"error": "Invalid value"}
+        assert "ETag" not in error.headers
+    assert calls == ["/missing?", "/error?"] * 2
+    assert cache.misses == 0
+
+
+def test_generation_keys(cached):
+    client, cache, generation, calls = cached
+
+    client.get("/spend?since=2024-01-01&until=2024-02-01")
+    client.get("/spend?until=2024-02-01&since=2024-01-01")
+    client.get("/spend?since=2024-01-01")
+    assert calls == ["/spend?since=2024-01-01&until=2024-02-01", "/spend?since=2024-01-01"]
+
+    # New receipts make every cached response stale
+    generation.generation += 1
+    client.get("/spend?since=2024-01-01")
+    assert calls[2:] == ["/spend?since=2024-01-01"]
+    assert (cache.hits, cache.misses) == (1, 3)
+
+
+def test_directory_backend(cached, tmp_path):
+    from response_cache import DirectoryBackend
+
+    client, cache, generation, calls = cached
+    cache.backend = DirectoryBackend(str(tmp_path))
+    etag = client.get("/spend").headers["ETag"]
+
+    # Like another process that shares the directory
+    cache.clear()
+    assert client.get("/spend").headers["ETag"] == etag
+    assert len(calls) == 1
+    assert cache.backend_hits == 1
+
+    # Starting a new generation removes the older ones
+    generation.generation += 1
+    client.get("/spend")
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["1"]
+
+
+def test_disabled(cached):
+    client, cache, _, calls = cached
+    cache.max_entries = 0
+
+    response = client.get("/spend", headers={"Accept-Encoding": "gzip"})
+    client.get("/spend", headers={"If-None-Match": "*"})
+    assert response.data == BODY
+    assert "ETag" not in response.headers
+    assert "Content-Encoding" not in response.headers
+    assert len(calls) == 2
+    assert (cache.hits, cache.misses) == (0, 0)
@@ -0,0 +1,107 @@
+import datetime as dt
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from test_reprocess import LINES, SUMMARY, details_payload, store_receipt
+
+DAY = dt.date(2024, 3, 1)
+
+
+def category_spend(engine) -> list[tuple]:
+    from database.model import DbDailyCategorySpend
+
+    with Session(engine) as session:
+        return session.execute(
+            select(
+                DbDailyCategorySpend.day,
+                DbDailyCategorySpend.taxonomy_id,
+                DbDailyCategorySpend.total,
+            ).order_by(DbDailyCategorySpend.taxonomy_id)
+        ).all()
+
+
+def rollup_rows(engine) -> int:
+    from database.rollups import ROLLUPS
+
+    with Session(engine) as session:
+        return sum(
+            session.scalar(select(func.count()).select_from(model)) for model, _ in ROLLUPS
+        )
+
+
+def test_store_receipt_writes_everything_at_once(db):
+    from database.DbHandler import DbHandler
+    from database.model import DbDailyStoreSpend, DbProduct, DbResolutionQueue
+    from classes.Receipt import Receipt
+
+    receipt = Receipt(SUMMARY, api_lookups=False, details_payload=details_payload(LINES))
+    receipt.set_details()
+    db_handler = DbHandler()
+    try:
+        location = db_handler.add_location(receipt.location)
+        receipt_id = db_handler.store_receipt(receipt, location.id).id
+    finally:
+        db_handler.close()
+
+    with Session(db) as session:
+        assert session.scalar(select(DbDailyStoreSpend.total)) == 6.18
+        assert session.scalar(select(DbDailyStoreSpend.day)) == DAY
+        products = session.scalars(select(DbProduct.id).where(DbProduct.receipt == receipt_id))
+        # The catalog is empty, so every line is queued for a lookup
+        queued = session.scalars(select(DbResolutionQueue.product))
+        assert sorted(queued) == sorted(products)
+
+
+def test_new_category_refreshes_earlier_days(db):
+    from database.DbHandler import DbHandler
+    from database.model import DbCategory, DbCategoryClosure
+    from classes.Product import Product
+
+    receipt_id = store_receipt(db)
+    with Session(db) as session:
+        session.add(DbCategory(name="Zuivel", slug="zuivel", english="Dairy", taxonomy_id="1301"))
+        session.flush()
+        session.add(DbCategoryClosure(ancestor="1301", descendant="1301", depth=0))
+        session.commit()
+    db_handler = DbHandler()
+    try:
+        assert db_handler.refresh_rollups([receipt_id]) == rollup_rows(db)
+        assert category_spend(db) == []
+
+        # A later receipt with the same milk assigns its category for the first time
+        product = Product(description="HALFVOLLE MELK", resolve=False)
+        product.product_id = "1525"
+        product.category = "1301"
+        assert db_handler.set_categories_for_products([product]) == 1
+    finally:
+        db_handler.close()
+
+    assert category_spend(db) == [(DAY, "1301", 1.19)]
+
+
+def test_category_outside_the_tree_is_logged(db, caplog):
+    from database.DbHandler import DbHandler
+    from database.model import DbCategory, DbCategoryClosure
+    from classes.Product import Product
+
+    with Session(db) as session:
+        session.add(DbCategory(name="Zuivel", slug="zuivel", english="Dairy", taxonomy_id="1301"))
+        session.flush()
+        session.add(DbCategoryClosure(ancestor="1301", descendant="1301", depth=0))
+        session.commit()
+    products = []
+    for description, category in [("HALFVOLLE MELK", "1301"), ("BANANEN", "9999")]:
+        product = Product(description=description, resolve=False)
+        product.product_id = description.lower()
+        product.category = category
+        products.append(product)
+    db_handler = DbHandler()
+    try:
+        assert db_handler.set_categories_for_products(products) == 1
+    finally:
+        db_handler.close()
+
+    assert 'Product "BANANEN"' in caplog.text
+    assert "category 9999 is not in the category tree" in caplog.text
+    assert "HALFVOLLE MELK" not in caplog.text
@@ -0,0 +1,16 @@
+from schemas import ReceiptUiItem, decode_receipt_details
+
+
+def test_decode_receipt_details():
+    response = (
+        b'{"receiptUiItems": [{"type": "text", "value": "AH Stationsstraat", "style": "bold"}],'
+        b' "receiptImage": null}'
+    )
+    assert decode_receipt_details(response) == [
+        ReceiptUiItem(type="text", value="AH Stationsstraat")
+    ]
+    # Archived before the responses were archived as received
+    assert decode_receipt_details(b'[{"type": "text", "value": "AH Stationsstraat"}]') == [
+        ReceiptUiItem(type="text", value="AH Stationsstraat")
+    ]
+
@@ -0,0 +1,49 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+SRC = os.path.join(os.path.dirname(__file__), "..", "src")
+
+
+@pytest.mark.parametrize(
+    "description, expected",
+    [
+        ("Prijs per KG €8,98", (8.98, "kg")),
+        ("Prijs per 100 g €1.50", (15.0, "kg")),
+        ("per stuk 0,45", (0.45, "st")),
+        ("Prijs €2,19", (2.19, None)),
+        ("", (None, None)),
+        (None, (None, None)),
+    ],
+)
+def test_parse_unit_price(description, expected):
+    from units import parse_unit_price
+
+    assert parse_unit_price(description) == expected
+
+
+def test_parse_units():
+    from units import parse_units
+
+    assert parse_units("Prijs per L €1,20", "6 x 330 ml") == {
+        "unit_price": 1.2,
+        "unit": "l",
+        "unit_size": 1.98,
+    }
+    # The size is only kept in the unit of the price
+    assert parse_units("Prijs per KG €8,98", "4 stuks")["unit_size"] is None
+    assert parse_units(None, "500 g") == {"unit_price": None, "unit": "kg", "unit_size": 0.5}
+
+
+def test_models_do_not_import_util():
+    # In a process of its own, the other tests have imported util already
+    code = (
+        "import sys, database.model\n"
+        "print(sorted({'deepl', 'config', 'util'} & set(sys.modules)))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], cwd=SRC, capture_output=True, text=True, check=True
+    ).stdout
+    assert output.strip() == "[]"